@@ -37,7 +37,6 @@ from nav.statemon import statistics
 from nav.statemon import megaping
 from nav.statemon import db
 from nav.statemon import config
-from nav.statemon import circbuf
 from nav.statemon.event import Event
 from nav.statemon.netbox import Netbox
 
@@ -84,8 +83,8 @@ class Pinger(object):
         self._nrping = int(self.config.get("nrping", 3))
         # To keep status...
         self.netboxmap = {}  # hash netboxid -> netbox
-        self.down = []       # list of netboxids down
-        self.replies = {}    # hash netboxid -> circbuf
+        self.down = set()    # set of netboxids down
+        self.misses = {}     # hash netboxid -> number of consecutive misses
         self.ip_to_netboxid = {}
 
     def update_host_list(self):
@@ -106,11 +105,10 @@ class Pinger(object):
                     _logger.debug(
                         "Got new netbox, %s, currently "
                         "marked down in navDB", netbox.ip)
-                    self.down.append(netbox.netboxid)
-            if netbox.netboxid not in self.replies:
-                self.replies[netbox.netboxid] = circbuf.CircBuf(self._nrping)
-                if netbox.up != 'y':
-                    self.replies[netbox.netboxid].reset_all_to(-1)
+                    self.down.add(netbox.netboxid)
+            if netbox.netboxid not in self.misses:
+                self.misses[netbox.netboxid] = (
+                    self._nrping if netbox.up != 'y' else 0)
             netboxmap[netbox.netboxid] = netbox
             self.ip_to_netboxid[netbox.ip] = netbox.netboxid
         # Update netboxmap
@@ -126,27 +124,28 @@ class Pinger(object):
         """
         _logger.debug("Checks which hosts didn't answer")
         answers = self.pinger.results()
+        updates = []
+        down_now = set()
         for ip, rtt in answers:
             # rtt = round trip time (-1 => host didn't reply)
             netboxid = self.ip_to_netboxid.get(ip)
-            self.replies[netboxid].push(rtt)
             netbox = self.netboxmap[netboxid]
             if rtt != -1:
-                statistics.update(netbox.sysname, 'N', 'UP', rtt)
+                self.misses[netboxid] = 0
+                updates.append((netbox.sysname, 'UP', rtt))
             else:
+                self.misses[netboxid] += 1
                 # ugly...
-                statistics.update(netbox.sysname, 'N', 'DOWN', 5)
-
-        down_now = []
-        # Find out which netboxes to consider down
-        for (netboxid, replies) in self.replies.items():
-            if replies[:self._nrping] == [-1]*self._nrping:
-                down_now.append(netboxid)
+                updates.append((netbox.sysname, 'DOWN', 5))
+            # Netboxes are considered down after nrping consecutive misses
+            if self.misses[netboxid] >= self._nrping:
+                down_now.add(netboxid)
+        statistics.update_many(updates)
 
         _logger.debug("No answer from %i hosts", len(down_now))
         # Detect state changes since last run
-        report_down = set(down_now) - set(self.down)
-        report_up = set(self.down) - set(down_now)
+        report_down = down_now - self.down
+        report_up = self.down - down_now
         self.down = down_now
 
         # Reporting netboxes as down
@@ -193,6 +192,11 @@ class Pinger(object):
             _logger.info("%i hosts checked in %03.3f secs. %i hosts "
                         "currently marked as down.",
                         len(self.netboxmap), elapsedtime, len(self.down))
+            stats = self.pinger.stats
+            _logger.info("Sent %i requests at %.1f requests/s, got %i "
+                         "replies, %i late replies from the previous round",
+                         stats.sent, stats.send_rate, stats.replies,
+                         stats.late_replies)
             wait = self._looptime-elapsedtime
             if wait > 0:
                 _logger.debug("Sleeping %03.3f secs", wait)
@@ -27,11 +27,14 @@ import signal
 import argparse
 import logging
 
+from django.utils import six
+from twisted.internet import reactor, task, threads
+
 from nav import buildconf
 import nav.daemon
-from nav.daemon import safesleep as sleep
 from nav.logs import init_generic_logging
-from nav.statemon import RunQueue, config, db
+from nav.statemon import config, db
+from nav.statemon.engine import CheckEngine
 
 
 _logger = logging.getLogger('nav.servicemon')
@@ -41,25 +44,27 @@ class Controller:
     def __init__(self, foreground=False):
         if not foreground:
             signal.signal(signal.SIGHUP, self.signalhandler)
-        signal.signal(signal.SIGTERM, self.signalhandler)
-        signal.signal(signal.SIGINT, self.signalhandler)
 
         self.conf = config.serviceconf()
         init_generic_logging(stderr=True, read_config=True)
-        self._isrunning = 1
         self._checkers = []
         self._looptime = int(self.conf.get("checkinterval", 60))
         _logger.debug("Setting checkinterval=%i", self._looptime)
         self.db = db.db()
         _logger.debug("Reading database config")
-        _logger.debug("Setting up runqueue")
-        self._runqueue = RunQueue.RunQueue(controller=self)
+        _logger.debug("Setting up check engine")
+        max_concurrent = int(self.conf.get('max concurrent checks', 500))
+        max_threads = int(self.conf.get('maxthreads', six.MAXSIZE))
+        _logger.info("Setting max concurrent checks=%i, maxthreads=%i",
+                     max_concurrent, max_threads)
+        self._engine = CheckEngine(max_concurrent=max_concurrent,
+                                   max_threads=max_threads)
         self.dirty = 1
 
     def get_checkers(self):
         """
-        Fetches new checkers from the NAV database and appends them to
-        the runqueue.
+        Fetches new checkers from the NAV database and replaces the list of
+        checkers to run.
         """
         newcheckers = self.db.get_checkers(self.dirty)
         self.dirty = 0
@@ -85,47 +90,52 @@ class Controller:
 
     def main(self):
         """
-        Loops until SIGTERM is caught. The looptime is defined
-        by self._looptime
+        Runs the check loop on the reactor until SIGTERM is caught. The
+        looptime is defined by self._looptime
         """
         self.db.start()
-        while self._isrunning:
-            start = time.time()
-            self.get_checkers()
+        self._engine.start()
+        loop = task.LoopingCall(self.run_checks)
+        loop.start(self._looptime).addErrback(self._loop_failed)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
+        reactor.run()
 
-            wait = self._looptime - (time.time() - start)
-            if wait <= 0:
-                _logger.warning("System clock has drifted backwards, "
-                               "resetting loop delay")
-                wait = self._looptime
-            if self._checkers:
-                pause = wait/(len(self._checkers)*2)
-            else:
-                pause = 0
-            for checker in self._checkers:
-                self._runqueue.enq(checker)
-                sleep(pause)
+    def run_checks(self):
+        """
+        Fetches the current checkers and schedules them to run spread out
+        over the first half of the check interval.
+        """
+        start = time.time()
+        deferred = threads.deferToThread(self.get_checkers)
 
+        def _schedule(_result):
             wait = self._looptime - (time.time() - start)
-            _logger.debug("Waiting %i seconds.", wait)
             if wait <= 0:
-                _logger.critical("Only superman can do this. Humans cannot "
-                                "wait for %i seconds.", wait)
-                wait %= self._looptime
-                sleep(wait)
-            else:
-                sleep(wait)
+                _logger.warning("Fetching checkers took longer than the "
+                                "check interval")
+                wait = self._looptime
+            pause = wait/(len(self._checkers)*2) if self._checkers else 0
+            _logger.debug("Scheduling %i checkers, %i still active from last "
+                          "round", len(self._checkers), self._engine.active)
+            for index, checker in enumerate(self._checkers):
+                self._engine.enq((time.time() + index * pause, checker))
+
+        deferred.addCallback(_schedule)
+        deferred.addErrback(lambda failure: _logger.error(
+            "Failed to fetch checkers: %s", failure.getErrorMessage()))
+        return deferred
+
+    @staticmethod
+    def _loop_failed(failure):
+        _logger.critical("Check loop failed: %s", failure.getTraceback())
+        reactor.stop()
+
+    def shutdown(self):
+        _logger.info("Shutting down check engine")
+        self._engine.stop()
 
     def signalhandler(self, signum, _):
-        if signum == signal.SIGTERM:
-            _logger.info("Caught SIGTERM. Exiting.")
-            self._runqueue.terminate()
-            sys.exit(0)
-        elif signum == signal.SIGINT:
-            _logger.info("Caught SIGINT. Exiting.")
-            self._runqueue.terminate()
-            sys.exit(0)
-        elif signum == signal.SIGHUP:
+        if signum == signal.SIGHUP:
             # reopen the logfile
             _logger.info("Caught SIGHUP. Reopening logfile...")
             logfile = open(self.conf.logfile, 'a')
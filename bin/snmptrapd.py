@@ -33,7 +33,8 @@ from nav import daemon
 from nav.config import NAV_CONFIG, NAVConfigParser
 import nav.buildconf
 from nav.snmptrapd.plugin import load_handler_modules, ModuleLoadError
-from nav.snmptrapd.trap import SNMPTrap
+from nav.snmptrapd import trap
+from nav.snmptrapd.dispatch import TrapDispatcher
 from nav.util import is_valid_ip, address_to_string
 from nav.db import getConnection
 from nav.bootstrap import bootstrap_django
@@ -46,7 +47,6 @@ logfile_path = os.path.join(NAV_CONFIG['LOG_DIR'], 'snmptrapd.log')
 pidfile = 'snmptrapd.pid'
 logging.raiseExceptions = False  # don't raise exceptions for logging issues
 _logger = logging.getLogger('nav.snmptrapd')
-_traplogger = logging.getLogger('nav.snmptrapd.traplog')
 handlermodules = None
 config = None
 
@@ -147,7 +147,7 @@ def main():
 
         _logger.info("Snmptrapd started, listening on %s", addresses_text)
         try:
-            server.listen(opts.community, trap_handler)
+            server.listen(opts.community, start_dispatcher().dispatch)
         except SystemExit:
             raise
         except Exception as why:
@@ -158,7 +158,7 @@ def main():
         # Start listening and exit cleanly if interrupted.
         try:
             _logger.info("Listening on %s", addresses_text)
-            server.listen(opts.community, trap_handler)
+            server.listen(opts.community, start_dispatcher().dispatch)
         except KeyboardInterrupt as why:
             _logger.error("Received keyboard interrupt, exiting.")
             server.close()
@@ -198,62 +198,21 @@ def Address(address):
     raise ValueError("%s is not a valid address" % address)
 
 
-def trap_handler(trap):
-    """Handles a trap.
+def start_dispatcher():
+    """Starts the worker processes that handle received traps
 
-    :type trap: SNMPTrap
+    :returns: The TrapDispatcher that received traps should be given to.
 
     """
-    _traplogger.debug("%s", trap)
-    connection = getConnection('default')
-    handled_by = []
-
-    for mod in handlermodules:
-        _logger.debug("Offering trap (%s) to %s", id(trap), mod)
-        try:
-            accepted = mod.handleTrap(trap, config=config)
-            if accepted:
-                handled_by.append(mod.__name__)
-            _logger.debug(
-                "Module %s %s trap (%s)",
-                mod.__name__,
-                'accepted' if accepted else 'ignored',
-                id(trap),
-            )
-        except Exception as why:
-            _logger.exception(
-                "Unhandled exception when handling trap (%s) with %s: %s",
-                id(trap),
-                mod.__name__,
-                why,
-            )
-        # Assuming that the handler used the same connection as this
-        # function, we rollback any uncommitted changes.  This is to
-        # avoid idling in transactions.
-        connection.rollback()
-
-    _log_trap_handle_result(handled_by, trap)
-
-
-def _log_trap_handle_result(handled_by, trap):
-    agent_string = (
-        trap.netbox.sysname + ' ({})'.format(trap.agent)
-        if trap.netbox else trap.agent
-    )
-    if handled_by:
-        _logger.info(
-            "v%s trap received from %s, handled by %s",
-            trap.version,
-            agent_string,
-            handled_by,
-        )
-    else:
-        _logger.info(
-            "v%s trap received from %s, no handlers wanted it: %s",
-            trap.version,
-            agent_string,
-            trap.snmpTrapOID,
-        )
+    trap.agents.refresh_interval = config.getint('snmptrapd', 'agentrefresh')
+    dispatcher = TrapDispatcher(
+        handlermodules, config,
+        workers=config.getint('snmptrapd', 'workers'),
+        queue_size=config.getint('snmptrapd', 'queuesize'))
+    dispatcher.start()
+    _logger.info("Started %d trap handling worker processes",
+                 dispatcher.workers)
+    return dispatcher
 
 
 def verify_subsystem():
@@ -285,6 +244,12 @@ def signal_handler(signum, _):
 class SnmptrapdConfig(NAVConfigParser):
     """Configparser for snmptrapd"""
     DEFAULT_CONFIG_FILES = ['snmptrapd.conf']
+    DEFAULT_CONFIG = u"""
+[snmptrapd]
+workers = 4
+queuesize = 10000
+agentrefresh = 60
+"""
 
 
 if __name__ == '__main__':
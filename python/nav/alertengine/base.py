@@ -29,6 +29,7 @@ from nav.models.profiles import (Account, AccountAlertQueue, AlertSubscription,
                                  AlertAddress, FilterGroup, AlertPreference,
                                  TimePeriod)
 from nav.models.event import AlertQueue
+from nav.alertengine.matching import AlertFilterMatcher, ALERT_RELATIONS
 
 
 _logger = logging.getLogger(__name__)
@@ -54,7 +55,8 @@ def check_alerts(debug=False):
     now = datetime.now()
 
     # Get all alerts that aren't in alert queue due to subscription
-    new_alerts = AlertQueue.objects.filter(accountalertqueue__isnull=True)
+    new_alerts = AlertQueue.objects.filter(
+        accountalertqueue__isnull=True).select_related(*ALERT_RELATIONS)
     num_new_alerts = len(new_alerts)
 
     initial_alerts = AlertQueue.objects.values_list('id', flat=True)
@@ -129,7 +131,13 @@ def check_alerts(debug=False):
 @transaction.atomic()
 def handle_new_alerts(new_alerts):
     """Handles new alerts on the queue"""
-    memoized_check_alert = lru_cache()(check_alert_against_filtergroupcontents)
+    matcher = AlertFilterMatcher()
+
+    def check_alert(alert, filtergroupcontents, atype):
+        return check_alert_against_filtergroupcontents(
+            alert, filtergroupcontents, atype, matcher)
+
+    memoized_check_alert = lru_cache()(check_alert)
     _logger = logging.getLogger('nav.alertengine.handle_new_alerts')
     accounts = []
 
@@ -164,13 +172,15 @@ def handle_new_alerts(new_alerts):
         for alertsubscription in current_alertsubscriptions:
             tmp.append(
                 (alertsubscription,
-                 alertsubscription.filter_group.filtergroupcontent_set.all()))
+                 alertsubscription.filter_group.filtergroupcontent_set.
+                 select_related('filter')))
 
         if tmp:
             permissions = []
             for filtergroup in FilterGroup.objects.filter(
                     group_permissions__accounts__in=[account]):
-                permissions.append(filtergroup.filtergroupcontent_set.all())
+                permissions.append(
+                    filtergroup.filtergroupcontent_set.select_related('filter'))
 
             accounts.append((account, tmp, permissions))
             del permissions
@@ -195,6 +205,7 @@ def handle_new_alerts(new_alerts):
         del permissions
 
     del memoized_check_alert
+    del matcher
     del new_alerts
     gc.collect()
 
@@ -435,8 +446,20 @@ def alert_should_be_ignored(queued_alert, subscription, now):
             subscription.type != AlertSubscription.NOW)
 
 
-def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
-    """Checks a given alert against an array of filtergroupcontents"""
+def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype,
+                                            matcher=None):
+    """Checks a given alert against an array of filtergroupcontents.
+
+    :param matcher: An optional AlertFilterMatcher instance, used to match the
+                    alert against filters in memory. If omitted, every filter
+                    is verified by querying the database.
+
+    """
+    if matcher:
+        verify = matcher.verify
+    else:
+        def verify(filtr, alert):
+            return filtr.verify(alert)
 
     _logger = logging.getLogger(
         'nav.alertengine.check_alert_against_filtergroupcontents')
@@ -453,7 +476,7 @@ def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
 
         # If we have not matched the message see if we can match it
         if not matches and content.include:
-            matches = content.filter.verify(alert) == content.positive
+            matches = verify(content.filter, alert) == content.positive
 
             if matches:
                 _logger.debug('alert %d: got included by filter %d in %s',
@@ -461,7 +484,7 @@ def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
 
         # If the alert has been matched try excluding it
         elif matches and not content.include:
-            matches = content.filter.verify(alert) != content.positive
+            matches = verify(content.filter, alert) != content.positive
 
             # Log that we excluded the alert
             if not matches:
@@ -0,0 +1,406 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 3 as published by the Free
+# Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""In-memory matching of alerts against alert profile filters.
+
+Filter.verify() asks the database whether a single alert matches a filter,
+which means one query for every alert and filter combination.
+
+This module compiles the expressions of a Filter into Python predicates,
+which are evaluated against the attributes of an alert and its directly
+related objects (see ALERT_RELATIONS). Only the expressions that cannot be
+evaluated faithfully in Python (e.g. matches against one-to-many relations,
+like a netbox' modules or prefixes) need the database, in which case the
+filter falls back to Filter.verify().
+
+"""
+import logging
+import re
+
+from django.db import models
+from IPy import IP
+
+from nav.models.manage import Location
+from nav.models.profiles import MatchField, Operator
+
+_logger = logging.getLogger(__name__)
+
+# The single-valued relations of an alert that match fields may refer to. An
+# alert queryset should use these with select_related() to ensure all the
+# attributes needed for matching are loaded in a single query.
+ALERT_RELATIONS = (
+    'event_type',
+    'alert_type',
+    'netbox__category',
+    'netbox__device',
+    'netbox__organization',
+    'netbox__room__location',
+    'netbox__type__vendor',
+)
+
+
+def _get_single_valued_lookups():
+    """Returns the set of all relation lookups reachable through
+    ALERT_RELATIONS, including the alert itself ('')
+
+    """
+    lookups = set([''])
+    for relation in ALERT_RELATIONS:
+        parts = relation.split('__')
+        for index in range(len(parts)):
+            lookups.add('__'.join(parts[:index + 1]))
+    return lookups
+
+
+_SINGLE_VALUED_LOOKUPS = _get_single_valued_lookups()
+
+_ORDERABLE_FIELDS = (
+    models.IntegerField, models.FloatField, models.DecimalField,
+    models.DateField, models.TimeField, models.AutoField,
+)
+
+_TEXT_FIELDS = (models.CharField, models.TextField)
+
+
+class UncompilableExpression(Exception):
+    """Raised when an expression cannot be evaluated without the database"""
+
+
+class AlertFilterMatcher(object):
+    """Matches alerts against alert profile filters.
+
+    Compiled filters and alert attribute snapshots are cached for the lifetime
+    of the matcher, which should therefore not outlive a single alertengine
+    run.
+
+    """
+    def __init__(self):
+        self._filters = {}
+        self._snapshots = {}
+
+    def verify(self, filtr, alert):
+        """Returns True if alert matches filtr"""
+        compiled = self._filters.get(filtr.id)
+        if compiled is None:
+            compiled = self._filters[filtr.id] = CompiledFilter(filtr)
+
+        snapshot = self._snapshots.get(alert.id)
+        if snapshot is None:
+            snapshot = self._snapshots[alert.id] = AlertSnapshot(alert)
+
+        return compiled.verify(snapshot)
+
+
+class AlertSnapshot(object):
+    """Provides cached values of attributes of an alert and its related
+    objects, keyed by Django-style lookup paths, like 'netbox__room_id'.
+
+    """
+    def __init__(self, alert):
+        self.alert = alert
+        self._values = {}
+
+    def get(self, path):
+        """Returns the value at the end of the lookup path, or None if any
+        relation along the path is unset.
+
+        """
+        if path not in self._values:
+            value = self.alert
+            for attr in path.split('__'):
+                value = getattr(value, attr)
+                if value is None:
+                    break
+            self._values[path] = value
+        return self._values[path]
+
+
+class CompiledFilter(object):
+    """A Filter, compiled into Python predicates.
+
+    The semantics of Filter.verify() are mirrored: All the filter expressions
+    must match, while the exclusion expressions only exclude an alert if they
+    all match. Like in verify(), an expression will replace any previous
+    expression that uses the same lookup.
+
+    """
+    def __init__(self, filtr):
+        self.filter = filtr
+        self.predicates = []
+        self.exclusions = []
+        self.needs_db = False
+        self._compile()
+
+    def _compile(self):
+        filters = {}
+        exclude = {}
+        for expression in self.filter.expression_set.select_related(
+                'match_field'):
+            try:
+                predicate = compile_expression(expression)
+            except UncompilableExpression as error:
+                _logger.debug("filter %s: falling back to database for "
+                              "expression %s: %s",
+                              self.filter.id, expression.id, error)
+                self.needs_db = True
+                predicate = None
+
+            target, lookup = get_verify_lookup(expression)
+            if target == 'filter':
+                filters[lookup] = predicate
+            elif target == 'exclude':
+                exclude[lookup] = predicate
+            elif predicate:
+                self.predicates.append(predicate)
+
+        self.predicates.extend(pred for pred in filters.values() if pred)
+        self.exclusions = list(exclude.values())
+
+    def verify(self, snapshot):
+        """Returns True if the alert represented by snapshot matches this
+        filter.
+
+        """
+        if not all(predicate(snapshot) for predicate in self.predicates):
+            return False
+        if self.needs_db:
+            return self.filter.verify(snapshot.alert)
+        if self.exclusions:
+            # needs_db is set whenever an exclusion couldn't be compiled
+            return not all(exclusion(snapshot)
+                           for exclusion in self.exclusions)
+        return True
+
+
+def get_verify_lookup(expression):
+    """Returns where Filter.verify() would put an expression.
+
+    :returns: A tuple (target, lookup), where target is one of 'filter',
+              'exclude' or None, and lookup is the ORM lookup that verify()
+              would use. A target of None signifies an expression that
+              verify() would put in an extra WHERE clause.
+
+    """
+    match_field = expression.match_field
+    if match_field.data_type == MatchField.IP:
+        return None, None
+    elif match_field.name == 'Location':
+        return 'filter', "{}__in".format(
+            MatchField.FOREIGN_MAP[MatchField.LOCATION])
+    elif expression.operator == Operator.WILDCARD:
+        return None, None
+
+    lookup = "%s%s" % (match_field.get_lookup_mapping(),
+                       expression.get_operator_mapping())
+    if expression.operator == Operator.NOT_EQUAL:
+        return 'exclude', lookup
+    return 'filter', lookup
+
+
+def compile_expression(expression):
+    """Compiles a single filter expression into a predicate.
+
+    :returns: A callable that takes an AlertSnapshot argument and returns
+              True if the expression matches the snapshot's alert.
+    :raises: UncompilableExpression if the expression can only be evaluated
+             by the database.
+
+    """
+    match_field = expression.match_field
+    path = match_field.get_lookup_mapping()
+    if not path:
+        raise UncompilableExpression("unsupported match field")
+    relation = path.rsplit('__', 1)[0] if '__' in path else ''
+    if relation not in _SINGLE_VALUED_LOOKUPS:
+        raise UncompilableExpression("%s is a multi-valued relation" %
+                                     relation)
+    field = _get_model_field(match_field)
+
+    if match_field.data_type == MatchField.IP:
+        return _compile_ip_expression(expression, path)
+
+    elif match_field.name == 'Location':
+        return _compile_location_expression(expression)
+
+    elif expression.operator == Operator.WILDCARD:
+        if not isinstance(field, _TEXT_FIELDS):
+            raise UncompilableExpression("wildcard match on non-text field")
+        regexp = _like_to_regexp(expression.value)
+        return _make_regexp_predicate(path, regexp, full=True)
+
+    operator = expression.operator
+    if operator in (Operator.EQUALS, Operator.NOT_EQUAL):
+        # NOT_EQUAL expressions are used as exclusions
+        value = _prep_value(field, expression.value)
+        return _make_equals_predicate(path, value)
+    elif operator == Operator.IN:
+        values = set(_prep_value(field, value)
+                     for value in expression.value.split('|'))
+        return _make_in_predicate(path, values)
+    elif operator in (Operator.GREATER, Operator.GREATER_EQ,
+                      Operator.LESS, Operator.LESS_EQ):
+        if not isinstance(field, _ORDERABLE_FIELDS):
+            # Text comparisons depend on the database collation
+            raise UncompilableExpression("ordering of non-numeric field")
+        value = _prep_value(field, expression.value)
+        return _make_ordering_predicate(path, operator, value)
+    elif operator in (Operator.STARTSWITH, Operator.ENDSWITH,
+                      Operator.CONTAINS):
+        if not isinstance(field, _TEXT_FIELDS):
+            raise UncompilableExpression("text match on non-text field")
+        return _make_text_predicate(path, operator, expression.value)
+    elif operator == Operator.REGEXP:
+        if not isinstance(field, _TEXT_FIELDS):
+            raise UncompilableExpression("regexp match on non-text field")
+        try:
+            regexp = re.compile(expression.value, re.IGNORECASE)
+        except re.error as error:
+            raise UncompilableExpression("invalid regexp: %s" % error)
+        return _make_regexp_predicate(path, regexp)
+
+    raise UncompilableExpression("unknown operator %s" % operator)
+
+
+def _get_model_field(match_field):
+    try:
+        model, attname = MatchField.MODEL_MAP[match_field.value_id]
+    except KeyError:
+        raise UncompilableExpression("unknown match field value id %s" %
+                                     match_field.value_id)
+    for field in model._meta.fields:
+        if field.attname == attname:
+            return field
+    raise UncompilableExpression("no field %s in %s" % (attname, model))
+
+
+def _prep_value(field, value):
+    """Converts an expression value the way the ORM would for a lookup"""
+    try:
+        return field.get_prep_value(value)
+    except (TypeError, ValueError) as error:
+        raise UncompilableExpression("invalid value %r: %s" % (value, error))
+
+
+def _compile_ip_expression(expression, path):
+    operator = expression.operator
+    if operator in (Operator.IN, Operator.CONTAINS):
+        values = expression.value.split('|')
+    else:
+        values = [expression.value]
+    try:
+        values = [IP(value) for value in values]
+    except ValueError as error:
+        raise UncompilableExpression("invalid IP value: %s" % error)
+
+    def _ip(snapshot):
+        value = snapshot.get(path)
+        return IP(value) if value is not None else None
+
+    if operator == Operator.EQUALS:
+        return lambda snapshot: _ip(snapshot) == values[0]
+    elif operator == Operator.NOT_EQUAL:
+        return lambda snapshot: _ip(snapshot) not in (None, values[0])
+    elif operator == Operator.CONTAINS:
+        def _contains(snapshot):
+            addr = _ip(snapshot)
+            return addr is not None and any(value in addr for value in values)
+        return _contains
+    elif operator == Operator.IN:
+        def _in(snapshot):
+            addr = _ip(snapshot)
+            return addr is not None and any(addr in value for value in values)
+        return _in
+
+    # Ordering and text matching of IP addresses is left to PostgreSQL
+    raise UncompilableExpression("IP operator %s" % operator)
+
+
+def _compile_location_expression(expression):
+    # Location expressions match all sublocations, regardless of operator
+    path = "%s__location_id" % MatchField.FOREIGN_MAP[MatchField.ROOM]
+    locations = Location.objects.filter(pk__in=expression.value.split('|'))
+    location_ids = set(
+        descendant.pk for location in locations
+        for descendant in location.get_descendants(include_self=True))
+    return _make_in_predicate(path, location_ids)
+
+
+def _make_equals_predicate(path, value):
+    def _equals(snapshot):
+        actual = snapshot.get(path)
+        return actual is not None and actual == value
+    return _equals
+
+
+def _make_in_predicate(path, values):
+    def _in(snapshot):
+        return snapshot.get(path) in values
+    return _in
+
+
+def _make_ordering_predicate(path, operator, value):
+    compare = {
+        Operator.GREATER: lambda actual: actual > value,
+        Operator.GREATER_EQ: lambda actual: actual >= value,
+        Operator.LESS: lambda actual: actual < value,
+        Operator.LESS_EQ: lambda actual: actual <= value,
+    }[operator]
+
+    def _ordering(snapshot):
+        actual = snapshot.get(path)
+        return actual is not None and compare(actual)
+    return _ordering
+
+
+def _make_text_predicate(path, operator, value):
+    value = value.lower()
+    compare = {
+        Operator.STARTSWITH: lambda actual: actual.startswith(value),
+        Operator.ENDSWITH: lambda actual: actual.endswith(value),
+        Operator.CONTAINS: lambda actual: value in actual,
+    }[operator]
+
+    def _text(snapshot):
+        actual = snapshot.get(path)
+        return actual is not None and compare(actual.lower())
+    return _text
+
+
+def _make_regexp_predicate(path, regexp, full=False):
+    def _regexp(snapshot):
+        actual = snapshot.get(path)
+        if actual is None:
+            return False
+        if full:
+            match = regexp.match(actual)
+            return bool(match) and match.end() == len(actual)
+        return bool(regexp.search(actual))
+    return _regexp
+
+
+def _like_to_regexp(pattern):
+    """Translates an SQL (I)LIKE pattern to a case insensitive regexp"""
+    regexp = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            regexp.append(re.escape(next(chars, '')))
+        elif char == '%':
+            regexp.append('.*')
+        elif char == '_':
+            regexp.append('.')
+        else:
+            regexp.append(re.escape(char))
+    return re.compile(''.join(regexp), re.IGNORECASE | re.DOTALL)
@@ -26,6 +26,8 @@ support.
 from __future__ import absolute_import
 
 import socket
+import threading
+import time
 from itertools import cycle
 from collections import defaultdict
 
@@ -44,53 +46,93 @@ from twisted.names.error import DNSNotImplementedError, DNSQueryRefusedError
 
 from django.utils import six
 
+# Number of seconds to remember that a name does not exist, if the response
+# does not say
+DEFAULT_NEGATIVE_TTL = 300
 
-def reverse_lookup(addresses):
+# The Twisted reactor is not thread safe, but resolvers may be used from
+# several threads at once, e.g. in a multithreaded web server. Only one thread
+# at a time may drive the reactor.
+_reactor_lock = threading.Lock()
+
+
+def reverse_lookup(addresses, timeout=None):
     """Runs parallel reverse DNS lookups for addresses.
 
+    :param timeout: The maximum number of seconds to wait for the lookups to
+                    finish. Lookups still unfinished by then will have a
+                    DNSQueryTimeoutError as their result.
     :returns: A dict of {address: [name, ...]} items
 
     """
     resolver = ReverseResolver()
-    return resolver.resolve(addresses)
+    return resolver.resolve(addresses, timeout)
 
 
-def forward_lookup(names):
+def forward_lookup(names, timeout=None):
     """Runs parallel forward DNS lookups for names.
 
+    :param timeout: The maximum number of seconds to wait for the lookups to
+                    finish. Lookups still unfinished by then will have a
+                    DNSQueryTimeoutError as their result.
     :returns: A dict of {name: [address, ...]} items
 
     """
     resolver = ForwardResolver()
-    return resolver.resolve(names)
+    return resolver.resolve(names, timeout)
 
 
 class Resolver(object):
-    """Abstract base class for resolvers"""
+    """Abstract base class for resolvers.
+
+    After resolve() has returned, the ttls attribute tells for how many
+    seconds each of the results may be cached. Results that should not be
+    cached, such as timeouts and server failures, have no TTL.
+
+    """
     def __init__(self):
-        self._resolvers = cycle([client.Resolver('/etc/resolv.conf')
-                                 for _i in range(3)])
+        with _reactor_lock:
+            self._resolvers = cycle([client.Resolver('/etc/resolv.conf')
+                                     for _i in range(3)])
         self.results = defaultdict(list)
+        self.ttls = {}
         self._finished = False
 
-    def resolve(self, names):
+    def resolve(self, names, timeout=None):
         """Resolves DNS names in parallel"""
+        with _reactor_lock:
+            return self._resolve(names, timeout)
+
+    def _resolve(self, names, timeout):
         self._finished = False
         self.results = defaultdict(list)
+        self.ttls = {}
+        names = set(names)
+        deadline = time.time() + timeout if timeout is not None else None
 
         deferred_list = []
         for name in names:
             for deferred in self.lookup(name):
+                deferred.addCallback(self._record_ttl, name)
                 deferred.addCallback(self._extract_records, name)
                 deferred.addErrback(self._errback, name)
+                deferred.addCallback(self._store_result)
                 deferred_list.append(deferred)
 
-        deferred_list = defer.DeferredList(deferred_list)
-        deferred_list.addCallback(self._parse_result)
-        deferred_list.addCallback(self._finish)
+        if deferred_list:
+            deferred = defer.DeferredList(deferred_list)
+            deferred.addCallback(self._finish)
+        else:
+            self._finished = True
 
         while not self._finished:
-            reactor.iterate()
+            if deadline is None:
+                reactor.iterate(0.1)
+            elif time.time() < deadline:
+                reactor.iterate(min(0.1, deadline - time.time()))
+            else:
+                self._expire(names, deferred_list)
+                break
         # Although the results are in at this point, we may need an extra
         # iteration to ensure the resolver library closes its UDP sockets
         reactor.iterate()
@@ -105,23 +147,61 @@ class Resolver(object):
     def _extract_records(result, name):
         raise NotImplementedError
 
-    def _parse_result(self, result):
-        """Parses the result to the correct format"""
-        for _success, (name, response) in result:
-            if isinstance(response, Exception):
-                self.results[name] = response
-            else:
-                self.results[name].extend(response)
-
-    @staticmethod
-    def _errback(failure, host):
+    def _record_ttl(self, result, name):
+        """Records the shortest TTL of the answers to a successful lookup"""
+        answers = result[0]
+        ttl = min([answer.ttl for answer in answers] or
+                  [_get_negative_ttl(result[1])])
+        self.ttls[name] = min(self.ttls.get(name, ttl), ttl)
+        return result
+
+    def _store_result(self, result):
+        """Stores the result of a single lookup"""
+        name, response = result
+        if isinstance(response, Exception):
+            self.results[name] = response
+        elif not isinstance(self.results[name], Exception):
+            self.results[name].extend(response)
+
+    def _errback(self, failure, host):
         """Errback"""
+        if failure.check(DNSNameError):
+            message = failure.value.args[0] if failure.value.args else None
+            ttl = _get_negative_ttl(getattr(message, 'authority', []))
+            self.ttls[host] = min(self.ttls.get(host, ttl), ttl)
+        else:
+            self.ttls[host] = 0
         return host, failure.value
 
+    def _expire(self, names, deferred_list):
+        """Gives up on the lookups that are still unfinished"""
+        unfinished = set(name for name in names if name not in self.results)
+        for deferred in deferred_list:
+            if not deferred.called:
+                deferred.cancel()
+        for name in names:
+            if (name in unfinished or
+                    isinstance(self.results[name], defer.CancelledError)):
+                self.results[name] = DNSQueryTimeoutError(name)
+                self.ttls.pop(name, None)
+
     def _finish(self, _):
         self._finished = True
 
 
+def _get_negative_ttl(authority):
+    """Returns the number of seconds a negative response may be cached, given
+    the authority section of the response.
+
+    :param authority: A list of RRHeader objects
+
+    """
+    for record in authority:
+        if record.type == dns.SOA:
+            return min(record.ttl, record.payload.minimum)
+    return DEFAULT_NEGATIVE_TTL
+
+
 class ForwardResolver(Resolver):
     """A forward resolver implementation for A and AAAA record lookups.
 
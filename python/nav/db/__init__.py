@@ -185,6 +185,15 @@ def closeConnections():
             pass
 
 
+def reset_connections():
+    """Closes and forgets all cached database connections, so that the next
+    call to getConnection opens a new one. Processes that fork should call
+    this first, to avoid sharing connections with their children.
+    """
+    closeConnections()
+    _connection_cache.clear()
+
+
 def commit_all_connections():
     """Attempts to commit the current transactions on all cached connections"""
     conns = (v.object for v in _connection_cache.values())
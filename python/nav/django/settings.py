@@ -175,7 +175,15 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': '/tmp/nav_cache',
         'TIMEOUT': '60'
-    }
+    },
+    # Reverse DNS lookups made by the web interface. Kept in memory, as there
+    # may be thousands of them per request. Each web server process has a
+    # cache of its own.
+    'dns': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nav-dns',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
 
 
@@ -160,6 +160,7 @@ class AlertGenerator(dict):
         history = self.make_alert_history()
         if history:
             history.save()
+            unresolved.track(history)
             self._post_alert_messages(history)
         return history
 
@@ -21,12 +21,16 @@ SQL is needed::
 
     CREATE RULE eventq_notify AS ON INSERT TO eventq DO ALSO NOTIFY new_event;
 
+The VLAN topology graphs used to evaluate whether a netbox is in shadow are
+cached until a ``topology_changed`` notification is received. This is sent by
+navtopology and whenever the swportvlan table changes.
+
 """
 import logging
 import sched
 import select
 import time
-from functools import wraps
+from functools import wraps, partial
 import errno
 
 from psycopg2 import OperationalError
@@ -37,7 +41,8 @@ from nav.eventengine.plugin import EventHandler
 from nav.eventengine.alerts import AlertGenerator
 from nav.eventengine.config import EVENTENGINE_CONF
 from nav.eventengine import unresolved
-from nav.models.event import EventQueue as Event
+from nav.eventengine.topology import VlanGraphCache
+from nav.models.event import EventQueue as Event, EventQueueVar
 import nav.db
 
 _logger = logging.getLogger(__name__)
@@ -85,14 +90,18 @@ class EventEngine(object):
     # inserted into the queue.
     CHECK_INTERVAL = 30
     PLUGIN_TASKS_PRIORITY = 1
+    # max number of events to load and process in a single transaction
+    BATCH_SIZE = 1000
     _logger = logging.getLogger(__name__)
 
     def __init__(self, target="eventEngine", config=EVENTENGINE_CONF):
         self._scheduler = sched.scheduler(time.time, self._notifysleep)
         self._unfinished = set()
+        self._last_seen_id = 0
         self.target = target
         self.config = config
         self.handlers = EventHandler.load_and_find_subclasses()
+        self.topology = VlanGraphCache()
         self._logger.debug("found %d event handler%s: %r",
                            len(self.handlers),
                            's' if len(self.handlers) > 1 else '',
@@ -117,15 +126,26 @@ class EventEngine(object):
             except OperationalError:
                 connection.connection = None
                 self._listen()
+                # notifications may have been lost with the connection
+                self.topology.invalidate()
                 return
             if conn.notifies:
-                self._logger.debug("got event notification from database")
-                self._schedule_next_queuecheck()
+                self._handle_notifications(conn.notifies)
                 del conn.notifies[:]
         else:
             self._logger.debug("regular sleep for %ss", delay)
             time.sleep(delay)
 
+    def _handle_notifications(self, notifies):
+        channels = set(notify.channel for notify in notifies)
+        if 'topology_changed' in channels:
+            self._logger.debug("got topology change notification from "
+                               "database")
+            self.topology.invalidate()
+        if 'new_event' in channels:
+            self._logger.debug("got event notification from database")
+            self._schedule_next_queuecheck()
+
     def start(self):
         "Starts the event engine"
         self._logger.info("--- starting event engine ---")
@@ -150,16 +170,17 @@ class EventEngine(object):
     @retry_on_db_loss()
     @transaction.atomic()
     def _listen():
-        """Ensures that we subscribe to new_event notifications on our
-        PostgreSQL connection.
+        """Ensures that we subscribe to new_event and topology_changed
+        notifications on our PostgreSQL connection.
 
         """
         _logger.debug("registering event listener with PostgreSQL")
         cursor = connection.cursor()
         cursor.execute('LISTEN new_event')
+        cursor.execute('LISTEN topology_changed')
 
     def _load_new_events_and_reschedule(self):
-        self.load_new_events()
+        self.load_new_events(full_scan=True)
         self._schedule_next_queuecheck(
             self.CHECK_INTERVAL,
             action=self._load_new_events_and_reschedule)
@@ -171,20 +192,55 @@ class EventEngine(object):
         self._scheduler.enter(delay, 0, action, ())
 
     @swallow_unhandled_exceptions
-    @transaction.atomic()
-    def load_new_events(self):
-        "Loads and processes new events on the queue, if any"
+    def load_new_events(self, full_scan=False):
+        """Loads and processes new events on the queue, if any.
+
+        Normally, only events with a higher id than the last seen event are
+        loaded. Since event ids aren't necessarily committed to the queue in
+        order, a full scan of the queue should still be requested regularly.
+
+        :param full_scan: If True, all events on the queue are loaded.
+
+        """
         self._logger.debug("checking for new events on queue")
-        events = Event.objects.filter(target=self.target).order_by('id')
-        if events:
-            old_events = [event for event in events
-                          if event.id in self._unfinished]
-            new_events = [event for event in events
-                          if event.id not in self._unfinished]
-            self._logger.info("found %d new and %d old events in queue db",
-                              len(new_events), len(old_events))
+        last_id = 0 if full_scan else self._last_seen_id
+        while True:
+            batch = self._get_events_after(last_id)
+            if batch:
+                last_id = batch[-1].id
+                self._last_seen_id = max(self._last_seen_id, last_id)
+                self._handle_event_batch(batch)
+            if len(batch) < self.BATCH_SIZE:
+                break
+
+        self._log_task_queue()
+
+    def _get_events_after(self, last_id):
+        """Returns the next batch of queued events with an id higher than
+        last_id, with related objects and variables preloaded.
+        """
+        events = list(
+            Event.objects.filter(target=self.target, id__gt=last_id)
+            .select_related('source', 'target', 'event_type', 'netbox',
+                            'device')
+            .order_by('id')[:self.BATCH_SIZE])
+        _preload_variables(events)
+        return events
+
+    @transaction.atomic()
+    def _handle_event_batch(self, events):
+        old_events = [event for event in events
+                      if event.id in self._unfinished]
+        new_events = [event for event in events
+                      if event.id not in self._unfinished]
+        self._logger.info("found %d new and %d old events in queue db",
+                          len(new_events), len(old_events))
+        if not new_events:
+            return
+
+        unresolved.update()
+        with DeferredDeletion(new_events):
             for event in new_events:
-                unresolved.update()
                 try:
                     self.handle_event(event)
                 except Exception:
@@ -194,8 +250,6 @@ class EventEngine(object):
                     if event.id:
                         event.delete()
 
-        self._log_task_queue()
-
     def _log_task_queue(self):
         _logger = logging.getLogger(__name__ + '.queue')
         _logger.debug("about to log task queue: %d", len(self._scheduler.queue))
@@ -239,8 +293,9 @@ class EventEngine(object):
         """Returns True if the event's associated netbox is currently on
         maintenance.
         """
-        return event.netbox and event.netbox.get_unresolved_alerts(
-            'maintenanceState').count() > 0
+        return bool(event.netbox_id) and (
+            unresolved.netbox_has_unresolved_alert(event.netbox_id,
+                                                   'maintenanceState'))
 
     @transaction.atomic()
     def handle_event(self, event):
@@ -285,3 +340,47 @@ class EventEngine(object):
     def cancel(self, task):
         """Cancel the current scheduled task"""
         self._scheduler.cancel(task)
+
+
+def _preload_variables(events):
+    """Loads the variable maps of a list of events using a single query"""
+    if not events:
+        return
+    varmaps = dict((event.id, {}) for event in events)
+    variables = EventQueueVar.objects.filter(
+        event_queue__in=list(varmaps)).values_list(
+            'event_queue', 'variable', 'value')
+    for event_id, variable, value in variables:
+        varmaps[event_id][variable] = value
+    for event in events:
+        setattr(event, Event.varmap.cachename, varmaps[event.id])
+
+
+class DeferredDeletion(object):
+    """Context manager that defers deletion of a list of events.
+
+    While active, calling delete() on any of the events will only mark them as
+    deleted. When the context is exited, all the marked events are deleted
+    from the database at once.
+
+    """
+    def __init__(self, events):
+        self.events = events
+        self.deleted = []
+
+    def __enter__(self):
+        for event in self.events:
+            event.delete = partial(self._delete, event)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for event in self.events:
+            del event.delete
+        if self.deleted and exc_type is None:
+            _logger.debug("deleting %d processed events", len(self.deleted))
+            Event.objects.filter(id__in=self.deleted).delete()
+
+    def _delete(self, event):
+        if event.id is not None:
+            self.deleted.append(event.id)
+            event.id = None
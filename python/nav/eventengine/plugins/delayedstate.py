@@ -201,8 +201,8 @@ class DelayedStateHandler(EventHandler):
 
     def _verify_shadow(self):
         netbox = self.event.netbox
-        netbox.up = (Netbox.UP_DOWN if netbox_appears_reachable(netbox)
-                     else Netbox.UP_SHADOW)
+        reachable = netbox_appears_reachable(netbox, self.engine.topology)
+        netbox.up = Netbox.UP_DOWN if reachable else Netbox.UP_SHADOW
         Netbox.objects.filter(id=netbox.id).update(up=netbox.up)
         return netbox.up == Netbox.UP_SHADOW
 
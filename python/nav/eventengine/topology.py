@@ -17,6 +17,7 @@
 import logging
 import socket
 import datetime
+import time
 
 import networkx
 from networkx.exception import NetworkXException
@@ -25,20 +26,28 @@ from nav.models.manage import SwPortVlan, Netbox, Prefix, Arp, Cam
 _logger = logging.getLogger(__name__)
 
 
-def netbox_appears_reachable(netbox):
+# Maximum number of seconds to keep cached VLAN graphs, in case a topology
+# change notification was missed
+DEFAULT_MAX_AGE = 3600
+
+
+def netbox_appears_reachable(netbox, topology=None):
     """Returns True if netbox appears to be reachable through the known
     topology.
 
+    :param topology: A VlanGraphCache to get VLAN graphs from. If omitted,
+                     the graphs are built from the database.
+
     """
-    target_path = get_path_to_netbox(netbox)
+    target_path = get_path_to_netbox(netbox, topology)
     nav = NAVServer.make_for(netbox.ip)
-    nav_path = get_path_to_netbox(nav) if nav else True
+    nav_path = get_path_to_netbox(nav, topology) if nav else True
     _logger.debug("reachability paths, target_path=%(target_path)r, "
                   "nav_path=%(nav_path)r", locals())
     return bool(target_path and nav_path)
 
 
-def get_path_to_netbox(netbox):
+def get_path_to_netbox(netbox, topology=None):
     """Returns a likely path from netbox to its apparent gateway/router.
 
     If any switches on the path, or the router itself is down,
@@ -46,6 +55,9 @@ def get_path_to_netbox(netbox):
     if there is insufficient information for NAV to find a likely path,
     a True value is returned.
 
+    :param topology: A VlanGraphCache to get VLAN graphs from. If omitted,
+                     the graphs are built from the database.
+
     """
     prefix = netbox.get_prefix()
     if not prefix:
@@ -63,11 +75,14 @@ def get_path_to_netbox(netbox):
     _logger.debug("reachability check for %s on %s (router: %s)",
                   netbox, prefix, router)
 
-    graph = get_graph_for_vlan(prefix.vlan)
-    try:
-        netbox.add_to_graph(graph)
-    except AttributeError:
-        pass
+    if topology is not None:
+        graph = topology.get_graph_for_vlan(prefix.vlan, netbox)
+    else:
+        graph = get_graph_for_vlan(prefix.vlan)
+        try:
+            netbox.add_to_graph(graph)
+        except AttributeError:
+            pass
 
     # first, see if any path exists
     if not _path_exists(graph, netbox, router):
@@ -76,7 +91,10 @@ def get_path_to_netbox(netbox):
         return True
 
     # now, remove nodes that are down and see if a path still exists
-    strip_down_nodes_from_graph(graph, keep=netbox)
+    if topology is not None:
+        graph = get_up_subgraph(graph, keep=netbox)
+    else:
+        strip_down_nodes_from_graph(graph, keep=netbox)
 
     if netbox not in graph or router not in graph:
         if router.up == router.UP_UP:
@@ -139,6 +157,79 @@ def get_graph_for_vlan(vlan):
     return graph
 
 
+class VlanGraphCache(object):
+    """A cache of the VLAN topology graphs used for reachability checks.
+
+    Building a VLAN graph from the database is expensive, and a large outage
+    will cause the same graphs to be needed for every affected netbox. The
+    graphs only change when the topology does, so they are kept until
+    invalidate() is called, or they are older than max_age seconds.
+
+    The cached graphs include every netbox regardless of its current state,
+    and must not be modified. Use get_up_subgraph() to find the part of a
+    graph that is currently up.
+
+    """
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._graphs = {}
+        self._built = time.time()
+
+    def get_graph_for_vlan(self, vlan, netbox=None):
+        """Returns the cached graph for vlan, building it if necessary.
+
+        :param netbox: The netbox whose path is wanted. If it is a NAVServer,
+                       the graph will also include the NAV server and its
+                       neighboring switches.
+
+        """
+        if time.time() - self._built > self.max_age:
+            self.invalidate()
+
+        add_to_graph = getattr(netbox, 'add_to_graph', None)
+        key = (vlan.id, netbox.ip) if add_to_graph else vlan.id
+        if key not in self._graphs:
+            if add_to_graph:
+                graph = self.get_graph_for_vlan(vlan).copy()
+                add_to_graph(graph)
+            else:
+                graph = get_graph_for_vlan(vlan)
+            _logger.debug("cached %r with %d nodes", graph.name, len(graph))
+            self._graphs[key] = graph
+        return self._graphs[key]
+
+    def invalidate(self):
+        """Forgets all the cached graphs"""
+        if self._graphs:
+            _logger.debug("invalidating %d cached VLAN graphs",
+                          len(self._graphs))
+        self._graphs = {}
+        self._built = time.time()
+
+    def __len__(self):
+        return len(self._graphs)
+
+
+def get_up_subgraph(graph, keep=None):
+    """Returns a read-only view of graph, without the netboxes that are
+    currently down.
+
+    The current state of each netbox is loaded from the database, as the
+    netbox objects in a cached graph may be outdated.
+
+    :param keep: A node to keep regardless of its current status.
+
+    """
+    netboxids = [node.id for node in graph.nodes()
+                 if isinstance(node, Netbox)]
+    states = dict(Netbox.objects.filter(id__in=netboxids)
+                  .values_list('id', 'up'))
+    return graph.subgraph(
+        node for node in graph.nodes()
+        if node == keep or
+        states.get(getattr(node, 'id', None), node.up) == Netbox.UP_UP)
+
+
 def strip_down_nodes_from_graph(graph, keep=None):
     """Strips all nodes (netboxes) from graph that are currently down.
 
@@ -226,6 +317,15 @@ class NAVServer(object):
         if arp:
             return arp[0].mac
 
+    def __eq__(self, other):
+        return isinstance(other, NAVServer) and self.ip == other.ip
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.ip)
+
     def __repr__(self):
         return "{self.__class__.__name__}({self.ip!r})".format(self=self)
 
@@ -15,6 +15,7 @@
 #
 """Loading and caching of unresolved alert states from the database"""
 
+from collections import defaultdict, Counter
 import logging
 
 from nav.models.event import AlertHistory
@@ -22,6 +23,7 @@ from nav.models.fields import INFINITY
 
 _logger = logging.getLogger(__name__)
 _unresolved_alerts_map = {}
+_netbox_event_types = defaultdict(Counter)
 
 
 def get_map():
@@ -33,10 +35,37 @@ def update():
     """Updates the map of unresolved alerts from the database"""
     # yes mr. pylint, we use global state, this module acts as a singleton
     # pylint: disable=W0603
-    global _unresolved_alerts_map
+    global _unresolved_alerts_map, _netbox_event_types
     unresolved = AlertHistory.objects.filter(end_time__gte=INFINITY)
     _unresolved_alerts_map = dict((alert.get_key(), alert)
                                   for alert in unresolved)
+    _netbox_event_types = defaultdict(Counter)
+    for netbox_id, _subid, event_type_id in _unresolved_alerts_map:
+        _netbox_event_types[netbox_id][event_type_id] += 1
+
+
+def track(alert):
+    """Updates the cached map of unresolved alerts with an AlertHistory entry
+    that was just saved, so that the map won't need to be reloaded from the
+    database.
+    """
+    key = alert.get_key()
+    netbox_id, _subid, event_type_id = key
+    if alert.end_time and alert.end_time >= INFINITY:
+        if key not in _unresolved_alerts_map:
+            _netbox_event_types[netbox_id][event_type_id] += 1
+        _unresolved_alerts_map[key] = alert
+    elif key in _unresolved_alerts_map and (
+            _unresolved_alerts_map[key].pk == alert.pk):
+        del _unresolved_alerts_map[key]
+        _netbox_event_types[netbox_id][event_type_id] -= 1
+
+
+def netbox_has_unresolved_alert(netbox_id, event_type_id):
+    """Returns True if the cached map contains an unresolved alert of the
+    given event type for a netbox.
+    """
+    return _netbox_event_types.get(netbox_id, {}).get(event_type_id, 0) > 0
 
 
 def refers_to_unresolved_alert(event):
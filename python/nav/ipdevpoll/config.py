@@ -32,11 +32,26 @@ class IpdevpollConfig(NAVConfigParser):
 [ipdevpoll]
 logfile = ipdevpolld.log
 max_concurrent_jobs = 500
+bulk_save = no
+
+[multiprocess]
+min_workers =
+max_worker_memory = 0
+worker_idle_timeout = 300
+worker_grow_load = 300
 
 [snmp]
 timeout = 1.5
 max-repetitions = 10
 
+[snmpcache]
+enabled = no
+max-size = 100000
+
+[snmpcache:ttl]
+3600 = IF-MIB::ifName IF-MIB::ifDescr
+1800 = ENTITY-MIB::entPhysicalTable
+
 [plugins]
 
 [jobs]
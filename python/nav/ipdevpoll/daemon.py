@@ -178,10 +178,18 @@ class IPDevPollProcess(object):
     def setup_multiprocess(self, process_count, max_jobs):
         self._logger.info("Starting multi-process setup")
         from .schedule import JobScheduler
+        from .config import ipdevpoll_conf as conf
         plugins.import_plugins()
-        self.work_pool = pool.WorkerPool(process_count,
-                                         max_jobs,
-                                         self.options.threadpoolsize)
+        min_workers = conf.get('multiprocess', 'min_workers').strip()
+        self.work_pool = pool.WorkerPool(
+            process_count,
+            max_jobs,
+            self.options.threadpoolsize,
+            min_workers=int(min_workers) if min_workers else None,
+            max_memory=conf.getint('multiprocess', 'max_worker_memory') * 1024,
+            idle_timeout=conf.getint('multiprocess', 'worker_idle_timeout'),
+            grow_load=conf.getfloat('multiprocess', 'worker_grow_load'),
+        )
         reactor.callWhenRunning(JobScheduler.initialize_from_config_and_run,
                                 self.work_pool, self.options.onlyjob)
 
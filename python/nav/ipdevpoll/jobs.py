@@ -37,6 +37,7 @@ from .plugins import plugin_registry
 from . import storage, shadows, dataloader
 from .utils import log_unhandled_failure
 from .snmp.common import snmp_parameter_factory
+from .snmp.responsecache import get_response_cache
 
 _logger = logging.getLogger(__name__)
 ports = cycle([snmpprotocol.port() for i in range(50)])
@@ -108,7 +109,8 @@ class JobHandler(object):
             community=self.netbox.read_only,
             snmpVersion='v%s' % self.netbox.snmp_version,
             protocol=port.protocol,
-            snmp_parameters=snmp_parameter_factory(self.netbox)
+            snmp_parameters=snmp_parameter_factory(self.netbox),
+            response_cache=get_response_cache(self.netbox.id)
         )
         try:
             self.agent.open()
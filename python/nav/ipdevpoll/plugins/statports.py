@@ -13,7 +13,16 @@
 # more details.  You should have received a copy of the GNU General Public
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""Collects port traffic counters and pushes to Graphite"""
+"""Collects port traffic counters and pushes to Graphite
+
+Interface names rarely change, but walking ifName and ifDescr on every run
+takes a significant part of the SNMP budget on large devices.  Once a
+device's ifIndex -> name layout is known, later runs will only walk the
+counter columns, using large GETBULK requests sized to the known number of
+interfaces.  The layout is discarded whenever the device's ifNumber or
+ifTableLastChange values change, or its sysUpTime goes backwards.
+
+"""
 import time
 import logging
 
@@ -21,6 +30,8 @@ from django.utils.six import itervalues
 from twisted.internet import defer
 from nav.ipdevpoll import Plugin
 from nav.ipdevpoll import db
+from nav.ipdevpoll.snmp.responsecache import (SYSUPTIME, IFTABLELASTCHANGE,
+                                              IFNUMBER, get_signal_change)
 from nav.metrics.carbon import send_metrics
 from nav.metrics.templates import metric_path_for_interface
 from nav.mibs import reduce_index
@@ -67,6 +78,14 @@ IP_COUNTERS = (
 USED_COUNTERS = NON_HC_COUNTERS + HC_COUNTERS + OTHER_COUNTERS
 LOGGED_COUNTERS = USED_COUNTERS + IP_COUNTERS
 
+LAYOUT_SIGNALS = (SYSUPTIME, IFNUMBER, IFTABLELASTCHANGE)
+
+LAYOUT_MAX_AGE = 3600  # seconds
+MAX_BULK_REPETITIONS = 200
+
+# Known interface layouts, by netbox id. Each ipdevpoll process keeps its own.
+_layouts = {}
+
 
 class StatPorts(Plugin):
     @classmethod
@@ -93,8 +112,17 @@ class StatPorts(Plugin):
     def _get_stats(self):
         ifmib = IfMib(self.agent)
         ipmib = IpMib(self.agent)
-        stats = yield ifmib.retrieve_columns(
-            ("ifName", "ifDescr") + USED_COUNTERS).addCallback(reduce_index)
+        stats = None
+        signals = yield self._get_layout_signals()
+        layout = _layouts.get(self.netbox.id)
+        if layout and layout.is_valid_for(*signals):
+            stats = yield self._get_counters(ifmib, layout)
+        if stats is None:
+            stats = yield ifmib.retrieve_columns(
+                ("ifName", "ifDescr") + USED_COUNTERS).addCallback(
+                    reduce_index)
+            _layouts[self.netbox.id] = InterfaceLayout.from_stats(
+                stats, *signals)
         ipv6stats = yield ipmib.get_ipv6_octet_counters()
         if ipv6stats:
             self._logger.debug("found ipv6 octet counters for %d interfaces",
@@ -106,6 +134,39 @@ class StatPorts(Plugin):
 
         defer.returnValue(stats)
 
+    @defer.inlineCallbacks
+    def _get_layout_signals(self):
+        """Retrieves the sysUpTime, ifNumber and ifTableLastChange values of
+        the device, any of which may be None if unavailable.
+
+        """
+        result = yield self.agent.get_device_signals()
+        defer.returnValue(tuple(result.get(oid) for oid in LAYOUT_SIGNALS))
+
+    @defer.inlineCallbacks
+    def _get_counters(self, ifmib, layout):
+        """Retrieves only the counter columns for the interfaces of a known
+        layout.
+
+        :returns: A stats dict like the one produced by a full walk, or None
+                  if the counter rows didn't match the known layout.
+
+        """
+        repetitions = min(len(layout.names) + 1, MAX_BULK_REPETITIONS)
+        stats = yield ifmib.retrieve_columns(
+            USED_COUNTERS, max_repetitions=repetitions).addCallback(
+                reduce_index)
+        if set(stats) - set(layout.names):
+            self._logger.debug("counters found for unknown interfaces, "
+                               "interface layout must be refreshed")
+            defer.returnValue(None)
+
+        self._logger.debug("using known interface layout, only counters "
+                           "were retrieved")
+        for ifindex, row in stats.items():
+            row['ifName'], row['ifDescr'] = layout.names[ifindex]
+        defer.returnValue(stats)
+
     def _make_metrics(self, stats, netboxes, timestamp=None):
         timestamp = timestamp or time.time()
         hc_counters = False
@@ -146,6 +207,39 @@ class StatPorts(Plugin):
                                "%s): %r", master, ifcs)
 
 
+class InterfaceLayout(object):
+    """The ifIndex -> (ifName, ifDescr) layout of a device, along with the
+    sysUpTime, ifNumber and ifTableLastChange values it was retrieved at.
+
+    """
+    def __init__(self, names, uptime, ifnumber, lastchange, timestamp=None):
+        self.names = names
+        self.uptime = uptime
+        self.ifnumber = ifnumber
+        self.lastchange = lastchange
+        self.timestamp = timestamp or time.time()
+
+    @classmethod
+    def from_stats(cls, stats, uptime, ifnumber, lastchange):
+        """Creates a layout from the result of a full counter walk"""
+        names = {ifindex: (row['ifName'], row['ifDescr'])
+                 for ifindex, row in stats.items()}
+        return cls(names, uptime, ifnumber, lastchange)
+
+    def is_valid_for(self, uptime, ifnumber, lastchange):
+        """Returns True if this layout is still valid for a device that
+        currently reports these sysUpTime, ifNumber and ifTableLastChange
+        values.
+
+        """
+        if None in (ifnumber, lastchange) or ifnumber != self.ifnumber:
+            return False
+        change = get_signal_change((self.uptime, self.lastchange),
+                                   (uptime, lastchange))
+        return (not change
+                and time.time() - self.timestamp < LAYOUT_MAX_AGE)
+
+
 def use_hc_counters(row):
     """
     Replaces octet counter values with high capacity counter values, if present
@@ -18,11 +18,13 @@ from __future__ import print_function
 
 import datetime
 import os
+import resource
 import sys
 import logging
+import time
 
 from twisted.protocols import amp
-from twisted.internet import reactor, protocol
+from twisted.internet import reactor, protocol, task
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet.endpoints import ProcessEndpoint, StandardIOEndpoint
 import twisted.internet.endpoints
@@ -32,6 +34,17 @@ from django.utils import six
 from . import control, jobs
 
 
+def get_memory_usage():
+    """Returns the resident set size of the current process, in kilobytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        # Not on Linux, fall back to the peak resident set size
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
 def initialize_worker():
     """Initializes AMP server for a worker process"""
     handler = JobHandler()
@@ -66,7 +79,9 @@ class Job(amp.Command):
         (b'serial', amp.Integer()),  # Serial number needed for cancelling
     ]
     response = [(b'result', amp.Boolean()),
-                (b'reschedule', amp.Integer())]
+                (b'reschedule', amp.Integer()),
+                (b'rss', amp.Integer(optional=True)),  # worker memory, in KiB
+                (b'rss_growth', amp.Integer(optional=True))]
     errors = {
         jobs.AbortedJobError: b'AbortedJob',
     }
@@ -102,6 +117,7 @@ class JobHandler(amp.CommandLocator):
         )
         job = jobs.JobHandler(job, netbox, plugins, interval)
         self.jobs[serial] = job
+        rss_before = get_memory_usage()
         deferred = job.run()
         deferred.addBoth(self.job_done, serial)
         deferred.addCallback(lambda x: {'result': x, 'reschedule': 0})
@@ -110,7 +126,13 @@ class JobHandler(amp.CommandLocator):
             failure.trap(jobs.SuggestedReschedule)
             return {'reschedule': failure.value.delay, "result": False}
 
+        def add_memory_usage(response):
+            response['rss'] = rss = get_memory_usage()
+            response['rss_growth'] = max(0, rss - rss_before)
+            return response
+
         deferred.addErrback(handle_reschedule)
+        deferred.addCallback(add_memory_usage)
         return deferred
 
     @Cancel.responder
@@ -124,6 +146,8 @@ class JobHandler(amp.CommandLocator):
     def shutdown(self):
         """Shuts down the worker process"""
         self.done = True
+        if not self.jobs:
+            reactor.callLater(3, reactor.stop)
         return {}
 
     def log_jobs(self):
@@ -201,20 +225,32 @@ class Worker(object):
         self.threadpoolsize = threadpoolsize
         self.max_jobs = max_jobs
         self.started_at = None
+        self.retiring = False
+        self.rss = 0
+        self.job_costs = {}
+        self.idle_since = time.time()
 
     def __repr__(self):
         return (
             "<Worker pid={pid} ready={ready} active={active} max={max} "
-            "total={total} started_at={started_at}>"
+            "total={total} load={load:.1f} rss={rss}KiB "
+            "started_at={started_at}>"
         ).format(
             pid=self.pid,
             ready=not self.done(),
             active=self.active_jobs,
             max=self.max_concurrent_jobs,
             total=self.total_jobs,
+            load=self.load,
+            rss=self.rss,
             started_at=self.started_at,
         )
 
+    @property
+    def load(self):
+        """The sum of the estimated costs of all jobs active on this worker"""
+        return sum(self.job_costs.values())
+
     @inlineCallbacks
     def start(self):
         """Starts a new child worker process"""
@@ -245,7 +281,17 @@ class Worker(object):
 
     def done(self):
         """Returns True if this worker process will take no more jobs"""
-        return self.max_jobs and (self.total_jobs >= self.max_jobs)
+        return self.retiring or bool(
+            self.max_jobs and (self.total_jobs >= self.max_jobs))
+
+    def retire(self):
+        """Takes this worker out of service. The worker process will exit
+        once its active jobs are done.
+        """
+        if not self.retiring:
+            self.retiring = True
+            self._logger.debug("Retiring worker %r", self)
+            self.process.callRemote(Shutdown)
 
     def _worker_died(self, _process, _reason):
         if not self.done():
@@ -256,10 +302,14 @@ class Worker(object):
             self._logger.debug("Exited normally: %r", self)
         self.pool.worker_died(self)
 
-    def execute(self, serial, command, **kwargs):
-        """Executes a remote job"""
+    def execute(self, serial, command, cost=1.0, **kwargs):
+        """Executes a remote job
+
+        :param cost: The estimated cost of the job, see JobCostEstimates.
+        """
         self.active_jobs += 1
         self.total_jobs += 1
+        self.job_costs[serial] = cost
         self.max_concurrent_jobs = max(self.active_jobs,
                                        self.max_concurrent_jobs)
         self._logger.debug(
@@ -276,55 +326,185 @@ class Worker(object):
             self.process.callRemote(Shutdown)
         return deferred
 
+    def job_finished(self, serial):
+        """Called to signal that a job dispatched to this worker has finished"""
+        self.active_jobs -= 1
+        self.job_costs.pop(serial, None)
+        if not self.active_jobs:
+            self.idle_since = time.time()
+
     def cancel(self, serial):
         """Cancels a job running on this worker"""
         return self.process.callRemote(Cancel, serial=serial)
 
 
+class JobCostEstimates(object):
+    """Keeps track of the measured cost of running jobs, by job name and
+    netbox.
+
+    The cost of a job is its runtime in seconds. Estimates are exponential
+    moving averages of measured runtimes and worker memory growth.
+
+    """
+    DEFAULT_COST = 1.0
+    SMOOTHING = 0.3
+
+    def __init__(self):
+        self.runtimes = {}
+        self.rss_growth = {}
+
+    def estimate(self, job, netbox):
+        """Returns the estimated cost of running job for netbox"""
+        for key in ((job, netbox), job):
+            if key in self.runtimes:
+                return self.runtimes[key]
+        return self.DEFAULT_COST
+
+    def update(self, job, netbox, runtime, rss_growth=None):
+        """Updates the estimates with the measurements of a single job run"""
+        for key in ((job, netbox), job):
+            self._update_average(self.runtimes, key, runtime)
+            if rss_growth is not None:
+                self._update_average(self.rss_growth, key, rss_growth)
+
+    def _update_average(self, averages, key, value):
+        if key in averages:
+            averages[key] += self.SMOOTHING * (value - averages[key])
+        else:
+            averages[key] = value
+
+
 class WorkerPool(object):
     """This class represent a pool of worker processes to which jobs can
-    be scheduled"""
+    be scheduled.
 
-    _logger = logging.getLogger(__name__ + '.workerpool')
+    Jobs are placed on the worker with the lowest estimated load, based on
+    measured runtimes of previous runs of the same jobs. The pool will grow
+    from min_workers up to `workers` processes as long as all workers are
+    busy, and shrink again when workers are idle. Workers whose memory usage
+    exceed max_memory are gracefully replaced.
+
+    """
 
-    def __init__(self, workers, max_jobs, threadpoolsize=None):
+    _logger = logging.getLogger(__name__ + '.workerpool')
+    SHRINK_CHECK_INTERVAL = 60  # seconds
+
+    def __init__(self, workers, max_jobs, threadpoolsize=None,
+                 min_workers=None, max_memory=0, idle_timeout=300,
+                 grow_load=300):
+        """
+        :param workers: The maximum number of worker processes.
+        :param max_jobs: The number of jobs after which to restart a worker.
+        :param threadpoolsize: The thread pool size of each worker.
+        :param min_workers: The minimum number of worker processes. If
+                            unset, the pool will always have `workers`
+                            workers.
+        :param max_memory: The resident memory size, in KiB, after which to
+                           replace a worker. 0 means no limit.
+        :param idle_timeout: The number of seconds a worker must have been
+                             idle before it is stopped to shrink the pool.
+        :param grow_load: The estimated load a worker must have before the
+                          pool grows to take more load.
+        """
         twisted.internet.endpoints.log = HackLog
         self.workers = set()
-        self.target_count = workers
+        self.max_count = workers
+        self.target_count = min(workers, min_workers or workers)
         self.max_jobs = max_jobs
         self.threadpoolsize = threadpoolsize
+        self.max_memory = max_memory
+        self.idle_timeout = idle_timeout
+        self.grow_load = grow_load
+        self.costs = JobCostEstimates()
+        self._spawning = 0
         for _ in range(self.target_count):
             self._spawn_worker()
         self.serial = 0
         self.jobs = dict()
+        if self.target_count < self.max_count:
+            self._shrink_loop = task.LoopingCall(self._shrink_idle_workers)
+            self._shrink_loop.start(self.SHRINK_CHECK_INTERVAL, now=False)
 
     def worker_died(self, worker):
         """Called to signal the death of a worker process"""
-        self.workers.remove(worker)
+        self.workers.discard(worker)
         if not worker.done():
             self._spawn_worker()
 
     @inlineCallbacks
     def _spawn_worker(self):
-        worker = yield Worker(self, self.threadpoolsize, self.max_jobs).start()
+        self._spawning += 1
+        try:
+            worker = yield Worker(self, self.threadpoolsize,
+                                  self.max_jobs).start()
+        finally:
+            self._spawning -= 1
         self.workers.add(worker)
 
     def _cleanup(self, result, deferred):
-        _serial, worker = self.jobs[deferred]
+        serial, worker, job, netbox, started_at = self.jobs[deferred]
         del self.jobs[deferred]
-        worker.active_jobs -= 1
+        worker.job_finished(serial)
+        runtime = time.time() - started_at
+        if isinstance(result, dict):
+            self.costs.update(job, netbox, runtime, result.get('rss_growth'))
+            worker.rss = result.get('rss') or worker.rss
+            self._recycle_if_bloated(worker)
+        else:
+            self.costs.update(job, netbox, runtime)
         return result
 
-    def _execute(self, command, **kwargs):
+    def _recycle_if_bloated(self, worker):
+        if (self.max_memory and worker.rss > self.max_memory
+                and not worker.done()):
+            self._logger.info("Worker %s uses %s KiB of memory, replacing it",
+                              worker.pid, worker.rss)
+            worker.retire()
+            self._spawn_worker()
+
+    def _choose_worker(self, job, netbox):
         ready_workers = [w for w in self.workers if not w.done()]
         if not ready_workers:
             raise RuntimeError("No ready workers")
-        worker = min(ready_workers, key=lambda x: x.active_jobs)  # type: Worker
+        if self.max_memory:
+            # Avoid pushing workers over their memory limit, if possible
+            growth = self.costs.rss_growth.get(
+                (job, netbox), self.costs.rss_growth.get(job, 0))
+            roomy = [w for w in ready_workers
+                     if w.rss + growth <= self.max_memory]
+            ready_workers = roomy or ready_workers
+        return min(ready_workers, key=lambda w: (w.load, w.rss))
+
+    def _grow_if_busy(self, worker):
+        if (worker.load >= self.grow_load and not self._spawning
+                and len(self.workers) < self.max_count):
+            self._logger.debug("All workers are busy, starting a new one")
+            self._spawn_worker()
+
+    def _shrink_idle_workers(self):
+        ready_workers = [w for w in self.workers if not w.done()]
+        if len(ready_workers) <= self.target_count:
+            return
+        deadline = time.time() - self.idle_timeout
+        idle = [w for w in ready_workers
+                if not w.active_jobs and w.idle_since < deadline]
+        if idle:
+            worker = min(idle, key=lambda w: w.idle_since)
+            self._logger.debug("Stopping idle worker %s", worker.pid)
+            worker.retire()
+
+    def _execute(self, command, **kwargs):
+        job, netbox = kwargs.get('job'), kwargs.get('netbox')
+        worker = self._choose_worker(job, netbox)  # type: Worker
         self.serial += 1
-        deferred = worker.execute(self.serial, command, **kwargs)
+        deferred = worker.execute(self.serial, command,
+                                  cost=self.costs.estimate(job, netbox),
+                                  **kwargs)
         if worker.done():
             self._spawn_worker()
-        self.jobs[deferred] = (self.serial, worker)
+        else:
+            self._grow_if_busy(worker)
+        self.jobs[deferred] = (self.serial, worker, job, netbox, time.time())
         deferred.addBoth(self._cleanup, deferred)
         return deferred
 
@@ -333,7 +513,7 @@ class WorkerPool(object):
         if deferred not in self.jobs:
             self._logger.debug("Cancelling job that isn't known")
             return
-        serial, worker = self.jobs[deferred]
+        serial, worker = self.jobs[deferred][:2]
         return worker.cancel(serial)
 
     def execute_job(self, job, netbox, plugins=None, interval=None):
@@ -354,7 +534,8 @@ class WorkerPool(object):
     def log_summary(self):
         """Logs a summary of currently running workers"""
         self._logger.info(
-            "%s out of %s workers running", len(self.workers), self.target_count
+            "%s out of %s workers running (min %s)", len(self.workers),
+            self.max_count, self.target_count
         )
         for worker in self.workers:
             self._logger.info(" - %r", worker)
@@ -17,6 +17,8 @@
 
 import logging
 import datetime
+import heapq
+import itertools
 import time
 from operator import itemgetter
 from collections import defaultdict
@@ -47,20 +49,93 @@ from .jobs import JobHandler, AbortedJobError, SuggestedReschedule
 _logger = logging.getLogger(__name__)
 
 
+class JobQueue(object):
+    """A priority queue of NetboxJobSchedulers waiting to run a job.
+
+    Schedulers are ordered by their queue priority keys, as computed by
+    NetboxJobScheduler.get_queue_priority(), lowest first. Schedulers with
+    equal keys are kept in FIFO order.
+
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return bool(self._heap)
+
+    __nonzero__ = __bool__  # For PY2 compatibility
+
+    def __iter__(self):
+        return (item[-1] for item in sorted(self._heap))
+
+    def append(self, scheduler):
+        """Adds a scheduler to the queue"""
+        heapq.heappush(self._heap, (scheduler.get_queue_priority(),
+                                    next(self._counter), scheduler))
+
+    def pop(self, predicate=None):
+        """Removes and returns the highest priority scheduler, skipping any
+        scheduler that has been cancelled.
+
+        :param predicate: If given, return the highest priority scheduler for
+                          which predicate(scheduler) is True, leaving the
+                          others in the queue.
+        :returns: A NetboxJobScheduler, or None if no scheduler was found.
+
+        """
+        skipped = []
+        found = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            scheduler = item[-1]
+            if scheduler.cancelled:
+                continue
+            if predicate and not predicate(scheduler):
+                skipped.append(item)
+                continue
+            found = scheduler
+            break
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return found
+
+
 class NetboxJobScheduler(object):
     """Netbox job schedule handler.
 
     An instance of this class takes care of scheduling, running and
     rescheduling of a single JobHandler for a single netbox.
 
+    When intensity limits are reached, jobs are queued in JobQueues. Jobs are
+    released from the queues in order of how late they are, adjusted by the
+    netbox category and the historical runtime of the job.
+
     """
     job_counters = {}
     job_queues = {}
-    global_job_queue = []
+    global_job_queue = JobQueue()
     global_intensity = config.ipdevpoll_conf.getint('ipdevpoll',
                                                     'max_concurrent_jobs')
+    queue_statistics = {}
     _logger = ipdevpoll.ContextLogger()
 
+    # Number of seconds a queued job for a netbox of these categories is
+    # considered to be later than it actually is
+    CATEGORY_PRIORITY = {
+        'GW': 300,
+        'GSW': 300,
+        'SW': 60,
+    }
+    # Fraction of a job's average runtime that is added to its queue priority
+    # key, to let quick jobs pass slow ones
+    RUNTIME_PENALTY = 0.5
+    # Weight of the most recent runtime in the average runtime of a job
+    RUNTIME_SMOOTHING = 0.3
+
     def __init__(self, job, netbox, pool):
         self.job = job
         self.netbox = netbox
@@ -75,15 +150,21 @@ class NetboxJobScheduler(object):
         self.running = False
         self._start_time = None
         self._current_job = None
+        self._queued_at = None
+        self.average_runtime = None
         self.callLater = reactor.callLater
 
     def get_current_runtime(self):
         """Returns time elapsed since the start of the job as a timedelta."""
         return datetime.datetime.now() - self._start_time
 
-    def start(self):
-        """Start polling schedule."""
-        self._next_call = self.callLater(0, self.run_job)
+    def start(self, delay=0):
+        """Start polling schedule.
+
+        :param delay: Number of seconds to wait before the first job run.
+
+        """
+        self._next_call = self.callLater(delay, self.run_job)
         return self._deferred
 
     def cancel(self):
@@ -148,6 +229,10 @@ class NetboxJobScheduler(object):
 
         self.count_job()
         self._last_job_started_at = time.time()
+        if self._queued_at is not None:
+            self._record_queue_lateness(
+                self._last_job_started_at - self._queued_at)
+            self._queued_at = None
 
         deferred.addErrback(self._adjust_intensity_on_snmperror)
         deferred.addCallbacks(self._reschedule_on_success,
@@ -253,6 +338,7 @@ class NetboxJobScheduler(object):
     def _unregister_handler(self, result):
         """Remove a JobHandler from internal data structures."""
         if self.running:
+            self._update_average_runtime(self.get_runtime())
             self.uncount_job()
             self.unqueue_next_job()
             self.unqueue_next_global_job()
@@ -292,35 +378,105 @@ class NetboxJobScheduler(object):
             return 0
 
     def queue_myself(self, queue):
+        if self._queued_at is None:
+            self._queued_at = time.time()
         queue.append(self)
 
     def unqueue_next_job(self):
         "Unqueues the next waiting job"
         queue = self.get_job_queue()
         if queue and not self.is_job_limit_reached():
-            handler = queue.pop(0)
-            return handler.start()
+            handler = queue.pop()
+            if handler:
+                return handler.start()
 
     @classmethod
     def unqueue_next_global_job(cls):
         "Unqueues the next job waiting because of the global intensity setting"
         if not cls.is_global_limit_reached():
-            for index, handler in enumerate(cls.global_job_queue):
-                if not handler.is_job_limit_reached():
-                    del cls.global_job_queue[index]
-                    return handler.start()
+            handler = cls.global_job_queue.pop(
+                lambda handler: not handler.is_job_limit_reached())
+            if handler:
+                return handler.start()
 
     def get_job_queue(self):
         if self.job.name not in self.job_queues:
-            self.job_queues[self.job.name] = []
+            self.job_queues[self.job.name] = JobQueue()
         return self.job_queues[self.job.name]
 
+    def get_queue_priority(self):
+        """Returns the priority key of this job in a JobQueue. Lower keys are
+        released from the queue first.
+
+        The key is based on the time the job was queued, so the longer a job
+        has been waiting, the sooner it will run, but jobs for important
+        netbox categories are considered to have been waiting longer, and
+        slow jobs are considered to have been waiting shorter.
+
+        """
+        queued_at = self._queued_at or time.time()
+        category = self.netbox.category
+        boost = self.CATEGORY_PRIORITY.get(category.id if category else None,
+                                           0)
+        runtime = min(self.average_runtime or 0, self.job.interval)
+        return queued_at - boost + runtime * self.RUNTIME_PENALTY
+
+    def _update_average_runtime(self, runtime):
+        if self.average_runtime is None:
+            self.average_runtime = runtime
+        else:
+            self.average_runtime += (
+                self.RUNTIME_SMOOTHING * (runtime - self.average_runtime))
+
+    def _record_queue_lateness(self, lateness):
+        stats = self.queue_statistics.setdefault(self.job.name,
+                                                 QueueStatistics())
+        stats.add(lateness)
+        self._logger.debug("%s job for %s was delayed %.1f seconds by "
+                           "intensity limits",
+                           self.job.name, self.netbox.sysname, lateness)
+
+    @classmethod
+    def get_queue_statistics(cls):
+        """Returns a dict mapping job names to QueueStatistics objects
+        describing how late jobs have started due to intensity limits.
+        """
+        return dict(cls.queue_statistics)
+
+
+class QueueStatistics(object):
+    """Statistics about how long jobs have been held in JobQueues"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def __repr__(self):
+        return "<QueueStatistics count=%d average=%.1fs maximum=%.1fs>" % (
+            self.count, self.average, self.maximum)
+
+    def add(self, lateness):
+        """Records the lateness of a single job run"""
+        self.count += 1
+        self.total += lateness
+        self.maximum = max(self.maximum, lateness)
+
+    @property
+    def average(self):
+        """The average lateness of all recorded job runs"""
+        return self.total / self.count if self.count else 0.0
+
 
 class JobScheduler(object):
     active_schedulers = set()
     job_logging_loop = None
     netbox_reload_interval = 2*60.0  # seconds
     netbox_reload_loop = None
+    # Start times of newly loaded netboxes are spread across this fraction of
+    # the job interval, but no longer than MAX_START_SPREAD seconds, to avoid
+    # starting every job at the same time.
+    START_SPREAD = 0.1
+    MAX_START_SPREAD = 60.0
     _logger = ipdevpoll.ContextLogger()
 
     def __init__(self, job, pool):
@@ -409,19 +565,22 @@ class JobScheduler(object):
                 self.job.name, datetime.datetime.min)
         new_and_changed = sorted(new_ids.union(changed_ids),
                                  key=_lastupdated)
-        for netbox_id in new_and_changed:
-            self.add_netbox_scheduler(netbox_id)
+        spread = min(self.job.interval * self.START_SPREAD,
+                     self.MAX_START_SPREAD)
+        step = spread / len(new_and_changed) if new_and_changed else 0
+        for index, netbox_id in enumerate(new_and_changed):
+            self.add_netbox_scheduler(netbox_id, delay=index * step)
 
     def _handle_reload_failures(self, failure):
         failure.trap(db.ResetDBConnectionError)
         self._logger.error("Reloading the IP device list failed because the "
                            "database connection was reset")
 
-    def add_netbox_scheduler(self, netbox_id):
+    def add_netbox_scheduler(self, netbox_id, delay=0):
         netbox = self.netboxes[netbox_id]
         scheduler = NetboxJobScheduler(self.job, netbox, self.pool)
         self.active_netboxes[netbox_id] = scheduler
-        return scheduler.start()
+        return scheduler.start(delay)
 
     def cancel_netbox_scheduler(self, netbox_id):
         if netbox_id not in self.active_netboxes:
@@ -462,6 +621,15 @@ class JobScheduler(object):
                         "no active jobs (%d JobHandlers)",
                         JobHandler.get_instance_count())
 
+        for name, stats in sorted(
+                iteritems(NetboxJobScheduler.get_queue_statistics())):
+            queue = NetboxJobScheduler.job_queues.get(name, ())
+            _logger.log(level,
+                        "%s: %d queued, %d delayed by intensity limits "
+                        "(average %.1fs, maximum %.1fs)",
+                        name, len(queue), stats.count, stats.average,
+                        stats.maximum)
+
 
 class CounterFlusher(defaultdict):
     """
@@ -25,6 +25,7 @@ from collections import defaultdict
 import IPy
 
 from django.db.models import Q
+from django.db import transaction
 
 from nav.models import manage
 from nav.event2 import EventFactory
@@ -612,6 +613,17 @@ class Arp(Shadow):
             myself = manage.Arp.objects.filter(id=self.id)
             myself.update(**attrs)
 
+    @classmethod
+    @transaction.atomic()
+    def bulk_save(cls, shadows, containers):
+        shadows = list(shadows)
+        super(Arp, cls).bulk_save([arp for arp in shadows if not arp.id],
+                                  containers)
+        cls._bulk_update(
+            (arp.id, dict((attr, getattr(arp, attr))
+                          for attr in arp.get_touched() if attr != 'id'))
+            for arp in shadows if arp.id)
+
 
 class SwPortAllowedVlan(Shadow):
     __shadowclass__ = manage.SwPortAllowedVlan
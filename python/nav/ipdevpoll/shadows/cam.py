@@ -42,37 +42,75 @@ grace period of MAX_MISS_COUNT collector runs.  If a "closed" cam record is
 found again within MAX_MISS_COUNT collector runs, the existing record can be
 reclaimed by resetting end_time to infinity.
 
+The reconciliation is performed in the database: The found records are
+copied into a temporary table, and new, reclaimed and closed records are then
+processed using a single SQL statement each.
+
 """
 import datetime
-import logging
 from collections import namedtuple
 
-from django.db.models import Q
-from django.db import transaction
+from django.db import connection, transaction
+from django.utils.six import StringIO
 
 from nav.models import manage
-from nav.models.fields import INFINITY
 from nav.ipdevpoll.storage import DefaultManager
 from .netbox import Netbox
 from .interface import Interface
 
 MAX_MISS_COUNT = 3
 
+# Name of the temporary table used to hold found records during
+# reconciliation
+FOUND_TABLE = 'ipdevpoll_found_cam'
+
 
 Cam = namedtuple('Cam', 'ifindex mac')
 Cam.sentinel = Cam(None, None)
 
-CamDetails = namedtuple('CamDetails', 'id end_time miss_count')
+_OPEN_RECORD = "(cam.end_time >= 'infinity' OR cam.misscnt >= 0)"
+
+_RECLAIM_SQL = """
+UPDATE cam SET end_time = 'infinity', misscnt = 0
+FROM {found} AS found
+WHERE cam.netboxid = %s
+  AND cam.ifindex = found.ifindex
+  AND cam.mac = found.mac
+  AND cam.end_time < 'infinity'
+  AND cam.misscnt >= 0
+""".format(found=FOUND_TABLE)
+
+_INSERT_NEW_SQL = """
+INSERT INTO cam (netboxid, sysname, ifindex, port, mac, start_time, end_time,
+                 misscnt)
+SELECT %s, %s, found.ifindex, found.port, found.mac, %s, 'infinity', 0
+FROM {found} AS found
+WHERE NOT EXISTS (
+  SELECT 1 FROM cam
+  WHERE cam.netboxid = %s
+    AND cam.ifindex = found.ifindex
+    AND cam.mac = found.mac
+    AND {open})
+""".format(found=FOUND_TABLE, open=_OPEN_RECORD)
+
+_CLOSE_MISSING_SQL = """
+UPDATE cam SET
+  end_time = CASE WHEN cam.end_time >= 'infinity' THEN %s
+                  ELSE cam.end_time END,
+  misscnt = CASE WHEN cam.misscnt + 1 < %s THEN cam.misscnt + 1
+                 ELSE NULL END
+WHERE cam.netboxid = %s
+  AND {open}
+  AND NOT EXISTS (
+    SELECT 1 FROM {found} AS found
+    WHERE found.ifindex = cam.ifindex AND found.mac = cam.mac)
+""".format(found=FOUND_TABLE, open=_OPEN_RECORD)
 
 
 class CamManager(DefaultManager):
     """Manages Cam records"""
 
-    _previously_open = None
-    _now_open = None
-    _keepers = None
-    _missing = None
-    _new = None
+    _found = None
     _ifnames = None
 
     def __init__(self, *args, **kwargs):
@@ -81,77 +119,63 @@ class CamManager(DefaultManager):
 
     def prepare(self):
         self._remove_sentinel()
-        self._load_open_records()
-        self._map_found_to_open()
-        self._log_stats()
+        self._found = set(self.get_managed())
+        self._copy_found_records()
+        self._logger.debug("found=%d", len(self._found))
 
     def _remove_sentinel(self):
         if Cam.sentinel in self.containers[Cam]:
             del self.containers[Cam][Cam.sentinel]
 
-    def _load_open_records(self):
-        match_open = Q(end_time__gte=INFINITY) | Q(miss_count__gte=0)
-        camlist = manage.Cam.objects.filter(netbox__id=self.netbox.id)
-        camlist = camlist.filter(match_open).values_list(
-            'ifindex', 'mac', 'id', 'end_time', 'miss_count')
-        self._previously_open = dict((Cam(*cam[0:2]), CamDetails(*cam[2:]))
-                                     for cam in camlist)
-
-    def _map_found_to_open(self):
-        self._now_open = set(self.get_managed())
-        self._new = self._now_open.difference(self._previously_open)
-
-        missing = set(self._previously_open).difference(self._now_open)
-        self._missing = set(self._previously_open[key] for key in missing)
-
-        self._keepers = self._now_open.intersection(self._previously_open)
-
-    def _log_stats(self):
-        if not self._logger.isEnabledFor(logging.DEBUG):
-            return
-        reclaimable_count = sum(1 for cam in self._previously_open.values()
-                                if cam.end_time < INFINITY)
-        self._logger.debug(
-            "existing=%d (reclaimable=%d) / "
-            "found=%d (known=%d new=%d missing=%d)",
-            len(self._previously_open), reclaimable_count, len(self._now_open),
-            len(self._keepers), len(self._new), len(self._missing))
+    def _copy_found_records(self):
+        """Copies the found records into a temporary table"""
+        ports = self._get_port_map()
+        data = StringIO(u"".join(
+            _copy_line(cam.ifindex, cam.mac, ports.get(cam.ifindex, ''))
+            for cam in self._found))
+
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS {}".format(FOUND_TABLE))
+        cursor.execute(
+            "CREATE TEMPORARY TABLE {} (ifindex INTEGER NOT NULL, "
+            "mac MACADDR NOT NULL, port VARCHAR)".format(FOUND_TABLE))
+        cursor.copy_expert(
+            "COPY {} (ifindex, mac, port) FROM STDIN".format(FOUND_TABLE),
+            data)
+        cursor.execute("ANALYZE {}".format(FOUND_TABLE))
 
     @transaction.atomic()
     def save(self):
-        # Reuse the same object over and over in an attempt to avoid the
-        # overhead of Python object creation
-        record = manage.Cam(
-            netbox_id=self.netbox.id, sysname=self.netbox.sysname,
-            start_time=datetime.datetime.now(), end_time=INFINITY)
-        for cam in self._new:
-            record.id = None
-            record.port = self._get_port_for(cam.ifindex)
-            record.ifindex = cam.ifindex
-            record.mac = cam.mac
-            record.save()
-
+        cursor = connection.cursor()
         # reclaim recently closed records
-        keepers = (self._previously_open[cam] for cam in self._keepers)
-        reclaim = [cam.id for cam in keepers if cam.end_time < INFINITY]
-        if reclaim:
-            self._logger.debug("reclaiming %r", reclaim)
-            manage.Cam.objects.filter(id__in=reclaim).update(
-                end_time=INFINITY, miss_count=0)
+        cursor.execute(_RECLAIM_SQL, [self.netbox.id])
+        reclaimed = cursor.rowcount
+        cursor.execute(_INSERT_NEW_SQL,
+                       [self.netbox.id, self.netbox.sysname,
+                        datetime.datetime.now(), self.netbox.id])
+        self._logger.debug("new=%d reclaimed=%d", cursor.rowcount, reclaimed)
 
-    def _get_port_for(self, ifindex):
-        """Gets a port name from an ifindex, either from newly collected or
-        previously saved data.
+    def _get_port_map(self):
+        """Returns a dict of port names for every ifindex of the found
+        records, either from newly collected or previously saved data.
 
         """
-        port = self.containers.get(ifindex, Interface)
-        if port and port.ifname:
-            return port.ifname
-        else:
-            return self._get_saved_ifname_for(ifindex)
-
-    def _get_saved_ifname_for(self, ifindex):
-        if not self._ifnames:
+        ports = {}
+        unknown = []
+        for ifindex in set(cam.ifindex for cam in self._found):
+            port = self.containers.get(ifindex, Interface)
+            if port and port.ifname:
+                ports[ifindex] = port.ifname
+            else:
+                unknown.append(ifindex)
+        if unknown:
+            saved = self._get_saved_ifnames()
+            for ifindex in unknown:
+                ports[ifindex] = saved.get(ifindex, '')
+        return ports
+
+    def _get_saved_ifnames(self):
+        if self._ifnames is None:
             ifcs = manage.Interface.objects.filter(
                 netbox__id=self.netbox.id, ifindex__isnull=False
                 ).values('ifindex', 'ifname', 'ifdescr')
@@ -159,26 +183,15 @@ class CamManager(DefaultManager):
                 (row['ifindex'], row['ifname'] or row['ifdescr'])
                 for row in ifcs)
 
-        return self._ifnames.get(ifindex, '')
+        return self._ifnames
 
     def cleanup(self):
-        for cam_detail in self._missing:
-            self._close_missing(cam_detail)
-
-    @classmethod
-    def _close_missing(cls, cam_detail):
-        upd = {}
-        cls._logger.debug("closing %r", cam_detail)
-        if cam_detail.end_time >= INFINITY:
-            upd['end_time'] = datetime.datetime.now()
-
-        if cam_detail.miss_count >= 0:
-            miss_count = cam_detail.miss_count + 1
-            upd['miss_count'] = (miss_count if miss_count < MAX_MISS_COUNT
-                                 else None)
-
-        if upd:
-            manage.Cam.objects.filter(id=cam_detail.id).update(**upd)
+        cursor = connection.cursor()
+        cursor.execute(_CLOSE_MISSING_SQL,
+                       [datetime.datetime.now(), MAX_MISS_COUNT,
+                        self.netbox.id])
+        self._logger.debug("missing=%d", cursor.rowcount)
+        cursor.execute("DROP TABLE IF EXISTS {}".format(FOUND_TABLE))
 
     @classmethod
     def add_sentinel(cls, containers):
@@ -192,3 +205,15 @@ class CamManager(DefaultManager):
 
 Cam.manager = CamManager
 CamManager.sentinel = Cam.sentinel
+
+
+def _copy_line(*values):
+    """Formats a row of values as a line of PostgreSQL COPY text format"""
+    return u"\t".join(_copy_escape(value) for value in values) + u"\n"
+
+
+def _copy_escape(value):
+    if value is None:
+        return u"\\N"
+    return (u"%s" % value).replace(u"\\", u"\\\\").replace(
+        u"\t", u"\\t").replace(u"\n", u"\\n").replace(u"\r", u"\\r")
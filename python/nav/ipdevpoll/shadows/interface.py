@@ -26,7 +26,8 @@ from nav.models.event import EventQueue as Event, EventQueueVar as EventVar
 from nav.models.event import AlertHistory
 from nav import natsort
 
-from nav.ipdevpoll.storage import Shadow, DefaultManager
+from nav.ipdevpoll.storage import Shadow, DefaultManager, BULK_BATCH_SIZE
+from nav.ipdevpoll.storage import _chunks
 
 from .netbox import Netbox
 
@@ -326,6 +327,8 @@ class Interface(Shadow):
         """
         if self._cached_existing_model:
             return self._cached_existing_model
+        elif getattr(self, '_cached_no_existing_model', False):
+            return None
         elif self.id:
             try:
                 ifc = manage.Interface.objects.get(id=self.id)
@@ -335,6 +338,29 @@ class Interface(Shadow):
                 self._cached_existing_model = ifc
                 return ifc
 
+    @classmethod
+    def resolve_existing_models(cls, shadows):
+        """Looks up the existing interfaces of shadows in bulk.
+
+        Like get_existing_model(), this only looks up interfaces by their
+        primary key; InterfaceManager will already have matched the
+        collected interfaces to the netbox's existing interfaces.
+
+        """
+        with_id = {}
+        for shadow in shadows:
+            if not shadow._cached_existing_model and shadow.id:
+                with_id.setdefault(shadow.id, []).append(shadow)
+
+        for batch in _chunks(with_id, BULK_BATCH_SIZE):
+            existing = manage.Interface.objects.in_bulk(batch)
+            for ifc_id in batch:
+                for shadow in with_id[ifc_id]:
+                    if ifc_id in existing:
+                        shadow._cached_existing_model = existing[ifc_id]
+                    else:
+                        shadow._cached_no_existing_model = True
+
     def set_existing_model(self, django_object):
         super(Interface, self).set_existing_model(django_object)
         self._verify_operstatus_change(django_object)
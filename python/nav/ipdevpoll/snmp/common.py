@@ -20,9 +20,11 @@ from functools import wraps
 from collections import namedtuple
 
 from twisted.internet import reactor
-from twisted.internet.defer import succeed
+from twisted.internet.defer import succeed, Deferred, DeferredSemaphore
 from twisted.internet.task import deferLater
 
+from nav.ipdevpoll.snmp.responsecache import SIGNAL_OIDS, DEVICE_SIGNAL_OIDS
+
 _logger = logging.getLogger(__name__)
 
 
@@ -48,6 +50,40 @@ def _cache_result(result, cache, key):
     return result
 
 
+def cache_across_jobs(func):
+    """Decorator for AgentProxyMixIn.getTable to cache responses in the
+    proxy's response cache, if it has one and the requested OIDs are
+    cacheable.
+
+    """
+    def _wrapper(*args, **kwargs):
+        self, oids = args[0], args[1]
+        cache = self.response_cache
+        ttl = cache.get_ttl(oids) if cache else None
+        if not ttl:
+            return func(*args, **kwargs)
+
+        key = tuple(str(oid) for oid in oids)
+
+        def _lookup(valid):
+            if valid:
+                result = cache.get(key)
+                if result is not None:
+                    return result
+            df = func(*args, **kwargs)
+            if valid:
+                df.addCallback(_store)
+            return df
+
+        def _store(result):
+            cache.set(key, result, ttl)
+            return result
+
+        return self.validate_response_cache().addCallback(_lookup)
+
+    return wraps(func)(_wrapper)
+
+
 def throttled(func):
     """Decorator for AgentProxyMixIn.getTable to throttle requests"""
     def _wrapper(*args, **kwargs):
@@ -80,6 +116,8 @@ class AgentProxyMixIn(object):
         """Initializes an agent proxy.
 
         :params snmp_parameters: An SNMPParameters namedtuple.
+        :params response_cache: An optional NetboxResponseCache, used to
+                                cache table responses across sessions.
 
         """
         if 'snmp_parameters' in kwargs:
@@ -87,9 +125,17 @@ class AgentProxyMixIn(object):
             del kwargs['snmp_parameters']
         else:
             self.snmp_parameters = SNMP_DEFAULTS
+        self.response_cache = kwargs.pop('response_cache', None)
+        self._response_cache_valid = None
+        self._device_signals = None
+        self._device_signal_waiters = None
         self._result_cache = {}
         self._last_request = 0
         self.throttle_delay = self.snmp_parameters.throttle_delay
+        # Throttled sessions should never have concurrent requests in flight
+        concurrent_walks = (self.snmp_parameters.max_concurrent_walks
+                            if not self.throttle_delay else 1)
+        self.walk_semaphore = DeferredSemaphore(max(1, concurrent_walks))
 
         super(AgentProxyMixIn, self).__init__(*args, **kwargs)
         # If we're mixed in with a pure twistedsnmp AgentProxy, the timeout
@@ -107,10 +153,71 @@ class AgentProxyMixIn(object):
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
     @cache_for_session
+    @cache_across_jobs
     def getTable(self, *args, **kwargs):
-        kwargs['maxRepetitions'] = self.snmp_parameters.max_repetitions
+        kwargs.setdefault('maxRepetitions',
+                          self.snmp_parameters.max_repetitions)
         return super(AgentProxyMixIn, self).getTable(*args, **kwargs)
 
+    def validate_response_cache(self):
+        """Checks the device's invalidation signals against the response
+        cache, once per session.
+
+        :returns: A deferred whose result is True if the response cache may
+                  be used during this session.
+
+        """
+        if self._response_cache_valid is not None:
+            return succeed(self._response_cache_valid)
+        return self.get_device_signals().addCallback(
+            self._update_response_cache_signals)
+
+    def _update_response_cache_signals(self, signals):
+        if self._response_cache_valid is None:
+            uptime, lastchange = [signals.get(oid) for oid in SIGNAL_OIDS]
+            if uptime is None:
+                _logger.debug("%r: no response cache signals, not using "
+                              "cache", self)
+            else:
+                self.response_cache.validate(uptime, lastchange)
+            self._response_cache_valid = uptime is not None
+        return self._response_cache_valid
+
+    def get_device_signals(self):
+        """Retrieves the sysUpTime, ifTableLastChange and ifNumber values of
+        the device, using a single request per session, shared by the
+        response cache and any plugin that needs them.
+
+        :returns: A deferred whose result is a dict mapping the OIDs in
+                  DEVICE_SIGNAL_OIDS to their values. The dict is empty if
+                  the values could not be retrieved.
+
+        """
+        if self._device_signals is not None:
+            return succeed(self._device_signals)
+
+        waiter = Deferred()
+        if self._device_signal_waiters is None:
+            self._device_signal_waiters = [waiter]
+            df = self.get(list(DEVICE_SIGNAL_OIDS))
+            df.addErrback(self._device_signals_failed)
+            df.addCallback(self._set_device_signals)
+        else:
+            self._device_signal_waiters.append(waiter)
+        return waiter
+
+    def _device_signals_failed(self, failure):
+        _logger.debug("%r: could not get device signals: %s", self,
+                      failure.getErrorMessage())
+        return {}
+
+    def _set_device_signals(self, signals):
+        self._device_signals = signals
+        waiters, self._device_signal_waiters = (
+            self._device_signal_waiters, None)
+        for waiter in waiters:
+            waiter.callback(signals)
+
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
     @throttled
@@ -132,10 +239,12 @@ class AgentProxyMixIn(object):
 
 # pylint: disable=C0103
 SNMPParameters = namedtuple('SNMPParameters',
-                            'timeout max_repetitions throttle_delay')
+                            'timeout max_repetitions throttle_delay '
+                            'max_concurrent_walks')
+SNMPParameters.__new__.__defaults__ = (1,)  # max_concurrent_walks
 
 SNMP_DEFAULTS = SNMPParameters(timeout=1.5, max_repetitions=50,
-                               throttle_delay=0)
+                               throttle_delay=0, max_concurrent_walks=1)
 
 
 # pylint: disable=W0212
@@ -155,6 +264,7 @@ def snmp_parameter_factory(host=None):
             ('max-repetitions', config.getint),
             ('timeout', config.getfloat),
             ('throttle-delay', config.getfloat),
+            ('max-concurrent-walks', config.getint),
     ]:
         if config.has_option(section, var):
             key = var.replace('-', '_')
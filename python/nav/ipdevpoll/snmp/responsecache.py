@@ -0,0 +1,259 @@
+#
+# Copyright (C) 2019 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A per-process SNMP response cache that survives across ipdevpoll jobs.
+
+Some tables, like ifName, ifDescr or entPhysicalTable, change rarely, but are
+still walked by several plugins in several jobs for every device.  When
+enabled in ipdevpoll.conf, table responses for a configured set of MIB objects
+are kept in memory for a configurable time, keyed by netbox and requested
+OIDs.
+
+The cache is bounded by the total number of cached values, evicting the least
+recently used responses first.  A device's cached responses are discarded
+whenever its sysUpTime goes backwards (i.e. it has rebooted) or its
+ifTableLastChange value changes.
+
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from nav.oids import OID
+from nav.smidumps import get_mib
+
+_logger = logging.getLogger(__name__)
+
+SECTION = 'snmpcache'
+TTL_SECTION = 'snmpcache:ttl'
+
+SYSUPTIME = '.1.3.6.1.2.1.1.3.0'
+IFTABLELASTCHANGE = '.1.3.6.1.2.1.31.1.5.0'
+SIGNAL_OIDS = (SYSUPTIME, IFTABLELASTCHANGE)
+IFNUMBER = '.1.3.6.1.2.1.2.1.0'
+# Retrieved once per SNMP session, for use by the response cache and plugins
+DEVICE_SIGNAL_OIDS = SIGNAL_OIDS + (IFNUMBER,)
+
+_response_cache = None
+
+
+class ResponseCache(object):
+    """An LRU cache of SNMP table responses, keyed by netbox and OIDs"""
+    def __init__(self, ttls, max_size=100000):
+        """Initializes a response cache.
+
+        :param ttls: A dict of {OID: seconds}, listing which MIB object
+                     subtrees may be cached and for how long.
+        :param max_size: The maximum number of values to keep in the cache
+                         in total.
+
+        """
+        self.ttls = sorted(((OID(oid), ttl) for oid, ttl in ttls.items()),
+                           key=lambda item: len(item[0]), reverse=True)
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._signals = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_ttl(self, oids):
+        """Returns the number of seconds a response to a table request for
+        oids may be cached, or None if it may not be cached at all.
+
+        A request is only cacheable if every requested OID is located within
+        a configured subtree.
+
+        """
+        ttls = [self._get_oid_ttl(OID(oid)) for oid in oids]
+        if not ttls or None in ttls:
+            return None
+        return min(ttls)
+
+    def _get_oid_ttl(self, oid):
+        for prefix, ttl in self.ttls:
+            if prefix == oid or prefix.is_a_prefix_of(oid):
+                return ttl
+
+    def get(self, netbox, key):
+        """Returns a cached response, or None if there is no fresh response"""
+        entry = self._entries.get((netbox, key))
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, _size, result = entry
+        if expires < time.time():
+            self._remove((netbox, key))
+            self.misses += 1
+            return None
+        self._touch((netbox, key))
+        self.hits += 1
+        return result
+
+    def set(self, netbox, key, result, ttl):
+        """Caches a response for ttl seconds"""
+        size = _count_values(result)
+        if size > self.max_size:
+            return
+        self._remove((netbox, key))
+        self._entries[(netbox, key)] = (time.time() + ttl, size, result)
+        self.size += size
+        while self.size > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, netbox):
+        """Discards all cached responses from netbox"""
+        for key in [key for key in self._entries if key[0] == netbox]:
+            self._remove(key)
+
+    def validate(self, netbox, uptime, lastchange):
+        """Updates the invalidation signals of a netbox, discarding its cached
+        responses if they indicate that they may no longer be valid.
+
+        :param uptime: The device's current sysUpTime value.
+        :param lastchange: The device's current ifTableLastChange value.
+
+        """
+        previous = self._signals.get(netbox)
+        self._signals[netbox] = (uptime, lastchange)
+        if previous is None:
+            return
+        change = get_signal_change(previous, (uptime, lastchange))
+        if change:
+            _logger.debug("%s, invalidating cache for %s", change, netbox)
+            self.invalidate(netbox)
+
+    def for_netbox(self, netbox):
+        """Returns a view of this cache bound to a single netbox"""
+        return NetboxResponseCache(self, netbox)
+
+    def _touch(self, key):
+        entry = self._entries.pop(key)
+        self._entries[key] = entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class NetboxResponseCache(object):
+    """A ResponseCache view for a single netbox, as used by an AgentProxy"""
+    def __init__(self, cache, netbox):
+        self.cache = cache
+        self.netbox = netbox
+
+    def get_ttl(self, oids):
+        return self.cache.get_ttl(oids)
+
+    def get(self, key):
+        return self.cache.get(self.netbox, key)
+
+    def set(self, key, result, ttl):
+        return self.cache.set(self.netbox, key, result, ttl)
+
+    def validate(self, uptime, lastchange):
+        return self.cache.validate(self.netbox, uptime, lastchange)
+
+
+def get_signal_change(old, new):
+    """Compares two sets of invalidation signals from a device.
+
+    :param old: A (sysUpTime, ifTableLastChange) tuple.
+    :param new: A (sysUpTime, ifTableLastChange) tuple, retrieved later.
+    :returns: A description of the change if the signals indicate that data
+              retrieved from the device at the time of old may no longer be
+              valid, otherwise None.
+
+    """
+    old_uptime, old_lastchange = old
+    uptime, lastchange = new
+    if uptime is None or old_uptime is None or uptime < old_uptime:
+        return "sysUpTime reset"
+    elif lastchange != old_lastchange:
+        return "ifTableLastChange changed"
+    return None
+
+
+def _count_values(result):
+    """Counts the values of a getTable response"""
+    if isinstance(result, dict):
+        return sum(_count_values(value) for value in result.values()) or 1
+    return 1
+
+
+def get_response_cache(netbox):
+    """Returns a response cache for netbox, or None if the cache is disabled
+    in ipdevpoll's config.
+
+    :param netbox: A netbox id.
+
+    """
+    global _response_cache
+    if _response_cache is None:
+        from nav.ipdevpoll.config import ipdevpoll_conf
+        if not ipdevpoll_conf.getboolean(SECTION, 'enabled'):
+            return None
+        _response_cache = ResponseCache(
+            get_configured_ttls(ipdevpoll_conf),
+            max_size=ipdevpoll_conf.getint(SECTION, 'max-size'))
+    return _response_cache.for_netbox(netbox)
+
+
+def get_configured_ttls(config):
+    """Returns a dict of {OID: seconds} from the [snmpcache:ttl] section.
+
+    Each option in the section is a number of seconds, listing the objects
+    that may be cached for that long, either as MIB::object names or as
+    numerical OIDs.
+
+    """
+    ttls = {}
+    if not config.has_section(TTL_SECTION):
+        return ttls
+    for seconds in config.options(TTL_SECTION):
+        try:
+            ttl = int(seconds)
+        except ValueError:
+            _logger.error("invalid TTL in [%s]: %r", TTL_SECTION, seconds)
+            continue
+        for name in config.get(TTL_SECTION, seconds).split():
+            oid = resolve_object_name(name)
+            if oid is None:
+                _logger.error("cannot resolve MIB object %r from [%s]",
+                              name, TTL_SECTION)
+            else:
+                ttls[oid] = ttl
+    return ttls
+
+
+def resolve_object_name(name):
+    """Resolves a MIB::object name or a numerical OID into an OID object.
+
+    :returns: An OID, or None if name could not be resolved.
+
+    """
+    if '::' not in name:
+        try:
+            return OID(name)
+        except ValueError:
+            return None
+    module, obj = name.split('::', 1)
+    mib = get_mib(module)
+    if mib and obj in mib.get('nodes', {}):
+        return OID(mib['nodes'][obj]['oid'])
@@ -21,6 +21,10 @@ from django.utils import six
 
 from nav import toposort
 from nav import ipdevpoll
+from nav.ipdevpoll.config import ipdevpoll_conf
+
+# Maximum number of rows touched by a single statement when saving in bulk
+BULK_BATCH_SIZE = 1000
 
 
 class MetaShadow(type):
@@ -82,9 +86,23 @@ class DefaultManager(object):
         self.cls.prepare_for_save(self.containers)
 
     def save(self):
-        """Saves managed shadows in containers"""
-        for obj in self.get_managed():
-            obj.save(self.containers)
+        """Saves managed shadows in containers.
+
+        If bulk saving is enabled in ipdevpoll.conf, and the managed shadow
+        class supports it, all the managed shadows are saved using a handful
+        of batched queries, rather than one or two queries per container.
+
+        """
+        if self.is_bulk_save_enabled() and self.cls.supports_bulk_save():
+            self.cls.bulk_save(self.get_managed(), self.containers)
+        else:
+            for obj in self.get_managed():
+                obj.save(self.containers)
+
+    @staticmethod
+    def is_bulk_save_enabled():
+        """Returns True if bulk saving of containers is enabled"""
+        return ipdevpoll_conf.getboolean('ipdevpoll', 'bulk_save')
 
     def cleanup(self):
         """Runs any necessary cleanup hooks after save is done"""
@@ -159,6 +177,7 @@ class Shadow(object):
         self.update_only = False
         self._cached_converted_model = None
         self._cached_existing_model = None
+        self._cached_no_existing_model = False
 
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
@@ -340,6 +359,8 @@ class Shadow(object):
         if hasattr(self, '_cached_existing_model') and \
                 self._cached_existing_model:
             return self._cached_existing_model
+        if getattr(self, '_cached_no_existing_model', False):
+            return None
         if containers is None:
             containers = {}
 
@@ -416,6 +437,132 @@ class Shadow(object):
         pkey = self.get_primary_key_attribute()
         setattr(self, pkey.name, getattr(django_object, pkey.name))
         self._cached_existing_model = django_object
+        self._cached_no_existing_model = False
+
+    @classmethod
+    def resolve_existing_models(cls, shadows):
+        """Finds the existing Django model instances represented by a
+        sequence of shadow instances, using a single query per lookup
+        field (per BULK_BATCH_SIZE shadows), rather than querying once per
+        shadow instance.
+
+        Matching model instances are attached to their shadows using
+        set_existing_model().  Shadows that are known to have no existing
+        counterpart in the database are marked as such, so that
+        get_existing_model() will not need to query the database for them.
+        Any shadow that cannot be unambiguously resolved here is left alone,
+        to be resolved by get_existing_model() as usual.
+
+        Shadow classes that override get_existing_model() are considered to
+        have custom lookup logic, and are not resolved by this method, unless
+        they also override this method to match that logic.
+
+        """
+        if cls._overrides('get_existing_model'):
+            return
+
+        unresolved = [shadow for shadow in shadows
+                      if not getattr(shadow, '_cached_existing_model', None)]
+        unresolved = cls._resolve_existing_by_primary_key(unresolved)
+        for lookup in cls.__lookups__:
+            unresolved = cls._resolve_existing_by_lookup(unresolved, lookup)
+
+        for shadow in unresolved:
+            shadow._cached_no_existing_model = True
+
+    @classmethod
+    def _resolve_existing_by_primary_key(cls, shadows):
+        """Resolves existing models for the shadows that have a primary key
+        value set.
+
+        :returns: A list of the shadows that have no primary key value.
+
+        """
+        with_pkey = {}
+        without_pkey = []
+        for shadow in shadows:
+            pkey_value = shadow.get_primary_key()
+            if not pkey_value:
+                without_pkey.append(shadow)
+            elif not isinstance(pkey_value, Shadow):
+                with_pkey.setdefault(pkey_value, []).append(shadow)
+            # Shadows whose primary key is also a foreign key are left to
+            # get_existing_model()
+
+        for batch in _chunks(with_pkey, BULK_BATCH_SIZE):
+            existing = cls.__shadowclass__.objects.in_bulk(batch)
+            for pkey_value, model in existing.items():
+                for shadow in with_pkey.get(pkey_value, []):
+                    shadow.set_existing_model(model)
+
+        return without_pkey
+
+    @classmethod
+    def _resolve_existing_by_lookup(cls, shadows, lookup):
+        """Resolves existing models for shadows by matching the values of a
+        single lookup (either a single field name or a tuple of field names)
+        against the database.
+
+        Shadows that cannot be matched unambiguously using only their own
+        attribute values are left for get_existing_model() to resolve.
+
+        :returns: A list of the shadows that are known not to match any
+                  existing object using this lookup.
+
+        """
+        fields = lookup if isinstance(lookup, tuple) else (lookup,)
+        model_fields = [cls._meta.get_field(field) for field in fields]
+        not_found = []
+        keyed = {}
+        for shadow in shadows:
+            if not isinstance(lookup, tuple) and getattr(shadow,
+                                                         lookup) is None:
+                # get_existing_model() skips unset single field lookups
+                not_found.append(shadow)
+                continue
+            key = shadow._get_lookup_key(model_fields)
+            if key is not None:
+                keyed.setdefault(key, []).append(shadow)
+
+        for batch in _chunks(keyed, BULK_BATCH_SIZE):
+            filtr = dict(
+                ("%s__in" % field.attname, set(key[index] for key in batch))
+                for index, field in enumerate(model_fields))
+            matches = {}
+            for model in cls.__shadowclass__.objects.filter(**filtr):
+                key = tuple(field.get_prep_value(getattr(model, field.attname))
+                            for field in model_fields)
+                matches.setdefault(key, []).append(model)
+
+            for key in batch:
+                found = matches.get(key, [])
+                if not found:
+                    not_found.extend(keyed[key])
+                elif len(found) == 1:
+                    for shadow in keyed[key]:
+                        shadow.set_existing_model(found[0])
+
+        return not_found
+
+    def _get_lookup_key(self, model_fields):
+        """Returns a tuple of the database-ready values of this shadow's
+        model_fields, for use in bulk lookups.
+
+        If any of the values are unset, or cannot be resolved without querying
+        the database, None is returned.
+
+        """
+        key = []
+        for field in model_fields:
+            value = getattr(self, field.name)
+            if isinstance(value, Shadow):
+                value = value.get_primary_key()
+            elif isinstance(value, django.db.models.Model):
+                value = value.pk
+            if value is None:
+                return None
+            key.append(field.get_prep_value(value))
+        return tuple(key)
 
     @classmethod
     def prepare_for_save(cls, containers):
@@ -488,6 +635,119 @@ class Shadow(object):
                     self.set_primary_key(obj.pk)
                 self._touched.clear()
 
+    @classmethod
+    def supports_bulk_save(cls):
+        """Returns True if containers of this class can be saved using
+        bulk_save().
+
+        A shadow class that has custom save() logic will need to implement its
+        own bulk_save() to support bulk saving.
+
+        """
+        return (not cls._overrides('save')
+                or cls._overrides('bulk_save'))
+
+    @classmethod
+    @transaction.atomic()
+    def bulk_save(cls, shadows, containers):
+        """Saves a sequence of containers of this class to the database
+        synchronously, in a single transaction.
+
+        This has the same effect as calling save() on every container, but
+        existing objects are looked up in bulk using resolve_existing_models(),
+        and deletions, updates and inserts are batched.
+
+        """
+        shadows = list(shadows)
+        cls.resolve_existing_models(shadows)
+
+        deleted = []
+        updated = []
+        created = []
+        for shadow in shadows:
+            existing = shadow.get_existing_model(containers)
+            if shadow.delete and existing:
+                deleted.append(existing.pk)
+            elif existing:
+                diff = shadow.get_diff_attrs(existing)
+                if diff:
+                    obj = shadow.convert_to_model(containers)
+                    updated.append((shadow, obj.pk, dict(
+                        (attr, getattr(obj, attr)) for attr in diff)))
+            else:
+                obj = shadow.convert_to_model(containers)
+                if obj:
+                    created.append((shadow, obj))
+
+        cls._bulk_delete(deleted)
+        cls._bulk_update((pkey, update) for _shadow, pkey, update in updated)
+        cls._bulk_create([obj for _shadow, obj in created])
+
+        for shadow, _pkey, _update in updated:
+            shadow._touched.clear()
+        for shadow, obj in created:
+            # See save() for the reasoning behind this
+            if not shadow.get_primary_key():
+                shadow.set_primary_key(obj.pk)
+            shadow._cached_existing_model = obj
+            shadow._cached_no_existing_model = False
+            shadow._touched.clear()
+
+    @classmethod
+    def _bulk_delete(cls, pkeys):
+        """Deletes the objects of the shadowed class with the given primary
+        key values.
+
+        """
+        if pkeys:
+            cls._logger.debug("bulk deleting %d %s objects",
+                              len(pkeys), cls.__shadowclass__.__name__)
+        for batch in _chunks(pkeys, BULK_BATCH_SIZE):
+            cls.__shadowclass__.objects.filter(pk__in=batch).delete()
+
+    @classmethod
+    def _bulk_update(cls, updates):
+        """Updates existing objects of the shadowed class.
+
+        :param updates: An iterable of (pkey, update) tuples, where update is a
+                        dict of attributes and values to set.  Objects that
+                        need identical updates are updated using a single
+                        query.
+
+        """
+        for update, pkeys in _group_updates(updates):
+            cls._logger.debug("bulk updating %d %s objects: %r",
+                              len(pkeys), cls.__shadowclass__.__name__,
+                              list(update))
+            for batch in _chunks(pkeys, BULK_BATCH_SIZE):
+                cls.__shadowclass__.objects.filter(pk__in=batch).update(
+                    **update)
+
+    @classmethod
+    def _bulk_create(cls, objs):
+        """Inserts new Django model objects of the shadowed class in batches.
+
+        The primary keys of the inserted objects are set from the database.
+
+        """
+        if objs:
+            cls._logger.debug("bulk inserting %d %s objects",
+                              len(objs), cls.__shadowclass__.__name__)
+            cls.__shadowclass__.objects.bulk_create(
+                objs, batch_size=BULK_BATCH_SIZE)
+
+    @classmethod
+    def _overrides(cls, name):
+        """Returns True if this class overrides the Shadow implementation of
+        the method called name.
+
+        """
+        def _function(klass):
+            attr = getattr(klass, name)
+            return getattr(attr, '__func__', attr)
+
+        return _function(cls) is not _function(Shadow)
+
     def update(self, containers):
         """Updates the existing object in the database (synchronously) with
         only the changed attributes of this shadow.
@@ -524,6 +784,39 @@ class Shadow(object):
                 if _is_different(a)]
 
 
+def _group_updates(updates):
+    """Groups a sequence of (pkey, update) tuples by identical update dicts.
+
+    :returns: A list of (update, [pkey, ...]) tuples.
+
+    """
+    groups = {}
+    result = []
+    for pkey, update in updates:
+        if not update:
+            continue
+        try:
+            key = tuple(sorted(update.items()))
+            hash(key)
+        except TypeError:
+            # unhashable values cannot be grouped
+            result.append((update, [pkey]))
+            continue
+        if key in groups:
+            groups[key][1].append(pkey)
+        else:
+            groups[key] = (update, [pkey])
+            result.append(groups[key])
+    return result
+
+
+def _chunks(sequence, size):
+    """Splits a sequence into lists of at most size items"""
+    sequence = list(sequence)
+    return [sequence[index:index + size]
+            for index in range(0, len(sequence), size)]
+
+
 def shadowify(model):
     """Return a properly shadowed version of a Django model object.
 
@@ -21,10 +21,18 @@ Syslog messages will be read from the configured file, parsed and
 inserted into structured NAV database tables.  Messages that cannot be
 parsed as Cisco syslog messages are ignored.
 
-The syslog file is truncated upon the exit of this program.  If you
-wish to keep a copy of the syslog messages on file, you should
-configure your syslog daemon to log the messages to two separate
-files, one of which this program will have exclusive access to.
+The syslog file is read incrementally, and is truncated whenever all of it
+has been read and stored in the database.  If you wish to keep a copy of the
+syslog messages on file, you should configure your syslog daemon to log the
+messages to two separate files, one of which this program will have
+exclusive access to.
+
+In follow mode, this program keeps running, storing new messages as they are
+written to the file.  It can also receive syslog messages directly from the
+network instead, as configured in the listen section of logger.conf.
+
+Lines flow through a pipeline of generators: they are read, parsed, collected
+in batches, and each batch is loaded into the database using COPY.
 
 """
 
@@ -33,27 +41,25 @@ files, one of which this program will have exclusive access to.
 # to make it more maintainable.  Feel free to refactor it further,
 # where it makes sense.
 
-# BUGS: This program has one glaring problem: All the log lines are
-# read into memory, and the logfile is subsequently truncated.  If
-# the program crashes before the lines are inserted into the
-# database, all the read log lines are lost.
-
-# TODO: Possible future enhancement is the ability to tail a log file
-# continually, instead of reading and truncating as a cron job.
-
 from __future__ import absolute_import, print_function
 
 import re
 import fcntl
+import io
+import os
+import select
+import socket
 import sys
 import errno
 import atexit
 import logging
+import time
 from configparser import ConfigParser
 import datetime
 import optparse
 
 from django.utils import six
+from psycopg2.extras import execute_values
 
 import nav
 import nav.logs
@@ -63,6 +69,18 @@ from nav.config import find_configfile
 
 
 PID_FILE = 'logengine.pid'
+DEFAULT_CHARSET = "ISO-8859-1"
+# Messages are loaded into the database in batches of at most BATCH_SIZE
+# messages, or whatever has been collected after BATCH_INTERVAL seconds
+BATCH_SIZE = 1000
+BATCH_INTERVAL = 1.0
+# How often to look for new lines when following the syslog file
+POLL_INTERVAL = 1.0
+# Maximum number of bytes to buffer from a syslog TCP stream while waiting for
+# the end of a message
+MAX_STREAM_BUFFER = 65536
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep",
+          "oct", "nov", "dec"]
 _logger = logging.getLogger("nav.logengine")
 
 
@@ -210,10 +228,8 @@ def find_year(mnd):
 
 
 def find_month(textual):
-    months = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep",
-              "oct", "nov", "dec"]
     try:
-        return months.index(textual.lower())+1
+        return MONTHS.index(textual.lower())+1
     except ValueError:
         pass
 
@@ -288,188 +304,413 @@ def get_types(cursor):
     return types
 
 
-def read_log_lines(config):
-    """Read and yield message lines from the watched cisco log file.
+def get_charset(config):
+    """Returns the charset of syslog messages, as configured in logger.conf"""
+    if config.has_option("paths", "charset"):
+        return config.get("paths", "charset")
+    return DEFAULT_CHARSET
+
+
+def read_log_lines(config, follow=False, poll_interval=POLL_INTERVAL):
+    """Reads and yields message lines from the watched cisco log file.
+
+    The file is read one line at a time.  Whenever the end of the file has
+    been reached, None is yielded.  When the next line is requested after
+    that, all the lines yielded so far are assumed to be safely stored, and
+    the file is truncated, unless something has been written to it in the
+    meantime.
 
-    Once the log file has been read, it is truncated. The watched file
-    is configured using the syslog option in the paths section of
-    logger.conf.
+    The watched file is configured using the syslog option in the paths
+    section of logger.conf.
+
+    :param follow: If True, keep polling the file for new lines forever.
+                   Otherwise, stop after the file has been truncated.
 
     """
     filename = config.get("paths", "syslog")
-    if config.has_option("paths", "charset"):
-        charset = config.get("paths", "charset")
-    else:
-        charset = "ISO-8859-1"
-
+    charset = get_charset(config)
     logfile = None
-    # open log
+    unprocessed = False
+
+    while True:
+        if logfile is None:
+            logfile = _open_log_file(filename)
+            if logfile is None and not follow:
+                return
+
+        line = logfile.readline() if logfile else b''
+        if line.endswith(b'\n') or (line and not follow):
+            unprocessed = True
+            yield _decode_line(line, charset)
+            continue
+
+        if unprocessed:
+            yield None
+        if line:
+            # an incomplete line is still being written; retry it later
+            logfile.seek(-len(line), os.SEEK_CUR)
+        elif unprocessed:
+            if not _truncate_log_file(logfile):
+                continue
+            unprocessed = False
+
+        if not follow:
+            logfile.close()
+            return
+        time.sleep(poll_interval)
+        if logfile and _is_replaced(logfile, filename):
+            logfile.close()
+            logfile = None
+
+
+def _open_log_file(filename):
     try:
-        if six.PY3:
-            logfile = open(filename, "r+", encoding=charset)
-        else:
-            logfile = open(filename, "r+")
+        return open(filename, "r+b")
     except IOError as err:
         # If logfile can't be found, we ignore it.  We won't needlessly
         # spam the NAV admin every minute with a file not found error!
         if err.errno != errno.ENOENT:
             _logger.exception("Couldn't open logfile %s", filename)
 
-    # if the file exists
-    if logfile:
 
-        # lock logfile
-        fcntl.flock(logfile, fcntl.LOCK_EX)
+def _decode_line(line, charset):
+    line = line.decode(charset, 'replace')
+    if six.PY2:
+        # Make sure the data is encoded as UTF-8 before we begin work on it
+        line = line.encode("UTF-8")
+    return line
 
-        # read log
-        fcon = logfile.readlines()
 
-        # truncate logfile
-        logfile.truncate(0)
+def _truncate_log_file(logfile):
+    """Truncates the log file, unless it has grown beyond the current read
+    position.
+
+    :returns: True if the file was truncated.
 
-        # unlock logfile
+    """
+    fcntl.flock(logfile, fcntl.LOCK_EX)
+    try:
+        if os.fstat(logfile.fileno()).st_size > logfile.tell():
+            return False
+        logfile.truncate(0)
+        logfile.seek(0)
+        return True
+    finally:
         fcntl.flock(logfile, fcntl.LOCK_UN)
-        # close log
-        logfile.close()
 
-        for line in fcon:
-            if six.PY2:
-                # Make sure the data is encoded as UTF-8 before we begin work on it
-                line = line.decode(charset).encode("UTF-8")
-            yield line
 
+def _is_replaced(logfile, filename):
+    try:
+        return os.stat(filename).st_ino != os.fstat(logfile.fileno()).st_ino
+    except OSError:
+        return True
 
-# pylint: disable=W0703
-def parse_and_insert(line, database,
-                     categories, origins, types,
-                     exceptionorigin, exceptiontype, exceptiontypeorigin):
-    """Parse a line of cisco log text and insert into db."""
 
-    try:
-        message = create_message(line, database)
-    except Exception:
-        _logger.exception("Unhandled exception during message parse: %s",
-                          line)
-        return False
+def get_listen_addresses(config):
+    """Returns the syslog addresses to listen to, as configured in the listen
+    section of logger.conf.
+
+    :returns: A list of (protocol, host, port) tuples.
+
+    """
+    if not config.has_option("listen", "addresses"):
+        return []
+    addresses = []
+    for address in config.get("listen", "addresses").split():
+        protocol, _sep, hostport = address.partition(':')
+        host, _sep, port = hostport.rpartition(':')
+        protocol = protocol.lower()
+        if protocol not in ('udp', 'tcp') or not port.isdigit():
+            raise ValueError("invalid syslog listen address: %s" % address)
+        addresses.append((protocol, host.strip('[]') or '0.0.0.0', int(port)))
+    return addresses
+
+
+def receive_log_lines(addresses, charset=DEFAULT_CHARSET,
+                      poll_interval=POLL_INTERVAL):
+    """Receives syslog messages over UDP and TCP, and yields them as log
+    lines, in the format syslog daemons write them to file.
+
+    TCP streams are expected to separate messages by newlines. Unterminated
+    data longer than MAX_STREAM_BUFFER bytes is passed on as a message of its
+    own. None is yielded whenever no messages have arrived for poll_interval
+    seconds.
+
+    :param addresses: A list of (protocol, host, port) tuples, as returned
+                      by get_listen_addresses().
+
+    """
+    datagram_sockets, listeners = [], []
+    for protocol, host, port in addresses:
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        if protocol == 'udp':
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.bind((host, port))
+            datagram_sockets.append(sock)
+        else:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen(16)
+            listeners.append(sock)
+        _logger.info("Listening for syslog messages on %s %s:%s",
+                     protocol, host, port)
+
+    streams = {}
+    while True:
+        readable, _, _ = select.select(
+            datagram_sockets + listeners + list(streams), [], [],
+            poll_interval)
+        if not readable:
+            yield None
+        for sock in readable:
+            if sock in datagram_sockets:
+                data, sender = sock.recvfrom(65535)
+                yield format_received_line(data, sender[0], charset)
+            elif sock in listeners:
+                try:
+                    conn, sender = sock.accept()
+                except socket.error as error:
+                    _logger.warning("Could not accept syslog connection: %s",
+                                    error)
+                    continue
+                streams[conn] = (sender[0], [b''])
+            else:
+                sender, buffer = streams[sock]
+                try:
+                    data = sock.recv(MAX_STREAM_BUFFER)
+                except socket.error as error:
+                    _logger.warning("Lost syslog connection from %s: %s",
+                                    sender, error)
+                    data = b''
+                if not data:
+                    del streams[sock]
+                    sock.close()
+                    data = b'\n'
+                lines = (buffer[0] + data).split(b'\n')
+                buffer[0] = lines.pop()
+                if len(buffer[0]) > MAX_STREAM_BUFFER:
+                    _logger.debug("Unterminated syslog message from %s "
+                                  "exceeds %d bytes", sender,
+                                  MAX_STREAM_BUFFER)
+                    lines.append(buffer[0])
+                    buffer[0] = b''
+                for line in lines:
+                    if line.strip():
+                        yield format_received_line(line, sender, charset)
+
+
+_priority_prefix_re = re.compile(br"^\s*<\d{1,3}>")
+
+
+def format_received_line(data, sender, charset=DEFAULT_CHARSET, now=None):
+    """Formats a syslog message received from the network as a log line, in
+    the format syslog daemons write to file: Prefixed by the time of
+    reception and the sender's address.
+    """
+    now = now or datetime.datetime.now()
+    data = _priority_prefix_re.sub(b'', data).strip(b'\r\n\x00')
+    line = u"%s %2d %02d:%02d:%02d %s %s\n" % (
+        MONTHS[now.month - 1].capitalize(), now.day, now.hour, now.minute,
+        now.second, sender, data.decode(charset, 'replace'))
+    if six.PY2:
+        line = line.encode("UTF-8")
+    return line
 
-    if message:
-        try:
-            insert_message(message, database,
-                           categories, origins, types,
-                           exceptionorigin, exceptiontype, exceptiontypeorigin)
-        except Exception:
-            _logger.exception("Unhandled exception during message insert: %s",
-                              line)
-            raise
 
+def parse_messages(lines, database=None):
+    """Parses log lines and yields Message objects.
 
-def insert_message(message, database,
-                   categories, origins, types,
-                   exceptionorigin, exceptiontype, exceptiontypeorigin):
-    # check origin (host)
-    if message.origin not in origins:
-        if message.category not in categories:
-            add_category(message.category, categories, database)
-        add_origin(message.origin, message.category, origins, database)
-    originid = origins[message.origin]
-
-    # check type
-    if (message.facility not in types or
-            message.mnemonic not in types[message.facility]):
-        add_type(message.facility, message.mnemonic, message.priorityid, types,
-                 database)
-    typeid = types[message.facility][message.mnemonic]
-
-    # overload priority if exceptions are set
+    Lines that cannot be parsed are skipped, while None values are passed
+    through, to mark the points where all messages so far should be stored.
+
+    """
+    parse = swallow_all_but_db_exceptions(create_message)
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        message = parse(line, database)
+        if message:
+            yield message
+
+
+def batch_messages(messages, size=BATCH_SIZE, interval=BATCH_INTERVAL):
+    """Collects messages into lists of at most size messages, or whatever
+    has been collected over interval seconds.  A None value ends the current
+    batch, which is yielded even if it is empty.
+    """
+    batch = []
+    started = None
+    for message in messages:
+        if message is not None:
+            batch.append(message)
+            started = started or time.time()
+            if len(batch) < size and time.time() - started < interval:
+                continue
+        yield batch
+        batch = []
+        started = None
+    if batch:
+        yield batch
+
+
+def get_new_priority(message, exceptionorigin, exceptiontype,
+                     exceptiontypeorigin):
+    """Returns the priority of message, overridden by any matching priority
+    exception.
+    """
     m_type = message.type.lower()
     origin = message.origin.lower()
     if (m_type in exceptiontypeorigin and
             origin in exceptiontypeorigin[m_type]):
-        try:
-            message.priorityid = int(exceptiontypeorigin[m_type][origin])
-        except ValueError:
-            pass
-
+        newpriority = exceptiontypeorigin[m_type][origin]
     elif origin in exceptionorigin:
-        try:
-            message.priorityid = int(exceptionorigin[origin])
-        except ValueError:
-            pass
-
+        newpriority = exceptionorigin[origin]
     elif m_type in exceptiontype:
+        newpriority = exceptiontype[m_type]
+    else:
+        return message.priorityid
+
+    try:
+        return int(newpriority)
+    except ValueError:
+        return message.priorityid
+
+
+class MessageLoader(object):
+    """Loads batches of messages into the log_message table.
+
+    Origins, categories and message types are looked up in in-memory caches.
+    Any that are missing are added in bulk for each batch.  The messages
+    themselves are loaded using COPY.
+
+    """
+    COLUMNS = ('time', 'origin', 'newpriority', 'type', 'message')
+
+    def __init__(self, connection, exceptions=({}, {}, {})):
+        """Initializes a message loader.
+
+        :param connection: A database connection.
+        :param exceptions: A tuple of priority exception dicts, as returned by
+                           get_exception_dicts().
+
+        """
+        self.connection = connection
+        (self.exceptionorigin,
+         self.exceptiontype,
+         self.exceptiontypeorigin) = exceptions
+        self.categories = self.origins = self.types = None
+
+    def load(self, messages):
+        """Loads a batch of messages and commits the transaction"""
         try:
-            message.priorityid = int(exceptiontype[m_type])
-        except ValueError:
-            pass
-
-    # insert message into database
-    database.execute("INSERT INTO log_message (time, origin, "
-                     "newpriority, type, message) "
-                     "VALUES (%s, %s, %s, %s, %s)",
-                     (str(message.time), originid,
-                      message.priorityid, typeid,
-                      message.description))
-
-
-def add_category(category, categories, database):
-    database.execute("INSERT INTO category (category) "
-                     "VALUES (%s)", (category,))
-    categories[category] = category
-
-
-def add_origin(origin, category, origins, database):
-    database.execute("SELECT nextval('origin_origin_seq')")
-    originid = database.fetchone()[0]
-    assert isinstance(originid, six.integer_types)
-    database.execute("INSERT INTO origin (origin, name, "
-                     "category) VALUES (%s, %s, %s)",
-                     (originid, origin, category))
-    origins[origin] = originid
-    return originid
-
-
-def add_type(facility, mnemonic, priorityid, types, database):
-    database.execute("SELECT nextval('log_message_type_type_seq')")
-    typeid = int(database.fetchone()[0])
-    assert isinstance(typeid, six.integer_types)
-
-    database.execute("INSERT INTO log_message_type (type, facility, "
-                     "mnemonic, priority) "
-                     "VALUES (%s, %s, %s, %s)",
-                     (typeid, facility, mnemonic, priorityid))
-    if facility not in types:
-        types[facility] = {}
-    types[facility][mnemonic] = typeid
+            cursor = self.connection.cursor()
+            if self.origins is None:
+                self._load_caches(cursor)
+            self._add_missing_origins(cursor, messages)
+            self._add_missing_types(cursor, messages)
+            if messages:
+                cursor.copy_from(self._make_copy_data(messages),
+                                 'log_message', columns=self.COLUMNS)
+            self.connection.commit()
+        except db.driver.Error:
+            self.connection.rollback()
+            # the caches may contain rows that were just rolled back
+            self.origins = None
+            raise
+        _logger.debug("Loaded %d messages", len(messages))
+
+    def _load_caches(self, cursor):
+        self.categories = get_categories(cursor)
+        self.origins = get_origins(cursor)
+        self.types = get_types(cursor)
+
+    def _add_missing_origins(self, cursor, messages):
+        missing = {}
+        for message in messages:
+            if message.origin not in self.origins:
+                missing.setdefault(message.origin, message.category)
+        if not missing:
+            return
+
+        categories = set(missing.values()).difference(self.categories)
+        if categories:
+            execute_values(cursor,
+                           "INSERT INTO category (category) VALUES %s",
+                           [(category,) for category in categories])
+            self.categories.update((category, category)
+                                   for category in categories)
+
+        rows = execute_values(
+            cursor,
+            "INSERT INTO origin (name, category) VALUES %s "
+            "RETURNING origin, name",
+            list(missing.items()), fetch=True)
+        self.origins.update((name, int(origin)) for origin, name in rows)
+
+    def _add_missing_types(self, cursor, messages):
+        missing = {}
+        for message in messages:
+            if message.mnemonic not in self.types.get(message.facility, {}):
+                missing.setdefault((message.facility, message.mnemonic),
+                                   message.priorityid)
+        if not missing:
+            return
+
+        rows = execute_values(
+            cursor,
+            "INSERT INTO log_message_type (facility, mnemonic, priority) "
+            "VALUES %s RETURNING type, facility, mnemonic",
+            [(facility, mnemonic, priority)
+             for (facility, mnemonic), priority in missing.items()],
+            fetch=True)
+        for type_, facility, mnemonic in rows:
+            self.types.setdefault(facility, {})[mnemonic] = int(type_)
+
+    def _make_copy_data(self, messages):
+        data = io.StringIO()
+        for message in messages:
+            row = (str(message.time),
+                   self.origins[message.origin],
+                   get_new_priority(message, self.exceptionorigin,
+                                    self.exceptiontype,
+                                    self.exceptiontypeorigin),
+                   self.types[message.facility][message.mnemonic],
+                   message.description)
+            data.write(u'\t'.join(_copy_value(value) for value in row))
+            data.write(u'\n')
+        data.seek(0)
+        return data
+
+
+def _copy_value(value):
+    """Formats a value for COPY's text format"""
+    if value is None:
+        return u'\\N'
+    if isinstance(value, bytes):
+        value = value.decode('UTF-8')
+    return (six.text_type(value).replace(u'\\', u'\\\\')
+            .replace(u'\t', u'\\t').replace(u'\n', u'\\n')
+            .replace(u'\r', u'\\r').replace(u'\x00', u''))
 
 
 def logengine(config, options):
     verify_singleton(options.quiet)
 
     connection = db.getConnection('logger', 'logger')
-    database = connection.cursor()
-
-    # initial setup of dictionaries
+    loader = MessageLoader(connection, get_exception_dicts(config))
 
-    categories = get_categories(database)
-    origins = get_origins(database)
-    types = get_types(database)
-
-    # parse priorityexceptions
-    (exceptionorigin,
-     exceptiontype,
-     exceptiontypeorigin) = get_exception_dicts(config)
-
-    # add new records
-    _logger.debug("Reading new log entries")
-    my_parse_and_insert = swallow_all_but_db_exceptions(parse_and_insert)
-    for line in read_log_lines(config):
-        my_parse_and_insert(line, database,
-                            categories, origins, types,
-                            exceptionorigin, exceptiontype,
-                            exceptiontypeorigin)
+    addresses = get_listen_addresses(config) if options.follow else []
+    if addresses:
+        lines = receive_log_lines(addresses, get_charset(config))
+    else:
+        _logger.debug("Reading new log entries")
+        lines = read_log_lines(config, follow=options.follow)
 
-    # Make sure it all sticks
-    connection.commit()
+    messages = parse_messages(lines, connection.cursor())
+    for batch in batch_messages(messages):
+        loader.load(batch)
 
 
 def swallow_all_but_db_exceptions(func):
@@ -492,6 +733,10 @@ def parse_options():
     parser.add_option("-q", "--quiet", action="store_true", dest="quiet",
                       help="quietly exit without returning an error code if "
                       "logengine is already running")
+    parser.add_option("-f", "--follow", action="store_true", dest="follow",
+                      help="keep running, storing new messages as they "
+                      "arrive in the syslog file, or on the syslog sockets "
+                      "configured in logger.conf")
 
     return parser.parse_args()
 
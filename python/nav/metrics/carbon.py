@@ -15,13 +15,23 @@
 #
 """
 This module implements various common API to send metrics to a
-Graphite/Carbon backend. It currently only supports the UDP line protocol,
-as it's the easiest to implement, and will also work without vodoo in
-asynchronous programs (i .e. such as ipdevpoll, which is implemented using
-Twisted).
+Graphite/Carbon backend. By default it uses the UDP line protocol, as it's the
+easiest to implement, and will also work without vodoo in asynchronous
+programs (i .e. such as ipdevpoll, which is implemented using Twisted).
+
+Carbon's pickle protocol over a persistent TCP connection is also supported,
+by setting `protocol = pickle` in the carbon section of graphite.conf. This
+will queue metrics in memory and send them in batches from a background
+thread, so that metrics aren't lost when the volume is high.
 """
+from collections import deque
+import atexit
 import logging
+import os
+import pickle
 import socket
+import struct
+import threading
 import time
 import warnings
 from nav.metrics import CONFIG
@@ -38,6 +48,16 @@ MAX_UDP_PAYLOAD = 1400
 # Minimum interval between socket error log entries, in seconds
 SOCKET_ERROR_MESSAGE_INTERVAL = 1
 
+# Maximum number of metrics to send in a single pickle protocol message
+MAX_PICKLE_BATCH = 500
+
+# Maximum number of seconds to hold metrics in queue before sending them
+PICKLE_FLUSH_INTERVAL = 1.0
+
+# Limits for the exponential backoff between reconnection attempts, in seconds
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
 
 class CarbonWarning(UserWarning):
     """Custom warning class for Carbon connection related warnings"""
@@ -118,9 +138,193 @@ def send_metrics(metric_tuples):
     """
     host = CONFIG.get("carbon", "host")
     port = CONFIG.getint("carbon", "port")
+    if CONFIG.get("carbon", "protocol").lower() == "pickle":
+        return get_pickle_sender(host, port).send(metric_tuples)
     return send_metrics_to(metric_tuples, host, port)
 
 
+_pickle_senders = {}
+
+
+def get_pickle_sender(host, port=2004):
+    """Returns a running PickleSender for the carbon backend at host:port.
+
+    Only one sender is created per backend per process. Since ipdevpoll may
+    fork worker processes, and threads do not survive a fork, a sender created
+    by a parent process will not be reused by its children.
+
+    """
+    key = (host, port, os.getpid())
+    sender = _pickle_senders.get(key)
+    if sender is None:
+        max_queue = CONFIG.getint("carbon", "queue_size")
+        sender = _pickle_senders[key] = PickleSender(host, port, max_queue)
+        sender.start()
+    return sender
+
+
+class PickleSender(object):
+    """Sends metrics to a carbon backend using the pickle protocol over a
+    persistent TCP connection.
+
+    Metrics are queued in a bounded in-memory queue, and are sent in batches
+    by a background thread whenever MAX_PICKLE_BATCH metrics have been queued
+    or PICKLE_FLUSH_INTERVAL seconds have passed. If the connection fails, the
+    sender will reconnect with an exponential backoff, while still queueing
+    metrics. When the queue is full, the oldest metrics are dropped, so
+    callers are never blocked.
+
+    The counters `queued`, `sent` and `dropped` keep track of the total
+    number of metrics handled by this sender.
+
+    """
+    def __init__(self, host, port=2004, max_queue=100000):
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._socket = None
+        self._thread = None
+        self._stopped = False
+        self._reconnect_delay = MIN_RECONNECT_DELAY
+        self._next_connect = 0
+
+    def __repr__(self):
+        return "<%s [%s]:%s queue=%d sent=%d dropped=%d>" % (
+            self.__class__.__name__, self.host, self.port, len(self._queue),
+            self.sent, self.dropped)
+
+    @property
+    def queue_length(self):
+        """The number of metrics currently waiting to be sent"""
+        return len(self._queue)
+
+    def start(self):
+        """Starts the background sender thread"""
+        self._thread = threading.Thread(target=self._run,
+                                        name="carbon-pickle-sender")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """Stops the background thread, after attempting to flush the queue
+        for at most timeout seconds.
+
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def send(self, metric_tuples):
+        """Queues a list of metric tuples for sending.
+
+        :param metric_tuples: A list of metric tuples in the form
+                              [(path, (timestamp, value)), ...]
+
+        """
+        dropped = 0
+        with self._condition:
+            for metric in metric_tuples:
+                if len(self._queue) >= self.max_queue:
+                    self._queue.popleft()
+                    dropped += 1
+                self._queue.append(metric)
+                self.queued += 1
+            self.dropped += dropped
+            if len(self._queue) >= MAX_PICKLE_BATCH:
+                self._condition.notify()
+        if dropped:
+            _handle_error("queue is full, %d metrics dropped so far" %
+                          self.dropped, self.host, self.port)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._queue) < MAX_PICKLE_BATCH:
+                    self._condition.wait(PICKLE_FLUSH_INTERVAL)
+                stopped = self._stopped
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                # The sender thread must survive anything, or metrics would
+                # be queued forever with nothing sending them
+                _logger.exception("unexpected error while sending metrics to "
+                                  "[%s]:%s", self.host, self.port)
+            if stopped:
+                return
+
+    def flush(self):
+        """Sends all queued metrics, unless the backend is unavailable"""
+        while self._queue:
+            if not self._connect():
+                return
+            batch = self._take_batch()
+            try:
+                payload = metrics_to_pickle(batch)
+            except Exception:  # pylint: disable=broad-except
+                _logger.exception("dropping a batch of %d metrics that could "
+                                  "not be pickled", len(batch))
+                self.dropped += len(batch)
+                continue
+            try:
+                self._socket.sendall(payload)
+            except socket.error as error:
+                self._requeue(batch)
+                self._disconnect(error)
+                return
+            else:
+                self.sent += len(batch)
+
+    def _take_batch(self):
+        with self._condition:
+            size = min(len(self._queue), MAX_PICKLE_BATCH)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _requeue(self, batch):
+        with self._condition:
+            room = self.max_queue - len(self._queue)
+            if room < len(batch):
+                self.dropped += len(batch) - room
+                batch = batch[len(batch) - room:] if room > 0 else []
+            self._queue.extendleft(reversed(batch))
+
+    def _connect(self):
+        if self._socket:
+            return True
+        if time.time() < self._next_connect:
+            return False
+        try:
+            self._socket = socket.create_connection((self.host, self.port),
+                                                    timeout=10)
+        except socket.error as error:
+            self._disconnect(error)
+            return False
+        else:
+            _logger.debug("connected to carbon pickle receiver at [%s]:%s",
+                          self.host, self.port)
+            self._reconnect_delay = MIN_RECONNECT_DELAY
+            return True
+
+    def _disconnect(self, error):
+        if self._socket:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+            self._socket = None
+        _handle_error(error, self.host, self.port)
+        self._next_connect = time.time() + self._reconnect_delay
+        self._reconnect_delay = min(self._reconnect_delay * 2,
+                                    MAX_RECONNECT_DELAY)
+
+
 def _socktype_from_addr(addr):
     info = socket.getaddrinfo(addr, 0)
     socktype = info[0][0]
@@ -158,3 +362,20 @@ def metrics_to_packets(metric_tuples):
     if output:
         packet = bytes(output)
         yield packet
+
+
+def metrics_to_pickle(metric_tuples):
+    """
+    Converts a list of metric tuples to a Carbon pickle protocol message,
+    ready to transmit over a TCP connection to a Carbon backend.
+
+    :param metric_tuples: A list of metric tuples in the form
+                          [(path, (timestamp, value)), ...]
+
+    """
+    payload = pickle.dumps(
+        [(str(path), (int(timestamp), value))
+         for path, (timestamp, value) in metric_tuples],
+        protocol=2)
+    header = struct.pack("!L", len(payload))
+    return header + payload
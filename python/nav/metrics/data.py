@@ -15,14 +15,20 @@
 #
 """Retrieval and calculations on raw numbers from Graphite metrics"""
 import codecs
+from collections import OrderedDict
 from datetime import datetime
 import json
 import logging
+from multiprocessing.pool import ThreadPool
+import re
+
+from django.utils import six
 from django.utils.six.moves.urllib.parse import urlencode, urljoin
 from django.utils.six.moves.urllib.request import Request, urlopen
 from django.utils.six.moves.urllib.error import HTTPError, URLError
 
 from nav.metrics import CONFIG, errors
+from nav.metrics.cache import ResultCache
 from nav.metrics.templates import (metric_path_for_packet_loss,
                                    metric_path_for_roundtrip_time)
 
@@ -45,6 +51,21 @@ def get_metric_average(target, start="-5min", end="now", ignore_unknown=True):
     start_time = datetime.now()
 
     data = get_metric_data(target, start, end)
+    result = calculate_averages(data, ignore_unknown)
+
+    _logger.debug('Got metric average for %s targets in %s seconds',
+                  len(data), datetime.now() - start_time)
+    return result
+
+
+def calculate_averages(data, ignore_unknown=True):
+    """Calculates the average value of each series in a render response.
+
+    :param data: A list of series, as returned by get_metric_data().
+    :param ignore_unknown: Ignore unknown values when calculating the average.
+    :returns: A dict of {series_name: average_value} items.
+
+    """
     result = {}
     for target in data:
         dpoints = [d[0] for d in target['datapoints']
@@ -55,9 +76,6 @@ def get_metric_average(target, start="-5min", end="now", ignore_unknown=True):
             else:
                 avg = sum(dpoints) / len(dpoints)
             result[target['target']] = avg
-
-    _logger.debug('Got metric average for %s targets in %s seconds',
-                  len(data), datetime.now() - start_time)
     return result
 
 
@@ -79,6 +97,11 @@ def get_metric_data(target, start="-5min", end="now"):
     """
     Retrieves raw datapoints from a graphite target for a given period of time.
 
+    Multiple targets are coalesced into as few render requests as possible,
+    and independent requests are run concurrently. Results are cached for
+    CACHE_TTL seconds. As the series are returned as one flat list, multiple
+    wildcard or function targets are batched into shared requests as well.
+
     :param target: A metric path string or a list of multiple metric paths
     :param start: A start time specification that Graphite will accept.
     :param end: An end time specification that Graphite will accept.
@@ -93,15 +116,168 @@ def get_metric_data(target, start="-5min", end="now"):
     if not target:
         return []  # no point in wasting time on http requests for no data
 
-    base = CONFIG.get("graphiteweb", "base")
-    url = urljoin(base, "/render/")
+    start, end = _format_time(start), _format_time(end)
+    targets = _unique_targets(target)
+    plain = [tgt for tgt in targets if _PLAIN_METRIC_PATH.match(tgt)]
+    other = [tgt for tgt in targets if not _PLAIN_METRIC_PATH.match(tgt)]
+    if len(other) < 2:
+        plain, other = targets, []
 
+    results = get_metric_data_by_target(plain, start, end)
+    data = [series for series_list in results.values()
+            for series in series_list]
+    if other:
+        data.extend(_get_batched_data(other, start, end))
+    return data
+
+
+def get_metric_data_by_target(target, start="-5min", end="now"):
+    """
+    Retrieves raw datapoints from graphite targets for a given period of time,
+    like get_metric_data(), but keeps the series returned for each target
+    apart.
+
+    :returns: An OrderedDict mapping each of the requested targets to the list
+              of series Graphite returned for it.
+
+    """
+    if not target:
+        return OrderedDict()
+
+    start, end = _format_time(start), _format_time(end)
+    targets = _unique_targets(target)
+
+    results = {}
+    missing = []
+    for tgt in targets:
+        cached = _cache.get((tgt, start, end))
+        if cached is None:
+            missing.append(tgt)
+        else:
+            results[tgt] = cached
+
+    if missing:
+        _logger.debug("get_metric_data: %d of %d targets not cached",
+                      len(missing), len(targets))
+        requests = _coalesce_targets(missing)
+        for response in _run_concurrently(_render_targets, [
+                (request, start, end) for request in requests]):
+            for tgt, data in response.items():
+                _cache.set((tgt, start, end), data)
+                results[tgt] = data
+
+    return OrderedDict((tgt, results.get(tgt, [])) for tgt in targets)
+
+
+def _get_batched_data(targets, start, end):
+    """Retrieves the series of targets whose series cannot be attributed to
+    the individual targets (i.e. using wildcards or functions), by batching
+    them into as few render requests as possible.
+
+    Results are cached per batch rather than per target.
+
+    """
+    data = []
+    missing = []
+    for batch in _coalesce_targets(targets, attributable=False):
+        cached = _cache.get((tuple(batch), start, end))
+        if cached is None:
+            missing.append(batch)
+        else:
+            data.extend(cached)
+
+    for batch, response in zip(missing, _run_concurrently(_render, [
+            (batch, start, end) for batch in missing])):
+        _cache.set((tuple(batch), start, end), response)
+        data.extend(response)
+    return data
+
+
+def _format_time(time):
     # What does Graphite accept of formats? Lets check if the parameters are
     # datetime objects and try to force a format then
-    if isinstance(start, datetime):
-        start = start.strftime('%H:%M%Y%m%d')
-    if isinstance(end, datetime):
-        end = end.strftime('%H:%M%Y%m%d')
+    if isinstance(time, datetime):
+        return time.strftime('%H:%M%Y%m%d')
+    return time
+
+
+def _unique_targets(target):
+    if isinstance(target, six.string_types):
+        return [target]
+    return list(OrderedDict.fromkeys(target))
+
+
+# Max number of concurrent render requests made by a single get_metric_data
+MAX_CONCURRENT_REQUESTS = 4
+
+# graphite-web is a Django app, which by default refuses requests with more
+# than 1000 fields or bodies larger than 2.5MB
+MAX_TARGETS_PER_REQUEST = 500
+MAX_REQUEST_BODY_SIZE = 1024 * 1024
+
+# Number of seconds to cache responses for each target
+CACHE_TTL = 60
+
+# Targets that consist only of these characters are plain metric paths,
+# which graphite-web will return a single series for, named by the path itself
+_PLAIN_METRIC_PATH = re.compile(r'^[-\w.:]+$')
+
+
+def _coalesce_targets(targets, attributable=True):
+    """Splits a list of targets into lists that can be fetched in a single
+    render request each.
+
+    Plain metric paths are coalesced into as few requests as the request size
+    limits will allow. Unless attributable is False, any other target (i.e.
+    using wildcards or functions) is requested on its own, so that every
+    series in its response can be attributed to it.
+
+    """
+    requests = []
+    current = []
+    size = 0
+    for target in targets:
+        if attributable and not _PLAIN_METRIC_PATH.match(target):
+            requests.append([target])
+            continue
+        field_size = len(urlencode({'target': target})) + 1
+        if current and (len(current) >= MAX_TARGETS_PER_REQUEST or
+                        size + field_size > MAX_REQUEST_BODY_SIZE):
+            requests.append(current)
+            current = []
+            size = 0
+        current.append(target)
+        size += field_size
+    if current:
+        requests.append(current)
+    return requests
+
+
+def _render_targets(targets, start, end):
+    """Fetches a list of targets in a single render request.
+
+    :returns: A dict mapping each of the targets to the list of series
+              returned for it.
+
+    """
+    data = _render(targets, start, end)
+    if len(targets) == 1:
+        return {targets[0]: data}
+
+    result = dict((target, []) for target in targets)
+    for series in data:
+        name = series.get('target') if isinstance(series, dict) else None
+        if name in result:
+            result[name].append(series)
+        else:
+            _logger.debug("get_metric_data: ignoring unrequested series %r",
+                          name)
+    return result
+
+
+def _render(target, start, end):
+    base = CONFIG.get("graphiteweb", "base")
+    url = urljoin(base, "/render/")
 
     query = {
         'target': target,
@@ -137,6 +313,31 @@ def get_metric_data(target, start="-5min", end="now"):
             pass
 
 
+def _run_concurrently(func, args_list):
+    """Runs func once for every tuple of arguments in args_list, using at most
+    MAX_CONCURRENT_REQUESTS threads.
+
+    :returns: A list of results, in the same order as args_list.
+
+    """
+    if len(args_list) < 2:
+        return [func(*args) for args in args_list]
+
+    pool = ThreadPool(min(len(args_list), MAX_CONCURRENT_REQUESTS))
+    try:
+        return pool.map(lambda args: func(*args), args_list)
+    finally:
+        pool.terminate()
+
+
+_cache = ResultCache(ttl=CACHE_TTL)
+
+
+def clear_cache():
+    """Clears the local cache of metric data"""
+    _cache.clear()
+
+
 DEFAULT_TIME_FRAMES = ('day', 'week', 'month')
 DEFAULT_DATA_SOURCES = ('availability', 'response_time')
 METRIC_PATH_LOOKUP = {
@@ -205,9 +406,9 @@ def populate_for_interval(result, targets, netboxes, start_time, end_time):
 
 def populate_for_time_frame(result, targets, netboxes, time_frames):
     """Populate results based on a list of time frames"""
-    for time_frame in time_frames:
-        avg = get_metric_average(targets, start="-1%s" % time_frame)
-
+    averages = _run_concurrently(get_metric_average, [
+        (targets, "-1%s" % time_frame) for time_frame in time_frames])
+    for time_frame, avg in zip(time_frames, averages):
         for netbox in netboxes:
             root = result[netbox.id]
 
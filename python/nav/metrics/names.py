@@ -16,16 +16,27 @@
 """Search & discovery functions for Graphite metric names and hierarchies"""
 
 from collections import OrderedDict
+from fnmatch import fnmatchcase
 import itertools
 import json
+from multiprocessing.pool import ThreadPool
 from django.utils.six.moves.urllib.parse import urlencode, urljoin
 from django.utils.six.moves.urllib.request import Request, urlopen
 from django.utils.six.moves.urllib.error import URLError
 from nav.metrics import CONFIG, errors
+from nav.metrics.cache import ResultCache
 import string
 
 LEGAL_METRIC_CHARACTERS = string.ascii_letters + string.digits + "-_"
 
+# Number of seconds to cache metric hierarchy query results
+TREE_CACHE_TTL = 300
+
+# Number of hierarchy levels that nodewalk will fetch concurrently
+WALK_LEVELS_PER_ROUND = 3
+
+_tree_cache = ResultCache(ttl=TREE_CACHE_TTL)
+
 
 def escape_metric_name(name):
     """
@@ -72,7 +83,7 @@ def get_metric_leaf_children(path):
 
     """
     query = path + ".*"
-    data = raw_metric_query(query)
+    data = cached_metric_query(query)
     result = [node['id'] for node in data
               if node.get('leaf', False)]
     return result
@@ -86,7 +97,7 @@ def get_metric_nonleaf_children(path):
 
     """
     query = path + ".*"
-    data = raw_metric_query(query)
+    data = cached_metric_query(query)
     result = [node['id'] for node in data
               if not node.get('leaf', False)]
     return result
@@ -95,7 +106,9 @@ def get_metric_nonleaf_children(path):
 def nodewalk(top, ignored=None):
     """Walks through a graphite metric hierarchy.
 
-    Basically works like os.walk()
+    Basically works like os.walk(). Instead of querying each node in the
+    hierarchy separately, one glob query is made for each level below top,
+    and WALK_LEVELS_PER_ROUND levels are queried concurrently.
 
     :param top: Path to the node to walk from.
     :param ignored: A list of node IDs to completely ignore.
@@ -103,22 +116,95 @@ def nodewalk(top, ignored=None):
               (name, nonleaves, leaves)
 
     """
-    ignored = ignored or []
-    nodes = raw_metric_query(top + '.*')
-    nonleaves, leaves = [], []
-    for node in nodes:
-        if node['id'] in ignored:
-            continue
-        if node.get('leaf', False):
-            leaves.append(node['id'])
-        else:
-            nonleaves.append(node['id'])
+    tree = _get_tree(top, set(ignored or []))
+    for item in _walk_tree(top, tree):
+        yield item
 
-    yield top, nonleaves, leaves
 
+def _get_tree(top, ignored):
+    """Fetches the entire metric hierarchy below top.
+
+    :returns: A dict mapping each non-leaf node to a tuple of
+              (nonleaves, leaves) found immediately below it.
+
+    """
+    tree = {top: ([], [])}
+    frontier = {top}
+    depth = 0
+    while frontier:
+        queries = [top + '.*' * (depth + level)
+                   for level in range(1, WALK_LEVELS_PER_ROUND + 1)]
+        for nodes in _query_concurrently(queries):
+            depth += 1
+            parents, frontier = frontier, set()
+            for node in nodes:
+                node_id = node['id']
+                parent = node_id.rsplit('.', 1)[0]
+                if parent not in parents or node_id in ignored:
+                    continue
+                nonleaves, leaves = tree[parent]
+                if node.get('leaf', False):
+                    leaves.append(node_id)
+                else:
+                    nonleaves.append(node_id)
+                    tree[node_id] = ([], [])
+                    frontier.add(node_id)
+            if not frontier:
+                break
+    return tree
+
+
+def _walk_tree(top, tree):
+    nonleaves, leaves = tree[top]
+    yield top, nonleaves, leaves
     for name in nonleaves:
-        for x in nodewalk(name):
-            yield x
+        for item in _walk_tree(name, tree):
+            yield item
+
+
+def _query_concurrently(queries):
+    pool = ThreadPool(len(queries))
+    try:
+        return pool.map(cached_metric_query, queries)
+    finally:
+        pool.terminate()
+
+
+def cached_metric_query(query):
+    """Runs a query for metric information against Graphite's REST API, like
+    raw_metric_query, but results are cached for TREE_CACHE_TTL seconds.
+
+    """
+    result = _tree_cache.get(query)
+    if result is None:
+        result = raw_metric_query(query)
+        _tree_cache.set(query, result)
+    return result
+
+
+def invalidate_metric_tree_cache(path=None):
+    """Invalidates cached metric hierarchy query results.
+
+    :param path: If given, only invalidate results that may include path or
+                 nodes below it. Otherwise, invalidate everything.
+
+    """
+    if path is None:
+        _tree_cache.clear()
+    else:
+        _tree_cache.invalidate(lambda query: _query_may_match(query, path))
+
+
+def _query_may_match(query, path):
+    """Returns True if the results of query may include path or any of its
+    ancestors or descendants.
+    """
+    for pattern, name in zip(query.split('.'), path.split('.')):
+        if '{' in pattern:
+            continue  # fnmatch doesn't do brace expansion, assume a match
+        if not fnmatchcase(name, pattern):
+            return False
+    return True
 
 
 def raw_metric_query(query):
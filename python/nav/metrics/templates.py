@@ -100,6 +100,16 @@ def metric_path_for_service_response_time(sysname, handler, service_id):
         service=metric_prefix_for_service(sysname, handler, service_id))
 
 
+def metric_path_for_statemon_event_queue(program):
+    tmpl = "nav.statemon.{program}.eventQueue"
+    return tmpl.format(program=escape_metric_name(program))
+
+
+def metric_path_for_snmptrapd(name):
+    tmpl = "nav.snmptrapd.{name}"
+    return tmpl.format(name=escape_metric_name(name))
+
+
 def metric_path_for_sysuptime(sysname):
     tmpl = "{system}.sysuptime"
     return tmpl.format(system=metric_prefix_for_system(sysname))
@@ -59,6 +59,7 @@ This module should provide an API for evaluating threshold expressions.
 Alerting is outside of the scope of this module.
 
 """
+from collections import defaultdict
 from datetime import timedelta
 from functools import partial
 import logging
@@ -66,14 +67,16 @@ import re
 
 from django.utils.six import iteritems, iterkeys
 
-from nav.metrics.data import get_metric_average
+from nav.metrics.data import (get_metric_average, get_metric_data_by_target,
+                              calculate_averages)
 from nav.metrics.graphs import get_metric_meta, extract_series_name
 
 
 # Pattern to extract the ID of a metric from a series name returned in a
 # Graphite render response.
 from nav.metrics.lookup import lookup
-from nav.models.manage import Interface
+from nav.metrics.names import escape_metric_name
+from nav.models.manage import Interface, Netbox
 
 
 EXPRESSION_PATTERN = re.compile(r'^ \s* (?P<operator> [<>] ) \s* '
@@ -87,6 +90,10 @@ YEAR = timedelta(days=365).total_seconds()
 
 MEGA = 1e6
 
+INTERFACE_OCTETS_PATTERN = re.compile(
+    r'\.devices\.(?P<sysname>[^.]+)\.ports\.(?P<ifname>[^.]+)\.'
+    r'(?P<counter>[^.]*octets[^.]*)$', re.IGNORECASE)
+
 _logger = logging.getLogger(__name__)
 
 
@@ -117,6 +124,7 @@ class ThresholdEvaluator(object):
         self.period = period
         self.raw = raw
         self.result = {}
+        self.maximums = None
 
         if not raw:
             meta = get_metric_meta(target)
@@ -136,6 +144,12 @@ class ThresholdEvaluator(object):
         start = "-{0}".format(interval_to_graphite(self.period))
         averages = get_metric_average(
             self.target, start=start, end='now', ignore_unknown=True)
+        return self.set_values(averages)
+
+    def set_values(self, averages):
+        """Sets the current values of this evaluator from a dict of
+        {series_name: average_value} items, as retrieved from Graphite.
+        """
         _logger.debug("retrieved %d values from graphite for %r, "
                       "period %s: %r",
                       len(averages), self.target, self.period, averages)
@@ -189,7 +203,10 @@ class ThresholdEvaluator(object):
         if metric in self.result:
             current = self.result[metric]['value']
             if percent:
-                maximum = get_metric_maximum(metric)
+                if self.maximums is not None:
+                    maximum = self.maximums.get(metric)
+                else:
+                    maximum = get_metric_maximum(metric)
                 if not maximum:
                     return None  # cannot relatively match a maximum=0
                 self.result[metric]['max'] = maximum
@@ -213,6 +230,80 @@ def get_metric_maximum(metric):
                 return maximum
 
 
+def get_metric_maximums(metrics):
+    """
+    Returns a dict of the maximum values of multiple metrics, for those
+    metrics that a maximum value can be determined for.
+
+    This gives the same results as calling get_metric_maximum() for each
+    metric, but uses a fixed number of database queries.
+
+    """
+    wanted = defaultdict(list)
+    for metric in metrics:
+        match = INTERFACE_OCTETS_PATTERN.search(metric)
+        if match:
+            wanted[match.group('sysname')].append(
+                (match.group('ifname'), metric))
+    if not wanted:
+        return {}
+
+    netboxes = dict(
+        (netboxid, escape_metric_name(sysname))
+        for netboxid, sysname in Netbox.objects.values_list('id', 'sysname')
+        if escape_metric_name(sysname) in wanted)
+    by_ifname = defaultdict(list)
+    by_ifdescr = defaultdict(list)
+    interfaces = Interface.objects.filter(
+        netbox__in=netboxes.keys()).values_list(
+            'netbox', 'ifname', 'ifdescr', 'speed')
+    for netboxid, ifname, ifdescr, speed in interfaces:
+        sysname = netboxes[netboxid]
+        by_ifname[(sysname, escape_metric_name(ifname))].append(speed)
+        by_ifdescr[(sysname, escape_metric_name(ifdescr))].append(speed)
+
+    result = {}
+    for sysname, ports in iteritems(wanted):
+        for ifname, metric in ports:
+            # Mimic lookup(), which only accepts unique matches
+            speeds = by_ifname.get((sysname, ifname), [])
+            if len(speeds) != 1:
+                speeds = by_ifdescr.get((sysname, ifname), [])
+            if len(speeds) == 1 and speeds[0]:
+                # Making the same unsafe assumption as get_metric_maximum
+                result[metric] = speeds[0] * MEGA
+    return result
+
+
+def prefetch_values(evaluators):
+    """
+    Retrieves values for multiple evaluators at once, as an alternative to
+    calling get_values() on each of them.
+
+    Evaluators are grouped by period, and the targets of each group are
+    retrieved from Graphite using as few render requests as possible. The
+    maximum values needed to evaluate percentage expressions are looked up
+    in bulk.
+
+    """
+    by_period = defaultdict(list)
+    for evaluator in evaluators:
+        by_period[evaluator.period].append(evaluator)
+
+    for period, group in iteritems(by_period):
+        start = "-{0}".format(interval_to_graphite(period))
+        data = get_metric_data_by_target(
+            [evaluator.target for evaluator in group], start=start, end='now')
+        for evaluator in group:
+            evaluator.set_values(
+                calculate_averages(data.get(evaluator.target, [])))
+
+    maximums = get_metric_maximums(
+        metric for evaluator in evaluators for metric in evaluator.result)
+    for evaluator in evaluators:
+        evaluator.maximums = maximums
+
+
 class InvalidExpressionError(Exception):
     """Invalid threshold match expression"""
     pass
@@ -378,9 +378,12 @@ class MibRetriever(object):
                     value = self.nodes[object_name].to_python(value)
                 defer.returnValue(value)
 
-    def retrieve_column(self, column_name):
+    def retrieve_column(self, column_name, max_repetitions=None):
         """Retrieve the contents of a single MIB table column.
 
+        :param max_repetitions: An optional GETBULK max-repetitions value to
+                                use instead of the agent proxy's default.
+
         Returns a deferred whose result is a dictionary:
 
           { row_index: column_value }
@@ -418,16 +421,26 @@ class MibRetriever(object):
                                  failure.getErrorMessage())
             return {}  # alternative is to retry or raise a Timeout exception
 
-        deferred = self.agent_proxy.getTable([str(node.oid)])
+        kwargs = {}
+        if max_repetitions:
+            kwargs['maxRepetitions'] = max_repetitions
+        deferred = self.agent_proxy.getTable([str(node.oid)], **kwargs)
         deferred.addCallbacks(_result_formatter, _valueerror_handler)
         return deferred
 
-    def retrieve_columns(self, column_names):
+    def retrieve_columns(self, column_names, max_repetitions=None):
         """Retrieve a set of table columns.
 
         The table columns may come from different tables, as long as
         the table rows are indexed the same way.
 
+        If the agent proxy allows concurrent walks (see the
+        max-concurrent-walks option of ipdevpoll.conf), the columns are walked
+        concurrently, otherwise they are walked one after the other.
+
+        :param max_repetitions: An optional GETBULK max-repetitions value to
+                                use instead of the agent proxy's default.
+
         Returns a deferred whose result is a dictionary:
 
           { row_index: MibTableResultRow instance }
@@ -435,10 +448,9 @@ class MibRetriever(object):
         """
         def _sortkey(col):
             return self.nodes[col].oid
-        columns = iter(sorted(column_names, key=_sortkey))
+        columns = sorted(column_names, key=_sortkey)
 
         final_result = {}
-        my_deferred = defer.Deferred()
 
         def _result_aggregate(result, column):
             for row_index, value in result.items():
@@ -448,6 +460,20 @@ class MibRetriever(object):
                 final_result[row_index][column] = value
             return True
 
+        column_kwargs = {}
+        if max_repetitions:
+            column_kwargs['max_repetitions'] = max_repetitions
+
+        semaphore = getattr(self.agent_proxy, 'walk_semaphore', None)
+        if (isinstance(semaphore, defer.DeferredSemaphore)
+                and semaphore.limit > 1 and len(columns) > 1):
+            return self._retrieve_columns_concurrently(
+                columns, semaphore, _result_aggregate, final_result,
+                **column_kwargs)
+
+        columns = iter(columns)
+        my_deferred = defer.Deferred()
+
         # schedule the next iteration (i.e. collect next column)
         def _schedule_next(_result=None):
             try:
@@ -455,7 +481,7 @@ class MibRetriever(object):
             except StopIteration:
                 my_deferred.callback(final_result)
                 return
-            deferred = self.retrieve_column(column)
+            deferred = self.retrieve_column(column, **column_kwargs)
             deferred.addCallback(_result_aggregate, column)
             deferred.addCallback(_schedule_next)
             deferred.addErrback(my_deferred.errback)
@@ -463,6 +489,33 @@ class MibRetriever(object):
         reactor.callLater(0, _schedule_next)
         return my_deferred
 
+    def _retrieve_columns_concurrently(self, columns, semaphore, aggregate,
+                                       final_result, **column_kwargs):
+        """Walks multiple columns concurrently, limited by semaphore.
+
+        :param aggregate: A callable that will be called with each column's
+                          result and name, as the results arrive.
+        :param column_kwargs: Extra keyword arguments for retrieve_column().
+        :returns: A deferred whose result is final_result, once all columns
+                  have been aggregated.
+
+        """
+        def _unwrap_first_error(failure):
+            failure.trap(defer.FirstError)
+            return failure.value.subFailure
+
+        deferreds = []
+        for column in columns:
+            deferred = semaphore.run(self.retrieve_column, column,
+                                     **column_kwargs)
+            deferred.addCallback(aggregate, column)
+            deferreds.append(deferred)
+
+        all_done = defer.gatherResults(deferreds, consumeErrors=True)
+        all_done.addCallbacks(lambda _result: final_result,
+                              _unwrap_first_error)
+        return all_done
+
     def retrieve_table(self, table_name):
         """Table retriever and formatter.
 
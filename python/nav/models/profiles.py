@@ -1438,6 +1438,17 @@ class NetmapViewNodePosition(models.Model):
         db_table = u'netmap_view_nodeposition'
 
 
+class NetmapTopology(models.Model):
+    """A Netmap topology graph of a layer, precomputed by navtopology"""
+    layer = models.IntegerField(primary_key=True)
+    version = VarcharField()
+    data = DictAsJsonField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        db_table = u'netmap_topology'
+
+
 @python_2_unicode_compatible
 class AccountTool(models.Model):
     """Link between tool and account"""
@@ -0,0 +1,5 @@
+-- Notify the eventEngine when VLAN topology changes, so that it can refresh
+-- its cached VLAN graphs
+CREATE OR REPLACE RULE swportvlan_insert_notify AS ON INSERT TO swportvlan DO ALSO NOTIFY topology_changed;
+CREATE OR REPLACE RULE swportvlan_update_notify AS ON UPDATE TO swportvlan DO ALSO NOTIFY topology_changed;
+CREATE OR REPLACE RULE swportvlan_delete_notify AS ON DELETE TO swportvlan DO ALSO NOTIFY topology_changed;
@@ -0,0 +1,7 @@
+-- Netmap topologies precomputed by navtopology, for the web interface to serve
+CREATE TABLE profiles.netmap_topology (
+  layer INTEGER PRIMARY KEY,
+  version VARCHAR NOT NULL,
+  data VARCHAR NOT NULL,
+  updated TIMESTAMP NOT NULL DEFAULT NOW()
+);
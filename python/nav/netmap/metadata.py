@@ -162,6 +162,7 @@ class Group(object):
                     ipdevinfo_link = None
 
             json['interface'] = {
+                'id': getattr(self.interface, 'id', None),
                 'ifname': six.text_type(self.interface.ifname),
                 'ipdevinfo_link': ipdevinfo_link}
 
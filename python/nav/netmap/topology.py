@@ -23,7 +23,7 @@ from django.utils import six
 
 from nav.models.manage import SwPortVlan
 from nav.netmap.metadata import edge_metadata_layer3, edge_metadata_layer2
-from nav.netmap.traffic import get_traffic_data, Traffic
+from nav.netmap.traffic import get_traffic_data, get_traffic_snapshot, Traffic
 
 
 _logger = logging.getLogger(__name__)
@@ -108,10 +108,12 @@ def build_netmap_layer2_graph(topology_without_metadata, vlan_by_interface,
         "build_netmap_layer2_graph() graph reduced.Port_pair metadata attached")
 
     empty_traffic = Traffic()
+    traffic_cache = get_traffic_snapshot() if load_traffic else None
     for source, target, metadata_dict in netmap_graph.edges(data=True):
         for interface_a, interface_b in metadata_dict.get('port_pairs'):
             traffic = get_traffic_data(
-                (interface_a, interface_b)) if load_traffic else empty_traffic
+                (interface_a, interface_b),
+                traffic_cache) if load_traffic else empty_traffic
             additional_metadata = edge_metadata_layer2((source, target),
                                                        interface_a,
                                                        interface_b,
@@ -179,10 +181,11 @@ def build_netmap_layer3_graph(topology_without_metadata, load_traffic=False,
     _logger.debug("build_netmap_layer3_graph() graph copy with metadata done")
 
     empty_traffic = Traffic()
+    traffic_cache = get_traffic_snapshot() if load_traffic else None
     for u, v, metadata_dict in graph.edges.data():
         for gwpp_u, gwpp_v in metadata_dict.get('gwportprefix_pairs'):
             traffic = get_traffic_data(
-                (gwpp_u.interface, gwpp_v.interface)
+                (gwpp_u.interface, gwpp_v.interface), traffic_cache
             ) if load_traffic else empty_traffic
             additional_metadata = edge_metadata_layer3((u, v),
                                                        gwpp_u, gwpp_v,
@@ -207,17 +210,21 @@ def _attach_node_positions(graph, node_set):
     :param node_set NetmapViewNodePosition collection for a given map view
     """
 
+    positions = {}
+    for position in node_set:
+        positions.setdefault(position.netbox_id, position)
+
     # node is a tuple(netbox, networkx_graph_node_meta_dict)
     # Traversing our generated graph which misses node positions..
     for node, metadata in graph.nodes(data=True):
         # Find node metadata in saved map view if it has any.
-        node_meta_dict = [x for x in node_set if x.netbox == node]
+        position = positions.get(getattr(node, 'pk', None))
 
         # Attached position meta data if map view has meta data on node in graph
-        if node_meta_dict:
+        if position is not None:
             if 'metadata' in metadata:
                 # has vlan meta data, need to just update position data
-                metadata['metadata'].update({'position': node_meta_dict[0]})
+                metadata['metadata'].update({'position': position})
             else:
-                metadata['metadata'] = {'position': node_meta_dict[0]}
+                metadata['metadata'] = {'position': position}
     return graph
@@ -15,21 +15,30 @@
 #
 """Functions for attaching traffic metadata to netmap"""
 import logging
+import time
 from collections import defaultdict
 
+from django.db.models import Q
 from django.utils.six import iteritems
 
 from nav.metrics.data import get_metric_average
 from nav.metrics.graphs import get_metric_meta
 from nav.metrics.templates import metric_path_for_interface
 from nav.models.manage import Interface
-from nav.util import chunks
+from nav.web.netmap.cache import (
+    TRAFFIC_CACHE_TIMEOUT,
+    get_cached_traffic_snapshot,
+    set_cached_traffic_snapshot,
+    claim_traffic_snapshot_refresh,
+    release_traffic_snapshot_refresh,
+)
 from nav.web.netmap.common import get_traffic_rgb, get_traffic_load_in_percent
 
 TRAFFIC_TIMEPERIOD = '-15min'
 INOCTETS = 'ifInOctets'
 OUTOCTETS = 'ifOutOctets'
-MAX_TARGETS_PER_REQUEST = 500
+# Net types of the prefixes whose router ports are drawn as layer 3 links
+LINK_NET_TYPES = ('link', 'elink', 'core')
 
 _logger = logging.getLogger(__name__)
 
@@ -90,7 +99,8 @@ class Traffic(object):
 
 
 def get_traffic_for(interfaces):
-    """Get traffic average for the given interfaces using one request
+    """Get traffic average for the given interfaces using as few requests as
+    possible
 
     :param QueryDict interfaces: interfaces to fetch data for
     :returns: A dict of {interface: { suffix: value, suffix: value}}
@@ -114,15 +124,9 @@ def get_traffic_for(interfaces):
 
     targets = [transform.format(id=m) for m in _merge_metrics(sorted(metrics))]
 
-    _logger.debug(
-        "getting data for %d targets in chunks of %d",
-        len(targets),
-        MAX_TARGETS_PER_REQUEST,
-    )
-
-    data = {}
-    for request in chunks(targets, MAX_TARGETS_PER_REQUEST):
-        data.update(get_metric_average(request, start=TRAFFIC_TIMEPERIOD))
+    # get_metric_average batches the targets into concurrent requests
+    _logger.debug("getting data for %d targets", len(targets))
+    data = get_metric_average(targets, start=TRAFFIC_TIMEPERIOD)
 
     _logger.debug("received %d metrics in response", len(data))
 
@@ -190,6 +194,108 @@ def get_traffic_data(port_pair, cache=None):
     return traffic
 
 
+class TrafficSnapshot(object):
+    """A snapshot of the traffic averages of all interfaces that can be drawn
+    as links in Netmap, taken once per collection interval.
+
+    A snapshot can be used as the cache argument to get_traffic_data().
+    """
+
+    def __init__(self, traffic=None, timestamp=None):
+        """
+        :param traffic: A dict of {interface_id: {suffix: value, ...}}
+        :param timestamp: The time the snapshot was taken, defaults to now.
+        """
+        self.traffic = traffic or {}
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __repr__(self):
+        return "<TrafficSnapshot interfaces={0} timestamp={1!r}>".format(
+            len(self.traffic), self.timestamp)
+
+    def __len__(self):
+        return len(self.traffic)
+
+    def __contains__(self, interface):
+        return getattr(interface, 'pk', interface) in self.traffic
+
+    def __getitem__(self, interface):
+        return self.traffic.get(getattr(interface, 'pk', interface), {})
+
+    def is_stale(self, max_age=TRAFFIC_CACHE_TIMEOUT):
+        """Returns True if this snapshot is older than max_age seconds"""
+        return time.time() - self.timestamp > max_age
+
+    def diff(self, other):
+        """Returns the changes from another snapshot to this one.
+
+        :param other: A previous TrafficSnapshot, or None.
+        :returns: A dict of {interface_id: {suffix: value, ...}} for every
+                  interface whose traffic data differs from the other
+                  snapshot. Interfaces missing from this snapshot map to None.
+        """
+        previous = other.traffic if other is not None else {}
+        changes = {ifc_id: data for ifc_id, data in iteritems(self.traffic)
+                   if previous.get(ifc_id) != data}
+        changes.update({ifc_id: None for ifc_id in previous
+                        if ifc_id not in self.traffic})
+        return changes
+
+
+def get_traffic_snapshot():
+    """Returns the current site-wide traffic snapshot.
+
+    The snapshot is shared between all processes through the Django cache, and
+    is only rebuilt once per collection interval. While one process rebuilds a
+    stale snapshot, the others will keep serving the stale one.
+
+    :rtype: TrafficSnapshot
+    """
+    snapshot = get_cached_traffic_snapshot()
+    if snapshot is not None and not snapshot.is_stale():
+        return snapshot
+
+    if not claim_traffic_snapshot_refresh() and snapshot is not None:
+        return snapshot
+    try:
+        snapshot = build_traffic_snapshot()
+        set_cached_traffic_snapshot(snapshot)
+    finally:
+        release_traffic_snapshot_refresh()
+    return snapshot
+
+
+def build_traffic_snapshot(interfaces=None):
+    """Builds a new traffic snapshot from Graphite.
+
+    :param interfaces: The interfaces to include, defaults to
+                       get_link_interfaces()
+    :rtype: TrafficSnapshot
+    """
+    if interfaces is None:
+        interfaces = get_link_interfaces()
+    start = time.time()
+    traffic = get_traffic_for(interfaces)
+    snapshot = TrafficSnapshot({interface.pk: data
+                                for interface, data in iteritems(traffic)})
+    _logger.debug("built traffic snapshot of %d interfaces in %.2f seconds",
+                  len(snapshot), time.time() - start)
+    return snapshot
+
+
+def get_link_interfaces():
+    """Returns all interfaces that can be drawn as links in Netmap, along with
+    the interfaces that layer 2 links point to, in case the traffic data is
+    only available from the far side of a link.
+    """
+    return Interface.objects.filter(
+        Q(to_netbox__isnull=False) |
+        Q(connected_to_interface__isnull=False) |
+        Q(gwportprefix__prefix__vlan__net_type__in=LINK_NET_TYPES,
+          netbox__category__in=('GW', 'GSW'))
+    ).select_related('netbox').distinct()
+
+
 def _fetch_data(interface, cache=None):
     in_bps = out_bps = speed = None
     if isinstance(interface, Interface):
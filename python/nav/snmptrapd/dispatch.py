@@ -0,0 +1,260 @@
+#
+# Copyright (C) 2018 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Dispatching of received traps to handler modules in worker processes.
+
+The trap listener only puts received traps on bounded queues, so that it
+never has to wait for the database. Each process in a pool of workers takes
+traps off its own queue in batches, and offers them to the handler modules.
+All traps from the same agent are put on the same queue, so that they are
+handled in the order they were received.
+
+Handler modules must provide a ``handleTrap(trap, config)`` function. They may
+also provide a ``handleTraps(traps, config)`` function, which is given a whole
+batch of traps at once, and returns a list telling whether each of them was
+accepted. This lets a handler write the results of a whole batch to the
+database at once.
+
+"""
+import logging
+import multiprocessing
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from django.db import connections
+
+import nav.db
+from nav.metrics.carbon import send_metrics
+from nav.metrics.templates import metric_path_for_snmptrapd
+
+_logger = logging.getLogger(__name__)
+_traplogger = logging.getLogger('nav.snmptrapd.traplog')
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 10000
+# The maximum number of traps a worker takes off the queue at a time
+BATCH_SIZE = 100
+# Seconds between each report of the queue statistics to Graphite
+METRIC_INTERVAL = 60
+
+
+class TrapDispatcher(object):
+    """Dispatches traps to handler modules, in a pool of worker processes"""
+
+    def __init__(self, handlermodules, config, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.handlermodules = handlermodules
+        self.config = config
+        self.workers = workers
+        self.received = 0
+        self.dropped = 0
+        context = _get_fork_context()
+        self._context = context
+        queue_count = max(workers, 1)
+        self._queues = [context.Queue(max(queue_size // queue_count, 1))
+                        for _ in range(queue_count)]
+        self._handled = context.Value('L', 0)
+        self._processes = []
+
+    def start(self):
+        """Starts the worker processes, and a thread that reports the queue
+        statistics to Graphite and replaces any dead worker.
+        """
+        # Database connections must not be shared with forked processes
+        nav.db.reset_connections()
+        connections.close_all()
+        self._processes = [self._start_worker(index)
+                           for index in range(self.workers)]
+
+        monitor = threading.Thread(target=self._monitor, name='trapmonitor')
+        monitor.daemon = True
+        monitor.start()
+
+    def _start_worker(self, index):
+        process = self._context.Process(target=self._work,
+                                        args=(self._queues[index],),
+                                        name='snmptrapd-worker-%d' % index)
+        process.daemon = True
+        process.start()
+        _logger.debug("started worker process %s", process.pid)
+        return process
+
+    def dispatch(self, trap):
+        """Queues a trap for handling by the worker responsible for its
+        agent. The trap is dropped if that worker's queue is full.
+        """
+        self.received += 1
+        trap_queue = self._queues[hash(trap.agent) % len(self._queues)]
+        try:
+            trap_queue.put_nowait(trap)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                _logger.warning("trap queue is full, %d traps dropped so far",
+                                self.dropped)
+
+    @property
+    def handled(self):
+        """The number of traps handled by the worker processes"""
+        return self._handled.value
+
+    def get_queue_depth(self):
+        """Returns the number of traps waiting to be handled"""
+        try:
+            return sum(trap_queue.qsize() for trap_queue in self._queues)
+        except NotImplementedError:
+            return None
+
+    def report_metrics(self, timestamp=None):
+        """Sends the queue depth and the trap counters to Graphite"""
+        timestamp = timestamp or time.time()
+        metrics = [
+            (metric_path_for_snmptrapd('received'), (timestamp, self.received)),
+            (metric_path_for_snmptrapd('dropped'), (timestamp, self.dropped)),
+            (metric_path_for_snmptrapd('handled'), (timestamp, self.handled)),
+        ]
+        depth = self.get_queue_depth()
+        if depth is not None:
+            metrics.append((metric_path_for_snmptrapd('queue'),
+                            (timestamp, depth)))
+        send_metrics(metrics)
+
+    def _monitor(self):
+        while True:
+            time.sleep(METRIC_INTERVAL)
+            try:
+                self.report_metrics()
+            except Exception:
+                _logger.debug("failed to send trap statistics", exc_info=True)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    _logger.error("worker process %s died, restarting it",
+                                  process.pid)
+                    self._processes[index] = self._start_worker(index)
+
+    def _work(self, trap_queue):
+        while True:
+            traps = get_batch(trap_queue, BATCH_SIZE)
+            try:
+                handle_traps(traps, self.handlermodules, self.config)
+            except Exception:
+                _logger.exception("Unhandled exception when handling traps")
+            with self._handled.get_lock():
+                self._handled.value += len(traps)
+
+
+def get_batch(trap_queue, size):
+    """Waits for a trap on the queue, and returns it along with any other
+    traps already waiting, up to a total of size traps.
+    """
+    traps = [trap_queue.get()]
+    while len(traps) < size:
+        try:
+            traps.append(trap_queue.get_nowait())
+        except queue.Empty:
+            break
+    return traps
+
+
+def handle_traps(traps, handlermodules, config):
+    """Offers a batch of traps to each handler module in turn.
+
+    :type traps: list of nav.snmptrapd.trap.SNMPTrap
+
+    """
+    for trap in traps:
+        _traplogger.debug("%s", trap)
+    connection = nav.db.getConnection('default')
+    handled_by = [[] for _trap in traps]
+
+    for mod in handlermodules:
+        _logger.debug("Offering %d traps to %s", len(traps), mod)
+        try:
+            if hasattr(mod, 'handleTraps'):
+                accepted = mod.handleTraps(traps, config=config)
+            else:
+                accepted = [_offer_trap(mod, trap, config) for trap in traps]
+        except Exception as why:
+            _logger.exception(
+                "Unhandled exception when handling %d traps with %s: %s",
+                len(traps),
+                mod.__name__,
+                why,
+            )
+            accepted = []
+        for index, trap_accepted in enumerate(accepted):
+            if trap_accepted:
+                handled_by[index].append(mod.__name__)
+        # Assuming that the handler used the same connection as this
+        # function, we rollback any uncommitted changes.  This is to
+        # avoid idling in transactions.
+        connection.rollback()
+
+    for trap, modules in zip(traps, handled_by):
+        _log_trap_handle_result(modules, trap)
+
+
+def _offer_trap(mod, trap, config):
+    try:
+        accepted = mod.handleTrap(trap, config=config)
+        _logger.debug(
+            "Module %s %s trap (%s)",
+            mod.__name__,
+            'accepted' if accepted else 'ignored',
+            id(trap),
+        )
+        return accepted
+    except Exception as why:
+        _logger.exception(
+            "Unhandled exception when handling trap (%s) with %s: %s",
+            id(trap),
+            mod.__name__,
+            why,
+        )
+        return False
+
+
+def _log_trap_handle_result(handled_by, trap):
+    agent_string = (
+        trap.netbox.sysname + ' ({})'.format(trap.agent)
+        if trap.netbox else trap.agent
+    )
+    if handled_by:
+        _logger.info(
+            "v%s trap received from %s, handled by %s",
+            trap.version,
+            agent_string,
+            handled_by,
+        )
+    else:
+        _logger.info(
+            "v%s trap received from %s, no handlers wanted it: %s",
+            trap.version,
+            agent_string,
+            trap.snmpTrapOID,
+        )
+
+
+def _get_fork_context():
+    """Returns a multiprocessing context that forks its worker processes, so
+    they inherit the loaded handler modules.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing  # Python 2 always forks
@@ -21,7 +21,7 @@ import logging
 import nav.errors
 
 from nav.db import getConnection
-from nav.event import Event
+from nav.event import Event, EventQ
 
 _logger = logging.getLogger('nav.snmptrapd.linkupdown')
 
@@ -32,33 +32,63 @@ LINKUP = ".1.3.6.1.6.3.1.1.5.4"
 
 def handleTrap(trap, config=None):
     """Handles LINKUP/LINKDOWN traps, discarding anything else"""
+    return handleTraps([trap], config)[0]
 
-    if trap.snmpTrapOID not in (LINKDOWN, LINKUP):
-        return False
 
-    _logger.debug("Module linkupdown got trap %s %s",
-                  trap.snmpTrapOID, trap.genericType)
+def handleTraps(traps, config=None):
+    """Handles a batch of traps, discarding anything but LINKUP/LINKDOWN.
 
-    ifindex = get_ifindex_from_trap(trap, config)
-    if not trap.netbox:
-        _logger.error("Could not find agent %s in database", trap.agent)
-        return False
-    (interfaceid, deviceid, modulename, ifname,
-     ifalias) = get_interface_details(trap.netbox.netboxid, ifindex)
-    if not interfaceid:
-        _logger.error(
-            "Ignoring link trap from %s. Could not identify interface with ifindex=%s.",
-            trap.netbox.sysname,
-            ifindex,
-        )
-        return False
+    The interfaces of all the traps are looked up in a single query, and all
+    their events are posted in a single transaction.
+
+    :returns: A list of booleans, telling whether each trap was accepted.
+
+    """
+    accepted = [False] * len(traps)
+    links = []
+    for index, trap in enumerate(traps):
+        if trap.snmpTrapOID not in (LINKDOWN, LINKUP):
+            continue
+        _logger.debug("Module linkupdown got trap %s %s",
+                      trap.snmpTrapOID, trap.genericType)
+        if not trap.netbox:
+            _logger.error("Could not find agent %s in database", trap.agent)
+            continue
+        ifindex = get_ifindex_from_trap(trap, config)
+        links.append((index, trap, ifindex))
+    if not links:
+        return accepted
+
+    details = get_interfaces_details(
+        (trap.netbox.netboxid, ifindex) for _index, trap, ifindex in links)
+
+    posted = []
+    events = []
+    for index, trap, ifindex in links:
+        key = (trap.netbox.netboxid, _to_int(ifindex))
+        if key not in details:
+            _logger.error(
+                "Ignoring link trap from %s. Could not identify interface "
+                "with ifindex=%s.",
+                trap.netbox.sysname,
+                ifindex,
+            )
+            continue
+        interfaceid, deviceid, modulename, ifname, ifalias = details[key]
+        down = trap.snmpTrapOID == LINKDOWN
+        event = make_link_event(down, trap.netbox.netboxid, deviceid,
+                                interfaceid, modulename, ifname, ifalias)
+        events.append(event)
+        posted.append((index, trap, down, ifname, ifalias))
+
+    try:
+        EventQ.post_events(events)
+    except nav.errors.GeneralException:
+        _logger.exception("Unexpected exception while posting events")
+        return accepted
 
-    # Check for traptype, post event on queue
-    down = trap.snmpTrapOID == LINKDOWN
-    success = post_link_event(down,
-                              trap.netbox.netboxid, deviceid, interfaceid,
-                              modulename, ifname, ifalias)
-    if success:
+    for index, trap, down, ifname, ifalias in posted:
+        accepted[index] = True
         _logger.info(
             "Interface %s (%s) on %s is %s.",
             ifname,
@@ -66,7 +96,7 @@ def handleTrap(trap, config=None):
             trap.netbox.sysname,
             'down' if down else 'up',
         )
-    return success
+    return accepted
 
 
 def get_ifindex_from_trap(trap, config):
@@ -80,33 +110,58 @@ def get_ifindex_from_trap(trap, config):
 
 def get_interface_details(netboxid, ifindex):
     """Get interfaceid, deviceid, modulename, ifname, ifalias for interface"""
+    details = get_interfaces_details([(netboxid, ifindex)])
+    return details.get((netboxid, _to_int(ifindex)),
+                       (None, None, None, None, None))
+
+
+def get_interfaces_details(keys):
+    """Gets interfaceid, deviceid, modulename, ifname, ifalias for multiple
+    interfaces in a single query.
+
+    :param keys: An iterable of (netboxid, ifindex) tuples.
+    :returns: A dict of {(netboxid, ifindex): details}.
+
+    """
+    keys = set((netboxid, _to_int(ifindex)) for netboxid, ifindex in keys)
+    keys = tuple(key for key in keys if key[1] is not None)
+    if not keys:
+        return {}
     idquery = """SELECT
+                   netbox.netboxid, interface.ifindex,
                    interfaceid, module.deviceid,
                    module.name AS modulename,
                    interface.ifname, interface.ifalias
                  FROM netbox
                  JOIN interface USING (netboxid)
                  LEFT JOIN module USING (moduleid)
-                 WHERE netbox.netboxid=%s AND ifindex = %s"""
+                 WHERE (netbox.netboxid, ifindex) IN %s"""
     _logger.debug(idquery)
     cursor = getConnection('default').cursor()
     try:
-        cursor.execute(idquery, (netboxid, ifindex))
+        cursor.execute(idquery, (keys,))
     except nav.db.driver.ProgrammingError:
         _logger.exception("Unexpected error when querying database")
-    else:
-        if cursor.rowcount > 0:
-            return cursor.fetchone()
-        else:
+        return {}
+
+    details = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+    for netboxid, ifindex in keys:
+        if (netboxid, ifindex) not in details:
             _logger.debug('Could not find ifindex %s on %s',
                           ifindex, netboxid)
+    return details
 
-    return (None, None, None, None, None)
 
+def _to_int(ifindex):
+    try:
+        return int(ifindex)
+    except (TypeError, ValueError):
+        return None
 
-def post_link_event(down, netboxid, deviceid, interfaceid, modulename, ifname,
-                    ifalias):
-    """Posts a linkState event on the event qeueue"""
+
+def make_link_event(down, netboxid, deviceid, interfaceid, modulename,
+                    ifname, ifalias):
+    """Makes a linkState event"""
     state = 's' if down else 'e'
 
     event = Event(source="snmptrapd", target="eventEngine",
@@ -117,7 +172,14 @@ def post_link_event(down, netboxid, deviceid, interfaceid, modulename, ifname,
     event['module'] = modulename or ''
     event['interface'] = ifname or ''
     event['ifalias'] = ifalias or ''
+    return event
+
 
+def post_link_event(down, netboxid, deviceid, interfaceid, modulename, ifname,
+                    ifalias):
+    """Posts a linkState event on the event qeueue"""
+    event = make_link_event(down, netboxid, deviceid, interfaceid, modulename,
+                            ifname, ifalias)
     try:
         event.post()
     except nav.errors.GeneralException:
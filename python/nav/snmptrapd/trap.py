@@ -16,16 +16,64 @@
 """Trap related data structures."""
 import string
 import logging
+import time
 from collections import namedtuple
 
+from IPy import IP
+
 from nav.db import getConnection
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_AGENT_REFRESH_INTERVAL = 60
 
 AgentNetbox = namedtuple('Agent', 'netboxid sysname roomid')
 
 
+class AgentMap(object):
+    """A map of IP addresses to NAV-monitored devices.
+
+    The entire map is loaded from the database, and reloaded when it is more
+    than refresh_interval seconds old, so that looking up the agent of a trap
+    never costs a database query of its own.
+
+    """
+    def __init__(self, refresh_interval=DEFAULT_AGENT_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._netboxes = {}
+        self._loaded = None
+
+    def get(self, address):
+        """Returns the AgentNetbox with the given IP address, or None if NAV
+        doesn't monitor it.
+        """
+        if (self._loaded is None or
+                time.time() - self._loaded > self.refresh_interval):
+            self.refresh()
+        return self._netboxes.get(_normalize_address(address))
+
+    def refresh(self):
+        """Reloads the map from the database"""
+        cursor = getConnection('snmptrapd').cursor()
+        cursor.execute("SELECT ip, netboxid, sysname, roomid FROM netbox")
+        self._netboxes = {
+            _normalize_address(ip): AgentNetbox(netboxid, sysname, roomid)
+            for ip, netboxid, sysname, roomid in cursor.fetchall()
+        }
+        self._loaded = time.time()
+        _logger.debug("loaded %d trap agents", len(self._netboxes))
+
+
+def _normalize_address(address):
+    try:
+        return IP(address).strCompressed()
+    except ValueError:
+        return address
+
+
+agents = AgentMap()
+
+
 class SNMPTrap(object):
     """Represents an SNMP trap or notification, in a structure agnostic to
     SNMP v1 and v2c differences.
@@ -52,20 +100,12 @@ class SNMPTrap(object):
 
     def _lookup_agent(self):
         """Attempts to look up the corresponding netbox of this trap"""
-        conn = getConnection('snmptrapd')
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT netboxid, sysname, roomid FROM netbox WHERE ip = %s",
-            (self.agent,),
-        )
-
-        if cur.rowcount < 1:
+        netbox = agents.get(self.agent)
+        if netbox is None:
             _logger.warning(
                 "Unable to match trap agent %s to a NAV-monitored device",
                 self.agent)
-            return None
-
-        return AgentNetbox(*cur.fetchone())
+        return netbox
 
     @property
     def netbox(self):
@@ -19,6 +19,7 @@ import time
 import logging
 
 from django.utils import six
+from twisted.internet import defer
 
 from nav.statemon import config, RunQueue, db, statistics, event
 
@@ -101,12 +102,18 @@ class AbstractChecker(object):
 
     def run(self):
         """
-        Calls execute_test(). If the status has changed it schedules a new
-        test. If the service has been unavailable for more than self.runcount
-        times, it marks the service as down.
+        Calls execute_test() and handles its result.
         """
         orig_version = self.version
         status, info = self.execute_test()
+        self.handle_result(status, info, orig_version)
+
+    def handle_result(self, status, info, orig_version):
+        """
+        Handles the result of a test. If the status has changed it schedules a
+        new test. If the service has been unavailable for more than
+        self.runcount times, it marks the service as down.
+        """
         service = "%s:%s" % (self.sysname, self.get_type())
         _logger.info("%-20s -> %s", service, info)
 
@@ -197,6 +204,42 @@ class AbstractChecker(object):
         """Executes the actual service test implemented by a plugin"""
         raise NotImplementedError
 
+    def execute_test_async(self):
+        """
+        Executes and times the test asynchronously, like execute_test().
+
+        :returns: A Deferred whose result is a (status, info) tuple, or None
+                  if this checker has no asynchronous implementation of its
+                  test.
+        """
+        start = time.time()
+        try:
+            deferred = self.execute_async()
+        except Exception as error:  # pylint: disable=broad-except
+            deferred = defer.fail(error)
+        if deferred is None:
+            return None
+
+        def _failed(failure):
+            return event.Event.DOWN, str(failure.value)
+
+        def _timed(result):
+            self.response_time = time.time() - start
+            return result
+
+        return deferred.addErrback(_failed).addCallback(_timed)
+
+    def execute_async(self):
+        """Executes the actual service test without blocking, if the plugin
+        implements it.
+
+        Implementations must never take longer than self.timeout seconds.
+
+        :returns: A Deferred whose result is a (status, info) tuple, or None
+                  to have the blocking execute() run in a thread instead.
+        """
+        return None
+
     @property
     def sysname(self):
         """Returns the sysname of which this service is running on.
@@ -20,9 +20,14 @@ import socket
 import dns.exception
 import dns.message
 import dns.query
+import dns.rcode
+from twisted.internet import defer
 
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon.protocols import query_udp, CheckTimeout
+
+DNS_PORT = 53
 
 
 class DnsChecker(AbstractChecker):
@@ -80,11 +85,62 @@ class DnsChecker(AbstractChecker):
             except dns.exception.Timeout:
                 pass
 
-            if not error and answer == 1:
-                return Event.UP, "Ok"
-            elif not error and answer == 0:
-                return Event.UP, "No record found, request=%s" % request
-            elif error and not timeout:
-                return Event.DOWN, "Other error while requesting %s" % request
+            return self._result(request, error, timeout, answer)
+
+    def execute_async(self):
+        request = self.args.get("request", "").strip()
+        if not request:
+            return defer.succeed(
+                (Event.UP, "Argument request must be supplied"))
+        return self._query_async(request)
+
+    @defer.inlineCallbacks
+    def _query_async(self, request):
+        ip, _port = self.get_address()
+        query = dns.message.make_query(request, "ANY")
+        version_query = dns.message.make_query("version.bind", rdclass="CH",
+                                               rdtype='txt')
+        # The version query is sent in parallel, as it will time out on
+        # servers that don't answer it
+        version_reply = query_udp((ip, DNS_PORT), version_query.to_wire(),
+                                  self.timeout)
+        version_reply.addErrback(lambda failure: None)
+
+        timeout = error = False
+        answer = ""
+        try:
+            reply = dns.message.from_wire(
+                (yield query_udp((ip, DNS_PORT), query.to_wire(),
+                                 self.timeout)))
+        except CheckTimeout:
+            timeout = error = True
+        except Exception:  # pylint: disable=broad-except
+            error = True
+        else:
+            if reply.rcode() != dns.rcode.NOERROR:
+                error = True
             else:
-                return Event.DOWN, "Timeout while requesting %s" % request
+                answer = 1 if reply.answer else 0
+
+        wire = yield version_reply
+        try:
+            response = dns.message.from_wire(wire) if wire else None
+        except dns.exception.DNSException:
+            response = None
+        if (response is not None and
+                response.rcode() == dns.rcode.NOERROR and
+                len(response.answer) > 1):
+            self.version = response.answer[0][0]
+
+        defer.returnValue(self._result(request, error, timeout, answer))
+
+    @staticmethod
+    def _result(request, error, timeout, answer):
+        if not error and answer == 1:
+            return Event.UP, "Ok"
+        elif not error and answer == 0:
+            return Event.UP, "No record found, request=%s" % request
+        elif error and not timeout:
+            return Event.DOWN, "Other error while requesting %s" % request
+        else:
+            return Event.DOWN, "Timeout while requesting %s" % request
@@ -14,15 +14,18 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """HTTP Service Checker"""
+import base64
 import contextlib
 import socket
 
 from django.utils.six.moves.urllib.parse import urlsplit
 from django.utils.six.moves import http_client
+from twisted.internet import defer
 
 from nav import buildconf
 from nav.statemon.event import Event
 from nav.statemon.abstractchecker import AbstractChecker
+from nav.statemon.protocols import connect_lines
 
 
 class HTTPConnection(http_client.HTTPConnection):
@@ -49,6 +52,7 @@ class HttpChecker(AbstractChecker):
         ('timeout', ''),
     )
     PORT = 80
+    TLS = False
 
     def __init__(self, service, **kwargs):
         AbstractChecker.__init__(self, service, port=0, **kwargs)
@@ -80,13 +84,61 @@ class HttpChecker(AbstractChecker):
                 i.putheader("Authorization", "Basic %s" % auth.encode("base64"))
             i.endheaders()
             response = i.getresponse()
-            if 200 <= response.status < 400 or (response.status == 401 and not username):
-                status = Event.UP
-                version = response.getheader('SERVER')
-                self.version = version
-                info = 'OK (%s) %s' % (str(response.status), version)
-            else:
-                status = Event.DOWN
-                info = 'ERROR (%s) %s' % (str(response.status), url)
-
-            return status, info
+            return self._parse_response(response.status,
+                                        response.getheader('SERVER'))
+
+    def execute_async(self):
+        return self._request_async()
+
+    @defer.inlineCallbacks
+    def _request_async(self):
+        ip, port = self.get_address()
+        url = self.args.get('url', '') or '/'
+        username = self.args.get('username')
+        password = self.args.get('password', '')
+        _protocol, vhost, path, query, _fragment = urlsplit(url)
+        if '?' in url:
+            path = path + '?' + query
+        port = port or self.PORT
+        host = vhost or (
+            ('[%s]' % ip if ':' in ip else ip) +
+            (':%s' % port if port != self.PORT else ''))
+
+        conn = yield connect_lines((ip, port), self.timeout, tls=self.TLS)
+        try:
+            conn.send_line('GET %s HTTP/1.0' % (path or '/'))
+            conn.send_line('Host: %s' % host)
+            conn.send_line('User-Agent: NAV/servicemon; version %s' %
+                           buildconf.VERSION)
+            if username:
+                auth = base64.b64encode(
+                    ("%s:%s" % (username, password)).encode('utf-8'))
+                conn.send_line('Authorization: Basic %s' %
+                               auth.decode('ascii'))
+            conn.send_line('')
+
+            status_line = yield conn.read_line()
+            try:
+                status = int(status_line.split()[1])
+            except (IndexError, ValueError):
+                defer.returnValue(
+                    (Event.DOWN, 'Invalid HTTP response: %s' % status_line))
+            server = None
+            header = yield conn.read_line()
+            while header:
+                name, _sep, value = header.partition(':')
+                if name.strip().lower() == 'server':
+                    server = value.strip()
+                header = yield conn.read_line()
+        finally:
+            conn.close()
+        defer.returnValue(self._parse_response(status, server))
+
+    def _parse_response(self, status, server):
+        url = self.args.get('url', '') or '/'
+        username = self.args.get('username')
+        if 200 <= status < 400 or (status == 401 and not username):
+            self.version = server
+            return Event.UP, 'OK (%s) %s' % (str(status), server)
+        else:
+            return Event.DOWN, 'ERROR (%s) %s' % (str(status), url)
@@ -22,6 +22,7 @@ from ssl import wrap_socket
 from django.utils.six.moves import http_client
 
 from nav.statemon.checker.HttpChecker import HttpChecker
+from nav.statemon.protocols import TLS_AVAILABLE
 
 
 class HTTPSConnection(http_client.HTTPSConnection):
@@ -40,6 +41,12 @@ class HTTPSConnection(http_client.HTTPSConnection):
 class HttpsChecker(HttpChecker):
     """HTTPS"""
     PORT = 443
+    TLS = True
 
     def connect(self, ip, port):
         return HTTPSConnection(self.timeout, ip, port)
+
+    def execute_async(self):
+        if not TLS_AVAILABLE:
+            return None
+        return super(HttpsChecker, self).execute_async()
@@ -19,8 +19,11 @@ import contextlib
 import socket
 import imaplib
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon.protocols import connect_lines
 
 
 # pylint: disable=R0904
@@ -67,14 +70,38 @@ class ImapChecker(AbstractChecker):
             if user:
                 session.login(user, passwd)
                 session.logout()
-            version = ''
-            ver = ver.split(' ')
-            if len(ver) >= 2:
-                for i in ver[2:]:
-                    if i != "at":
-                        version += "%s " % i
-                    else:
-                        break
-            self.version = version
+            self.version = self._parse_welcome(ver)
+
+            return Event.UP, self.version
+
+    def execute_async(self):
+        if self.args.get("username", ""):
+            return None  # logging in is left to the blocking implementation
+        return self._check_welcome()
+
+    @defer.inlineCallbacks
+    def _check_welcome(self):
+        conn = yield connect_lines(self.get_address(), self.timeout)
+        try:
+            welcome = yield conn.read_line()
+            if not welcome.startswith('* OK'):
+                defer.returnValue((Event.DOWN, welcome))
+            conn.send_line('a001 LOGOUT')
+        finally:
+            conn.close()
+        self.version = self._parse_welcome(welcome)
+        defer.returnValue((Event.UP, self.version))
 
-            return Event.UP, version
+    @staticmethod
+    def _parse_welcome(welcome):
+        if isinstance(welcome, bytes):
+            welcome = welcome.decode('utf-8', 'replace')
+        version = ''
+        ver = welcome.split(' ')
+        if len(ver) >= 2:
+            for i in ver[2:]:
+                if i != "at":
+                    version += "%s " % i
+                else:
+                    break
+        return version
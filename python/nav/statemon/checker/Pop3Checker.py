@@ -17,8 +17,11 @@
 import socket
 import poplib
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon.protocols import connect_lines
 
 
 class Pop3Checker(AbstractChecker):
@@ -48,19 +51,43 @@ class Pop3Checker(AbstractChecker):
                 conn.user(user)
                 conn.pass_(passwd)
                 len(conn.list()[1])
-            version = ''
-            ver = ver.split(' ')
-            if len(ver) >= 1:
-                for i in ver[1:]:
-                    if i != "server":
-                        version += "%s " % i
-                    else:
-                        break
-            self.version = version
+            self.version = self._parse_welcome(ver)
         finally:
             conn.quit()
 
-        return Event.UP, version
+        return Event.UP, self.version
+
+    def execute_async(self):
+        if self.args.get("username", ""):
+            return None  # logging in is left to the blocking implementation
+        return self._check_welcome()
+
+    @defer.inlineCallbacks
+    def _check_welcome(self):
+        conn = yield connect_lines(self.get_address(), self.timeout)
+        try:
+            welcome = yield conn.read_line()
+            if not welcome.startswith('+OK'):
+                defer.returnValue((Event.DOWN, welcome))
+            conn.send_line('QUIT')
+        finally:
+            conn.close()
+        self.version = self._parse_welcome(welcome)
+        defer.returnValue((Event.UP, self.version))
+
+    @staticmethod
+    def _parse_welcome(welcome):
+        if isinstance(welcome, bytes):
+            welcome = welcome.decode('utf-8', 'replace')
+        version = ''
+        ver = welcome.split(' ')
+        if len(ver) >= 1:
+            for i in ver[1:]:
+                if i != "server":
+                    version += "%s " % i
+                else:
+                    break
+        return version
 
 
 class PopConnection(poplib.POP3):
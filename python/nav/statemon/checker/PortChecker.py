@@ -17,8 +17,11 @@
 import select
 import socket
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon.protocols import connect_lines, CheckTimeout
 
 
 class PortChecker(AbstractChecker):
@@ -43,3 +46,14 @@ class PortChecker(AbstractChecker):
         sock.close()
 
         return status, txt
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        conn = yield connect_lines(self.get_address(), self.timeout)
+        try:
+            yield conn.read_line()
+        except CheckTimeout:
+            pass  # the port is alive, even if it never says anything
+        finally:
+            conn.close()
+        defer.returnValue((Event.UP, 'Alive'))
@@ -18,8 +18,11 @@ import re
 import socket
 import smtplib
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon.protocols import connect_lines
 
 
 class SmtpChecker(AbstractChecker):
@@ -45,6 +48,19 @@ class SmtpChecker(AbstractChecker):
             smtp.quit()
         except smtplib.SMTPException:
             pass
+        return self._parse_greeting(code, msg)
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        conn = yield connect_lines(self.get_address(), self.timeout)
+        try:
+            code, msg = yield read_reply(conn)
+            conn.send_line('QUIT')
+        finally:
+            conn.close()
+        defer.returnValue(self._parse_greeting(code, msg))
+
+    def _parse_greeting(self, code, msg):
         if code != 220:
             return Event.DOWN, msg
         try:
@@ -58,6 +74,26 @@ class SmtpChecker(AbstractChecker):
         return Event.UP, msg
 
 
+@defer.inlineCallbacks
+def read_reply(conn):
+    """Reads a possibly multi-line SMTP reply from a LineConnection.
+
+    :returns: A Deferred whose result is a (code, message) tuple, like
+              smtplib.SMTP.getreply()
+    """
+    lines = []
+    while True:
+        line = yield conn.read_line()
+        lines.append(line[4:].strip())
+        if line[3:4] != '-':
+            break
+    try:
+        code = int(line[:3])
+    except ValueError:
+        code = -1
+    defer.returnValue((code, '\n'.join(lines)))
+
+
 # pylint: disable=R0904
 class SMTP(smtplib.SMTP):
     """A customized SMTP protocol interface"""
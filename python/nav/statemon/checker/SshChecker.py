@@ -18,8 +18,11 @@
 
 import socket
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon.protocols import connect_lines
 
 
 class SshChecker(AbstractChecker):
@@ -55,3 +58,19 @@ class SshChecker(AbstractChecker):
                 pass  # sock was never created
         self.version = version
         return Event.UP, version
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        conn = yield connect_lines(self.get_address(), self.timeout)
+        try:
+            version = (yield conn.read_line()).strip()
+            protocol, major = version.split('-')[:2]
+            conn.send("%s-%s-%s" % (protocol, major, "NAV_Servicemon"))
+        except Exception as err:
+            defer.returnValue((Event.DOWN,
+                               "Failed to send version reply to %s: %s" % (
+                                   self.get_address(), str(err))))
+        finally:
+            conn.close()
+        self.version = version
+        defer.returnValue((Event.UP, version))
@@ -30,13 +30,20 @@ except ImportError:
 import time
 import atexit
 from collections import defaultdict
+import json
 import logging
+import os
+import sys
 
 import psycopg2
 from psycopg2.errorcodes import IN_FAILED_SQL_TRANSACTION
 from psycopg2.errorcodes import lookup as pg_err_lookup
+from psycopg2.extras import execute_values
 
+from nav import buildconf
 from nav.db import get_connection_string
+from nav.metrics.carbon import send_metrics
+from nav.metrics.templates import metric_path_for_statemon_event_queue
 from nav.util import synchronized
 
 from . import checkermap
@@ -58,6 +65,23 @@ class DbError(Exception):
     """Generic database error"""
 
 
+# Errors that indicate that the database is unavailable, as opposed to
+# errors caused by the data that was written
+_CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+# Events are collected for at most this many seconds before they are written
+# to the database in a single transaction
+FLUSH_WINDOW = 1.0
+MAX_BATCH_SIZE = 1000
+# Seconds to wait before retrying when the database is unavailable. The delay
+# is doubled for every failed attempt, up to the max.
+MIN_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+# Seconds between each report of the event queue depth to Graphite
+QUEUE_METRIC_INTERVAL = 60
+
+
 _queryLock = threading.Lock()
 
 
@@ -71,6 +95,11 @@ class _DB(threading.Thread):
         self._hosts_to_ping = []
         self._checkers = []
         self.db = None
+        self.program = _get_program_name()
+        self.spool_file = os.path.join(
+            buildconf.localstatedir, '%s-eventq.json' % self.program)
+        self._pending = []
+        self._last_queue_report = 0
 
     def connect(self):
         """Connects to the NAV database"""
@@ -134,20 +163,114 @@ class _DB(threading.Thread):
         return cursor
 
     def run(self):
-        """Runs the event posting loop, popping events from the queue"""
+        """Runs the event posting loop, popping events from the queue and
+        writing them to the database in batches.
+
+        Events that cannot be written are kept in a spool file until the
+        database is available again, so they survive a restart.
+        """
         self.connect()
+        self._pending = self.load_spool()
+        retry_delay = MIN_RETRY_DELAY
         while 1:
-            event = self.queue.get()
-            _logger.debug("Got event: [%s]", event)
+            batch = self._pending + self.collect_events(
+                block=not self._pending)
+            self.report_queue_depth(len(batch))
+            if not batch:
+                continue
             try:
-                self.commit_event(event)
-                self.db.commit()
-            except Exception:
-                # If we fail to commit the event, place it
-                # back in our queue
-                _logger.debug("Failed to commit event, rescheduling...")
-                self.new_event(event)
-                time.sleep(5)
+                self.commit_events(batch)
+            except DbError as error:
+                # Some events may have been written before the failure
+                batch = getattr(error, 'unwritten', batch)
+                _logger.warning("Failed to commit %d events, retrying in %d "
+                                "seconds", len(batch), retry_delay)
+                self._pending = batch
+                self.save_spool(batch)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+            else:
+                if self._pending:
+                    _logger.info("Committed %d delayed events", len(batch))
+                    self.save_spool([])
+                self._pending = []
+                retry_delay = MIN_RETRY_DELAY
+
+    def collect_events(self, block=True):
+        """Collects events from the queue for up to FLUSH_WINDOW seconds after
+        the first one arrives, or until MAX_BATCH_SIZE events are collected.
+
+        :param block: Whether to wait for the first event. The wait is limited
+                      to QUEUE_METRIC_INTERVAL seconds, so the queue depth can
+                      be reported while idle.
+        """
+        events = []
+        try:
+            events.append(self.queue.get(block=block,
+                                         timeout=QUEUE_METRIC_INTERVAL))
+        except queue.Empty:
+            return events
+
+        deadline = time.time() + FLUSH_WINDOW
+        while len(events) < MAX_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _logger.debug("Collected %d events", len(events))
+        return events
+
+    def report_queue_depth(self, pending=0):
+        """Sends the number of events waiting to be written to Graphite, at
+        most once every QUEUE_METRIC_INTERVAL seconds.
+        """
+        now = time.time()
+        if now - self._last_queue_report < QUEUE_METRIC_INTERVAL:
+            return
+        self._last_queue_report = now
+        depth = self.queue.qsize() + pending
+        try:
+            send_metrics([(metric_path_for_statemon_event_queue(self.program),
+                           (now, depth))])
+        except Exception:
+            _logger.debug("Failed to send event queue depth", exc_info=True)
+
+    def load_spool(self):
+        """Loads events left unwritten by a previous database outage"""
+        try:
+            with open(self.spool_file) as spool:
+                events = [Event(**attrs) for attrs in json.load(spool)]
+        except (IOError, OSError):
+            return []
+        except (ValueError, TypeError):
+            _logger.error("Ignoring corrupt event spool file %s",
+                          self.spool_file)
+            return []
+        if events:
+            _logger.info("Loaded %d unwritten events from %s", len(events),
+                         self.spool_file)
+        return events
+
+    def save_spool(self, events):
+        """Saves unwritten events to the spool file, or removes the spool file
+        if there are none.
+        """
+        try:
+            if not events:
+                if os.path.exists(self.spool_file):
+                    os.unlink(self.spool_file)
+                return
+            tmpfile = self.spool_file + '.tmp'
+            with open(tmpfile, 'w') as spool:
+                json.dump([vars(event) for event in events], spool,
+                          default=str)
+            os.rename(tmpfile, self.spool_file)
+        except (IOError, OSError, TypeError, ValueError) as error:
+            _logger.error("Could not write event spool file %s: %s",
+                          self.spool_file, error)
 
     @synchronized(_queryLock)
     def query(self, statement, values=None, commit=1):
@@ -210,41 +333,89 @@ class _DB(threading.Thread):
         """Places a new event on the queue to be posted to the db"""
         self.queue.put(event)
 
-    def commit_event(self, event):
-        """Commits an event to the database event queue"""
-        if event.source not in ("serviceping", "pping"):
-            _logger.critical("Invalid source for event: %s", event.source)
-            return
-        if event.eventtype == "version":
-            statement = """UPDATE service SET version = %s
-                           WHERE serviceid = %s"""
-            self.execute(statement, (event.version, event.serviceid))
-            return
+    def commit_events(self, events):
+        """Commits a batch of events to the database event queue, in a single
+        transaction.
+
+        If the batch cannot be written for any other reason than the database
+        being unavailable, e.g. because it violates database integrity or
+        contains values that cannot be stored, its events are committed one
+        by one, throwing away the ones that fail.
 
-        if event.status == Event.UP:
-            value = 100
-            state = 'e'
-        elif event.status == Event.DOWN:
-            value = 1
-            state = 's'
-        else:
-            value = 1
-            state = 'x'
-
-        nextid = self.query("SELECT nextval('eventq_eventqid_seq')")[0][0]
-        statement = """INSERT INTO eventq
+        :raises: DbError if the database is unavailable. Its `unwritten`
+                 attribute lists the events that were not committed.
+        """
+        events = [event for event in events if _is_valid(event)]
+        try:
+            self._commit_events(events)
+        except DbError:
+            raise
+        except Exception:
+            _logger.critical("Failed to commit %d events, committing them "
+                             "one by one", len(events), exc_info=True)
+            for index, event in enumerate(events):
+                try:
+                    self._commit_events([event])
+                except DbError as error:
+                    error.unwritten = events[index:]
+                    raise
+                except Exception:
+                    _logger.critical("Throwing away event: %r", event,
+                                     exc_info=True)
+
+    @synchronized(_queryLock)
+    def _commit_events(self, events):
+        try:
+            cursor = self.cursor()
+        except Exception:
+            _logger.critical("Failed to commit %d events, no database "
+                             "connection", len(events), exc_info=True)
+            raise DbError()
+        try:
+            versions = [(event.version, event.serviceid) for event in events
+                        if event.eventtype == "version"]
+            states = [event for event in events
+                      if event.eventtype != "version"]
+            if versions:
+                cursor.executemany(
+                    """UPDATE service SET version = %s
+                       WHERE serviceid = %s""", versions)
+            if states:
+                cursor.execute(
+                    """SELECT nextval('eventq_eventqid_seq')
+                       FROM generate_series(1, %s)""", (len(states),))
+                ids = [row[0] for row in cursor.fetchall()]
+                execute_values(
+                    cursor,
+                    """INSERT INTO eventq
                        (eventqid, subid, netboxid, eventtypeid,
                         state, value, source, target)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
-        values = (nextid, event.serviceid, event.netboxid,
-                  event.eventtype, state, value, event.source, "eventEngine")
-        self.execute(statement, values)
+                       VALUES %s""",
+                    [(eventqid, event.serviceid, event.netboxid,
+                      event.eventtype) + _get_state_and_value(event) +
+                     (event.source, "eventEngine")
+                     for eventqid, event in zip(ids, states)])
+                execute_values(
+                    cursor,
+                    """INSERT INTO eventqvar (eventqid, var, val) VALUES %s""",
+                    [(eventqid, 'descr', event.info)
+                     for eventqid, event in zip(ids, states)])
+            self.db.commit()
+        except _CONNECTION_ERRORS:
+            _logger.critical("Failed to commit %d events", len(events),
+                             exc_info=True)
+            self._rollback()
+            raise DbError()
+        except Exception:
+            # The events themselves are at fault, let the caller sort them out
+            self._rollback()
+            raise
 
-        statement = """INSERT INTO eventqvar
-                       (eventqid, var, val) VALUES
-                       (%s, %s, %s)"""
-        values = (nextid, 'descr', event.info)
-        self.execute(statement, values)
+    def _rollback(self):
+        try:
+            self.db.rollback()
+        except Exception:
+            _logger.critical("Failed to rollback")
 
     def hosts_to_ping(self):
         """Returns a list of netboxes to ping, from the database"""
@@ -323,3 +494,25 @@ class _DB(threading.Thread):
             self._checkers += [new_checker]
         _logger.info("Returned %s checkers", len(self._checkers))
         return self._checkers
+
+
+def _is_valid(event):
+    if event.source not in ("serviceping", "pping"):
+        _logger.critical("Invalid source for event: %s", event.source)
+        return False
+    return True
+
+
+def _get_state_and_value(event):
+    if event.status == Event.UP:
+        return 'e', 100
+    elif event.status == Event.DOWN:
+        return 's', 1
+    else:
+        return 'x', 1
+
+
+def _get_program_name():
+    name = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else ''
+    name = os.path.splitext(name)[0]
+    return name or 'statemon'
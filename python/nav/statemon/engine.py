@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2018 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Asynchronous execution engine for service checkers"""
+import logging
+import time
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 500
+DEFAULT_MAX_THREADS = 20
+
+
+class CheckEngine(object):
+    """Runs service checkers on the Twisted reactor.
+
+    Checkers with an asynchronous implementation are run directly on the
+    reactor, at most max_concurrent at a time. All other checkers are run in
+    a pool of at most max_threads threads. A checker is never started while a
+    previous run of it is still in progress, so slow services cannot pile up
+    in the queue.
+
+    The engine implements the enq() method of RunQueue, which checkers use to
+    reschedule themselves.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                 max_threads=DEFAULT_MAX_THREADS, clock=reactor):
+        self._clock = clock
+        self._semaphore = defer.DeferredSemaphore(max_concurrent)
+        self._threadpool = ThreadPool(minthreads=0, maxthreads=max_threads,
+                                      name='servicemon')
+        self._active = set()
+
+    def start(self):
+        """Starts the thread pool used by blocking checkers"""
+        self._threadpool.start()
+
+    def stop(self):
+        """Stops the thread pool used by blocking checkers"""
+        self._threadpool.stop()
+
+    def enq(self, runnable):
+        """Runs a checker as soon as possible. It accepts a checker, or a
+        tuple containing (timestamp, checker). If given in the last form, the
+        checker will be run at the time given by timestamp.
+        """
+        if isinstance(runnable, tuple):
+            timestamp, checker = runnable
+            delay = max(0, timestamp - time.time())
+            self._clock.callLater(delay, self.run, checker)
+        else:
+            self.run(runnable)
+
+    def run(self, checker):
+        """Runs a checker and handles its result.
+
+        :returns: A Deferred that fires when the checker has finished.
+        """
+        if checker in self._active:
+            _logger.warning("%s:%s is still being checked, skipping",
+                            checker.sysname, checker.get_type())
+            return defer.succeed(None)
+
+        self._active.add(checker)
+        checker.runq = self
+        orig_version = checker.version
+        deferred = self._execute(checker)
+        deferred.addCallback(
+            lambda result: checker.handle_result(result[0], result[1],
+                                                 orig_version))
+        deferred.addErrback(self._log_failure, checker)
+        deferred.addBoth(self._finished, checker)
+        return deferred
+
+    @property
+    def active(self):
+        """The number of checkers currently running"""
+        return len(self._active)
+
+    @defer.inlineCallbacks
+    def _execute(self, checker):
+        yield self._semaphore.acquire()
+        try:
+            deferred = checker.execute_test_async()
+        except Exception:
+            self._semaphore.release()
+            raise
+
+        if deferred is None:
+            self._semaphore.release()
+            result = yield threads.deferToThreadPool(
+                reactor, self._threadpool, checker.execute_test)
+        else:
+            try:
+                result = yield deferred
+            finally:
+                self._semaphore.release()
+        defer.returnValue(result)
+
+    @staticmethod
+    def _log_failure(failure, checker):
+        _logger.error("%s:%s failed unexpectedly: %s", checker.sysname,
+                      checker.get_type(), failure.getTraceback())
+
+    def _finished(self, _result, checker):
+        self._active.discard(checker)
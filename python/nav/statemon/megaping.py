@@ -15,6 +15,9 @@
 #
 """Ping multiple hosts at once."""
 
+from array import array
+from collections import namedtuple
+import errno
 import threading
 import time
 import socket
@@ -23,6 +26,7 @@ import os
 import random
 import logging
 import hashlib
+import struct
 
 from nav.daemon import safesleep as sleep
 from nav.statemon import config
@@ -138,6 +142,43 @@ class Host(object):
             self.ip, self.packet.sequence)
 
 
+class TokenBucket(object):
+    """
+    Paces events to an average rate, while allowing bursts of up to a given
+    number of events. Sleeping once per burst rather than once per event
+    keeps the pacing accurate even with coarse sleep granularity.
+    """
+    def __init__(self, rate, burst=1, clock=time.time, sleeper=sleep):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._clock = clock
+        self._sleep = sleeper
+        self._last = clock()
+
+    def consume(self):
+        """Takes a single token from the bucket, sleeping until one is
+        available if the bucket is empty.
+        """
+        self._refill()
+        if self._tokens < 1:
+            # wait until there is room for a full burst
+            self._sleep((min(self.burst, self.rate) - self._tokens) /
+                        self.rate)
+            self._refill()
+        self._tokens -= 1
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+PingStats = namedtuple('PingStats', 'hosts sent send_rate replies '
+                                    'late_replies duration')
+
+
 class MegaPing(object):
     """
     Sends icmp echo to multiple hosts in parallell.
@@ -146,8 +187,12 @@ class MegaPing(object):
     pinger.set_hosts(['127.0.0.1','10.0.0.1'])
     timeUsed = pinger.ping()
     results = pinger.results()
+
+    The hosts of a round are kept in arrays, indexed by a number that is
+    embedded in the cookie of each echo request, along with a token that
+    identifies the round.
     """
-    _requests = _sender = _getter = _sender_finished = None
+    _sender = _getter = _sender_finished = None
 
     def __init__(self, sockets, conf=None):
 
@@ -163,8 +208,14 @@ class MegaPing(object):
 
         # Delay between each packet is transmitted
         self._delay = float(self._conf.get('delay', 2))/1000  # convert from ms
+        # Max number of packets sent back to back
+        self._burst = int(self._conf.get('burst', 50))
         # Timeout before considering hosts as down
         self._timeout = int(self._conf.get('timeout', 5))
+        # Sending must be finished in time for the timeout to expire before
+        # the next round should start
+        self._send_window = max(
+            1, int(self._conf.get('checkinterval', 60)) - self._timeout)
         # Dictionary with all the hosts, populated by set_hosts()
         self._hosts = {}
 
@@ -178,6 +229,16 @@ class MegaPing(object):
         # Global timing of the ppinger
         self._elapsedtime = 0
 
+        # Per-round state, see reset()
+        self._round_hosts = []
+        self._round_token = self._previous_token = None
+        self._sent = array('d')
+        self._replies = array('d')
+        self._sent_count = self._reply_count = 0
+        self._late_replies = 0
+        self._send_rate = 0.0
+        self.stats = None
+
         # Initialize the sockets
         if sockets is not None:
             self._sock6 = sockets[0]
@@ -191,6 +252,8 @@ class MegaPing(object):
             self._sock6 = sockets[0]
             self._sock4 = sockets[1]
             _logger.info("No sockets passed as argument, creating own")
+        for sock in (self._sock6, self._sock4):
+            sock.setblocking(False)
 
     def set_hosts(self, ips):
         """
@@ -211,11 +274,34 @@ class MegaPing(object):
         """
         Reset method to clear requests and responses
         """
-        self._requests = {}
-        for host in self._hosts.values():
-            host.reply = None
+        self._round_hosts = list(self._hosts.values())
+        count = len(self._round_hosts)
+        self._previous_token = self._round_token
+        self._round_token = os.urandom(ROUND_TOKEN_LENGTH)
+        self._sent = array('d', [0.0]) * count
+        self._replies = array('d', [-1.0]) * count
+        # each counter is only updated by one of the threads
+        self._sent_count = self._reply_count = 0
+        self._late_replies = 0
+        self._send_rate = 0.0
         self._sender_finished = 0
 
+    def get_send_rate(self):
+        """
+        Returns the number of requests to send per second. This is given by
+        the configured delay, but is increased if necessary to send requests
+        to all hosts within the check interval.
+        """
+        rate = 1 / self._delay if self._delay > 0 else float('inf')
+        required = len(self._round_hosts) / float(self._send_window)
+        if required > rate:
+            _logger.warning("Pinging %d hosts with a delay of %s ms would "
+                            "overrun the check interval, increasing the rate "
+                            "to %d requests/s", len(self._round_hosts),
+                            self._delay * 1000, required)
+            rate = required
+        return rate
+
     def ping(self):
         """
         Send icmp echo to all configured hosts. Returns the
@@ -232,37 +318,53 @@ class MegaPing(object):
         self._sender.start()
         self._getter.start()
         self._getter.join()
+        self.stats = PingStats(
+            hosts=len(self._round_hosts),
+            sent=self._sent_count,
+            send_rate=self._send_rate,
+            replies=self._reply_count,
+            late_replies=self._late_replies,
+            duration=self._elapsedtime,
+        )
         return self._elapsedtime
 
     def _send_requests(self):
-
-        # Get ip addresses to ping
-        hosts = self._hosts.values()
+        start = time.time()
+        rate = self.get_send_rate()
+        bucket = (TokenBucket(rate, self._burst)
+                  if rate != float('inf') else None)
 
         # Ping each host
-        for host in hosts:
-            host.time = time.time()
-            # create and save a request identifier
-            packet, cookie = host.make_packet(self._packetsize)
-            self._requests[cookie] = host
+        for index, host in enumerate(self._round_hosts):
+            if bucket:
+                bucket.consume()
+            # the cookie identifies both the round and the host index
+            cookie = self._round_token + struct.pack('!I', index)
+            packet, _cookie = host.make_packet(self._packetsize, cookie)
             host.next_seq()
 
+            address = (host.ip, 0, 0, 0) if host.is_v6() else (host.ip, 0)
+            sock = self._sock6 if host.is_v6() else self._sock4
+            self._sent[index] = host.time = time.time()
             try:
-                if not host.is_v6():
-                    self._sock4.sendto(packet, (host.ip, 0))
-                else:
-                    self._sock6.sendto(packet, (host.ip, 0, 0, 0))
+                _send(sock, packet, address, self._timeout)
             except Exception as error:
                 _logger.info("Failed to ping %s [%s]", host.ip, error)
+                self._sent[index] = 0.0
+            else:
+                self._sent_count += 1
 
-            sleep(self._delay)
         self._sender_finished = time.time()
+        elapsed = self._sender_finished - start
+        if elapsed > 0:
+            self._send_rate = len(self._round_hosts) / elapsed
 
     def _get_responses(self):
         start = time.time()
         timeout = self._timeout
 
-        while not self._sender_finished or self._requests:
+        while (not self._sender_finished or
+               self._reply_count < self._sent_count):
             if self._sender_finished:
                 runtime = time.time() - self._sender_finished
                 if runtime > self._timeout:
@@ -276,27 +378,17 @@ class MegaPing(object):
 
             # If data found
             if readable:
-                # okay to use time here, because select has told us
-                # there is data and we don't care to measure the time
-                # it takes the system to give us the packet.
-                arrival = time.time()
-
-                # Find out which socket got data and read
+                # Drain every queued packet from the readable sockets before
+                # going back to select()
                 for sock in readable:
-                    try:
-                        raw_pong, sender = sock.recvfrom(4096)
-                    except socket.error:
-                        _logger.critical("RealityError -2", exc_info=True)
-                        continue
-
                     is_ipv6 = sock == self._sock6
-                    self._process_response(raw_pong, sender, is_ipv6, arrival)
+                    for raw_pong, sender, arrival in _receive_all(sock):
+                        self._process_response(raw_pong, sender, is_ipv6,
+                                               arrival)
             elif self._sender_finished:
                 break
 
         # Everything else timed out
-        for host in self._requests.values():
-            host.reply = None
         end = time.time()
         self._elapsedtime = end - start
 
@@ -321,23 +413,30 @@ class MegaPing(object):
                           "packet: %r)", sender, self._pid, pong, raw_pong)
             return
 
-        cookie = pong.data[:Host.COOKIE_LENGTH]
+        token = pong.data[:ROUND_TOKEN_LENGTH]
+        if token != self._round_token:
+            if token == self._previous_token:
+                self._late_replies += 1
+            _logger.debug("packet from %r does not match any outstanding "
+                          "request: %r (raw packet: %r)",
+                          sender, pong, raw_pong)
+            return
 
-        # Find the host with this cookie
         try:
-            host = self._requests[cookie]
-        except KeyError:
-            _logger.debug("packet from %r does not match any outstanding "
-                          "request: %r (raw packet: %r cookie: %r)",
-                          sender, pong, raw_pong, cookie)
+            index, = struct.unpack(
+                '!I', pong.data[ROUND_TOKEN_LENGTH:Host.COOKIE_LENGTH])
+            sent = self._sent[index]
+        except (struct.error, IndexError):
             return
+        if not sent or self._replies[index] >= 0:
+            return  # duplicate or bogus reply
 
-        # Delete the entry of the host who has replied and add the pingtime
-        pingtime = arrival - host.time
-        host.reply = pingtime
+        # Record the reply time of the host who has replied
+        pingtime = arrival - sent
+        self._replies[index] = pingtime
+        self._reply_count += 1
         _logger.debug("Response from %-16s in %03.3f ms",
                       sender, pingtime*1000)
-        del self._requests[cookie]
 
     def results(self):
         """
@@ -345,5 +444,42 @@ class MegaPing(object):
         (ip, roundtriptime) for all hosts.
         Unreachable hosts will have roundtriptime = -1
         """
-        return [(host.ip, host.reply if host.reply else -1)
-                for host in self._hosts.values()]
+        return [(host.ip, rtt if rtt > 0 else -1)
+                for host, rtt in zip(self._round_hosts, self._replies)]
+
+
+# The remaining bytes of a cookie are used for the host index
+ROUND_TOKEN_LENGTH = Host.COOKIE_LENGTH - 4
+
+
+def _send(sock, packet, address, timeout):
+    """Sends a packet on a non-blocking socket, waiting for at most timeout
+    seconds for the socket to become writable if its buffer is full.
+    """
+    try:
+        sock.sendto(packet, address)
+    except socket.error as error:
+        if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+            raise
+        select.select([], [sock], [], timeout)
+        sock.sendto(packet, address)
+
+
+def _receive_all(sock):
+    """Reads every packet that is currently queued on a non-blocking socket.
+
+    :returns: A list of (packet, sender, arrival time) tuples.
+    """
+    packets = []
+    while True:
+        try:
+            raw_pong, sender = sock.recvfrom(4096)
+        except socket.error as error:
+            if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _logger.critical("RealityError -2", exc_info=True)
+            break
+        # okay to use time here, because select has told us there is data
+        # and we don't care to measure the time it takes the system to give
+        # us the packet.
+        packets.append((raw_pong, sender, time.time()))
+    return packets
@@ -0,0 +1,207 @@
+#
+# Copyright (C) 2018 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Non-blocking network primitives for service checkers.
+
+Every conversation started through this module is bounded by a deadline, so
+that a check never takes longer than its timeout, regardless of how many
+round trips it makes.
+"""
+from collections import deque
+
+from IPy import IP
+from twisted.internet import defer, error, protocol, reactor
+from twisted.protocols.basic import LineOnlyReceiver
+
+try:
+    from twisted.internet import ssl
+except ImportError:  # twisted.internet.ssl requires pyOpenSSL
+    ssl = None
+
+TLS_AVAILABLE = ssl is not None
+
+
+class CheckTimeout(Exception):
+    """Raised when a conversation exceeds its deadline"""
+
+    def __init__(self, timeout):
+        super(CheckTimeout, self).__init__(
+            "Timed out after {0} seconds".format(timeout))
+
+
+class LineConnection(LineOnlyReceiver):
+    """A line based client connection, whose received lines can be read one
+    at a time.
+    """
+    delimiter = b'\n'
+    MAX_LENGTH = 65536
+
+    def __init__(self):
+        self._lines = deque()
+        self._waiting = deque()
+        self._reason = None
+        self._deadline = None
+
+    def connectionMade(self):
+        self.factory.connection_made(self)
+
+    def lineReceived(self, line):
+        line = line.rstrip(b'\r').decode('utf-8', 'replace')
+        if self._waiting:
+            self._waiting.popleft().callback(line)
+        else:
+            self._lines.append(line)
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        if self._reason is None:
+            self._reason = reason
+        while self._waiting:
+            self._waiting.popleft().errback(self._reason)
+        self.factory.connection_lost()
+
+    def read_line(self):
+        """Reads the next line from the server.
+
+        :returns: A Deferred whose result is the line as a text string,
+                  without its line terminator.
+        """
+        if self._lines:
+            return defer.succeed(self._lines.popleft())
+        if self._reason is not None:
+            return defer.fail(self._reason)
+        deferred = defer.Deferred()
+        self._waiting.append(deferred)
+        return deferred
+
+    def send_line(self, line):
+        """Sends a text line to the server, terminated by CRLF"""
+        self.transport.write(line.encode('utf-8') + b'\r\n')
+
+    def send(self, data):
+        """Sends a text string to the server, as is"""
+        self.transport.write(data.encode('utf-8'))
+
+    def close(self):
+        """Closes the connection"""
+        self.transport.loseConnection()
+
+    def expire(self, timeout):
+        """Aborts the connection due to a timeout"""
+        self._reason = CheckTimeout(timeout)
+        self.transport.abortConnection()
+
+
+class _LineConnectionFactory(protocol.ClientFactory):
+    protocol = LineConnection
+
+    def __init__(self, timeout):
+        self.deferred = defer.Deferred()
+        self.connector = None
+        self.connection = None
+        self.timeout = timeout
+        self._deadline = reactor.callLater(timeout, self._expire)
+
+    def connection_made(self, connection):
+        self.connection = connection
+        self.deferred.callback(connection)
+
+    def connection_lost(self):
+        if self._deadline.active():
+            self._deadline.cancel()
+
+    def clientConnectionFailed(self, connector, reason):
+        if self._deadline.active():
+            self._deadline.cancel()
+        if not self.deferred.called:
+            self.deferred.errback(reason)
+
+    def _expire(self):
+        if self.connection is not None:
+            self.connection.expire(self.timeout)
+        elif not self.deferred.called:
+            try:
+                self.connector.stopConnecting()
+            except error.NotConnectingError:
+                pass
+            if not self.deferred.called:
+                self.deferred.errback(CheckTimeout(self.timeout))
+
+
+def connect_lines(address, timeout, tls=False):
+    """Connects to a TCP service for a line based conversation.
+
+    :param address: An (ip, port) tuple.
+    :param timeout: The number of seconds the entire conversation may last,
+                    including the connection attempt. The connection is
+                    aborted when the time is up.
+    :param tls: Whether to run the conversation over TLS. Requires
+                TLS_AVAILABLE. Server certificates are not verified.
+    :returns: A Deferred whose result is a connected LineConnection.
+    """
+    host, port = address
+    factory = _LineConnectionFactory(timeout)
+    if tls:
+        factory.connector = reactor.connectSSL(
+            host, port, factory, ssl.CertificateOptions(), timeout=timeout)
+    else:
+        factory.connector = reactor.connectTCP(host, port, factory,
+                                               timeout=timeout)
+    return factory.deferred
+
+
+class _DatagramQuery(protocol.DatagramProtocol):
+    def __init__(self, address, payload):
+        self.address = address
+        self.payload = payload
+        self.deferred = defer.Deferred()
+
+    def startProtocol(self):
+        self.transport.connect(*self.address)
+        self.transport.write(self.payload)
+
+    def datagramReceived(self, datagram, addr):
+        if not self.deferred.called:
+            self.deferred.callback(datagram)
+
+    def connectionRefused(self):
+        if not self.deferred.called:
+            self.deferred.errback(error.ConnectionRefusedError())
+
+
+def query_udp(address, payload, timeout):
+    """Sends a single UDP datagram and waits for the first reply.
+
+    :param address: An (ip, port) tuple.
+    :param payload: The datagram to send, as a byte string.
+    :param timeout: The number of seconds to wait for a reply.
+    :returns: A Deferred whose result is the reply datagram.
+    """
+    query = _DatagramQuery(address, payload)
+    interface = '::' if IP(address[0]).version() == 6 else ''
+    port = reactor.listenUDP(0, query, interface=interface)
+
+    def _expire():
+        if not query.deferred.called:
+            query.deferred.errback(CheckTimeout(timeout))
+
+    deadline = reactor.callLater(timeout, _expire)
+
+    def _cleanup(result):
+        if deadline.active():
+            deadline.cancel()
+        port.stopListening()
+        return result
+
+    return query.deferred.addBoth(_cleanup)
@@ -49,6 +49,31 @@ def update(sysname, timestamp, status, responsetime, serviceid=None,
                     service handler.
 
     """
+    send_metrics(_make_metrics(sysname, timestamp, status, responsetime,
+                               serviceid, handler))
+
+
+def update_many(updates, timestamp=None):
+    """Sends metric updates for multiple devices to graphite at once, packing
+    them into as few packets as possible.
+
+    :param updates: An iterable of (sysname, status, responsetime) tuples,
+                    with the same meaning as the arguments to update().
+    :param timestamp: Timestamp of the measurements. If None, the current
+                      time will be used.
+
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    metrics = []
+    for sysname, status, responsetime in updates:
+        metrics.extend(_make_metrics(sysname, timestamp, status, responsetime))
+    if metrics:
+        send_metrics(metrics)
+
+
+def _make_metrics(sysname, timestamp, status, responsetime, serviceid=None,
+                  handler=""):
     if serviceid:
         status_name = metric_path_for_service_availability(
             sysname, handler, serviceid)
@@ -61,8 +86,7 @@ def update(sysname, timestamp, status, responsetime, serviceid=None,
     if timestamp is None or timestamp == 'N':
         timestamp = time.time()
 
-    metrics = [
+    return [
         (status_name, (timestamp, 0 if status == event.Event.UP else 1)),
         (response_name, (timestamp, responsetime))
     ]
-    send_metrics(metrics)
@@ -32,6 +32,7 @@ from nav.models.manage import Netbox, Interface, Sensor
 from nav.models.thresholds import ThresholdRule
 from nav.models.event import EventQueue as Event, AlertHistory
 from nav.metrics.lookup import lookup
+from nav.metrics.thresholds import prefetch_values
 
 LOG_FILE = 'thresholdmon.log'
 
@@ -69,22 +70,53 @@ def scan():
     alerts = get_unresolved_threshold_alerts()
 
     _logger.info("evaluating %d rules", len(rules))
+    evaluators = prefetch_evaluators(rules)
     for rule in rules:
-        evaluate_rule(rule, alerts)
+        evaluate_rule(rule, alerts, evaluators.get(rule.id))
     _logger.info("done")
 
 
 # pylint: disable=W0703
-def evaluate_rule(rule, alerts):
+def prefetch_evaluators(rules):
+    """
+    Makes evaluators for a list of rules and retrieves their values in bulk.
+
+    :returns: A dict of {rule_id: evaluator} items. If values could not be
+              retrieved in bulk, an empty dict is returned, and each rule
+              will need to be evaluated separately.
+    """
+    evaluators = {}
+    for rule in rules:
+        try:
+            evaluators[rule.id] = rule.get_evaluator()
+        except Exception:
+            _logger.exception("Unhandled exception while creating evaluator "
+                              "for rule: %r", rule)
+    try:
+        prefetch_values(list(evaluators.values()))
+    except Exception:
+        _logger.exception("Unhandled exception while getting values for all "
+                          "rules, falling back to evaluating them one by one")
+        return {}
+    return evaluators
+
+
+# pylint: disable=W0703
+def evaluate_rule(rule, alerts, evaluator=None):
     """
     Evaluates the current status of a single rule and posts events if
     necessary.
+
+    :param evaluator: An evaluator for rule whose values have already been
+                      retrieved. If None, a new one will be made.
     """
     _logger.debug("evaluating rule %r", rule)
 
-    evaluator = rule.get_evaluator()
     try:
-        if not evaluator.get_values():
+        if evaluator is None:
+            evaluator = rule.get_evaluator()
+            evaluator.get_values()
+        if not evaluator.result:
             _logger.warning(
                 "did not find any matching values for rule %r %s",
                 rule.target, rule.alert
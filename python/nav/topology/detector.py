@@ -65,9 +65,13 @@ def main():
             vlans = [int(v) for v in options.include_vlans]
         else:
             vlans = []
-        do_vlan_detection(vlans)
+        do_vlan_detection(vlans, options.processes)
         delete_unused_prefixes()
         delete_unused_vlans()
+    if options.l2 or options.vlan:
+        notify_topology_changed()
+    if options.l2 or options.vlan or options.netmap:
+        do_netmap_precomputation()
 
 
 def int_list(value):
@@ -86,9 +90,15 @@ def make_option_parser():
                         help="Detect physical topology")
     parser.add_argument("--vlan", action="store_true",
                         help="Detect vlan subtopologies")
+    parser.add_argument("--netmap", action="store_true",
+                        help="Only precompute Netmap topology data (this is "
+                             "also done after --l2 and --vlan)")
     parser.add_argument("-i", dest="include_vlans", type=int_list,
                         metavar="vlan[,...]",
                         help="Only analyze the VLANs included in this list")
+    parser.add_argument("-p", "--processes", type=int, metavar="N",
+                        help="Number of processes to analyze vlan "
+                             "subtopologies in (default: number of CPUs)")
     parser.add_argument("-s", "--stderr", action="store_true",
                         help="Log to stderr (even if not a tty)")
     return parser
@@ -123,8 +133,8 @@ def do_layer2_detection():
 
 
 @with_exception_logging
-def do_vlan_detection(vlans):
-    analyzer = VlanGraphAnalyzer()
+def do_vlan_detection(vlans, processes=None):
+    analyzer = VlanGraphAnalyzer(processes=processes)
     if vlans:
         analyzer.analyze_vlans_by_id(vlans)
     else:
@@ -134,6 +144,29 @@ def do_vlan_detection(vlans):
     update()
 
 
+@with_exception_logging
+def notify_topology_changed():
+    """Notifies listening processes, such as eventengine, that the topology
+    may have changed.
+
+    """
+    cursor = django.db.connection.cursor()
+    cursor.execute("NOTIFY topology_changed")
+
+
+@with_exception_logging
+def do_netmap_precomputation():
+    """Precomputes the Netmap topology graphs, so that web requests don't
+    need to build them.
+
+    """
+    from nav.web.netmap.graph import precompute_topologies
+    rebuilt = precompute_topologies()
+    if rebuilt:
+        _logger.info("Netmap topology rebuilt for layer(s) %s",
+                     ", ".join(str(layer) for layer in rebuilt))
+
+
 @with_exception_logging
 def delete_unused_vlans():
     """Deletes vlans unassociated with prefixes or switch ports"""
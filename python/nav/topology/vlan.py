@@ -18,6 +18,7 @@
 from collections import defaultdict
 from itertools import groupby, chain
 import logging
+import multiprocessing
 from operator import attrgetter
 
 import networkx as nx
@@ -25,7 +26,7 @@ from IPy import IP
 
 from django.utils import six
 from django.db.models import Q
-from django.db import transaction
+from django.db import connections, transaction
 
 from nav.models.manage import (GwPortPrefix, Interface, SwPortVlan,
                                SwPortBlocked, Prefix, Vlan)
@@ -35,16 +36,29 @@ from nav.netmap import stubs
 _logger = logging.getLogger(__name__)
 NO_TRUNK = Q(trunk=False) | Q(trunk__isnull=True)
 
+# The analyzer shared with forked worker processes
+_shared_analyzer = None
+
 
 class VlanGraphAnalyzer(object):
     """Analyzes VLAN topologies as a subset of the layer 2 topology"""
-    def __init__(self):
+    def __init__(self, processes=None):
+        """Initializes a VLAN graph analyzer.
+
+        :param processes: The number of worker processes to analyze VLANs in.
+                          Defaults to the number of CPUs.
+
+        """
+        self.processes = processes or _cpu_count()
         self.routed_vlans = self._build_vlan_router_dict()
         self.unrouted_vlans = self._build_unrouted_vlan_seed_dict()
-        self.layer2 = build_layer2_graph()
+        self.layer2 = build_layer2_graph(related_extra=('swportallowedvlan',))
         self.stp_blocked = get_stp_blocked_ports()
         _logger.debug("blocked ports: %r", self.stp_blocked)
+        self.non_trunk_ports = get_non_trunk_ports()
         self.ifc_vlan_map = {}
+        self._interfaces = None
+        self._groups = []
 
     @staticmethod
     def _build_vlan_router_dict():
@@ -62,23 +76,107 @@ class VlanGraphAnalyzer(object):
         return dict((addr.prefix.vlan, addr) for addr in reversed(addrs))
 
     def _build_unrouted_vlan_seed_dict(self):
-        return {x for x in Vlan.objects.filter(prefix__isnull=True,
-                                               netbox__isnull=False).iterator()}
+        return {x for x in Vlan.objects.filter(
+            prefix__isnull=True, netbox__isnull=False).select_related(
+                'netbox').iterator()}
 
     def analyze_all(self):
-        """Analyze all VLAN topologies"""
-        for vlan in sorted(self.routed_vlans, key=lambda x: x.vlan):
-            _logger.debug("Analyzing routed VLAN %s", vlan)
-            self.analyze_vlan(vlan)
-        while self.unrouted_vlans:
-            vlan = min(self.unrouted_vlans, key=_unrouted_vlan_sort)
-            self.unrouted_vlans.remove(vlan)
-            if vlan.netbox not in self.layer2:
-                continue
-            _logger.debug("Analyzing unrouted VLAN %s", vlan)
-            self.analyze_vlan(vlan)
+        """Analyze all VLAN topologies.
+
+        The VLANs are analyzed in a pool of worker processes. The workers are
+        forked after the layer 2 graph has been loaded, so they all share it
+        with this process.
+
+        Unrouted VLAN candidates are pruned by the topologies of VLANs with
+        the same tag, so each group of candidates with the same tag is
+        analyzed in order by a single worker, after all routed VLANs.
+
+        """
+        routed = sorted(self.routed_vlans, key=lambda x: x.vlan)
+        _logger.debug("Analyzing %d routed VLANs", len(routed))
+        covered = set()
+        for vlan, topology in self._analyze_groups([[v] for v in routed]):
+            self._integrate_vlan_topology(vlan, topology)
+            covered.update((vlan.vlan, ifc.netbox_id) for ifc in topology)
+
+        candidates = sorted(
+            (vlan for vlan in self.unrouted_vlans
+             if vlan.netbox in self.layer2 and
+             (vlan.vlan, vlan.netbox_id) not in covered),
+            key=lambda x: (_unrouted_vlan_sort(x), x.pk))
+        groups = [list(group) for _tag, group
+                  in groupby(candidates, attrgetter('vlan'))]
+        _logger.debug("Analyzing %d unrouted VLAN candidates in %d groups",
+                      len(candidates), len(groups))
+        for vlan, topology in self._analyze_groups(groups):
+            self._integrate_vlan_topology(vlan, topology)
+        self.unrouted_vlans = set()
         return self.ifc_vlan_map
 
+    def _analyze_groups(self, groups):
+        """Analyzes groups of VLANs, in parallel if possible.
+
+        Only group indexes are sent to the worker processes, and only
+        interface ids are sent back, to be mapped to this process' Interface
+        objects.
+
+        :returns: A list of (vlan, topology) tuples.
+        """
+        if self.processes < 2 or len(groups) < 2:
+            return [result for group in groups
+                    for result in self._analyze_group(group)]
+
+        global _shared_analyzer
+        _shared_analyzer = self
+        self._groups = groups
+        # Database connections must not be shared with forked processes
+        connections.close_all()
+        pool = _get_fork_context().Pool(min(self.processes, len(groups)))
+        try:
+            chunksize = max(1, len(groups) // (self.processes * 4))
+            results = pool.map(_analyze_shared_group, range(len(groups)),
+                               chunksize)
+        finally:
+            pool.close()
+            pool.join()
+            _shared_analyzer = None
+            self._groups = []
+
+        interfaces = self._get_interfaces()
+        return [(group[position],
+                 {interfaces[ifcid]: direction
+                  for ifcid, direction in topology.items()})
+                for group, result in zip(groups, results)
+                for position, topology in result]
+
+    def _analyze_group(self, vlans):
+        """Analyzes a group of VLANs in order, pruning any unrouted VLAN whose
+        seed netbox is covered by the topology of a previous one with the same
+        tag.
+
+        :returns: A list of (vlan, topology) tuples.
+        """
+        covered = set()
+        results = []
+        for vlan in vlans:
+            if (vlan not in self.routed_vlans and
+                    (vlan.vlan, vlan.netbox_id) in covered):
+                _logger.debug("pruning vlan %s", vlan)
+                continue
+            _logger.debug("Analyzing VLAN %s", vlan)
+            topology = self._get_analyzer(vlan).analyze()
+            covered.update((vlan.vlan, ifc.netbox_id) for ifc in topology)
+            results.append((vlan, topology))
+        return results
+
+    def _get_interfaces(self):
+        if self._interfaces is None:
+            self._interfaces = {ifc.id: ifc for _u, _v, ifc
+                                in self.layer2.edges(keys=True)}
+            for addr in self.routed_vlans.values():
+                self._interfaces.setdefault(addr.interface.id, addr.interface)
+        return self._interfaces
+
     def analyze_vlans_by_id(self, vlans):
         """Analyzes a list of VLANs by their PVIDs"""
         vlan_id_map = {vlan.vlan: vlan for vlan in self.routed_vlans.keys()}
@@ -91,18 +189,22 @@ class VlanGraphAnalyzer(object):
 
     def analyze_vlan(self, vlan):
         """Analyzes a single vlan"""
+        topology = self._get_analyzer(vlan).analyze()
+        self._integrate_vlan_topology(vlan, topology)
+        self._prune_unrouted_vlans(vlan, topology)
+
+    def _get_analyzer(self, vlan):
         if vlan in self.routed_vlans:
             addr = self.routed_vlans[vlan]
-            analyzer = RoutedVlanTopologyAnalyzer(addr, self.layer2,
-                                                  self.stp_blocked)
+            return RoutedVlanTopologyAnalyzer(addr, self.layer2,
+                                              self.stp_blocked,
+                                              self.non_trunk_ports)
         else:
             seed_netbox = vlan.netbox
-            analyzer = UnroutedVlanTopologyAnalyzer(vlan, seed_netbox,
-                                                    self.layer2,
-                                                    self.stp_blocked)
-        topology = analyzer.analyze()
-        self._integrate_vlan_topology(vlan, topology)
-        self._prune_unrouted_vlans(vlan, topology)
+            return UnroutedVlanTopologyAnalyzer(vlan, seed_netbox,
+                                                self.layer2,
+                                                self.stp_blocked,
+                                                self.non_trunk_ports)
 
     def _prune_unrouted_vlans(self, vlan, topology):
         for ifc in topology:
@@ -154,17 +256,23 @@ class VlanGraphAnalyzer(object):
 class RoutedVlanTopologyAnalyzer(object):
     """Analyzer of a single routed VLAN topology"""
 
-    def __init__(self, address, layer2_graph, stp_blocked=None):
+    def __init__(self, address, layer2_graph, stp_blocked=None,
+                 non_trunk_ports=None):
         """Initializes an analyzer for a given routed VLAN.
 
         :param address: A GwPortPrefix representing the router address of this
                         VLAN.
         :param layer2_graph: A layer 2 graph, as produced by the
                              build_layer2_graph() function.
+        :param non_trunk_ports: Non-trunk ports on each netbox and VLAN, as
+                                produced by the get_non_trunk_ports()
+                                function. If omitted, they are looked up in
+                                the database as needed.
 
         """
         self.address = address
         self.layer2 = layer2_graph
+        self.non_trunk_ports = non_trunk_ports
 
         self.vlan = address.prefix.vlan
         self.router_port = address.interface
@@ -255,13 +363,15 @@ class RoutedVlanTopologyAnalyzer(object):
         if not ifc.trunk:
             return self._ifc_has_vlan(ifc)
         else:
-            non_trunks_on_vlan = dest.interface_set.filter(
-                vlan=self.vlan.vlan).filter(NO_TRUNK)
-            if ifc.to_interface:
-                non_trunks_on_vlan = non_trunks_on_vlan.exclude(
-                    id=ifc.to_interface.id)
+            non_trunks_on_vlan = self._get_non_trunk_ports(dest)
+            return bool(non_trunks_on_vlan - {ifc.to_interface_id})
 
-            return non_trunks_on_vlan.count() > 0
+    def _get_non_trunk_ports(self, netbox):
+        if self.non_trunk_ports is not None:
+            return self.non_trunk_ports.get((netbox.id, self.vlan.vlan),
+                                            set())
+        return set(netbox.interface_set.filter(
+            vlan=self.vlan.vlan).filter(NO_TRUNK).values_list('id', flat=True))
 
     def _out_edges_on_vlan(self, node):
         return (
@@ -324,7 +434,8 @@ class RoutedVlanTopologyAnalyzer(object):
 class UnroutedVlanTopologyAnalyzer(RoutedVlanTopologyAnalyzer):
     """Analyzer of a single unrouted VLAN topology"""
 
-    def __init__(self, vlan, seed, layer2_graph, stp_blocked=None):
+    def __init__(self, vlan, seed, layer2_graph, stp_blocked=None,
+                 non_trunk_ports=None):
         """Initializes an analyzer for a given unrouted VLAN.
 
         :param layer2_graph: A layer 2 graph, as produced by the
@@ -332,6 +443,7 @@ class UnroutedVlanTopologyAnalyzer(RoutedVlanTopologyAnalyzer):
 
         """
         self.layer2 = layer2_graph
+        self.non_trunk_ports = non_trunk_ports
         self.stp_blocked = stp_blocked or {}
         self.ifc_directions = {}
         self.edge_directions = {}
@@ -371,24 +483,47 @@ class VlanTopologyUpdater(object):
 
     @transaction.atomic()
     def update(self):
-        """Updates the VLAN topology in the NAV database"""
-        for ifc, vlans in self.ifc_vlan_map.items():
-            for vlan, dirstr in vlans.items():
-                self._update_or_create_new_swportvlan_entry(ifc, vlan, dirstr)
-            self._remove_dead_swpvlan_records_for_ifc(ifc)
+        """Updates the VLAN topology in the NAV database.
 
-        self._delete_swportvlans_from_untouched_ifcs()
-
-    @classmethod
-    def _update_or_create_new_swportvlan_entry(cls, ifc, vlan, dirstr):
-        direction = cls._direction_from_string(dirstr)
-        obj, created = SwPortVlan.objects.get_or_create(
-            interface=ifc, vlan=vlan,
-            defaults={'direction': direction})
-        if not created and obj.direction != direction:
-            obj.direction = direction
-            obj.save()
-        return object
+        The existing swportvlan records are compared to the new topology in
+        memory, and only the difference is written back, in bulk.
+        """
+        wanted = {
+            (ifc.pk, vlan.pk): self._direction_from_string(dirstr)
+            for ifc, vlans in self.ifc_vlan_map.items()
+            for vlan, dirstr in vlans.items()
+        }
+        existing = {
+            (ifcid, vlanid): (swpvlanid, direction)
+            for swpvlanid, ifcid, vlanid, direction
+            in SwPortVlan.objects.values_list(
+                'id', 'interface_id', 'vlan_id', 'direction').iterator()
+        }
+
+        obsolete = [swpvlanid for key, (swpvlanid, _direction)
+                    in existing.items() if key not in wanted]
+        if obsolete:
+            _logger.debug("deleting %d obsolete swportvlan records",
+                          len(obsolete))
+            SwPortVlan.objects.filter(id__in=obsolete).delete()
+
+        changed = defaultdict(list)
+        for key, (swpvlanid, direction) in existing.items():
+            if key in wanted and wanted[key] != direction:
+                changed[wanted[key]].append(swpvlanid)
+        for direction, swpvlanids in changed.items():
+            _logger.debug("changing direction of %d swportvlan records to %s",
+                          len(swpvlanids), direction)
+            SwPortVlan.objects.filter(id__in=swpvlanids).update(
+                direction=direction)
+
+        new = [SwPortVlan(interface_id=ifcid, vlan_id=vlanid,
+                          direction=direction)
+               for (ifcid, vlanid), direction in wanted.items()
+               if (ifcid, vlanid) not in existing]
+        if new:
+            _logger.debug("creating %d new swportvlan records", len(new))
+            SwPortVlan.objects.bulk_create(new, batch_size=1000)
 
     DIRECTION_MAP = {
         'up': SwPortVlan.DIRECTION_UP,
@@ -403,28 +538,6 @@ class VlanTopologyUpdater(object):
                 if string in cls.DIRECTION_MAP
                 else SwPortVlan.DIRECTION_UNDEFINED)
 
-    def _remove_dead_swpvlan_records_for_ifc(self, ifc):
-        records_for_ifc = SwPortVlan.objects.filter(interface=ifc)
-        active_vlans = self.ifc_vlan_map[ifc].keys()
-        dead = records_for_ifc.exclude(vlan__in=active_vlans)
-        dead.delete()
-
-    def _delete_swportvlans_from_untouched_ifcs(self):
-        """Deletes old swportvlan entries that weren't touched by this update"""
-        # this can turn into a rather huge, and surprisingly inefficient SQL
-        # statement if we let PostgreSQL do all the work, so we calculate the
-        # set difference using Python instead
-        touched_interfaceids = set(ifc.pk for ifc in self.ifc_vlan_map)
-        existing_interfaceids = set(
-            SwPortVlan.objects.distinct().values_list('interface__id',
-                                                      flat=True)
-        )
-        to_delete = existing_interfaceids.difference(touched_interfaceids)
-        if to_delete:
-            _logger.debug("deleting obsolete swpvlan records for these ifcs: "
-                          "%s", to_delete)
-            SwPortVlan.objects.filter(interface__id__in=to_delete).delete()
-
 
 def build_layer2_graph(related_extra=None):
     """Builds a graph representation of the layer 2 topology stored in the NAV
@@ -568,7 +681,7 @@ def get_active_addresses_of_routed_vlans():
 
     """
     addrs = get_routed_vlan_addresses().select_related(
-        'prefix__vlan', 'interface__netbox')
+        'prefix__vlan', 'interface__netbox', 'interface__to_netbox')
     return filter_active_router_addresses(addrs)
 
 
@@ -624,5 +737,49 @@ def get_stp_blocked_ports():
     return dict(blocked)
 
 
+def get_non_trunk_ports():
+    """Returns the non-trunk ports of each netbox, by VLAN.
+
+    :returns: A dictionary: {(netboxid, vlan): set([interfaceid, ...])}
+
+    """
+    ports = defaultdict(set)
+    interfaces = Interface.objects.filter(vlan__isnull=False).filter(NO_TRUNK)
+    for ifcid, netboxid, vlan in interfaces.values_list(
+            'id', 'netbox_id', 'vlan').iterator():
+        ports[(netboxid, vlan)].add(ifcid)
+    return dict(ports)
+
+
+def _analyze_shared_group(index):
+    """Analyzes a group of VLANs in a worker process, using the analyzer
+    inherited from the parent process.
+
+    :returns: A list of (position in group, {interfaceid: direction}) tuples.
+
+    """
+    group = _shared_analyzer._groups[index]
+    return [(group.index(vlan),
+             {ifc.id: direction for ifc, direction in topology.items()})
+            for vlan, topology in _shared_analyzer._analyze_group(group)]
+
+
+def _get_fork_context():
+    """Returns a multiprocessing context that forks its worker processes, so
+    they inherit the parent's memory.
+
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing  # Python 2 always forks
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
 def _unrouted_vlan_sort(vlan):
     return vlan.vlan * 10 + (0 if vlan.has_meaningful_net_ident() else 1)
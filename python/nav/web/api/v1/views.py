@@ -17,6 +17,7 @@
 
 from datetime import datetime, timedelta
 import logging
+import time
 
 from IPy import IP
 from django.http import HttpResponse, JsonResponse
@@ -41,6 +42,9 @@ from rest_framework.generics import ListAPIView, get_object_or_404
 from nav.models import manage, event, cabling, rack, profiles
 from nav.models.fields import INFINITY, UNRESOLVED
 from nav.web.servicecheckers import load_checker_classes
+from nav.web.ipam.prefix_index import get_prefix_index
+from nav.netmap.traffic import (InterfaceLoad, get_traffic_snapshot,
+                                get_interface_data, INOCTETS, OUTOCTETS)
 from nav.util import auth_token
 
 from nav.buildconf import VERSION
@@ -448,6 +452,7 @@ class InterfaceViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
     -------------
     - last_used: interface/<id\>/last_used/
     - metrics: interface/<id\>/metrics/
+    - traffic: interface/<id\>/traffic/
 
     Example: `/api/1/interface/?netbox=91&ifclass=trunk&ifclass=swport`
     """
@@ -479,6 +484,26 @@ class InterfaceViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
         """
         return Response(self.get_object().get_port_metrics())
 
+    @detail_route()
+    def traffic(self, _request, pk=None):
+        """Return the current traffic averages for this interface
+
+        Interfaces that are drawn as links in Netmap are served from the
+        site-wide traffic snapshot, others are fetched from Graphite.
+        """
+        interface = self.get_object()
+        snapshot = get_traffic_snapshot()
+        if interface in snapshot:
+            data = snapshot[interface]
+            in_bps, out_bps = data.get(INOCTETS), data.get(OUTOCTETS)
+            timestamp = snapshot.timestamp
+        else:
+            in_bps, out_bps = get_interface_data(interface)
+            timestamp = time.time()
+        result = InterfaceLoad(in_bps, out_bps, interface.speed).to_json()
+        result['timestamp'] = timestamp
+        return Response(result)
+
     @detail_route()
     def last_used(self, _request, pk=None):
         """Return last used timestamp for this interface
@@ -820,22 +845,23 @@ class PrefixUsageList(NAVAPIMixin, ListAPIView):
 
     def get_queryset(self):
         """Filter for ip family"""
+        index = get_prefix_index()
         if 'scope' in self.request.GET:
-            queryset = manage.Prefix.objects.within(
-                self.request.GET.get('scope')
-            ).order_by('net_address')
-        elif self.request.GET.get('family'):
-            queryset = manage.Prefix.objects.extra(
-                where=['family(netaddr)=%s'],
-                params=[self.request.GET['family']])
+            found = index.within(self.request.GET.get('scope'), strict=True)
         else:
-            queryset = manage.Prefix.objects.all()
+            found = index.within()
+            family = self.request.GET.get('family')
+            if family:
+                found = [(prefix, entries) for prefix, entries in found
+                         if str(IP(prefix).version()) == family]
 
         # Filter prefixes that is smaller than minimum prefix length
-        results = [p for p in queryset
-                   if IP(p.net_address).len() >= MINIMUMPREFIXLENGTH]
+        pks = [entry.pk for prefix, entries in found
+               if IP(prefix).len() >= MINIMUMPREFIXLENGTH
+               for entry in entries]
 
-        return results
+        return list(manage.Prefix.objects.filter(
+            pk__in=pks).order_by('net_address'))
 
     def get_serializer(self, data, *args, **kwargs):
         """Populate the serializer with usages based on the prefix list"""
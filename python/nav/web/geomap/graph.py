@@ -18,14 +18,22 @@
 """Graph representation and manipulation."""
 
 import logging
+import threading
+from collections import OrderedDict
 
-from math import sqrt
+from math import floor, sqrt
 from nav.web.geomap.utils import (map_dict, nansafe_max, identity, first,
                                   group, avg, filter_dict, subdict,
                                   map_dict_lazy)
 
 _logger = logging.getLogger('nav.web.geomap.graph')
 
+# The maximum number of zoom levels to keep place clusterings for
+PLACE_INDEX_CACHE_SIZE = 32
+
+_place_indexes = OrderedDict()
+_place_indexes_lock = threading.Lock()
+
 
 # Specifications of how to combine the properties when combining nodes
 # and edges:
@@ -82,7 +90,7 @@ def build_graph(db_results):
     return graph
 
 
-def simplify(graph, bounds, viewport_size, limit):
+def simplify(graph, bounds, viewport_size, limit, zoom=None):
     """Remove and combine edges and nodes in a graph.
 
     Objects outside the interesting area (given by bounds) are
@@ -103,14 +111,87 @@ def simplify(graph, bounds, viewport_size, limit):
     limit -- the minimum distance (in pixels) there may be between two
     points without them being collapsed to one.
 
+    zoom -- the zoom level of the user's map, if known (see
+    get_place_index).
+
     """
-    area_filter(graph, bounds)
+    index = get_place_index(graph, bounds, viewport_size, limit, zoom)
+    area_filter(graph, bounds, index)
     create_rooms(graph)
-    create_places(graph, bounds, viewport_size, limit)
+    create_places(graph, bounds, viewport_size, limit, index)
     combine_edges(graph, AGGREGATE_PROPERTIES_EDGE)
 
 
-def area_filter(graph, bounds):
+def get_place_index(graph, bounds, viewport_size, limit, zoom=None):
+    """Get a PlaceIndex of all the rooms of a graph of netboxes.
+
+    The index only depends on the positions of the rooms and the zoom
+    level (the scale of the map and limit), not on which part of the
+    map is viewed.  It is therefore cached per zoom level, so that
+    panning the map doesn't require the rooms to be clustered again.
+
+    The map is shown in a Mercator projection, where the number of
+    pixels per degree of latitude changes as the map is panned north
+    or south.  When the client tells us its zoom level, the index is
+    cached by that, and is reused for the whole zoom level with the
+    scale of the first view it was made for.  Otherwise, it is cached
+    by the exact scale of the view, and only reused when the map is
+    panned east or west.
+
+    Arguments:
+
+    graph -- a Graph object with nodes representing netboxes.
+
+    bounds, viewport_size, limit, zoom -- as for simplify.
+
+    """
+    lon_scale, lat_scale = get_scale(bounds, viewport_size)
+    rooms = {}
+    for node in graph.nodes.values():
+        rooms[node.properties['roomid']] = (node.lon, node.lat)
+    if zoom is None:
+        scale = ('%.6g' % lon_scale, '%.6g' % lat_scale)
+    else:
+        scale = ('zoom', zoom)
+    key = scale + (limit, frozenset(rooms.items()))
+
+    with _place_indexes_lock:
+        index = _place_indexes.pop(key, None)
+    if index is None:
+        index = PlaceIndex(lon_scale, lat_scale, limit)
+        for roomid in sorted(rooms):
+            lon, lat = rooms[roomid]
+            index.add_room(roomid, lon, lat)
+        _logger.debug("clustered %d rooms in %d places",
+                      len(rooms), len(index.places))
+    with _place_indexes_lock:
+        _place_indexes[key] = index
+        while len(_place_indexes) > PLACE_INDEX_CACHE_SIZE:
+            _place_indexes.popitem(last=False)
+    return index
+
+
+def get_scale(bounds, viewport_size):
+    """Get the scale of the map, in pixels per degree of longitude and
+    latitude.
+
+    """
+    # TODO:
+    #
+    # -- This may give division by zero with bogus input (should check
+    #    for zeros -- what should we do then?)
+    #
+    # -- Should take into account that longitudes wrap around. Is
+    #    there any way to detect whether we have a map wider than the
+    #    earth, or do we need an extra parameter?
+    width = bounds['maxLon'] - bounds['minLon']
+    height = bounds['maxLat'] - bounds['minLat']
+    lon_scale = float(viewport_size['width']) / width
+    lat_scale = float(viewport_size['height']) / height
+    return lon_scale, lat_scale
+
+
+def area_filter(graph, bounds, index=None):
     """Restrict a graph to a geographical area.
 
     Removes objects outside bounds from graph.  An edge is retained if
@@ -126,6 +207,9 @@ def area_filter(graph, bounds):
     bounds -- a dictionary with keys (minLon, maxLon, minLat, maxLat)
     describing the bounds of the interesting region.
 
+    index -- a PlaceIndex of the rooms of the netboxes in graph.  If
+    given, it is used to look up the rooms within bounds.
+
     """
     def in_bounds(node):
         """Check if node is within bounds"""
@@ -136,7 +220,12 @@ def area_filter(graph, bounds):
         """Check if edge is connected to a node in the nodehash"""
         return edge.source.id in nodehash or edge.target.id in nodehash
 
-    nodes = filter_dict(in_bounds, graph.nodes)
+    if index is None:
+        nodes = filter_dict(in_bounds, graph.nodes)
+    else:
+        rooms = index.rooms_within(bounds)
+        nodes = filter_dict(lambda node: node.properties['roomid'] in rooms,
+                            graph.nodes)
     edges = filter_dict(lambda edge: edge_connected_to(edge, nodes),
                         graph.edges)
     node_ids = (set(nodes.keys())
@@ -166,7 +255,7 @@ def create_rooms(graph):
                    AGGREGATE_PROPERTIES_ROOM)
 
 
-def create_places(graph, bounds, viewport_size, limit):
+def create_places(graph, bounds, viewport_size, limit, index=None):
     """Convert a graph of rooms to a graph of 'places'.
 
     A 'place' is a set of one or more rooms.  The position of a place
@@ -189,46 +278,37 @@ def create_places(graph, bounds, viewport_size, limit):
     limit -- the minimum distance (in pixels) there may be between two
     points without them being collapsed to one.
 
-    """
-    # TODO:
-    #
-    # -- This may give division by zero with bogus input (should check
-    #    for zeros -- what should we do then?)
-    #
-    # -- Should take into account that longitudes wrap around. Is
-    #    there any way to detect whether we have a map wider than the
-    #    earth, or do we need an extra parameter?
-    width = bounds['maxLon'] - bounds['minLon']
-    height = bounds['maxLat'] - bounds['minLat']
-    lon_scale = float(viewport_size['width']) / width
-    lat_scale = float(viewport_size['height']) / height
-
-    def square(var):
-        """Square a number"""
-        return var * var
+    index -- a PlaceIndex which has already clustered the rooms of
+    graph (see get_place_index).  The places are then taken from it,
+    and positioned at the average of all of their rooms, including
+    those that are not in graph.  If not given, the rooms of graph
+    are clustered here.
 
-    def distance(node1, node2):
-        """Calculate distance from node1 to node2"""
-        return sqrt(square((node1.lon - node2.lon) * lon_scale) +
-                    square((node1.lat - node2.lat) * lat_scale))
-
-    places = []
+    """
+    if index is None:
+        index = PlaceIndex(*get_scale(bounds, viewport_size), limit=limit)
+        for node in graph.nodes.values():
+            index.add_room(node.id, node.lon, node.lat)
+
+        def get_roomid(node):
+            """Get the key of node in index"""
+            return node.id
+    else:
+        def get_roomid(node):
+            """Get the key of node in index"""
+            return node.properties['id']
+
+    places = {}
     for node in graph.nodes.values():
-        for place in places:
-            if distance(node, place['position']) < limit:
-                place['rooms'].append(node)
-                place['position'].lon = avg([n.lon for n in place['rooms']])
-                place['position'].lat = avg([n.lat for n in place['rooms']])
-                break
-        else:
-            places.append({'position': Node(None, node.lon, node.lat, None),
-                           'rooms': [node]})
+        places.setdefault(index.get_place(get_roomid(node)), []).append(node)
+    places = sorted(places.items(), key=lambda item: item[0].number)
     collapse_nodes(graph,
-                   [place['rooms'] for place in places],
-                   AGGREGATE_PROPERTIES_PLACE)
+                   [rooms for _place, rooms in places],
+                   AGGREGATE_PROPERTIES_PLACE,
+                   [(place.lon, place.lat) for place, _rooms in places])
 
 
-def collapse_nodes(graph, node_sets, property_aggregators):
+def collapse_nodes(graph, node_sets, property_aggregators, positions=None):
     """Collapse sets of nodes to single nodes.
 
     Replaces each set of nodes in node_sets by a single (new) node and
@@ -261,18 +341,24 @@ def collapse_nodes(graph, node_sets, property_aggregators):
     aggregator functions as corresponding values.  Each aggregator
     function should take a single argument, a list.
 
+    positions -- a list of (lon, lat) pairs, the positions of the new
+    nodes.  If given, it is used instead of computing the average
+    position of each node set.
+
     """
     if property_aggregators is None:
         property_aggregators = {}
+    if positions is None:
+        positions = [(avg([n.lon for n in node_set]),
+                      avg([n.lat for n in node_set]))
+                     for node_set in node_sets]
     graph.nodes = {}
     nodehash = {}
-    for node_set in node_sets:
+    for node_set, (lon, lat) in zip(node_sets, positions):
         properties = aggregate_properties(
             [x.properties for x in node_set],
             property_aggregators)
-        new_node = Node('cn[%s]' % combine_ids(node_set),
-                        avg([n.lon for n in node_set]),
-                        avg([n.lat for n in node_set]),
+        new_node = Node('cn[%s]' % combine_ids(node_set), lon, lat,
                         properties)
         for node in node_set:
             nodehash[node.id] = new_node
@@ -406,6 +492,170 @@ def reverse_edge(edge):
                 edge.target_data, edge.source_data)
 
 
+class GridIndex(object):
+    """A spatial index of items with geographical positions.
+
+    The items are kept in a grid of cells of cell_width degrees of
+    longitude by cell_height degrees of latitude.  The grid is anchored
+    at (0, 0), so that the cells of a position only depend on the cell
+    size.
+
+    """
+    def __init__(self, cell_width, cell_height):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self._cells = {}
+
+    def get_cell(self, lon, lat):
+        """Get the (column, row) of the cell containing a position"""
+        return (int(floor(lon / self.cell_width)),
+                int(floor(lat / self.cell_height)))
+
+    def add(self, item, lon, lat):
+        """Add item at position (lon, lat)"""
+        self._cells.setdefault(self.get_cell(lon, lat), set()).add(item)
+
+    def remove(self, item, lon, lat):
+        """Remove item, which was added at position (lon, lat)"""
+        cell = self.get_cell(lon, lat)
+        self._cells[cell].discard(item)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def near(self, lon, lat):
+        """Get the items in the cell of a position and its eight
+        neighboring cells.
+
+        These include all items less than one cell width/height away
+        from the position.
+
+        """
+        column, row = self.get_cell(lon, lat)
+        for cell in ((column + i, row + j)
+                     for i in (-1, 0, 1) for j in (-1, 0, 1)):
+            for item in self._cells.get(cell, ()):
+                yield item
+
+    def within(self, bounds):
+        """Get the items in the cells overlapping bounds.
+
+        This may include items outside bounds, but only in cells along
+        the edges of bounds.
+
+        """
+        min_column, min_row = self.get_cell(bounds['minLon'],
+                                            bounds['minLat'])
+        max_column, max_row = self.get_cell(bounds['maxLon'],
+                                            bounds['maxLat'])
+        num_cells = (max_column - min_column + 1) * (max_row - min_row + 1)
+        if num_cells > len(self._cells):
+            cells = [cell for cell in self._cells
+                     if min_column <= cell[0] <= max_column and
+                     min_row <= cell[1] <= max_row]
+        else:
+            cells = [(column, row)
+                     for column in range(min_column, max_column + 1)
+                     for row in range(min_row, max_row + 1)]
+        for cell in cells:
+            for item in self._cells.get(cell, ()):
+                yield item
+
+
+class Place(object):
+    """A cluster of rooms.
+
+    The position of a place is the average of the positions of its
+    rooms, which is updated as rooms are added.
+
+    """
+    def __init__(self, number):
+        self.number = number
+        self.lon = 0.0
+        self.lat = 0.0
+        self.rooms = []
+
+    def add_room(self, roomid, lon, lat):
+        """Add a room at position (lon, lat) to this place"""
+        self.rooms.append(roomid)
+        count = len(self.rooms)
+        self.lon += (lon - self.lon) / count
+        self.lat += (lat - self.lat) / count
+
+    def __repr__(self):
+        return "Place(%s)" % self.number
+
+
+class PlaceIndex(object):
+    """Clustering of rooms into places, with a spatial index of both.
+
+    Rooms are added one at a time.  A room is added to the first
+    created place whose position is closer than limit pixels to it,
+    or to a new place if there is no such place.  The distance is
+    computed using the given scales, in pixels per degree of longitude
+    and latitude.
+
+    The places are indexed in a grid whose cells are limit pixels
+    wide, so that only the places in neighboring cells need to be
+    considered when adding a room.
+
+    """
+    def __init__(self, lon_scale, lat_scale, limit):
+        self.lon_scale = lon_scale
+        self.lat_scale = lat_scale
+        self.limit = limit
+        self.places = []
+        cell_size = max(limit, 1)
+        self._place_grid = GridIndex(float(cell_size) / lon_scale,
+                                     float(cell_size) / lat_scale)
+        self._room_grid = GridIndex(float(cell_size) / lon_scale,
+                                    float(cell_size) / lat_scale)
+        self._rooms = {}
+
+    def add_room(self, roomid, lon, lat):
+        """Add a room at position (lon, lat) to the closest place
+
+        Returns the Place the room was added to.
+
+        """
+        self._room_grid.add(roomid, lon, lat)
+        nearby = [place for place in self._place_grid.near(lon, lat)
+                  if self.distance(place, lon, lat) < self.limit]
+        if nearby:
+            place = min(nearby, key=lambda p: p.number)
+            self._place_grid.remove(place, place.lon, place.lat)
+        else:
+            place = Place(len(self.places))
+            self.places.append(place)
+        place.add_room(roomid, lon, lat)
+        self._place_grid.add(place, place.lon, place.lat)
+        self._rooms[roomid] = (place, lon, lat)
+        return place
+
+    def distance(self, place, lon, lat):
+        """Calculate the distance from place to (lon, lat) in pixels"""
+        return sqrt(((place.lon - lon) * self.lon_scale) ** 2 +
+                    ((place.lat - lat) * self.lat_scale) ** 2)
+
+    def get_place(self, roomid):
+        """Get the Place a room was added to"""
+        return self._rooms[roomid][0]
+
+    def rooms_within(self, bounds):
+        """Get the set of ids of the rooms within bounds.
+
+        bounds -- a dictionary with keys (minLon, maxLon, minLat,
+        maxLat).
+
+        """
+        rooms = set()
+        for roomid in self._room_grid.within(bounds):
+            _place, lon, lat = self._rooms[roomid]
+            if (bounds['minLon'] <= lon <= bounds['maxLon'] and
+                    bounds['minLat'] <= lat <= bounds['maxLat']):
+                rooms.add(roomid)
+        return rooms
+
+
 class Node:
     """Representation of a node in a graph."""
     def __init__(self, node_id, lon, lat, properties):
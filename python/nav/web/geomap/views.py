@@ -152,6 +152,7 @@ def data(request, variant):
     viewport_size = {'width': int(request.GET['viewportWidth']),
                      'height': int(request.GET['viewportHeight'])}
     limit = int(request.GET['limit'])
+    zoom = int(request.GET['zoom']) if 'zoom' in request.GET else None
     if 'timeStart' in request.GET and 'timeEnd' in request.GET:
         time_interval = {'start': request.GET['timeStart'],
                          'end': request.GET['timeEnd']}
@@ -160,14 +161,15 @@ def data(request, variant):
 
     data = get_formatted_data(variant, db, format_, bounds, viewport_size,
                               limit, time_interval, do_create_edges,
-                              do_fetch_data)
+                              do_fetch_data, zoom)
     response = HttpResponse(data)
     response['Content-Type'] = format_mime_type(format_)
     return response
 
 
 def get_formatted_data(variant, db, format_, bounds, viewport_size, limit,
-                       time_interval, do_create_edges, do_fetch_data):
+                       time_interval, do_create_edges, do_fetch_data,
+                       zoom=None):
     """Get formatted output for given conditions.
 
     variant -- name of the map variant to create data for (variants
@@ -190,6 +192,8 @@ def get_formatted_data(variant, db, format_, bounds, viewport_size, limit,
     should be strings describing times in the syntax expected by
     rrdfetch. (see http://oss.oetiker.ch/rrdtool/doc/rrdfetch.en.html)
 
+    zoom -- the zoom level of the user's map, if known.
+
     Return value: formatted data as a string.
 
     """
@@ -197,7 +201,7 @@ def get_formatted_data(variant, db, format_, bounds, viewport_size, limit,
     _logger.debug('build_graph')
     graph = build_graph(data)
     _logger.debug('simplify')
-    simplify(graph, bounds, viewport_size, limit)
+    simplify(graph, bounds, viewport_size, limit, zoom)
     if do_fetch_data:
         _logger.debug('_attach_cpu_load')
         _attach_cpu_load(graph, time_interval)
@@ -33,6 +33,7 @@ from nav.web.ipam.util import PrefixQuerysetBuilder, get_available_subnets, \
     suggest_range
 
 from .prefix_tree import make_tree, make_tree_from_ip
+from .prefix_index import get_prefix_index
 
 
 # from nav.models.fields import CIDRField
@@ -127,10 +128,11 @@ class PrefixViewSet(viewsets.ViewSet):
         prefix = Prefix.objects.get(pk=pk)
         max_addr = IP(prefix.net_address).len()
         active_addr = prefix_collector.collect_active_ip(prefix)
-        # calculate allocated ratio
-        query = PrefixQuerysetBuilder().within(prefix.net_address)
-        allocated = query.finalize().exclude(vlan__net_type="scope")
-        total_allocated = sum(p.get_prefix_size() for p in allocated)
+        # calculate allocated ratio from the addresses spanned by non-scope
+        # prefixes within this one
+        total_allocated = get_prefix_index().get_covered_size(
+            prefix.net_address,
+            predicate=lambda entry: entry.net_type != "scope")
         payload = {
             "max_addr": max_addr,
             "active_addr": active_addr,
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A radix tree index of IPv4 and IPv6 prefixes.
+
+Prefixes are stored as integers in a path compressed binary trie (a Patricia
+trie), which makes it cheap to insert or remove single prefixes, and to find
+the hierarchy of a large number of prefixes by walking the trie once.
+
+"""
+
+from __future__ import unicode_literals, absolute_import
+import ipaddress
+import time
+from collections import namedtuple
+
+from IPy import IP
+from django.utils import six
+
+from nav.models.manage import Prefix
+
+WIDTH = {4: 32, 6: 128}
+INDEX_TTL = 60  # seconds
+
+PrefixEntry = namedtuple('PrefixEntry', 'pk net_address net_type')
+
+_cached_index = None
+_cached_at = 0
+
+
+class _Node(object):
+    __slots__ = ('network', 'prefixlen', 'values', 'children')
+
+    def __init__(self, network, prefixlen, values=None):
+        self.network = network
+        self.prefixlen = prefixlen
+        self.values = values if values is not None else []
+        self.children = [None, None]
+
+
+class PrefixIndex(object):
+    """An index of arbitrary values keyed by IPv4 or IPv6 prefixes.
+
+    Prefixes may be given as IPy.IP objects or as strings. Several values can
+    be stored for the same prefix.
+
+    """
+    def __init__(self, items=None):
+        """Initializes the index.
+
+        :param items: An optional iterable of (prefix, value) pairs to add.
+
+        """
+        self._roots = {4: _Node(0, 0), 6: _Node(0, 0)}
+        self._count = 0
+        for prefix, value in items or ():
+            self.add(prefix, value)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, prefix, value):
+        """Adds a value to the index under prefix"""
+        version, network, prefixlen = _to_key(prefix)
+        node = self._find_or_insert(version, network, prefixlen)
+        node.values.append(value)
+        self._count += 1
+
+    def remove(self, prefix, value):
+        """Removes a value stored under prefix.
+
+        :returns: True if the value was found and removed.
+
+        """
+        version, network, prefixlen = _to_key(prefix)
+        path = self._find_path(version, network, prefixlen)
+        if not path or value not in path[-1].values:
+            return False
+        path[-1].values.remove(value)
+        self._count -= 1
+        self._prune(path)
+        return True
+
+    def get(self, prefix):
+        """Returns a list of the values stored under exactly this prefix"""
+        path = self._find_path(*_to_key(prefix))
+        return list(path[-1].values) if path else []
+
+    def walk(self, prefix=None):
+        """Walks the stored prefixes within prefix (or all stored prefixes),
+        in IPy.IP sort order.
+
+        :returns: A generator of (prefix, values, parent) tuples, where parent
+                  is the nearest enclosing prefix that has values stored in
+                  the index, or None. Prefixes are returned as strings.
+
+        """
+        if prefix is None:
+            for version in sorted(self._roots):
+                for item in self._walk(version, self._roots[version], None):
+                    yield item
+            return
+
+        version, network, prefixlen = _to_key(prefix)
+        start, parent = self._find_subtree(version, network, prefixlen)
+        if start is not None:
+            for item in self._walk(version, start, parent):
+                yield item
+
+    def within(self, prefix=None, strict=False):
+        """Returns a list of (prefix, values) for every stored prefix within,
+        or equal to, prefix.
+
+        :param strict: If True, prefix itself is not included.
+
+        """
+        exclude = _format(*_to_key(prefix)) if strict and prefix else None
+        return [(key, values) for key, values, _parent in self.walk(prefix)
+                if key != exclude]
+
+    def get_children(self, prefix):
+        """Returns a list of (prefix, values) for the nearest stored
+        prefixes strictly within prefix.
+
+        """
+        version, network, prefixlen = _to_key(prefix)
+        start, _parent = self._find_subtree(version, network, prefixlen)
+        if start is None:
+            return []
+        result = []
+        for node in _below(start, prefixlen):
+            result.extend((_format(version, child.network, child.prefixlen),
+                           list(child.values))
+                          for child in _outermost(node))
+        return result
+
+    def get_empty_ranges(self, prefix):
+        """Returns the ranges within prefix not spanned by any stored prefix,
+        as a list of IPy.IP objects.
+
+        """
+        version, network, prefixlen = _to_key(prefix)
+        start, _parent = self._find_subtree(version, network, prefixlen)
+        spans = []
+        if start is not None:
+            for node in _below(start, prefixlen):
+                spans.extend(_span(version, child.network, child.prefixlen)
+                             for child in _outermost(node))
+        first, last = _span(version, network, prefixlen)
+        return [IP(_format(version, block, length))
+                for block, length in _gaps(version, first, last, spans)]
+
+    def get_covered_size(self, prefix, predicate=None):
+        """Returns the number of addresses within prefix that are spanned by
+        stored prefixes strictly within it.
+
+        :param predicate: An optional callable that decides, for each stored
+                          value, whether its prefix should be counted.
+
+        """
+        version, network, prefixlen = _to_key(prefix)
+        start, _parent = self._find_subtree(version, network, prefixlen)
+        if start is None:
+            return 0
+        width = WIDTH[version]
+        total = 0
+        for node in _below(start, prefixlen):
+            for child in _outermost(node, predicate):
+                total += 1 << (width - child.prefixlen)
+        return total
+
+    #
+    # Internal trie operations
+    #
+
+    def _find_or_insert(self, version, network, prefixlen):
+        width = WIDTH[version]
+        node = self._roots[version]
+        while True:
+            if node.prefixlen == prefixlen:
+                return node
+            bit = (network >> (width - node.prefixlen - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = node.children[bit] = _Node(network, prefixlen)
+                return child
+            # inlined _covers(), since this is the hot path of bulk inserts
+            if (child.prefixlen <= prefixlen and not
+                    (child.network ^ network) >> (width - child.prefixlen)):
+                node = child
+                continue
+
+            common = min(child.prefixlen, prefixlen,
+                         width - (child.network ^ network).bit_length())
+            if common == prefixlen:
+                new = _Node(network, prefixlen)
+                new.children[_bit(child.network, prefixlen, width)] = child
+                node.children[bit] = new
+                return new
+
+            glue = _Node(network & _mask(common, width), common)
+            new = _Node(network, prefixlen)
+            glue.children[_bit(child.network, common, width)] = child
+            glue.children[_bit(network, common, width)] = new
+            node.children[bit] = glue
+            return new
+
+    def _find_path(self, version, network, prefixlen):
+        """Returns the list of nodes leading to an exact match of the prefix,
+        or an empty list if it isn't in the trie.
+
+        """
+        width = WIDTH[version]
+        node = self._roots[version]
+        path = [node]
+        while node.prefixlen < prefixlen:
+            node = node.children[_bit(network, node.prefixlen, width)]
+            if node is None or not _covers(node.network, node.prefixlen,
+                                           network, prefixlen, width):
+                return []
+            path.append(node)
+        return path if node.prefixlen == prefixlen else []
+
+    def _find_subtree(self, version, network, prefixlen):
+        """Finds the topmost node within (or equal to) the prefix, and the
+        nearest enclosing prefix that has values.
+
+        """
+        width = WIDTH[version]
+        node = self._roots[version]
+        parent = None
+        while node is not None and node.prefixlen < prefixlen:
+            if node.values:
+                parent = _format(version, node.network, node.prefixlen)
+            node = node.children[_bit(network, node.prefixlen, width)]
+            if node is None:
+                return None, parent
+            if not _covers(node.network, node.prefixlen, network, prefixlen,
+                           width):
+                if _covers(network, prefixlen, node.network, node.prefixlen,
+                           width):
+                    return node, parent
+                return None, parent
+        return node, parent
+
+    @staticmethod
+    def _walk(version, start, parent):
+        stack = [(start, parent)]
+        while stack:
+            node, parent = stack.pop()
+            if node.values:
+                key = _format(version, node.network, node.prefixlen)
+                yield key, list(node.values), parent
+                parent = key
+            for child in reversed(node.children):
+                if child is not None:
+                    stack.append((child, parent))
+
+    @staticmethod
+    def _prune(path):
+        """Removes empty and superfluous glue nodes at the end of path"""
+        while len(path) > 1:
+            node, parent = path[-1], path[-2]
+            if node.values:
+                return
+            children = [child for child in node.children if child is not None]
+            if len(children) > 1:
+                return
+            index = parent.children.index(node)
+            parent.children[index] = children[0] if children else None
+            path.pop()
+
+
+class NavPrefixIndex(PrefixIndex):
+    """A PrefixIndex of PrefixEntry values for prefixes stored in NAV, which
+    can be updated one prefix at a time.
+
+    """
+    def __init__(self, prefixes=None):
+        super(NavPrefixIndex, self).__init__()
+        self._by_pk = {}
+        if prefixes is None:
+            prefixes = Prefix.objects.values_list(
+                'id', 'net_address', 'vlan__net_type')
+        for entry in prefixes:
+            self.update_prefix(PrefixEntry(*entry))
+
+    def update_prefix(self, entry):
+        """Adds or replaces a PrefixEntry in the index"""
+        self.remove_prefix(entry.pk)
+        self.add(entry.net_address, entry)
+        self._by_pk[entry.pk] = entry
+
+    def remove_prefix(self, pk):
+        """Removes the prefix entry with the given primary key"""
+        entry = self._by_pk.pop(pk, None)
+        if entry is not None:
+            self.remove(entry.net_address, entry)
+
+
+def get_prefix_index():
+    """Returns an index of all prefixes in NAV, rebuilt if older than
+    INDEX_TTL seconds.
+
+    :rtype: NavPrefixIndex
+
+    """
+    global _cached_index, _cached_at
+    if _cached_index is None or time.time() - _cached_at > INDEX_TTL:
+        _cached_index = NavPrefixIndex()
+        _cached_at = time.time()
+    return _cached_index
+
+
+def invalidate_prefix_index():
+    """Discards the cached index of NAV prefixes"""
+    global _cached_index
+    _cached_index = None
+
+
+def get_empty_ranges(prefix, children):
+    """Returns the ranges within prefix not spanned by any of its children, as
+    a list of IPy.IP objects.
+
+    :param prefix: An IPy.IP object.
+    :param children: A list of IPy.IP objects located within prefix.
+
+    """
+    version, network, prefixlen = _to_key(prefix)
+    spans = []
+    for child in children:
+        spans.append(_span(*_to_key(child)))
+    first, last = _span(version, network, prefixlen)
+    return [IP(_format(version, block, length))
+            for block, length in _gaps(version, first, last, spans)]
+
+
+#
+# Integer helpers
+#
+
+def _to_key(prefix):
+    if not isinstance(prefix, IP):
+        prefix = IP(prefix)
+    return prefix.version(), prefix.int(), prefix.prefixlen()
+
+
+def _format(version, network, prefixlen):
+    if version == 4:
+        address = ipaddress.IPv4Address(network)
+    else:
+        address = ipaddress.IPv6Address(network)
+    return '%s/%d' % (six.text_type(address), prefixlen)
+
+
+def _mask(prefixlen, width):
+    return ((1 << prefixlen) - 1) << (width - prefixlen)
+
+
+def _bit(network, position, width):
+    """Returns the bit following the first `position` bits of network"""
+    return (network >> (width - position - 1)) & 1
+
+
+def _covers(network, prefixlen, other_network, other_prefixlen, width):
+    """Returns True if the first prefix contains, or equals, the second"""
+    if prefixlen > other_prefixlen:
+        return False
+    shift = width - prefixlen
+    return (network >> shift) == (other_network >> shift)
+
+
+def _span(version, network, prefixlen):
+    return network, network + (1 << (WIDTH[version] - prefixlen)) - 1
+
+
+def _below(start, prefixlen):
+    """Returns the topmost nodes strictly within a prefix, given the topmost
+    node within or equal to it.
+
+    """
+    if start.prefixlen == prefixlen:
+        return [child for child in start.children if child is not None]
+    return [start]
+
+
+def _outermost(node, predicate=None):
+    """Yields the topmost nodes with (matching) values at or below node"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        values = node.values
+        if predicate is not None:
+            values = [value for value in values if predicate(value)]
+        if values:
+            yield node
+            continue
+        stack.extend(child for child in reversed(node.children)
+                     if child is not None)
+
+
+def _gaps(version, first, last, spans):
+    """Yields (network, prefixlen) blocks covering the addresses from first
+    to last that are not in any of the sorted (start, end) spans.
+
+    """
+    cursor = first
+    for start, end in sorted(spans):
+        if start > cursor:
+            for block in _range_to_blocks(version, cursor, start - 1):
+                yield block
+        cursor = max(cursor, end + 1)
+    if cursor <= last:
+        for block in _range_to_blocks(version, cursor, last):
+            yield block
+
+
+def _range_to_blocks(version, start, end):
+    """Yields the smallest list of (network, prefixlen) blocks that exactly
+    covers the address range from start to end.
+
+    """
+    width = WIDTH[version]
+    while start <= end:
+        alignment = (start & -start).bit_length() - 1 if start else width
+        size = min(alignment, (end - start + 1).bit_length() - 1)
+        yield start, width - size
+        start += 1 << size
@@ -31,6 +31,7 @@ from django.urls import reverse, NoReverseMatch
 from django.utils import six
 
 from nav.web.ipam.util import get_available_subnets
+from nav.web.ipam.prefix_index import PrefixIndex, get_empty_ranges
 from nav.models.manage import Prefix
 
 
@@ -97,9 +98,26 @@ class PrefixHeap(object):
         self.children.insert(i, node)
 
     def add_many(self, nodes):
-        "Add multiple nodes to heap"
-        for node in nodes:
-            self.add(node)
+        """Add multiple nodes to heap.
+
+        Rather than inserting the nodes one by one, the entire heap is rebuilt
+        from a prefix index, which is a lot faster for large numbers of nodes.
+
+        """
+        nodes = list(self.walk()) + list(nodes)
+        self.children = []
+        index = PrefixIndex((node.ip, node) for node in nodes)
+        heads = {}
+        for prefix, values, parent in index.walk():
+            head = heads.get(parent)
+            for node in values:
+                node.children = []
+                node.parent = head
+            if head is None:
+                self.children.extend(values)
+            else:
+                head.children.extend(values)
+            heads[prefix] = values[-1]
 
 
 # To maintain our sanity, we need a somewhat decent contract between the view
@@ -126,10 +144,7 @@ class IpNode(PrefixHeap):
         "Show unused subnets in the CIDR range"
         if self.is_leaf() or self.net_type != "scope":
             return []
-        base_set = IPSet([self.ip])
-        for child in self.children:
-            base_set.discard(child.ip)
-        return base_set.prefixes
+        return get_empty_ranges(self.ip, [child.ip for child in self.children])
 
     def in_use(self):
         "Show allocated *used( subnets in the CIDR range"
@@ -404,25 +419,25 @@ def make_prefix_heap(prefixes, initial_children=None, family=None,
             return True
         return False
 
-    heap = PrefixHeap(initial_children)
+    heap = PrefixHeap()
     filtered = (prefix for prefix in prefixes if accept(prefix))
-    nodes = (PrefixNode(prefix, sort_fn=sort_fn) for prefix in filtered)
-    for node in sorted(nodes, reverse=False):
-        heap.add(node)
+    nodes = [PrefixNode(prefix, sort_fn=sort_fn) for prefix in filtered]
+    heap.add_many((initial_children or []) + nodes)
     # Add marker nodes for available ranges/prefixes
     if show_available:
-        scopes = (child for child in heap.walk_roots() if child.net_type in
-                  ["scope"])
-        subnets = (get_available_nodes([scope.ip]) for scope in scopes)
-        for subnet in subnets:
-            heap.add_many(subnet)
+        scopes = [child for child in heap.walk_roots() if child.net_type in
+                  ["scope"]]
+        available = []
+        for scope in scopes:
+            available.extend(get_available_nodes([scope.ip]))
+        heap.add_many(available)
     # Add marker nodes for empty ranges, e.g. ranges not spanned by the
     # children of a node. This is useful for aligning visualizations and so on.
     if show_unused:
-        unused_prefixes = (child.not_in_use() for child in heap.walk())
-        for unused_prefix in unused_prefixes:
-            nodes = nodes_from_ips(unused_prefix, klass="empty")
-            heap.add_many(nodes)
+        unused = []
+        for child in list(heap.walk()):
+            unused.extend(nodes_from_ips(child.not_in_use(), klass="empty"))
+        heap.add_many(unused)
     return heap
 
 
@@ -496,7 +511,6 @@ def make_tree_from_ip(cidr_addresses):
 
     """
     heap = PrefixHeap()
-    for addr in cidr_addresses:
-        prefix = FauxNode(addr, "available", "available")
-        heap.add(prefix)
+    heap.add_many(FauxNode(addr, "available", "available")
+                  for addr in cidr_addresses)
     return heap
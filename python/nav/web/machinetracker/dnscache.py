@@ -0,0 +1,101 @@
+#
+# Copyright (C) 2018 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Cached reverse DNS lookups for Machine Tracker.
+
+Hostnames are kept in the ``dns`` cache for as long as the TTL of their PTR
+records allow, but no longer than MAX_TTL seconds. Addresses without a
+hostname are cached as well, for as long as the negative response allows.
+
+The ``dns`` cache is an in-memory cache, local to each web server process.
+When the web server runs several processes, each of them looks up and caches
+hostnames on its own, so a cached hostname is only reused by requests that
+are served by the same process.
+
+"""
+import logging
+from collections import defaultdict
+
+from django.core.cache import caches
+from django.utils import six
+
+from nav import asyncdns
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 5
+MAX_TTL = 3600
+CACHE_PREFIX = 'machinetracker:ptr:'
+
+
+def get_cached_hostnames(addresses):
+    """Returns the cached hostnames of addresses, without looking up any.
+
+    :returns: A dict of {address: hostname} for the addresses found in the
+              cache. The hostname is an empty string if the address is known
+              to have none.
+
+    """
+    keys = {_cache_key(addr): addr for addr in addresses}
+    cached = _get_cache().get_many(list(keys))
+    return {keys[key]: hostname for key, hostname in cached.items()}
+
+
+def reverse_lookup(addresses, timeout=DEFAULT_TIMEOUT):
+    """Looks up the hostnames of addresses, in parallel.
+
+    Addresses found in the cache are not looked up again.
+
+    :param addresses: An iterable of IP address strings.
+    :param timeout: The maximum number of seconds to wait for lookups. If 0,
+                    only cached hostnames are returned.
+    :returns: A dict of {address: hostname}. The hostname is an empty string
+              if the address has none, or the lookup failed. Addresses whose
+              lookup did not finish within the timeout are left out.
+
+    """
+    addresses = set(six.text_type(addr) for addr in addresses)
+    hostnames = get_cached_hostnames(addresses)
+    missing = addresses.difference(hostnames)
+    if not missing or timeout == 0:
+        return hostnames
+
+    _logger.debug("looking up PTR records for %d of %d addresses",
+                  len(missing), len(addresses))
+    resolver = asyncdns.ReverseResolver()
+    lookups = resolver.resolve(missing, timeout)
+
+    to_cache = defaultdict(dict)
+    for addr, names in lookups.items():
+        if isinstance(names, asyncdns.DNSQueryTimeoutError):
+            continue
+        hostname = names[0] if names and isinstance(names, list) else ""
+        hostnames[addr] = hostname
+        ttl = min(resolver.ttls.get(addr, 0), MAX_TTL)
+        if ttl > 0:
+            to_cache[ttl][_cache_key(addr)] = hostname
+    for ttl, values in to_cache.items():
+        _get_cache().set_many(values, ttl)
+    _logger.debug("PTR lookups done, %d unfinished",
+                  len(addresses) - len(hostnames))
+    return hostnames
+
+
+def _cache_key(addr):
+    return CACHE_PREFIX + six.text_type(addr)
+
+
+def _get_cache():
+    return caches['dns']
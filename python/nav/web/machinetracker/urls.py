@@ -47,4 +47,8 @@ urlpatterns = [
         views.netbios_search,
         name='machinetracker-netbios'),
 
+    url(r'^dns/$',
+        views.hostname_lookup,
+        name='machinetracker-dns'),
+
 ]
@@ -16,7 +16,6 @@
 """Common utility functions for Machine Tracker"""
 
 from datetime import datetime
-from socket import gethostbyaddr, herror
 from collections import namedtuple, OrderedDict
 import logging
 
@@ -25,33 +24,23 @@ from IPy import IP
 from django.db import DatabaseError, transaction
 from django.utils import six
 
-from nav import asyncdns
 from nav.models.manage import Prefix, Netbox, Interface
+from nav.web.machinetracker import dnscache
 
-_cached_hostname = {}
 _logger = logging.getLogger(__name__)
 
 
 def hostname(ip):
     """
-    Performs a DNS reverse lookup for an IP address and caches the result in
-    a global variable, which is really, really stupid.
+    Performs a DNS reverse lookup for an IP address. The result is cached, see
+    nav.web.machinetracker.dnscache.
 
     :param ip: And IP address string.
     :returns: A hostname string or a False value if the lookup failed.
 
     """
     addr = six.text_type(ip)
-    if addr in _cached_hostname:
-        return _cached_hostname[addr]
-
-    try:
-        dns = gethostbyaddr(addr)
-    except herror:
-        return False
-
-    _cached_hostname[addr] = dns[0]
-    return dns[0]
+    return dnscache.reverse_lookup([addr]).get(addr) or False
 
 
 @transaction.atomic()
@@ -153,24 +142,20 @@ def track_mac(keys, resultset, dns):
                       result should be grouped by
         resultset   - a QuerySet
         dns         - should we lookup the hostname?
+
+    Rows whose hostname could not be looked up in time get a dns_lookup value
+    of None, and are left for the browser to fill in.
     """
     if dns:
-        ips_to_lookup = {row.ip for row in resultset}
-        _logger.debug("track_mac: looking up PTR records for %d addresses)",
-                      len(ips_to_lookup))
-        dns_lookups = asyncdns.reverse_lookup(ips_to_lookup)
-        _logger.debug("track_mac: PTR lookup done")
+        ips_to_lookup = {six.text_type(row.ip) for row in resultset}
+        dns_lookups = dnscache.reverse_lookup(ips_to_lookup)
 
     tracker = OrderedDict()
     for row in resultset:
         if row.end_time > datetime.now():
             row.still_active = "Still active"
         if dns:
-            ip = row.ip
-            if dns_lookups[ip] and not isinstance(dns_lookups[ip], Exception):
-                row.dns_lookup = dns_lookups[ip].pop()
-            else:
-                row.dns_lookup = ""
+            row.dns_lookup = dns_lookups.get(six.text_type(row.ip))
         if not hasattr(row, 'module'):
             row.module = ''
         if not hasattr(row, 'port'):
@@ -24,14 +24,12 @@ from IPy import IP
 from django.db.models import Q
 from django.shortcuts import render, get_object_or_404
 from django.utils import six
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 
 from nav.django.utils import reverse_with_query
 from nav.models.manage import Arp, Cam, Netbios, Prefix
 
-from nav import asyncdns
-
-from nav.web.machinetracker import forms
+from nav.web.machinetracker import forms, dnscache
 from nav.web.machinetracker.utils import ip_dict, UplinkTracker, \
     InterfaceTracker
 from nav.web.machinetracker.utils import process_ip_row, track_mac
@@ -51,6 +49,11 @@ NBT_DEFAULTS = {'title': NBT_TITLE, 'navpath': NAVBAR,
                 'active': {'netbios': True}}
 
 ADDRESS_LIMIT = 4096  # Value for when inactive gets disabled
+# Searches for more addresses than this are rendered without waiting for DNS
+# lookups; the browser fills in the hostnames afterwards
+PROGRESSIVE_DNS_LIMIT = 256
+# Max number of addresses to look up in a single hostname request
+HOSTNAME_LOOKUP_LIMIT = 256
 
 _logger = logging.getLogger(__name__)
 
@@ -167,15 +170,19 @@ def create_ip_range(inactive, from_ip, to_ip, ip_result):
 
 
 def create_tracker(active, dns, inactive, ip_range, ip_result):
-    """Creates a result tracker based on form data"""
+    """Creates a result tracker based on form data.
+
+    Only cached hostnames are used for large IP ranges, and the browser is
+    left to fill in the rest.
+
+    """
     dns_lookups = None
     if dns:
-        ips_to_lookup = {str(ip) for ip in ip_range}
-        _logger.debug(
-            "create_tracker: looking up PTR records for %d addresses)",
-            len(ips_to_lookup))
-        dns_lookups = asyncdns.reverse_lookup(ips_to_lookup)
-        _logger.debug("create_tracker: PTR lookup done")
+        ips_to_lookup = {six.text_type(ip) for ip in ip_range}
+        if len(ips_to_lookup) > PROGRESSIVE_DNS_LIMIT:
+            dns_lookups = dnscache.get_cached_hostnames(ips_to_lookup)
+        else:
+            dns_lookups = dnscache.reverse_lookup(ips_to_lookup)
 
     tracker = OrderedDict()
     for ip_key in ip_range:
@@ -193,11 +200,7 @@ def create_active_row(tracker, dns, dns_lookups, ip_key, ip_result):
     for row in rows:
         row = process_ip_row(row, dns=False)
         if dns:
-            if (isinstance(dns_lookups[ip], Exception)
-                    or not dns_lookups[ip]):
-                row.dns_lookup = ""
-            else:
-                row.dns_lookup = dns_lookups[ip][0]
+            row.dns_lookup = dns_lookups.get(ip)
         row.ip_int_value = normalize_ip_to_string(row.ip)
         if (row.ip, row.mac) not in tracker:
             tracker[(row.ip, row.mac)] = []
@@ -209,14 +212,28 @@ def create_inactive_row(tracker, dns, dns_lookups, ip_key):
     ip = six.text_type(ip_key)
     row = {'ip': ip, 'ip_int_value': normalize_ip_to_string(ip)}
     if dns:
-        if (dns_lookups[ip] and not
-                isinstance(dns_lookups[ip], Exception)):
-            row['dns_lookup'] = dns_lookups[ip][0]
-        else:
-            row['dns_lookup'] = ""
+        row['dns_lookup'] = dns_lookups.get(ip)
     tracker[(ip, "")] = [row]
 
 
+def hostname_lookup(request):
+    """Looks up the hostnames of the IP addresses given as addr parameters,
+    for filling in search results progressively.
+
+    :returns: A JSON object mapping each address to its hostname. Addresses
+              whose lookups did not finish in time are left out.
+
+    """
+    addresses = []
+    for addr in request.GET.getlist('addr')[:HOSTNAME_LOOKUP_LIMIT]:
+        try:
+            IP(addr)
+        except ValueError:
+            continue
+        addresses.append(addr)
+    return JsonResponse(dnscache.reverse_lookup(addresses))
+
+
 def find_colspan(view, form):
     """Find correct colspan for the view"""
     defaults = {'ip': 5, 'netbios': 7}
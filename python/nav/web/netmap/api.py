@@ -15,9 +15,12 @@
 #
 from __future__ import absolute_import
 
+import json
+import time
+
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import views, generics
 from rest_framework.permissions import BasePermission
@@ -25,11 +28,11 @@ from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
 from nav.models.manage import Netbox
+from nav.netmap.traffic import get_traffic_snapshot, INOCTETS, OUTOCTETS
 from nav.models.profiles import (NetmapView, NetmapViewDefaultView, Account,
                                  NetmapViewNodePosition)
 from nav.web.api.v1.auth import NavBaseAuthentication
 
-from .cache import cache_exists, update_cached_node_positions
 from .graph import get_layer3_traffic, get_layer2_traffic, get_topology_graph
 from .serializers import NetmapViewSerializer, NetmapViewDefaultViewSerializer
 
@@ -72,6 +75,56 @@ class TrafficView(views.APIView):
         return Response(traffic)
 
 
+# A stream occupies a web server worker for as long as it lasts, browsers will
+# reconnect automatically when it ends
+TRAFFIC_STREAM_DURATION = 30*60
+TRAFFIC_STREAM_POLL_INTERVAL = 30
+
+
+def traffic_stream(_request):
+    """Streams changes to the site-wide traffic snapshot as server-sent
+    events.
+
+    The first event contains the traffic of every interface in the snapshot,
+    subsequent events only contain the interfaces whose traffic has changed.
+    """
+    response = StreamingHttpResponse(stream_traffic_deltas(),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def stream_traffic_deltas(duration=TRAFFIC_STREAM_DURATION,
+                          interval=TRAFFIC_STREAM_POLL_INTERVAL):
+    """Generates server-sent events for traffic snapshot changes, polling for
+    a new snapshot every interval seconds, for duration seconds.
+    """
+    deadline = time.time() + duration
+    previous = None
+    while True:
+        snapshot = get_traffic_snapshot()
+        if previous is None or snapshot.timestamp != previous.timestamp:
+            yield _format_traffic_event(snapshot, snapshot.diff(previous))
+            previous = snapshot
+        else:
+            yield ': keepalive\n\n'
+        if time.time() + interval > deadline:
+            break
+        time.sleep(interval)
+
+
+def _format_traffic_event(snapshot, changes):
+    interfaces = {
+        ifc_id: data and {'in_bps': data.get(INOCTETS),
+                          'out_bps': data.get(OUTOCTETS)}
+        for ifc_id, data in changes.items()
+    }
+    data = json.dumps({'timestamp': snapshot.timestamp,
+                       'interfaces': interfaces})
+    return 'event: traffic\ndata: {0}\n\n'.format(data)
+
+
 class NetmapViewList(generics.ListAPIView):
     """
     View for returning a list of NetmapViews which are public or
@@ -139,8 +192,8 @@ class NodePositionUpdate(generics.UpdateAPIView):
 
         viewid = kwargs.pop('viewid')
         data = request.data.get('data', [])
-        # nodes to be updated in the topology cache
-        cache_updates = []
+        # node positions are applied to the cached topology per request, so
+        # no cache updates are needed here
         for d in data:
             defaults = {
                 'x': int(d['x']),
@@ -155,17 +208,6 @@ class NodePositionUpdate(generics.UpdateAPIView):
                 obj.x = defaults['x']
                 obj.y = defaults['y']
                 obj.save()
-            cache_updates.append({
-                "id": str(obj.netbox.id),
-                "x": defaults["x"],
-                "y": defaults["y"],
-                "new_node": created
-            })
-        # Invalidate cached position
-        if cache_exists("topology", viewid, "layer 2"):
-            update_cached_node_positions(viewid, "layer 2", cache_updates)
-        if cache_exists("topology", viewid, "layer 3"):
-            update_cached_node_positions(viewid, "layer 3", cache_updates)
         return Response({"status": "OK"})
 
 
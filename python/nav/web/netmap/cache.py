@@ -15,91 +15,116 @@
 #
 
 """Cache utils for NetMap"""
+from datetime import datetime, timedelta
+import logging
 
-from functools import wraps
 from django.core.cache import cache
+from django.db import IntegrityError
 
-# TODO: This cache should be shared by all of NAV?
-# TODO: This cache should be invalidated only when the topology is
-# changed, which is somewhat rare, so set to a reasonable long time
-# for now
 from django.utils import six
 
-CACHE_TIMEOUT = 60*60
+from nav.models.profiles import NetmapTopology
+
+_logger = logging.getLogger(__name__)
+
+# Precomputed topologies are refreshed by navtopology after every run, this
+# timeout only ensures they won't be served forever if navtopology stops running
+TOPOLOGY_CACHE_TIMEOUT = 24*60*60
 # Data is collected every 5 minutes by NAV
 TRAFFIC_CACHE_TIMEOUT = 5*60
 
 
-def cache_exists(*args):
-    key = _cache_key(*args)
-    return cache.get(key) is not None
-
-
-# Cache model: Index traffic by location, then by traffic layer
-def cache_traffic(layer):
-    "Utility wrapper to cache get_traffic functions for layer 2/3"
-    def _decorator(func):
-        @wraps(func)
-        def get_traffic(location_or_room_id):
-            cache_key = _cache_key("traffic", location_or_room_id, layer)
-            cached = cache.get(cache_key)
-            if cached is not None:
-                return cached
-            result = func(location_or_room_id)
-            cache.set(cache_key, result, TRAFFIC_CACHE_TIMEOUT)
-            return result
-        return get_traffic
-    return _decorator
-
-
-# Cache model: Index by topology layer and view
-def cache_topology(layer):
-    "Utility decorator to cache the topology graph of Netmap"
-    def _decorator(func):
-        @wraps(func)
-        def get_traffic(*args, **kwargs):
-            view = kwargs["view"]
-            if view is None:
-                cache_key = _cache_key("topology", "global_view", layer)
-            else:
-                cache_key = _cache_key("topology", view.pk, layer)
-            try:
-                cached = cache.get(cache_key)
-                if cached is not None:
-                    return cached
-            except ValueError:
-                pass
-            result = func(*args, **kwargs)
-            cache.set(cache_key, result, CACHE_TIMEOUT)
-            return result
-        return get_traffic
-    return _decorator
-
-
-# Update all nodes at once to save a couple of hundred/thousand cache lookups
-def update_cached_node_positions(viewid, layer, updated_nodes):
-    cache_key = _cache_key("topology", viewid, layer)
-    to_update = cache.get(cache_key)
-    for node in updated_nodes:
-        # If the node is new, it is easier just to make an early exit and
-        # rebuild the whole topology
-        if node["new_node"]:
-            return invalidate_topology_cache(viewid, layer)
-        # Otherwise, don't update nodes not cached in the topology
-        if node["id"] not in to_update["nodes"]:
-            continue
-        diff = {
-            "x": node["x"],
-            "y": node["y"]
-        }
-        to_update["nodes"][node["id"]]["position"] = diff
-    cache.set(cache_key, to_update, CACHE_TIMEOUT)
-
-
-def invalidate_topology_cache(viewid, layer):
+# Cache model: A single site-wide traffic snapshot, shared by all views and
+# locations, which are sliced from it when traffic is requested
+def get_cached_traffic_snapshot():
+    """Returns the current TrafficSnapshot, or None if there is none"""
+    try:
+        return cache.get(_cache_key("traffic", "snapshot"))
+    except (ValueError, IOError, OSError) as error:
+        _logger.warning("could not read traffic snapshot from cache: %s",
+                        error)
+        return None
+
+
+def set_cached_traffic_snapshot(snapshot):
+    """Stores a TrafficSnapshot. It is kept for twice the collection interval,
+    so that a stale snapshot can be served while a new one is being built.
+
+    """
+    try:
+        cache.set(_cache_key("traffic", "snapshot"), snapshot,
+                  2 * TRAFFIC_CACHE_TIMEOUT)
+    except (IOError, OSError) as error:
+        _logger.warning("could not store traffic snapshot in cache: %s",
+                        error)
+
+
+def claim_traffic_snapshot_refresh():
+    """Claims the right to refresh the traffic snapshot.
+
+    :returns: True if no other process is currently refreshing it.
+
+    """
+    try:
+        return cache.add(_cache_key("traffic", "refresh"), True,
+                         TRAFFIC_CACHE_TIMEOUT)
+    except (IOError, OSError):
+        return True
+
+
+def release_traffic_snapshot_refresh():
+    "Releases a claim made by claim_traffic_snapshot_refresh()"
+    try:
+        cache.delete(_cache_key("traffic", "refresh"))
+    except (IOError, OSError):
+        pass
+
+
+# Storage model: One row per topology layer in the NetmapTopology table, since
+# the topology is precomputed by navtopology, which may not be able to share
+# the web server's Django cache. The topology of a layer is the same in all
+# views, node positions are applied per view when the topology is served.
+def get_cached_topology(layer):
+    """Returns the precomputed topology of a layer, as a dict of
+    {'version': ..., 'data': ...}, or None if there is none.
+
+    """
+    try:
+        topology = NetmapTopology.objects.get(layer=layer)
+    except NetmapTopology.DoesNotExist:
+        return None
+    if topology.updated < datetime.now() - timedelta(
+            seconds=TOPOLOGY_CACHE_TIMEOUT):
+        return None
+    return {'version': topology.version, 'data': topology.data}
+
+
+def set_cached_topology(layer, version, data):
+    """Stores a precomputed topology of a layer.
+
+    :param version: An identifier of the database state the topology was
+                    built from.
+
+    """
+    try:
+        NetmapTopology.objects.update_or_create(
+            layer=layer, defaults={'version': version, 'data': data})
+    except IntegrityError as error:
+        # A concurrent insert of the same layer, the other one will do
+        _logger.debug("could not store layer %s topology: %s", layer, error)
+
+
+def refresh_cached_topology(layer):
+    """Marks the precomputed topology of a layer as up to date, without
+    storing it again.
+
+    """
+    NetmapTopology.objects.filter(layer=layer).update(updated=datetime.now())
+
+
+def invalidate_topology_cache(layer):
     "Resets the topology cache, prompting NAV to rebuild it"
-    cache_key = _cache_key("topology", viewid, layer)
-    cache.delete(cache_key)
+    NetmapTopology.objects.filter(layer=layer).delete()
 
 
 # TODO: Consider using a proper slug generator for this
@@ -17,6 +17,7 @@
 
 from datetime import datetime
 from collections import defaultdict
+import hashlib
 import logging
 
 from django.shortcuts import get_object_or_404
@@ -36,25 +37,194 @@ from nav.netmap.topology import (
     _get_vlans_map_layer3,
 )
 from nav.topology import vlan
-from nav.models.manage import Interface, Prefix, GwPortPrefix, Location, Room
-from nav.netmap.traffic import get_traffic_data, get_traffic_for
+from nav.models.manage import (Interface, Prefix, GwPortPrefix, Location,
+                               Room, Netbox, SwPortVlan, Vlan)
+from nav.models.profiles import NetmapViewNodePosition
+from nav.netmap.traffic import (
+    LINK_NET_TYPES,
+    get_traffic_data,
+    get_traffic_snapshot,
+)
 
 from .common import get_traffic_rgb
-from .cache import cache_traffic, cache_topology
+from .cache import (get_cached_topology, set_cached_topology,
+                    refresh_cached_topology)
 
 _logger = logging.getLogger(__name__)
 
 
 def get_topology_graph(layer=2, load_traffic=False, view=None):
-    """Builds and returns topology graph for the given layer"""
+    """Returns the topology graph for the given layer, with node positions
+    from view.
+
+    The topology is normally served from data precomputed by navtopology (see
+    precompute_topologies()). It is only built on demand if no precomputed
+    data exists. If traffic data is requested, it is added to the links of the
+    precomputed topology from the current traffic snapshot.
+
+    """
+    cached = get_cached_topology(layer)
+    if cached is None:
+        _logger.info("no precomputed layer %s topology, building it now",
+                     layer)
+        cached = _precompute_topology(layer)
+    topology = cached['data']
+
+    if load_traffic:
+        topology = attach_traffic(topology)
+    if view is not None:
+        topology = attach_view_positions(topology, view)
+    return topology
+
+
+def build_topology(layer, load_traffic=False):
+    """Builds the JSON serializable topology of the given layer"""
+    if layer == 2:
+        return _json_layer2(load_traffic)
+    else:
+        return _json_layer3(load_traffic)
+
+
+def precompute_topologies(force=False):
+    """Precomputes and caches the topology of both layers, unless the
+    database rows they are built from are unchanged since the last time.
+
+    :returns: The list of layers that were rebuilt.
+
+    """
+    rebuilt = []
+    for layer in (2, 3):
+        version = get_topology_version(layer)
+        cached = get_cached_topology(layer)
+        if not force and cached is not None and cached['version'] == version:
+            _logger.debug("layer %s topology is unchanged", layer)
+            refresh_cached_topology(layer)
+            continue
+        _precompute_topology(layer, version)
+        rebuilt.append(layer)
+    return rebuilt
+
+
+def _precompute_topology(layer, version=None):
+    if version is None:
+        version = get_topology_version(layer)
+    start = datetime.now()
+    data = build_topology(layer)
+    set_cached_topology(layer, version, data)
+    _logger.info("layer %s topology with %d nodes built in %s", layer,
+                 len(data['nodes']), datetime.now() - start)
+    return {'version': version, 'data': data}
+
+
+def get_topology_version(layer):
+    """Returns a digest of the database rows that the topology of the given
+    layer is built from. The digest changes whenever the resulting topology
+    may change.
+
+    """
+    querysets = [
+        Netbox.objects.values_list(
+            'id', 'sysname', 'ip', 'category', 'room', 'up').order_by('id'),
+        Room.objects.values_list('id', 'location').order_by('id'),
+        Location.objects.values_list('id', 'description').order_by('id'),
+        Vlan.objects.values_list(
+            'id', 'vlan', 'net_type', 'net_ident', 'description',
+            'organization', 'usage').order_by('id'),
+    ]
     if layer == 2:
-        return _json_layer2(load_traffic, view=view)
+        querysets.extend([
+            Interface.objects.filter(to_netbox__isnull=False).values_list(
+                'id', 'netbox', 'ifname', 'speed', 'to_netbox',
+                'to_interface').order_by('id'),
+            SwPortVlan.objects.values_list(
+                'id', 'interface', 'vlan', 'direction').order_by('id'),
+        ])
     else:
-        return _json_layer3(load_traffic, view=view)
+        querysets.extend([
+            GwPortPrefix.objects.values_list(
+                'gw_ip', 'interface', 'prefix', 'virtual').order_by('gw_ip'),
+            Prefix.objects.values_list(
+                'id', 'net_address', 'vlan').order_by('id'),
+        ])
+
+    digest = hashlib.sha1()
+    for queryset in querysets:
+        for row in queryset.iterator():
+            digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def attach_view_positions(topology, view):
+    """Returns a copy of topology with the node positions saved in view"""
+    nodes = dict(topology['nodes'])
+    positions = NetmapViewNodePosition.objects.filter(
+        viewid=view).values_list('netbox', 'x', 'y')
+    for netboxid, x, y in positions:
+        key = str(netboxid)
+        if key in nodes:
+            nodes[key] = dict(nodes[key], position={'x': x, 'y': y})
+    result = dict(topology)
+    result['nodes'] = nodes
+    return result
 
 
-@cache_topology("layer 2")
-def _json_layer2(load_traffic=False, view=None):
+def attach_traffic(topology):
+    """Returns a copy of topology with traffic data from the current traffic
+    snapshot attached to the edges of its links.
+
+    """
+    links = [dict(link, edges=_copy_edges(link['edges']))
+             for link in topology['links']]
+    edges = list(_iter_edges(links))
+    interface_ids = set()
+    for edge in edges:
+        for end in ('source', 'target'):
+            interface_id = _get_edge_interface_id(edge, end)
+            if interface_id is not None:
+                interface_ids.add(interface_id)
+    interfaces = Interface.objects.only('id', 'speed').in_bulk(
+        list(interface_ids))
+
+    snapshot = get_traffic_snapshot()
+    for edge in edges:
+        port_pair = tuple(
+            interfaces.get(_get_edge_interface_id(edge, end))
+            for end in ('source', 'target'))
+        edge['traffic'] = get_traffic_data(port_pair, snapshot).to_json()
+
+    result = dict(topology)
+    result['links'] = links
+    return result
+
+
+def _copy_edges(edges):
+    # Layer 2 links have a list of edges, layer 3 links a dict of lists
+    if isinstance(edges, dict):
+        return {key: [dict(edge) for edge in value]
+                for key, value in edges.items()}
+    return [dict(edge) for edge in edges]
+
+
+def _iter_edges(links):
+    for link in links:
+        edges = link['edges']
+        if isinstance(edges, dict):
+            for value in edges.values():
+                for edge in value:
+                    yield edge
+        else:
+            for edge in edges:
+                yield edge
+
+
+def _get_edge_interface_id(edge, end):
+    end = edge.get(end)
+    if isinstance(end, dict):
+        return end.get('interface', {}).get('id')
+    return None
+
+
+def _json_layer2(load_traffic=False):
     topology_without_metadata = vlan.build_layer2_graph(
         (
             'to_interface__netbox',
@@ -71,7 +241,7 @@ def _json_layer2(load_traffic=False, view=None):
 
     graph = build_netmap_layer2_graph(topology_without_metadata,
                                       vlan_by_interface, vlan_by_netbox,
-                                      load_traffic, view)
+                                      load_traffic)
 
     def get_edge_from_meta(meta):
         edge = meta['metadata'][0]
@@ -86,16 +256,14 @@ def _json_layer2(load_traffic=False, view=None):
     return result
 
 
-@cache_topology("layer 3")
-def _json_layer3(load_traffic=False, view=None):
+def _json_layer3(load_traffic=False):
     topology_without_metadata = vlan.build_layer3_graph(
         ('prefix__vlan__net_type',)
     )
 
     vlans_map = _get_vlans_map_layer3(topology_without_metadata)
 
-    graph = build_netmap_layer3_graph(topology_without_metadata, load_traffic,
-                                      view)
+    graph = build_netmap_layer3_graph(topology_without_metadata, load_traffic)
 
     def get_edge_from_meta(meta):
         edges = next(iter(meta['metadata'].values()))
@@ -127,9 +295,8 @@ def get_traffic_gradient():
     ]
 
 
-@cache_traffic("layer 2")
 def get_layer2_traffic(location_or_room_id=None):
-    """Fetches traffic data for layer 2"""
+    """Fetches traffic data for layer 2, sliced from the traffic snapshot"""
     start = datetime.now()
 
     # TODO: Handle missing?
@@ -165,11 +332,9 @@ def get_layer2_traffic(location_or_room_id=None):
         datetime.now() - start,
     )
 
-    complete_interface_set = set(interfaces) | set(
-        ifc.to_interface for ifc in interfaces if ifc.to_interface
-    )
-    traffic_cache = get_traffic_for(complete_interface_set)
-    _logger.debug('Traffic cache built. Time used so far: %s', datetime.now() - start)
+    traffic_cache = get_traffic_snapshot()
+    _logger.debug('Traffic snapshot fetched. Time used so far: %s',
+                  datetime.now() - start)
 
     traffic = []
     for (source, target), edge_interfaces in edges.items():
@@ -193,12 +358,11 @@ def get_layer2_traffic(location_or_room_id=None):
     return traffic
 
 
-@cache_traffic("layer 3")
 def get_layer3_traffic(location_or_room_id=None):
-    """Fetches traffic data for layer 3"""
+    """Fetches traffic data for layer 3, sliced from the traffic snapshot"""
 
     prefixes = Prefix.objects.filter(
-        vlan__net_type__in=('link', 'elink', 'core')
+        vlan__net_type__in=LINK_NET_TYPES
     ).select_related('vlan__net_type')
 
     # No location/room => fetch data for all nodes
@@ -233,6 +397,7 @@ def get_layer3_traffic(location_or_room_id=None):
 
     interfaces = set()
     traffic = []
+    traffic_cache = get_traffic_snapshot()
 
     for prefix in prefixes:
 
@@ -260,7 +425,7 @@ def get_layer3_traffic(location_or_room_id=None):
             'source_ifname': interface.ifname,
             'target_ifname': to_interface.ifname,
             'traffic_data': get_traffic_data(
-                (interface, to_interface,)
+                (interface, to_interface,), traffic_cache
             ).to_json()
         })
     return traffic
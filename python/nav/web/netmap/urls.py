@@ -26,6 +26,7 @@ from nav.web.netmap.api import (
     NetmapViewDefaultViewUpdate,
     NodePositionUpdate,
     NetmapGraph,
+    traffic_stream,
 )
 
 from nav.models.profiles import Account
@@ -76,6 +77,11 @@ urlpatterns = [
         NetmapGraph.as_view(),
         name='netmap-graph-view',
     ),
+    url(
+        r'^traffic/stream/$',
+        never_cache(traffic_stream),
+        name='netmap-traffic-stream',
+    ),
     url(
         r'^traffic/layer(?P<layer>[2|3])/(?P<roomid>.*)$',
         never_cache(TrafficView.as_view()),
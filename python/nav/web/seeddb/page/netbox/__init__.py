@@ -20,6 +20,8 @@ from django.db import transaction
 from django.contrib.postgres.aggregates import ArrayAgg
 
 from nav.models.manage import Netbox
+from nav.metrics.names import invalidate_metric_tree_cache
+from nav.metrics.templates import metric_prefix_for_device
 from nav.bulkparse import NetboxBulkParser
 from nav.bulkimport import NetboxImporter
 
@@ -88,6 +90,8 @@ def netbox_pre_deletion_mark(queryset):
     :type queryset: django.db.models.QuerySet
     """
     queryset.update(deleted_at=datetime.datetime.now(), up_to_date=False)
+    for sysname in queryset.values_list('sysname', flat=True):
+        invalidate_metric_tree_cache(metric_prefix_for_device(sysname))
 
 
 def netbox_move(request):
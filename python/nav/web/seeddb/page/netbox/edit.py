@@ -30,6 +30,8 @@ from django.db import transaction
 from django.contrib import messages
 
 from nav.auditlog.models import LogEntry
+from nav.metrics.names import invalidate_metric_tree_cache
+from nav.metrics.templates import metric_prefix_for_device
 from nav.models.manage import Netbox, NetboxCategory, NetboxType, NetboxProfile
 from nav.models.manage import NetboxInfo, ManagementProfile
 from nav.Snmp import Snmp, safestring
@@ -231,8 +233,11 @@ def netbox_do_save(form):
     do a commit=False save first.
     """
 
+    old_sysname = form.initial.get('sysname')
     netbox = form.save(commit=False)  # Prevents saving m2m relationships
     netbox.save()
+    if old_sysname and old_sysname != netbox.sysname:
+        invalidate_metric_tree_cache(metric_prefix_for_device(old_sysname))
 
     # Save the function field
     function = form.cleaned_data['function']
@@ -157,6 +157,9 @@ NetworkLayer = OpenLayers.Class(OpenLayers.Layer.Vector, {
                     viewportHeight: function () {
                         return thisObj.map.getSize().h;
                     },
+                    zoom: function () {
+                        return thisObj.map.getZoom();
+                    },
                     create_edges: function() {
                         return edgeToggler.checked;
                     },
@@ -2,7 +2,8 @@ require(["libs/jquery.tablesorter.min", "libs/jquery"], function (tablesorter) {
 
     var ns = "nav.machinetracker",
         elementIds = ['id_netbios', 'id_dns'],
-        searchFormId = 'search_form';
+        searchFormId = 'search_form',
+        hostnameBatchSize = 256;
 
     /**
      * Enable setting and getting of local search settings (checkboxes only)
@@ -62,6 +63,54 @@ require(["libs/jquery.tablesorter.min", "libs/jquery"], function (tablesorter) {
     }
 
 
+    /**
+     * Fill in the hostnames that were not looked up before the search
+     * results were rendered, in batches of addresses. The batches are looked
+     * up one after another, to avoid tying up all the web server processes.
+     */
+    function fillInHostnames() {
+        var $pending = $('td.dns-pending'),
+            url = $('[data-dns-url]').data('dns-url'),
+            addresses = [];
+
+        $pending.each(function () {
+            var address = $(this).data('ip');
+            if (addresses.indexOf(address) < 0) {
+                addresses.push(address);
+            }
+        });
+
+        lookupHostnames($pending, url, addresses, 0);
+    }
+
+    /**
+     * Look up the hostnames of the batch of addresses starting at offset and
+     * fill them in, then go on with the next batch
+     */
+    function lookupHostnames($pending, url, addresses, offset) {
+        if (offset >= addresses.length) {
+            return;
+        }
+        var batch = addresses.slice(offset, offset + hostnameBatchSize);
+        $.ajax({
+            url: url,
+            data: {addr: batch},
+            traditional: true,
+            dataType: 'json'
+        }).always(function (hostnames) {
+            $pending.filter(function () {
+                return batch.indexOf($(this).data('ip')) >= 0;
+            }).each(function () {
+                var $cell = $(this);
+                $cell.text((hostnames && hostnames[$cell.data('ip')]) || '');
+                $cell.removeClass('dns-pending').removeAttr('title');
+            });
+            $('#tracker-table').trigger('update');
+            lookupHostnames($pending, url, addresses, offset + hostnameBatchSize);
+        });
+    }
+
+
     $(document).ready(function () {
 
         // Data parameters for tablesorter
@@ -100,6 +149,7 @@ require(["libs/jquery.tablesorter.min", "libs/jquery"], function (tablesorter) {
         }
 
         addLocalStateSettings();
+        fillInHostnames();
 
     });
 
@@ -21,7 +21,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.utils import six
 
-from nav.metrics.names import raw_metric_query
+from nav.metrics.names import cached_metric_query
 from nav.metrics.graphs import get_simple_graph_url, Graph
 from nav.models.thresholds import ThresholdRule
 from nav.web.threshold.forms import ThresholdForm
@@ -159,10 +159,10 @@ def get_metrics(term):
 
     :type term: str
     """
-    metrics = raw_metric_query(term)
+    metrics = list(cached_metric_query(term))
     if not metrics:
         term += '*'
-        metrics = raw_metric_query(term)
+        metrics = list(cached_metric_query(term))
 
     if len(metrics) > 1 and is_all_leaves(metrics):
         metrics.insert(0, {
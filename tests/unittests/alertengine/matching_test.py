@@ -0,0 +1,142 @@
+from mock import Mock, patch
+import pytest
+
+from nav.models.event import AlertQueue
+from nav.models.manage import Netbox, Room, Category, Location
+from nav.models.profiles import Expression, Filter, MatchField, Operator
+from nav.alertengine.matching import (AlertSnapshot, CompiledFilter,
+                                      UncompilableExpression,
+                                      compile_expression, _like_to_regexp)
+
+
+@pytest.fixture
+def alert():
+    netbox = Netbox(id=10, sysname='gw.example.org', ip='10.0.1.1',
+                    category=Category(id='GW'),
+                    room=Room(id='myroom', location=Location(id='mylocation')))
+    return AlertQueue(id=1, netbox=netbox, severity=50)
+
+
+def make_expression(value_id, operator, value, data_type=MatchField.STRING,
+                    name='match field'):
+    match_field = MatchField(value_id=value_id, data_type=data_type,
+                             name=name)
+    return Expression(id=1, match_field=match_field, operator=operator,
+                      value=value)
+
+
+def make_filter(*expressions):
+    filtr = Mock(spec=Filter, id=1)
+    filtr.expression_set.select_related.return_value = expressions
+    filtr.verify.return_value = True
+    return filtr
+
+
+@pytest.mark.parametrize('value_id,operator,value,expected', [
+    ('netbox.sysname', Operator.EQUALS, 'gw.example.org', True),
+    ('netbox.sysname', Operator.EQUALS, 'GW.example.org', False),
+    ('netbox.sysname', Operator.STARTSWITH, 'GW.', True),
+    ('netbox.sysname', Operator.ENDSWITH, '.org', True),
+    ('netbox.sysname', Operator.CONTAINS, 'EXAMPLE', True),
+    ('netbox.sysname', Operator.REGEXP, '^gw\\.', True),
+    ('netbox.sysname', Operator.WILDCARD, 'GW.%', True),
+    ('netbox.sysname', Operator.WILDCARD, 'gw', False),
+    ('cat.catid', Operator.IN, 'SW|GW', True),
+    ('cat.catid', Operator.IN, 'SW|EDGE', False),
+    ('room.roomid', Operator.EQUALS, 'myroom', True),
+    ('alertq.severity', Operator.GREATER, '40', True),
+    ('alertq.severity', Operator.LESS_EQ, '40', False),
+])
+def test_compiled_expression_should_match_like_database(
+        alert, value_id, operator, value, expected):
+    predicate = compile_expression(make_expression(value_id, operator, value))
+    assert predicate(AlertSnapshot(alert)) == expected
+
+
+@pytest.mark.parametrize('operator,value,expected', [
+    (Operator.EQUALS, '10.0.1.1', True),
+    (Operator.NOT_EQUAL, '10.0.1.1', False),
+    (Operator.IN, '192.168.0.0/16|10.0.0.0/8', True),
+    (Operator.IN, '192.168.0.0/16', False),
+])
+def test_compiled_ip_expression_should_match(alert, operator, value,
+                                             expected):
+    expression = make_expression('netbox.ip', operator, value,
+                                 data_type=MatchField.IP)
+    assert compile_expression(expression)(AlertSnapshot(alert)) == expected
+
+
+@patch('nav.alertengine.matching.Location.objects')
+def test_location_filter_should_match_sublocations(objects, alert):
+    parent = Mock()
+    parent.get_descendants.return_value = [Location(id='building'),
+                                           Location(id='mylocation')]
+    objects.filter.return_value = [parent]
+    filtr = make_filter(make_expression('location.locationid',
+                                        Operator.EQUALS, 'building',
+                                        name='Location'))
+    assert CompiledFilter(filtr).verify(AlertSnapshot(alert))
+    assert not filtr.verify.called
+
+    parent.get_descendants.return_value = [Location(id='building')]
+    assert not CompiledFilter(filtr).verify(AlertSnapshot(alert))
+
+
+def test_text_ordering_should_not_be_compiled():
+    expression = make_expression('netbox.sysname', Operator.GREATER, 'a')
+    with pytest.raises(UncompilableExpression):
+        compile_expression(expression)
+
+
+def test_multi_valued_relation_should_not_be_compiled():
+    expression = make_expression('module.name', Operator.EQUALS, 'foo')
+    with pytest.raises(UncompilableExpression):
+        compile_expression(expression)
+
+
+def test_alert_without_netbox_should_not_match_netbox_expression():
+    alert = AlertQueue(id=1, netbox=None)
+    predicate = compile_expression(
+        make_expression('netbox.sysname', Operator.CONTAINS, 'gw'))
+    assert not predicate(AlertSnapshot(alert))
+
+
+class TestCompiledFilter(object):
+    def test_should_require_all_expressions_to_match(self, alert):
+        filtr = make_filter(
+            make_expression('cat.catid', Operator.EQUALS, 'GW'),
+            make_expression('alertq.severity', Operator.GREATER, '60'))
+        assert not CompiledFilter(filtr).verify(AlertSnapshot(alert))
+
+    def test_should_exclude_only_when_all_exclusions_match(self, alert):
+        filtr = make_filter(
+            make_expression('cat.catid', Operator.NOT_EQUAL, 'GW'),
+            make_expression('room.roomid', Operator.NOT_EQUAL, 'otherroom'))
+        assert CompiledFilter(filtr).verify(AlertSnapshot(alert))
+
+    def test_should_not_use_database_when_compiled_part_fails(self, alert):
+        filtr = make_filter(
+            make_expression('cat.catid', Operator.EQUALS, 'SW'),
+            make_expression('module.name', Operator.EQUALS, 'foo'))
+        assert not CompiledFilter(filtr).verify(AlertSnapshot(alert))
+        assert not filtr.verify.called
+
+    def test_should_fall_back_to_database_for_uncompilable_expressions(
+            self, alert):
+        filtr = make_filter(
+            make_expression('cat.catid', Operator.EQUALS, 'GW'),
+            make_expression('module.name', Operator.EQUALS, 'foo'))
+        assert CompiledFilter(filtr).verify(AlertSnapshot(alert))
+        filtr.verify.assert_called_once_with(alert)
+
+    def test_later_expression_should_replace_earlier_with_same_lookup(
+            self, alert):
+        filtr = make_filter(
+            make_expression('cat.catid', Operator.EQUALS, 'SW'),
+            make_expression('cat.catid', Operator.EQUALS, 'GW'))
+        assert CompiledFilter(filtr).verify(AlertSnapshot(alert))
+
+
+def test_like_pattern_should_treat_regexp_characters_literally():
+    assert _like_to_regexp('a.c%').match('a.cdef')
+    assert not _like_to_regexp('a.c%').match('abcdef')
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+from mock import Mock, patch
+
+from nav.eventengine import unresolved
+from nav.eventengine.engine import DeferredDeletion, EventEngine
+from nav.models.event import AlertHistory
+from nav.models.fields import INFINITY
+
+
+class _Event(object):
+    def __init__(self, id):
+        self.id = id
+
+    def delete(self):
+        return "deleted for real"
+
+
+class TestDeferredDeletion(object):
+    def test_delete_should_be_deferred_until_exit(self):
+        event = _Event(42)
+        with patch('nav.eventengine.engine.Event.objects') as objects:
+            with DeferredDeletion([event]):
+                event.delete()
+                assert event.id is None
+                assert not objects.filter.called
+            objects.filter.assert_called_once_with(id__in=[42])
+            objects.filter.return_value.delete.assert_called_once_with()
+
+    def test_delete_should_not_be_deferred_after_exit(self):
+        event = _Event(42)
+        with patch('nav.eventengine.engine.Event.objects'):
+            with DeferredDeletion([event]):
+                pass
+        assert event.delete() == "deleted for real"
+
+    def test_nothing_should_be_deleted_on_exception(self):
+        event = _Event(42)
+        with patch('nav.eventengine.engine.Event.objects') as objects:
+            try:
+                with DeferredDeletion([event]):
+                    event.delete()
+                    raise ValueError("boom")
+            except ValueError:
+                pass
+            assert not objects.filter.called
+
+
+class TestLoadNewEvents(object):
+    def _make_engine(self, queued_ids, batch_size=2):
+        engine = EventEngine.__new__(EventEngine)
+        engine._unfinished = set()
+        engine._last_seen_id = 0
+        engine.BATCH_SIZE = batch_size
+        engine._scheduler = Mock(queue=[])
+        handled = []
+
+        def get_events_after(last_id):
+            return [Mock(id=i) for i in queued_ids
+                    if i > last_id][:batch_size]
+
+        engine._get_events_after = get_events_after
+        engine._handle_event_batch = lambda batch: handled.append(
+            [event.id for event in batch])
+        return engine, handled
+
+    def test_should_process_queue_in_batches(self):
+        engine, handled = self._make_engine([1, 2, 3, 4, 5])
+        engine.load_new_events()
+        assert handled == [[1, 2], [3, 4], [5]]
+
+    def test_should_only_load_events_after_last_seen(self):
+        engine, handled = self._make_engine([1, 2, 3])
+        engine._last_seen_id = 2
+        engine.load_new_events()
+        assert handled == [[3]]
+
+    def test_full_scan_should_load_all_events(self):
+        engine, handled = self._make_engine([1, 2, 3])
+        engine._last_seen_id = 3
+        engine.load_new_events(full_scan=True)
+        assert handled == [[1, 2], [3]]
+        assert engine._last_seen_id == 3
+
+
+class TestUnresolvedTracking(object):
+    def setup_method(self, method):
+        with patch('nav.eventengine.unresolved.AlertHistory.objects') as objs:
+            objs.filter.return_value = []
+            unresolved.update()
+
+    def _make_alert(self, pk, end_time):
+        return AlertHistory(id=pk, netbox_id=1, subid='',
+                            event_type_id='maintenanceState',
+                            start_time=datetime.now(), end_time=end_time)
+
+    def test_tracked_start_should_be_unresolved(self):
+        unresolved.track(self._make_alert(1, INFINITY))
+        assert unresolved.netbox_has_unresolved_alert(1, 'maintenanceState')
+        assert (1, '', 'maintenanceState') in unresolved.get_map()
+
+    def test_tracked_end_should_resolve(self):
+        unresolved.track(self._make_alert(1, INFINITY))
+        unresolved.track(self._make_alert(1, datetime.now()))
+        assert not unresolved.netbox_has_unresolved_alert(
+            1, 'maintenanceState')
+        assert not unresolved.get_map()
+
+    def test_unrelated_stateless_alert_should_not_resolve(self):
+        unresolved.track(self._make_alert(1, INFINITY))
+        unresolved.track(self._make_alert(2, None))
+        assert unresolved.netbox_has_unresolved_alert(1, 'maintenanceState')
@@ -0,0 +1,101 @@
+from mock import Mock, patch
+import networkx
+import pytest
+
+from nav.eventengine import topology
+from nav.eventengine.engine import EventEngine
+from nav.models.manage import Netbox, Vlan
+
+
+def make_graph(vlan):
+    graph = networkx.MultiGraph(name='graph for vlan %s' % vlan)
+    boxes = [Netbox(id=i, sysname='box%d' % i, up=Netbox.UP_UP)
+             for i in range(1, 4)]
+    graph.add_edge(boxes[0], boxes[1])
+    graph.add_edge(boxes[1], boxes[2])
+    return graph
+
+
+@pytest.fixture
+def build():
+    with patch('nav.eventengine.topology.get_graph_for_vlan',
+               side_effect=make_graph) as build:
+        yield build
+
+
+def test_vlan_graph_should_only_be_built_once(build):
+    cache = topology.VlanGraphCache()
+    vlan = Vlan(id=10)
+    assert cache.get_graph_for_vlan(vlan) is cache.get_graph_for_vlan(vlan)
+    assert build.call_count == 1
+
+
+@patch('nav.eventengine.topology.get_up_subgraph',
+       side_effect=lambda graph, keep=None: graph)
+@patch('nav.eventengine.topology.NAVServer.make_for', return_value=None)
+def test_reachability_checks_should_share_cached_graph(_make_for,
+                                                       _get_up_subgraph,
+                                                       build):
+    netbox = Netbox(id=1, sysname='box1', ip='10.0.0.1')
+    router = Netbox(id=3, sysname='box3', up=Netbox.UP_UP)
+    prefix = Mock(vlan=Vlan(id=10))
+    prefix.get_router_ports.return_value = [Mock(interface=Mock(
+        netbox=router))]
+    netbox.get_prefix = Mock(return_value=prefix)
+
+    cache = topology.VlanGraphCache()
+    assert topology.netbox_appears_reachable(netbox, cache)
+    assert topology.netbox_appears_reachable(netbox, cache)
+    assert build.call_count == 1
+    assert len(cache) == 1
+
+
+def test_invalidated_vlan_graph_should_be_rebuilt(build):
+    cache = topology.VlanGraphCache()
+    vlan = Vlan(id=10)
+    cache.get_graph_for_vlan(vlan)
+    cache.invalidate()
+    cache.get_graph_for_vlan(vlan)
+    assert build.call_count == 2
+
+
+def test_expired_vlan_graph_should_be_rebuilt(build):
+    cache = topology.VlanGraphCache(max_age=0)
+    vlan = Vlan(id=10)
+    cache.get_graph_for_vlan(vlan)
+    cache._built -= 1
+    cache.get_graph_for_vlan(vlan)
+    assert build.call_count == 2
+
+
+def test_nav_server_graph_should_not_modify_vlan_graph(build):
+    cache = topology.VlanGraphCache()
+    vlan = Vlan(id=10)
+    nav = topology.NAVServer('10.0.0.1')
+    switch = Netbox(id=3)
+    with patch.object(topology.NAVServer, 'get_switches_from_cam',
+                      return_value=[switch]) as get_switches:
+        graph = cache.get_graph_for_vlan(vlan, nav)
+        cache.get_graph_for_vlan(vlan, topology.NAVServer('10.0.0.1'))
+    assert topology.NAVServer('10.0.0.1') in graph
+    assert nav not in cache.get_graph_for_vlan(vlan)
+    assert get_switches.call_count == 1
+
+
+@patch('nav.eventengine.topology.Netbox.objects')
+def test_up_subgraph_should_use_current_netbox_state(objects):
+    graph = make_graph(10)
+    objects.filter.return_value.values_list.return_value = [
+        (1, Netbox.UP_UP), (2, Netbox.UP_DOWN), (3, Netbox.UP_DOWN)]
+    subgraph = topology.get_up_subgraph(graph, keep=Netbox(id=3))
+    assert sorted(node.id for node in subgraph) == [1, 3]
+    assert len(graph) == 3
+
+
+def test_topology_notification_should_invalidate_cache():
+    engine = EventEngine.__new__(EventEngine)
+    engine.topology = Mock()
+    engine._schedule_next_queuecheck = Mock()
+    engine._handle_notifications([Mock(channel='topology_changed')])
+    assert engine.topology.invalidate.called
+    assert not engine._schedule_next_queuecheck.called
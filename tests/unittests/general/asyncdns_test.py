@@ -0,0 +1,81 @@
+from twisted.internet import defer
+from twisted.names import dns
+
+from nav import asyncdns
+
+
+class FakeResolver(asyncdns.ReverseResolver):
+    """A ReverseResolver whose lookups are served from a dict of deferreds"""
+    def __init__(self, responses):
+        super(FakeResolver, self).__init__()
+        self.responses = responses
+
+    def lookup(self, address):
+        return [self.responses[address]()]
+
+
+def ptr(name, ttl):
+    return dns.RRHeader(type=dns.PTR, ttl=ttl,
+                        payload=dns.Record_PTR(name=name))
+
+
+def soa(ttl, minimum):
+    return dns.RRHeader(type=dns.SOA, ttl=ttl,
+                        payload=dns.Record_SOA(minimum=minimum))
+
+
+def nxdomain(authority):
+    message = dns.Message(rCode=dns.ENAME)
+    message.authority = authority
+    return defer.fail(asyncdns.DNSNameError(message))
+
+
+def test_should_record_shortest_answer_ttl():
+    resolver = FakeResolver({
+        '10.0.0.1': lambda: defer.succeed(
+            ([ptr('a.example.org', 600), ptr('b.example.org', 60)], [], [])),
+    })
+    assert resolver.resolve(['10.0.0.1']) == {
+        '10.0.0.1': ['a.example.org', 'b.example.org']}
+    assert resolver.ttls == {'10.0.0.1': 60}
+
+
+def test_nxdomain_ttl_should_be_taken_from_soa():
+    resolver = FakeResolver({
+        '10.0.0.1': lambda: nxdomain([soa(ttl=3600, minimum=120)]),
+        '10.0.0.2': lambda: nxdomain([]),
+    })
+    result = resolver.resolve(['10.0.0.1', '10.0.0.2'])
+    assert isinstance(result['10.0.0.1'], asyncdns.DNSNameError)
+    assert resolver.ttls == {'10.0.0.1': 120,
+                             '10.0.0.2': asyncdns.DEFAULT_NEGATIVE_TTL}
+
+
+def test_server_failure_should_not_be_cached():
+    resolver = FakeResolver({
+        '10.0.0.1': lambda: defer.fail(asyncdns.DNSServerError()),
+    })
+    resolver.resolve(['10.0.0.1'])
+    assert resolver.ttls == {'10.0.0.1': 0}
+
+
+def test_unfinished_lookups_should_time_out():
+    resolver = FakeResolver({
+        '10.0.0.1': lambda: defer.succeed(([ptr('a.example.org', 60)], [],
+                                           [])),
+        '10.0.0.2': defer.Deferred,
+    })
+    result = resolver.resolve(['10.0.0.1', '10.0.0.2'], timeout=0.1)
+    assert result['10.0.0.1'] == ['a.example.org']
+    assert isinstance(result['10.0.0.2'], asyncdns.DNSQueryTimeoutError)
+    assert '10.0.0.2' not in resolver.ttls
+
+
+def test_lookups_should_run_with_the_reactor_locked():
+    def locked_lookup():
+        assert asyncdns._reactor_lock.locked()
+        return defer.succeed(([ptr('a.example.org', 60)], [], []))
+
+    resolver = FakeResolver({'10.0.0.1': locked_lookup})
+    assert resolver.resolve(['10.0.0.1']) == {'10.0.0.1': ['a.example.org']}
+    assert not asyncdns._reactor_lock.locked()
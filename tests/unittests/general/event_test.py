@@ -0,0 +1,19 @@
+from mock import Mock, patch
+
+from nav.event import Event, EventQ
+
+
+@patch('nav.event.execute_values')
+def test_post_events_should_assign_eventqids_in_input_order(execute_values):
+    cursor = Mock()
+    cursor.fetchall.return_value = [(12,), (10,), (11,)]
+    connection = Mock(**{'cursor.return_value': cursor})
+    events = [
+        Event(source='snmptrapd', target='eventEngine', netboxid=1),
+        Event(source='snmptrapd', target='eventEngine', netboxid=1, subid=2),
+        Event(source='snmptrapd', target='eventEngine', netboxid=1),
+    ]
+    with patch.object(EventQ, '_get_connection', return_value=connection):
+        EventQ.post_events(events)
+    assert [event.eventqid for event in events] == [10, 11, 12]
+    connection.commit.assert_called_once_with()
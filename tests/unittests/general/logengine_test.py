@@ -1,8 +1,11 @@
 import datetime
 import pytest
-from mock import Mock
+from configparser import ConfigParser
+from mock import Mock, patch
 from unittest import TestCase
 import random
+import socket
+import struct
 import logging
 logging.raiseExceptions = False
 
@@ -41,19 +44,166 @@ def test_parse_without_exceptions(loglines):
             "Message has no facility: {0!r}\n{1!r}".format(line, vars(msg))
 
 
-def test_insert(loglines):
-    for line in loglines:
-        database = Mock('cursor')
-        database.fetchone = lambda: [random.randint(1, 10000)]
-
-        def execute(sql, params=()):
-            return sql % params
-        database.execute = execute
-        message = logengine.create_message(line)
-        assert message, "unparseable: %s" % line
-        logengine.insert_message(message, database,
-                                 {}, {}, {},
-                                 {}, {}, {})
+@patch('nav.logengine.execute_values')
+def test_load(execute_values, loglines):
+    def _insert(cursor, sql, rows, fetch=False):
+        columns = 2 if 'origin' in sql else 3
+        return [(random.randint(1, 10000),) + tuple(row[:columns - 1])
+                for row in rows]
+
+    execute_values.side_effect = _insert
+    connection = Mock()
+    connection.cursor.return_value.fetchall.return_value = []
+    messages = [logengine.create_message(line) for line in loglines]
+    loader = logengine.MessageLoader(connection)
+    loader.load(messages)
+
+    copy_data, table = connection.cursor.return_value.copy_from.call_args[0]
+    assert table == 'log_message'
+    assert len(copy_data.getvalue().splitlines()) == len(loglines)
+    connection.commit.assert_called_once_with()
+
+
+@patch('nav.logengine.execute_values')
+def test_load_should_only_add_unknown_origins_and_types(execute_values,
+                                                        loglines):
+    connection = Mock()
+    loader = logengine.MessageLoader(connection)
+    loader.categories = {'rest': 'rest'}
+    loader.origins = {'10.0.42.103': 1, '10.0.80.11': 2, '10.0.128.13': 3}
+    loader.types = {'LINK': {'UPDOWN': 1}}
+    execute_values.return_value = [(2, 'LINEPROTO', 'UPDOWN'),
+                                   (3, 'EC', 'COMPATIBLE'),
+                                   (4, 'SEC', 'IPACCESSLOGP'),
+                                   (5, 'EC', 'CANNOT_BUNDLE2'),
+                                   (6, 'SPANTREE', 'TOPOTRAP'),
+                                   (7, 'MV64340_ETHERNET', 'LATECOLLISION')]
+    loader.load([logengine.create_message(line) for line in loglines])
+
+    [(_cursor, sql, rows)] = [call[0] for call in execute_values.call_args_list]
+    assert 'log_message_type' in sql
+    assert len(rows) == 6
+
+
+def test_copy_value_should_escape_special_characters():
+    assert logengine._copy_value(None) == u'\\N'
+    assert logengine._copy_value(u'a\tb\nc\\d') == u'a\\tb\\nc\\\\d'
+
+
+def test_priority_exceptions_should_prefer_type_and_origin(loglines):
+    message = logengine.create_message(loglines[0])
+    assert logengine.get_new_priority(
+        message, {'10.0.42.103': '2'}, {'lineproto-5-updown': '3'},
+        {'lineproto-5-updown': {'10.0.42.103': '1'}}) == 1
+    assert logengine.get_new_priority(
+        message, {'10.0.42.103': '2'}, {'lineproto-5-updown': '3'}, {}) == 2
+    assert logengine.get_new_priority(message, {}, {}, {}) == 5
+
+
+def test_batch_messages_should_flush_on_none():
+    batches = list(logengine.batch_messages(iter([1, 2, None, 3]), size=10))
+    assert batches == [[1, 2], [3]]
+
+
+def test_batch_messages_should_respect_size():
+    batches = list(logengine.batch_messages(iter(range(5)), size=2))
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+def test_read_log_lines_should_truncate_after_processing(tmpdir, loglines):
+    logfile = tmpdir.join('cisco.log')
+    logfile.write('\n'.join(loglines[:2]) + '\n')
+    config = ConfigParser()
+    config.read_dict({'paths': {'syslog': str(logfile)}})
+
+    lines = logengine.read_log_lines(config)
+    assert next(lines).startswith('Oct 28 13:15:06')
+    assert next(lines).startswith('Oct 28 13:15:21')
+    assert next(lines) is None
+    assert logfile.size() > 0
+    assert list(lines) == []
+    assert logfile.size() == 0
+
+
+def test_read_log_lines_should_not_truncate_new_lines(tmpdir, loglines):
+    logfile = tmpdir.join('cisco.log')
+    logfile.write(loglines[0] + '\n')
+    config = ConfigParser()
+    config.read_dict({'paths': {'syslog': str(logfile)}})
+
+    lines = logengine.read_log_lines(config)
+    next(lines)
+    assert next(lines) is None
+    logfile.write(loglines[1] + '\n', mode='a')
+    assert next(lines).startswith('Oct 28 13:15:21')
+    assert list(lines) == [None]
+    assert logfile.size() == 0
+
+
+def test_received_line_should_be_parseable():
+    data = (b"<189>1030: Oct 28 13:15:05.310 CEST: %LINEPROTO-5-UPDOWN: "
+            b"Line protocol on Interface Gi1/0/29, changed state to up\n")
+    line = logengine.format_received_line(
+        data, '10.0.42.103', now=datetime.datetime(2010, 10, 8, 13, 15, 6))
+    assert line.startswith('Oct  8 13:15:06 10.0.42.103 1030: Oct 28')
+    message = logengine.create_message(line)
+    assert message.origin == '10.0.42.103'
+    assert message.mnemonic == 'UPDOWN'
+
+
+def _get_free_tcp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _next_line(lines, containing=''):
+    for line in lines:
+        if line is not None and containing in line:
+            return line
+
+
+def test_reset_syslog_stream_should_not_stop_receiver():
+    port = _get_free_tcp_port()
+    lines = logengine.receive_log_lines([('tcp', '127.0.0.1', port)],
+                                        poll_interval=0.1)
+    next(lines)  # binds the listening socket
+    broken = socket.create_connection(('127.0.0.1', port))
+    broken.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                      struct.pack('ii', 1, 0))
+    broken.sendall(b"<189>1030: incomplete")
+    broken.close()  # zero linger time makes this a connection reset
+    healthy = socket.create_connection(('127.0.0.1', port))
+    try:
+        healthy.sendall(b"<189>1031: Oct 28 13:15:05.310 CEST: "
+                        b"%LINK-3-UPDOWN: Interface Gi1/0/29\n")
+        assert _next_line(lines, containing='LINK-3-UPDOWN')
+    finally:
+        healthy.close()
+        lines.close()
+
+
+def test_unterminated_syslog_stream_data_should_be_flushed():
+    port = _get_free_tcp_port()
+    lines = logengine.receive_log_lines([('tcp', '127.0.0.1', port)],
+                                        poll_interval=0.1)
+    next(lines)
+    conn = socket.create_connection(('127.0.0.1', port))
+    try:
+        conn.sendall(b"x" * (logengine.MAX_STREAM_BUFFER + 1))
+        assert _next_line(lines).rstrip().endswith('x' * 100)
+    finally:
+        conn.close()
+        lines.close()
+
+
+def test_listen_addresses_should_be_parsed():
+    config = ConfigParser()
+    config.read_dict({'listen': {'addresses': 'udp:0.0.0.0:514 tcp:[::]:1514'}})
+    assert logengine.get_listen_addresses(config) == [
+        ('udp', '0.0.0.0', 514), ('tcp', '::', 1514)]
 
 
 def test_swallow_generic_exceptions():
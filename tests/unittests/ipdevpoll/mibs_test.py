@@ -36,6 +36,7 @@ from nav.mibs.entity_mib import (
     _entity_to_powersupply_or_fan,
 )
 from nav.mibs.snmpv2_mib import Snmpv2Mib
+from nav.mibs.if_mib import IfMib
 from nav.mibs import itw_mib, itw_mibv3, itw_mibv4
 
 
@@ -214,6 +215,54 @@ class TestCiscoHSRPMib(object):
         assert (IP('10.0.42.1'), 155) in df.result.items()
 
 
+class TestConcurrentRetrieveColumns(object):
+    def test_columns_should_be_walked_concurrently(self):
+        pending = {}
+
+        class MockedMib(IfMib):
+            def retrieve_column(self, column):
+                pending[column] = defer.Deferred()
+                return pending[column]
+
+        agent = Mock('AgentProxy')
+        agent.walk_semaphore = defer.DeferredSemaphore(2)
+        df = MockedMib(agent).retrieve_columns(['ifName', 'ifDescr'])
+        assert sorted(pending) == ['ifDescr', 'ifName']
+
+        pending['ifName'].callback({(1,): 'Gi0/1'})
+        pending['ifDescr'].callback({(1,): 'GigabitEthernet0/1'})
+        assert df.called
+        assert df.result[(1,)]['ifName'] == 'Gi0/1'
+        assert df.result[(1,)]['ifDescr'] == 'GigabitEthernet0/1'
+
+    def test_concurrent_walks_should_be_limited_by_semaphore(self):
+        pending = {}
+
+        class MockedMib(IfMib):
+            def retrieve_column(self, column):
+                pending[column] = defer.Deferred()
+                return pending[column]
+
+        agent = Mock('AgentProxy')
+        agent.walk_semaphore = defer.DeferredSemaphore(2)
+        MockedMib(agent).retrieve_columns(['ifName', 'ifDescr', 'ifAlias'])
+        assert len(pending) == 2
+
+    def test_failing_column_should_fail_retrieval(self):
+        class MockedMib(IfMib):
+            def retrieve_column(self, column):
+                if column == 'ifDescr':
+                    return defer.fail(defer.TimeoutError())
+                return defer.succeed({(1,): 'Gi0/1'})
+
+        agent = Mock('AgentProxy')
+        agent.walk_semaphore = defer.DeferredSemaphore(2)
+        df = MockedMib(agent).retrieve_columns(['ifName', 'ifDescr'])
+        assert isinstance(df.result, failure.Failure)
+        assert df.result.check(defer.TimeoutError)
+        df.addErrback(lambda _failure: None)
+
+
 def test_short_dateandtime_parses_properly():
     parsed = parse_dateandtime_tc(b'\xdf\x07\x05\x0e\x0c\x1e*\x05')
     assert parsed == datetime.datetime(2015, 5, 14, 12, 30, 42, 500000)
@@ -321,3 +370,13 @@ def entity_physical_table(scope="session"):
             "entPhysicalIsFRU": 1,
         },
     }
+
+    def test_max_repetitions_should_be_passed_to_agent(self):
+        agent = Mock('AgentProxy')
+        agent.walk_semaphore = defer.DeferredSemaphore(2)
+        agent.getTable = Mock(return_value=defer.succeed({}))
+        IfMib(agent).retrieve_columns(['ifName', 'ifDescr'],
+                                      max_repetitions=100)
+        for _args, kwargs in agent.getTable.call_args_list:
+            assert kwargs == {'maxRepetitions': 100}
+        assert agent.getTable.call_count == 2
@@ -0,0 +1,112 @@
+from mock import Mock, patch
+import pytest
+
+from twisted.internet import defer
+
+from nav.ipdevpoll.plugins import statports
+from nav.ipdevpoll.plugins.statports import (
+    InterfaceLayout,
+    StatPorts,
+    SYSUPTIME,
+    IFNUMBER,
+    IFTABLELASTCHANGE,
+    USED_COUNTERS,
+)
+from nav.ipdevpoll.storage import ContainerRepository
+
+
+@pytest.fixture(autouse=True)
+def clear_layouts():
+    statports._layouts.clear()
+    yield
+    statports._layouts.clear()
+
+
+def _row(ifname, **counters):
+    row = {'ifName': ifname, 'ifDescr': ifname}
+    row.update(counters)
+    return row
+
+
+class TestInterfaceLayout(object):
+    def test_unchanged_signals_should_be_valid(self):
+        layout = InterfaceLayout({1: ('a', 'a')}, 1000, 1, 50)
+        assert layout.is_valid_for(2000, 1, 50)
+
+    def test_reboot_should_be_invalid(self):
+        layout = InterfaceLayout({1: ('a', 'a')}, 1000, 1, 50)
+        assert not layout.is_valid_for(10, 1, 50)
+
+    def test_changed_ifnumber_should_be_invalid(self):
+        layout = InterfaceLayout({1: ('a', 'a')}, 1000, 1, 50)
+        assert not layout.is_valid_for(2000, 2, 50)
+
+    def test_changed_iftable_should_be_invalid(self):
+        layout = InterfaceLayout({1: ('a', 'a')}, 1000, 1, 50)
+        assert not layout.is_valid_for(2000, 1, 1500)
+
+    def test_missing_last_change_should_be_invalid(self):
+        layout = InterfaceLayout({1: ('a', 'a')}, 1000, 1, None)
+        assert not layout.is_valid_for(2000, 1, None)
+
+    def test_old_layout_should_be_invalid(self):
+        layout = InterfaceLayout({1: ('a', 'a')}, 1000, 1, 50, timestamp=1)
+        assert not layout.is_valid_for(2000, 1, 50)
+
+
+class TestStatPortsGetStats(object):
+    def _run(self, walk_results, signals):
+        agent = Mock()
+        agent.get_device_signals.return_value = defer.succeed(signals)
+        plugin = StatPorts(Mock(id=1), agent, ContainerRepository())
+        ifmib = Mock()
+        ifmib.retrieve_columns.side_effect = [
+            defer.succeed(result) for result in walk_results]
+        ipmib = Mock()
+        ipmib.get_ipv6_octet_counters.return_value = defer.succeed({})
+        with patch('nav.ipdevpoll.plugins.statports.IfMib',
+                   return_value=ifmib), \
+                patch('nav.ipdevpoll.plugins.statports.IpMib',
+                      return_value=ipmib), \
+                patch('nav.ipdevpoll.plugins.statports.reduce_index',
+                      side_effect=lambda result: result):
+            result = []
+            plugin._get_stats().addCallback(result.append)
+        return result[0], ifmib
+
+    def test_first_run_should_walk_names(self):
+        signals = {SYSUPTIME: 1000, IFNUMBER: 1, IFTABLELASTCHANGE: 50}
+        _stats, ifmib = self._run([{1: _row('Gi0/1', ifInOctets=1)}],
+                                  signals)
+        columns = ifmib.retrieve_columns.call_args[0][0]
+        assert 'ifName' in columns
+
+    def test_known_layout_should_only_walk_counters(self):
+        signals = {SYSUPTIME: 1000, IFNUMBER: 1, IFTABLELASTCHANGE: 50}
+        self._run([{1: _row('Gi0/1', ifInOctets=1)}], signals)
+
+        signals[SYSUPTIME] = 2000
+        stats, ifmib = self._run([{1: {'ifInOctets': 2}}], signals)
+        args, kwargs = ifmib.retrieve_columns.call_args
+        assert args[0] == USED_COUNTERS
+        assert kwargs['max_repetitions'] == 2
+        assert stats[1]['ifName'] == 'Gi0/1'
+        assert stats[1]['ifInOctets'] == 2
+
+    def test_changed_layout_should_walk_names_again(self):
+        signals = {SYSUPTIME: 1000, IFNUMBER: 1, IFTABLELASTCHANGE: 50}
+        self._run([{1: _row('Gi0/1')}], signals)
+
+        signals[IFTABLELASTCHANGE] = 1500
+        stats, ifmib = self._run([{1: _row('Gi0/2')}], signals)
+        assert 'ifName' in ifmib.retrieve_columns.call_args[0][0]
+        assert statports._layouts[1].names == {1: ('Gi0/2', 'Gi0/2')}
+
+    def test_unknown_counter_rows_should_walk_names_again(self):
+        signals = {SYSUPTIME: 1000, IFNUMBER: 1, IFTABLELASTCHANGE: 50}
+        self._run([{1: _row('Gi0/1')}], signals)
+
+        stats, ifmib = self._run(
+            [{1: {}, 2: {}}, {1: _row('Gi0/1'), 2: _row('Gi0/2')}], signals)
+        assert ifmib.retrieve_columns.call_count == 2
+        assert stats[2]['ifName'] == 'Gi0/2'
@@ -0,0 +1,90 @@
+from mock import Mock, patch
+
+from twisted.internet import defer
+
+from nav.ipdevpoll.pool import JobCostEstimates, Worker, WorkerPool
+
+
+class TestJobCostEstimates(object):
+    def test_unknown_job_should_have_default_cost(self):
+        costs = JobCostEstimates()
+        assert costs.estimate('topo', 1) == JobCostEstimates.DEFAULT_COST
+
+    def test_estimate_should_prefer_netbox_specific_runtime(self):
+        costs = JobCostEstimates()
+        costs.update('topo', 1, 100)
+        costs.update('topo', 2, 10)
+        assert costs.estimate('topo', 1) == 100
+        assert costs.estimate('topo', 2) == 10
+
+    def test_estimate_should_fall_back_to_job_runtime(self):
+        costs = JobCostEstimates()
+        costs.update('topo', 1, 100)
+        assert costs.estimate('topo', 3) == 100
+
+    def test_estimates_should_be_smoothed(self):
+        costs = JobCostEstimates()
+        costs.update('topo', 1, 100)
+        costs.update('topo', 1, 0)
+        assert 0 < costs.estimate('topo', 1) < 100
+
+
+def _make_pool(worker_count=2, **kwargs):
+    pool = WorkerPool(0, None, **kwargs)
+    pool.max_count = worker_count
+    for _ in range(worker_count):
+        worker = Worker(pool, None, None)
+        worker.process = Mock()
+        worker.process.callRemote.side_effect = (
+            lambda *args, **kwargs: defer.Deferred())
+        pool.workers.add(worker)
+    return pool
+
+
+class TestWorkerPool(object):
+    def test_should_place_job_on_least_loaded_worker(self):
+        pool = _make_pool()
+        pool.costs.update('topo', 1, 600)
+        pool.execute_job('topo', 1, [], 0)
+        pool.execute_job('snmpcheck', 2, [], 0)
+        pool.execute_job('snmpcheck', 3, [], 0)
+        loads = sorted(worker.active_jobs for worker in pool.workers)
+        assert loads == [1, 2]
+
+    def test_finished_job_should_update_estimates_and_load(self):
+        pool = _make_pool(worker_count=1)
+        deferred = pool.execute_job('topo', 1, [], 0)
+        worker = list(pool.workers)[0]
+        assert worker.load == JobCostEstimates.DEFAULT_COST
+        deferred.callback({'result': True, 'reschedule': 0,
+                           'rss': 1000, 'rss_growth': 10})
+        assert worker.load == 0
+        assert worker.rss == 1000
+        assert pool.costs.rss_growth['topo'] == 10
+
+    def test_should_retire_and_replace_bloated_worker(self):
+        pool = _make_pool(worker_count=1, max_memory=500)
+        deferred = pool.execute_job('topo', 1, [], 0)
+        worker = list(pool.workers)[0]
+        with patch.object(pool, '_spawn_worker') as spawn:
+            deferred.callback({'result': True, 'reschedule': 0,
+                               'rss': 1000, 'rss_growth': 10})
+            assert spawn.called
+        assert worker.retiring
+        assert worker.done()
+
+    def test_should_grow_when_workers_are_busy(self):
+        pool = _make_pool(worker_count=1, grow_load=100)
+        pool.max_count = 2
+        pool.costs.update('topo', 1, 600)
+        with patch.object(pool, '_spawn_worker') as spawn:
+            pool.execute_job('topo', 1, [], 0)
+            assert spawn.called
+
+    def test_should_retire_idle_workers_above_minimum(self):
+        pool = _make_pool(worker_count=2, idle_timeout=10)
+        pool.target_count = 1
+        for worker in pool.workers:
+            worker.idle_since = 0
+        pool._shrink_idle_workers()
+        assert len([w for w in pool.workers if w.retiring]) == 1
@@ -3,7 +3,7 @@ from mock import Mock
 import pytest
 from twisted.internet import defer, task
 
-from nav.ipdevpoll import schedule
+from nav.ipdevpoll import schedule, shadows
 
 
 @pytest.fixture
@@ -32,3 +32,81 @@ def test_netbox_job_scheduler_reschedule_on_success(netbox_job_scheduler):
     assert pool.execute_job.call_count == 2
     pool.execute_job.assert_called_with('myjob', 1, plugins=[],
                                         interval=10)
+
+
+def _queued_scheduler(name, queued_at, category='EDGE', runtime=None):
+    job = Mock()
+    job.name = 'myjob'
+    job.interval = 300
+    netbox = shadows.Netbox(id=1, sysname=name)
+    if category:
+        netbox.category = shadows.Category(id=category)
+    scheduler = schedule.NetboxJobScheduler(job, netbox, Mock())
+    scheduler._queued_at = queued_at
+    scheduler.average_runtime = runtime
+    return scheduler
+
+
+class TestJobQueue(object):
+    def test_should_release_longest_waiting_first(self):
+        queue = schedule.JobQueue()
+        queue.append(_queued_scheduler('b', 200))
+        queue.append(_queued_scheduler('a', 100))
+        assert queue.pop().netbox.sysname == 'a'
+        assert queue.pop().netbox.sysname == 'b'
+        assert queue.pop() is None
+
+    def test_should_prioritize_core_categories(self):
+        queue = schedule.JobQueue()
+        queue.append(_queued_scheduler('switch', 100, 'EDGE'))
+        queue.append(_queued_scheduler('router', 200, 'GW'))
+        assert queue.pop().netbox.sysname == 'router'
+
+    def test_netbox_without_category_should_not_be_prioritized(self):
+        queue = schedule.JobQueue()
+        queue.append(_queued_scheduler('unknown', 100, category=None))
+        queue.append(_queued_scheduler('switch', 110, 'EDGE'))
+        assert queue.pop().netbox.sysname == 'unknown'
+
+    def test_should_let_quick_jobs_pass_slow_ones(self):
+        queue = schedule.JobQueue()
+        queue.append(_queued_scheduler('slow', 100, runtime=200))
+        queue.append(_queued_scheduler('quick', 110, runtime=1))
+        assert queue.pop().netbox.sysname == 'quick'
+
+    def test_pop_should_skip_cancelled_schedulers(self):
+        queue = schedule.JobQueue()
+        cancelled = _queued_scheduler('a', 100)
+        cancelled.cancelled = True
+        queue.append(cancelled)
+        queue.append(_queued_scheduler('b', 200))
+        assert queue.pop().netbox.sysname == 'b'
+        assert not queue
+
+    def test_pop_with_predicate_should_keep_skipped_schedulers(self):
+        queue = schedule.JobQueue()
+        queue.append(_queued_scheduler('a', 100))
+        queue.append(_queued_scheduler('b', 200))
+        found = queue.pop(lambda s: s.netbox.sysname == 'b')
+        assert found.netbox.sysname == 'b'
+        assert [s.netbox.sysname for s in queue] == ['a']
+
+
+def test_queue_lateness_should_be_recorded(netbox_job_scheduler):
+    schedule.NetboxJobScheduler.queue_statistics.clear()
+    pool = netbox_job_scheduler.pool
+    pool.execute_job.return_value = defer.Deferred()
+    netbox_job_scheduler.queue_myself(schedule.JobQueue())
+    netbox_job_scheduler._queued_at -= 30
+    netbox_job_scheduler.run_job()
+    stats = schedule.NetboxJobScheduler.get_queue_statistics()['myjob']
+    assert stats.count == 1
+    assert stats.maximum >= 30
+    assert netbox_job_scheduler._queued_at is None
+
+
+def test_average_runtime_should_be_smoothed(netbox_job_scheduler):
+    netbox_job_scheduler._update_average_runtime(10)
+    assert netbox_job_scheduler.average_runtime == 10
+    netbox_job_scheduler._update_average_runtime(20)
+    assert 10 < netbox_job_scheduler.average_runtime < 20
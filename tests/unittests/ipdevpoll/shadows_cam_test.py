@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from mock import patch
+
+from nav.ipdevpoll.storage import ContainerRepository
+from nav.ipdevpoll.shadows import Netbox, Interface
+from nav.ipdevpoll.shadows.cam import Cam, CamManager, _copy_line
+
+
+class CopyLineTest(TestCase):
+    def test_should_separate_values_by_tabs(self):
+        self.assertEqual(_copy_line(1, 'aa:bb:cc:dd:ee:ff', 'Gi1/1'),
+                         u'1\taa:bb:cc:dd:ee:ff\tGi1/1\n')
+
+    def test_should_escape_special_characters(self):
+        self.assertEqual(_copy_line('a\tb\\c\nd'), u'a\\tb\\\\c\\nd\n')
+
+    def test_should_represent_none_as_null(self):
+        self.assertEqual(_copy_line(None), u'\\N\n')
+
+
+class CamManagerTest(TestCase):
+    def setUp(self):
+        self.repo = ContainerRepository()
+        netbox = self.repo.factory(None, Netbox)
+        netbox.id = 1
+        netbox.sysname = 'sw.example.org'
+        interface = self.repo.factory(1, Interface)
+        interface.ifname = 'Gi1/1'
+        self.repo.factory((1, 'aa:bb:cc:dd:ee:01'), Cam,
+                          1, 'aa:bb:cc:dd:ee:01')
+        self.repo.factory((2, 'aa:bb:cc:dd:ee:02'), Cam,
+                          2, 'aa:bb:cc:dd:ee:02')
+        CamManager.add_sentinel(self.repo)
+        self.manager = CamManager(Cam, self.repo)
+
+    def test_port_map_should_prefer_collected_interfaces(self):
+        self.manager._remove_sentinel()
+        self.manager._found = set(self.manager.get_managed())
+        with patch.object(self.manager, '_get_saved_ifnames',
+                          return_value={1: 'old', 2: 'Gi1/2'}):
+            self.assertEqual(self.manager._get_port_map(),
+                             {1: 'Gi1/1', 2: 'Gi1/2'})
+
+    def test_port_map_should_not_query_when_all_ports_are_known(self):
+        self.repo.factory(2, Interface).ifname = 'Gi1/2'
+        self.manager._remove_sentinel()
+        self.manager._found = set(self.manager.get_managed())
+        with patch.object(self.manager, '_get_saved_ifnames') as saved:
+            self.manager._get_port_map()
+            self.assertFalse(saved.called)
+
+    def test_prepare_should_copy_found_records_without_sentinel(self):
+        with patch('nav.ipdevpoll.shadows.cam.connection') as connection, \
+             patch.object(self.manager, '_get_saved_ifnames',
+                          return_value={}):
+            self.manager.prepare()
+            cursor = connection.cursor.return_value
+            data = cursor.copy_expert.call_args[0][1].getvalue()
+        self.assertEqual(sorted(data.splitlines()),
+                         [u'1\taa:bb:cc:dd:ee:01\tGi1/1',
+                          u'2\taa:bb:cc:dd:ee:02\t'])
@@ -0,0 +1,152 @@
+from mock import patch
+
+from twisted.internet import defer
+
+from nav.oids import OID
+from nav.ipdevpoll.snmp.common import AgentProxyMixIn
+from nav.ipdevpoll.snmp.responsecache import (
+    ResponseCache,
+    SYSUPTIME,
+    IFTABLELASTCHANGE,
+    resolve_object_name,
+)
+
+IFNAME = '.1.3.6.1.2.1.31.1.1.1.1'
+IFDESCR = '.1.3.6.1.2.1.2.2.1.2'
+IFXTABLE = '.1.3.6.1.2.1.31.1.1'
+
+
+class TestResponseCache(object):
+    def test_configured_subtree_should_be_cacheable(self):
+        cache = ResponseCache({IFNAME: 60})
+        assert cache.get_ttl([IFNAME]) == 60
+        assert cache.get_ttl([IFNAME + '.1']) == 60
+
+    def test_enclosing_table_should_not_be_cacheable(self):
+        cache = ResponseCache({IFNAME: 60})
+        assert cache.get_ttl([IFXTABLE]) is None
+
+    def test_request_should_only_be_cacheable_if_all_oids_are(self):
+        cache = ResponseCache({IFNAME: 60, IFDESCR: 30})
+        assert cache.get_ttl([IFNAME, IFDESCR]) == 30
+        assert cache.get_ttl([IFNAME, IFXTABLE]) is None
+
+    def test_expired_response_should_not_be_returned(self):
+        cache = ResponseCache({IFNAME: 60})
+        with patch('time.time', return_value=1000):
+            cache.set(1, (IFNAME,), {IFNAME: {}}, 60)
+        with patch('time.time', return_value=1030):
+            assert cache.get(1, (IFNAME,)) is not None
+        with patch('time.time', return_value=1061):
+            assert cache.get(1, (IFNAME,)) is None
+        assert len(cache) == 0
+
+    def test_least_recently_used_response_should_be_evicted(self):
+        cache = ResponseCache({IFNAME: 60}, max_size=4)
+        result = {IFNAME: {IFNAME + '.1': 'a', IFNAME + '.2': 'b'}}
+        cache.set(1, (IFNAME,), result, 60)
+        cache.set(2, (IFNAME,), result, 60)
+        cache.get(1, (IFNAME,))
+        cache.set(3, (IFNAME,), result, 60)
+        assert cache.get(1, (IFNAME,)) == result
+        assert cache.get(2, (IFNAME,)) is None
+        assert cache.size == 4
+
+    def test_reboot_should_invalidate_netbox(self):
+        cache = ResponseCache({IFNAME: 60})
+        cache.validate(1, 5000, 100)
+        cache.set(1, (IFNAME,), {}, 60)
+        cache.set(2, (IFNAME,), {}, 60)
+        cache.validate(1, 10, 100)
+        assert cache.get(1, (IFNAME,)) is None
+        assert cache.get(2, (IFNAME,)) is not None
+
+    def test_iftable_change_should_invalidate_netbox(self):
+        cache = ResponseCache({IFNAME: 60})
+        cache.validate(1, 5000, 100)
+        cache.set(1, (IFNAME,), {}, 60)
+        cache.validate(1, 6000, 5500)
+        assert cache.get(1, (IFNAME,)) is None
+
+    def test_unchanged_signals_should_keep_responses(self):
+        cache = ResponseCache({IFNAME: 60})
+        cache.validate(1, 5000, 100)
+        cache.set(1, (IFNAME,), {}, 60)
+        cache.validate(1, 6000, 100)
+        assert cache.get(1, (IFNAME,)) is not None
+
+
+def test_mib_object_name_should_resolve_to_oid():
+    assert resolve_object_name('IF-MIB::ifName') == OID(IFNAME)
+
+
+def test_numerical_oid_should_resolve_to_itself():
+    assert resolve_object_name(IFNAME) == OID(IFNAME)
+
+
+def test_unknown_object_name_should_not_resolve():
+    assert resolve_object_name('IF-MIB::ifFooBar') is None
+
+
+class FakeSnmpBackend(object):
+    def __init__(self, *args, **kwargs):
+        self.ip = '10.0.0.1'
+        self.table_requests = []
+        self.signal_requests = 0
+        self.signals = {SYSUPTIME: 5000, IFTABLELASTCHANGE: 100}
+
+    def getTable(self, oids, **kwargs):
+        self.table_requests.append(oids)
+        return defer.succeed({oids[0]: {}})
+
+    def get(self, oids):
+        self.signal_requests += 1
+        if isinstance(self.signals, Exception):
+            return defer.fail(self.signals)
+        return defer.succeed(self.signals)
+
+
+class FakeAgentProxy(AgentProxyMixIn, FakeSnmpBackend):
+    pass
+
+
+class TestAgentProxyResponseCache(object):
+    def test_second_session_should_get_cached_response(self):
+        cache = ResponseCache({IFNAME: 60})
+        FakeAgentProxy(response_cache=cache.for_netbox(1)).getTable([IFNAME])
+        agent = FakeAgentProxy(response_cache=cache.for_netbox(1))
+        result = []
+        agent.getTable([IFNAME]).addCallback(result.append)
+        assert result == [{IFNAME: {}}]
+        assert agent.table_requests == []
+
+    def test_uncacheable_request_should_not_check_signals(self):
+        cache = ResponseCache({IFNAME: 60})
+        agent = FakeAgentProxy(response_cache=cache.for_netbox(1))
+        agent.getTable([IFXTABLE])
+        assert agent.signal_requests == 0
+        assert len(cache) == 0
+
+    def test_signals_should_only_be_fetched_once_per_session(self):
+        cache = ResponseCache({IFNAME: 60, IFDESCR: 60})
+        agent = FakeAgentProxy(response_cache=cache.for_netbox(1))
+        agent.getTable([IFNAME])
+        agent.getTable([IFDESCR])
+        assert agent.signal_requests == 1
+
+    def test_device_signals_should_share_cache_signal_request(self):
+        cache = ResponseCache({IFNAME: 60})
+        agent = FakeAgentProxy(response_cache=cache.for_netbox(1))
+        agent.getTable([IFNAME])
+        result = []
+        agent.get_device_signals().addCallback(result.append)
+        assert result == [agent.signals]
+        assert agent.signal_requests == 1
+
+    def test_failed_signal_fetch_should_bypass_cache(self):
+        cache = ResponseCache({IFNAME: 60})
+        agent = FakeAgentProxy(response_cache=cache.for_netbox(1))
+        agent.signals = Exception("timeout")
+        agent.getTable([IFNAME])
+        assert agent.table_requests == [[IFNAME]]
+        assert len(cache) == 0
@@ -1,4 +1,7 @@
-from nav.ipdevpoll.storage import get_shadow_sort_order
+from mock import patch
+
+from nav.models import manage
+from nav.ipdevpoll.storage import get_shadow_sort_order, _group_updates
 from nav.ipdevpoll import shadows
 
 
@@ -8,3 +11,78 @@ from nav.ipdevpoll import shadows
 def test_netboxinfo_should_always_sort_last():
     classes = get_shadow_sort_order()
     assert classes[-1] is shadows.NetboxInfo
+
+
+def test_arp_should_support_bulk_save():
+    assert shadows.Arp.supports_bulk_save()
+
+
+def test_interface_should_support_bulk_save():
+    assert shadows.Interface.supports_bulk_save()
+
+
+def test_vlan_should_not_support_bulk_save():
+    assert not shadows.Vlan.supports_bulk_save()
+
+
+def test_group_updates_should_group_identical_updates():
+    updates = [(1, {'end_time': 42}), (2, {'end_time': 42}),
+               (3, {'end_time': 43})]
+    assert _group_updates(updates) == [({'end_time': 42}, [1, 2]),
+                                       ({'end_time': 43}, [3])]
+
+
+def test_group_updates_should_not_group_unhashable_updates():
+    updates = [(1, {'data': {}}), (2, {'data': {}})]
+    assert _group_updates(updates) == [({'data': {}}, [1]),
+                                       ({'data': {}}, [2])]
+
+
+def test_group_updates_should_skip_empty_updates():
+    assert _group_updates([(1, {})]) == []
+
+
+class TestResolveExistingModels(object):
+    def test_should_set_existing_model_on_match(self):
+        existing = manage.NetboxType(id=1, sysobjectid='1.2.3')
+        found = shadows.NetboxType(sysobjectid='1.2.3')
+        with patch.object(manage.NetboxType, 'objects') as objects:
+            objects.filter.return_value = [existing]
+            shadows.NetboxType.resolve_existing_models([found])
+        assert found.get_existing_model() is existing
+        assert found.id == 1
+
+    def test_should_mark_unmatched_shadow_as_nonexistent(self):
+        missing = shadows.NetboxType(sysobjectid='1.2.4')
+        with patch.object(manage.NetboxType, 'objects') as objects:
+            objects.filter.return_value = []
+            shadows.NetboxType.resolve_existing_models([missing])
+            assert missing.get_existing_model() is None
+            assert objects.get.call_count == 0
+
+    def test_should_leave_ambiguous_matches_to_get_existing_model(self):
+        dupes = [manage.NetboxType(id=1, sysobjectid='1.2.3'),
+                 manage.NetboxType(id=2, sysobjectid='1.2.3')]
+        found = shadows.NetboxType(sysobjectid='1.2.3')
+        with patch.object(manage.NetboxType, 'objects') as objects:
+            objects.filter.return_value = dupes
+            shadows.NetboxType.resolve_existing_models([found])
+        assert not found._cached_existing_model
+        assert not found._cached_no_existing_model
+
+
+class TestResolveExistingInterfaces(object):
+    def test_should_look_up_interfaces_by_id_in_bulk(self):
+        existing = manage.Interface(id=1, ifname='ge-0/0/1')
+        found = shadows.Interface(id=1)
+        missing = shadows.Interface(id=2)
+        unsaved = shadows.Interface(ifname='ge-0/0/3')
+        with patch.object(manage.Interface, 'objects') as objects:
+            objects.in_bulk.return_value = {1: existing}
+            shadows.Interface.resolve_existing_models(
+                [found, missing, unsaved])
+            assert found.get_existing_model() is existing
+            assert missing.get_existing_model() is None
+            assert unsaved.get_existing_model() is None
+            objects.in_bulk.assert_called_once_with([1, 2])
+            assert not objects.get.called
@@ -0,0 +1,101 @@
+import pickle
+import socket
+import struct
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from nav.metrics import carbon
+from nav.metrics.carbon import PickleSender, metrics_to_pickle
+
+
+class MetricsToPickleTests(TestCase):
+    def test_header_should_contain_payload_length(self):
+        message = metrics_to_pickle([('nav.foo', (1000, 42))])
+        length, = struct.unpack('!L', message[:4])
+        self.assertEqual(length, len(message) - 4)
+
+    def test_payload_should_unpickle_to_metric_tuples(self):
+        metrics = [('nav.foo', (1000.5, 42)), ('nav.bar', (1001, 1.5))]
+        message = metrics_to_pickle(metrics)
+        self.assertEqual(pickle.loads(message[4:]),
+                         [('nav.foo', (1000, 42)), ('nav.bar', (1001, 1.5))])
+
+
+class PickleSenderTests(TestCase):
+    def setUp(self):
+        self.sender = PickleSender('localhost', 2004, max_queue=3)
+
+    def test_send_should_queue_metrics(self):
+        self.sender.send([('a', (1, 1)), ('b', (1, 2))])
+        self.assertEqual(self.sender.queue_length, 2)
+        self.assertEqual(self.sender.queued, 2)
+
+    @patch('nav.metrics.carbon._handle_error')
+    def test_full_queue_should_drop_oldest_metrics(self, handle_error):
+        self.sender.send([('a', (1, 1)), ('b', (1, 2)), ('c', (1, 3)),
+                          ('d', (1, 4))])
+        self.assertEqual(self.sender.dropped, 1)
+        self.assertEqual(list(self.sender._queue),
+                         [('b', (1, 2)), ('c', (1, 3)), ('d', (1, 4))])
+        self.assertTrue(handle_error.called)
+
+    def test_flush_should_send_queued_metrics(self):
+        sock = Mock()
+        self.sender.send([('a', (1, 1)), ('b', (1, 2))])
+        with patch('socket.create_connection', return_value=sock):
+            self.sender.flush()
+        sock.sendall.assert_called_once_with(
+            metrics_to_pickle([('a', (1, 1)), ('b', (1, 2))]))
+        self.assertEqual(self.sender.sent, 2)
+        self.assertEqual(self.sender.queue_length, 0)
+
+    @patch('nav.metrics.carbon._handle_error')
+    def test_failed_send_should_requeue_and_back_off(self, _handle_error):
+        sock = Mock()
+        sock.sendall.side_effect = socket.error("broken pipe")
+        self.sender.send([('a', (1, 1)), ('b', (1, 2))])
+        with patch('socket.create_connection', return_value=sock) as connect:
+            self.sender.flush()
+            self.sender.flush()
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(self.sender.queue_length, 2)
+        self.assertEqual(self.sender.sent, 0)
+        self.assertIsNone(self.sender._socket)
+
+    @patch('nav.metrics.carbon.MAX_PICKLE_BATCH', 1)
+    def test_unpicklable_batch_should_be_dropped(self):
+        sock = Mock()
+        self.sender.send([('a', (1, lambda: None)), ('b', (1, 2))])
+        with patch('socket.create_connection', return_value=sock):
+            self.sender.flush()
+        sock.sendall.assert_called_once_with(
+            metrics_to_pickle([('b', (1, 2))]))
+        self.assertEqual(self.sender.dropped, 1)
+        self.assertEqual(self.sender.sent, 1)
+
+    def test_sender_thread_should_survive_unexpected_errors(self):
+        errors = [ValueError("bad data")]
+
+        def _flush():
+            if errors:
+                raise errors.pop()
+
+        with patch.object(self.sender, 'flush', side_effect=_flush) as flush:
+            with patch('nav.metrics.carbon.PICKLE_FLUSH_INTERVAL', 0.01):
+                self.sender.start()
+                self.sender._thread.join(0.5)
+                self.assertTrue(self.sender._thread.is_alive())
+                self.sender.stop()
+        self.assertFalse(self.sender._thread.is_alive())
+        self.assertGreaterEqual(flush.call_count, 2)
+
+    @patch('nav.metrics.carbon._handle_error')
+    def test_backoff_should_grow_exponentially(self, _handle_error):
+        with patch('socket.create_connection',
+                   side_effect=socket.error("refused")):
+            for _ in range(10):
+                self.sender._next_connect = 0
+                self.sender._connect()
+        self.assertEqual(self.sender._reconnect_delay,
+                         carbon.MAX_RECONNECT_DELAY)
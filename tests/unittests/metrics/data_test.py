@@ -2,8 +2,17 @@ import pytest
 from mock import patch
 from io import BytesIO
 
+from nav.metrics import data
 from nav.metrics.errors import GraphiteUnreachableError
-from nav.metrics.data import get_metric_data
+from nav.metrics.cache import ResultCache
+from nav.metrics.data import get_metric_data, clear_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
 
 
 def test_get_metric_data_without_target_should_return_empty_list():
@@ -23,3 +32,85 @@ def test_get_metric_data_can_parse_response():
     with patch('nav.metrics.data.urlopen') as urlopen:
         urlopen.return_value = BytesIO(b'[1]')
         assert get_metric_data(target) == [1]
+
+
+def test_get_metric_data_should_cache_results():
+    target = "nav.devices.example-sw_example_org.ports.1.ifInOctets"
+    with patch('nav.metrics.data.urlopen') as urlopen:
+        urlopen.side_effect = lambda req: BytesIO(b'[1]')
+        get_metric_data(target)
+        assert get_metric_data(target) == [1]
+        assert urlopen.call_count == 1
+
+
+def test_get_metric_data_should_attribute_coalesced_series_to_targets():
+    response = (b'[{"target": "nav.a", "datapoints": []},'
+                b' {"target": "nav.b", "datapoints": []}]')
+    with patch('nav.metrics.data.urlopen') as urlopen:
+        urlopen.return_value = BytesIO(response)
+        result = get_metric_data(['nav.b', 'nav.a'])
+        assert [s['target'] for s in result] == ['nav.b', 'nav.a']
+        assert urlopen.call_count == 1
+        assert get_metric_data('nav.a') == [
+            {'target': 'nav.a', 'datapoints': []}]
+        assert urlopen.call_count == 1
+
+
+def test_coalesce_should_put_plain_paths_in_same_request():
+    assert data._coalesce_targets(['nav.a', 'nav.b']) == [['nav.a', 'nav.b']]
+
+
+def test_coalesce_should_put_wildcard_targets_in_separate_requests():
+    assert data._coalesce_targets(['nav.a', 'nav.*', 'sum(nav.b.*)']) == [
+        ['nav.*'], ['sum(nav.b.*)'], ['nav.a']]
+
+
+def test_coalesce_should_batch_unattributable_targets_if_allowed():
+    assert data._coalesce_targets(['nav.a', 'nav.*', 'sum(nav.b.*)'],
+                                  attributable=False) == [
+        ['nav.a', 'nav.*', 'sum(nav.b.*)']]
+
+
+def test_get_metric_data_should_batch_multiple_wildcard_targets():
+    response = (b'[{"target": "nav.a.x", "datapoints": []},'
+                b' {"target": "nav.b.x", "datapoints": []}]')
+    with patch('nav.metrics.data.urlopen') as urlopen:
+        urlopen.side_effect = lambda req: BytesIO(response)
+        result = get_metric_data(['nav.a.{x,y}', 'nav.b.{x,y}'])
+        assert len(result) == 2
+        assert urlopen.call_count == 1
+        get_metric_data(['nav.a.{x,y}', 'nav.b.{x,y}'])
+        assert urlopen.call_count == 1
+
+
+def test_coalesce_should_respect_max_targets_per_request():
+    targets = ['nav.%d' % i for i in range(5)]
+    with patch('nav.metrics.data.MAX_TARGETS_PER_REQUEST', 2):
+        assert data._coalesce_targets(targets) == [
+            ['nav.0', 'nav.1'], ['nav.2', 'nav.3'], ['nav.4']]
+
+
+def test_result_cache_should_expire_entries():
+    cache = ResultCache(ttl=60)
+    cache.set('foo', [1])
+    assert cache.get('foo') == [1]
+    with patch('time.time', return_value=10 ** 11):
+        assert cache.get('foo') is None
+
+
+def test_result_cache_should_evict_oldest_entries():
+    cache = ResultCache(ttl=60, max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('c', 3)
+    assert cache.get('a') is None
+    assert cache.get('c') == 3
+
+
+def test_result_cache_should_not_share_values_with_callers():
+    cache = ResultCache(ttl=60)
+    value = [{'datapoints': [[1, 0]]}]
+    cache.set('foo', value)
+    value[0]['datapoints'].append([2, 60])
+    cache.get('foo')[0]['datapoints'].append([3, 120])
+    assert cache.get('foo') == [{'datapoints': [[1, 0]]}]
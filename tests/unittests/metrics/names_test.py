@@ -1,5 +1,7 @@
 import pytest
 from unittest import TestCase
+from mock import patch
+from nav.metrics import names
 from nav.metrics.names import join_series, escape_metric_name
 
 
@@ -31,3 +33,62 @@ class MetricNamingTests(TestCase):
 )
 def test_escape_metric_name(test_input, expected):
     assert escape_metric_name(test_input) == expected
+
+
+class NodeWalkTests(TestCase):
+    TREE = {
+        'nav.box.*': [
+            {'id': 'nav.box.cpu', 'leaf': 0},
+            {'id': 'nav.box.ports', 'leaf': 0},
+            {'id': 'nav.box.uptime', 'leaf': 1},
+        ],
+        'nav.box.*.*': [
+            {'id': 'nav.box.cpu.load', 'leaf': 1},
+            {'id': 'nav.box.ports.gi1', 'leaf': 0},
+        ],
+        'nav.box.*.*.*': [
+            {'id': 'nav.box.ports.gi1.ifInOctets', 'leaf': 1},
+        ],
+    }
+
+    def setUp(self):
+        names.invalidate_metric_tree_cache()
+        patcher = patch('nav.metrics.names.raw_metric_query',
+                        side_effect=lambda query: self.TREE.get(query, []))
+        self.raw_metric_query = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(names.invalidate_metric_tree_cache)
+
+    def test_nodewalk_should_walk_like_os_walk(self):
+        self.assertEqual(list(names.nodewalk('nav.box')), [
+            ('nav.box', ['nav.box.cpu', 'nav.box.ports'], ['nav.box.uptime']),
+            ('nav.box.cpu', [], ['nav.box.cpu.load']),
+            ('nav.box.ports', ['nav.box.ports.gi1'], []),
+            ('nav.box.ports.gi1', [], ['nav.box.ports.gi1.ifInOctets']),
+        ])
+
+    def test_get_all_leaves_below_should_skip_ignored_subtrees(self):
+        self.assertEqual(
+            names.get_all_leaves_below('nav.box', ['nav.box.ports']),
+            ['nav.box.uptime', 'nav.box.cpu.load'])
+
+    def test_nodewalk_should_make_one_query_per_level(self):
+        list(names.nodewalk('nav.box'))
+        queried = set(call[0][0]
+                      for call in self.raw_metric_query.call_args_list)
+        self.assertEqual(queried, set(['nav.box.*', 'nav.box.*.*',
+                                       'nav.box.*.*.*']))
+
+    def test_nodewalk_should_use_cached_results(self):
+        list(names.nodewalk('nav.box'))
+        count = self.raw_metric_query.call_count
+        list(names.nodewalk('nav.box'))
+        self.assertEqual(self.raw_metric_query.call_count, count)
+
+    def test_invalidate_should_only_remove_matching_queries(self):
+        names.cached_metric_query('nav.box.*')
+        names.cached_metric_query('nav.other.*')
+        names.invalidate_metric_tree_cache('nav.other.cpu')
+        names.cached_metric_query('nav.box.*')
+        names.cached_metric_query('nav.other.*')
+        self.assertEqual(self.raw_metric_query.call_count, 3)
@@ -1,5 +1,10 @@
+from datetime import timedelta
+
 import pytest
+from mock import patch
 
+from nav.metrics.thresholds import (ThresholdEvaluator, get_metric_maximums,
+                                    prefetch_values)
 from nav.metrics.graphs import (extract_series_name,
                                 translate_serieslist_to_regex)
 
@@ -39,3 +44,53 @@ def test_translate_serieslist_to_regex(series, matches, nonmatches):
 
     for string in nonmatches:
         assert not pattern.match(string), "%s matches %s" % (string, series)
+
+
+OCTETS = 'nav.devices.sw_example_org.ports.Gi1_1.ifInOctets'
+ERRORS = 'nav.devices.sw_example_org.ports.Gi1_1.ifInErrors'
+
+
+def test_get_metric_maximums_should_use_interface_speed():
+    with patch('nav.metrics.thresholds.Netbox.objects') as netboxes, \
+         patch('nav.metrics.thresholds.Interface.objects') as interfaces:
+        netboxes.values_list.return_value = [(1, 'sw.example.org'),
+                                             (2, 'other.example.org')]
+        interfaces.filter.return_value.values_list.return_value = [
+            (1, 'Gi1/1', 'GigabitEthernet1/1', 1000.0),
+        ]
+        result = get_metric_maximums([OCTETS, ERRORS])
+    assert result == {OCTETS: 1000.0 * 1e6}
+
+
+def test_get_metric_maximums_should_not_query_for_unknown_metrics():
+    with patch('nav.metrics.thresholds.Netbox.objects') as netboxes:
+        assert get_metric_maximums([ERRORS]) == {}
+        assert not netboxes.values_list.called
+
+
+def test_prefetch_values_should_request_each_period_once():
+    day = ThresholdEvaluator('nav.a', period=timedelta(days=1), raw=True)
+    day2 = ThresholdEvaluator('nav.b', period=timedelta(days=1), raw=True)
+    minutes = ThresholdEvaluator('nav.c', raw=True)
+    responses = {
+        '-1day': {'nav.a': [{'target': 'nav.a', 'datapoints': [[1, 0]]}],
+                  'nav.b': [{'target': 'nav.b', 'datapoints': [[2, 0]]}]},
+        '-10min': {'nav.c': [{'target': 'nav.c', 'datapoints': [[3, 0]]}]},
+    }
+    with patch('nav.metrics.thresholds.get_metric_data_by_target',
+               side_effect=lambda targets, start, end: responses[start]
+               ) as get_data:
+        prefetch_values([day, day2, minutes])
+    assert get_data.call_count == 2
+    assert day.result == {'nav.a': {'value': 1}}
+    assert day2.result == {'nav.b': {'value': 2}}
+    assert minutes.result == {'nav.c': {'value': 3}}
+
+
+def test_evaluate_should_use_prefetched_maximums():
+    evaluator = ThresholdEvaluator(OCTETS, raw=True)
+    evaluator.set_values({OCTETS: 600.0})
+    evaluator.maximums = {OCTETS: 1000.0}
+    with patch('nav.metrics.thresholds.lookup') as lookup:
+        assert evaluator.evaluate('>50%') == [(OCTETS, 600.0)]
+        assert not lookup.called
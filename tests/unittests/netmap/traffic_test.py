@@ -0,0 +1,93 @@
+from mock import Mock, patch
+
+from nav.netmap import traffic
+from nav.netmap.traffic import (
+    TrafficSnapshot,
+    get_traffic_data,
+    INOCTETS,
+    OUTOCTETS,
+)
+from nav.web.netmap import api
+
+
+def test_snapshot_should_slice_by_interface():
+    snapshot = TrafficSnapshot({1: {INOCTETS: 10, OUTOCTETS: 20}})
+    interface = Mock(pk=1)
+    assert interface in snapshot
+    assert snapshot[interface] == {INOCTETS: 10, OUTOCTETS: 20}
+    assert snapshot[Mock(pk=2)] == {}
+
+
+def test_snapshot_diff_should_only_contain_changes():
+    old = TrafficSnapshot({1: {INOCTETS: 1}, 2: {INOCTETS: 2},
+                           3: {INOCTETS: 3}})
+    new = TrafficSnapshot({1: {INOCTETS: 1}, 2: {INOCTETS: 5},
+                           4: {INOCTETS: 4}})
+    assert new.diff(old) == {2: {INOCTETS: 5}, 3: None, 4: {INOCTETS: 4}}
+    assert new.diff(None) == new.traffic
+
+
+def test_snapshot_should_be_stale_after_max_age():
+    snapshot = TrafficSnapshot({}, timestamp=1000)
+    with patch('time.time', return_value=1100):
+        assert not snapshot.is_stale(300)
+        assert snapshot.is_stale(60)
+
+
+@patch('nav.netmap.traffic.get_interface_data')
+def test_traffic_data_should_be_sliced_from_snapshot(get_interface_data):
+    snapshot = TrafficSnapshot({1: {INOCTETS: 10, OUTOCTETS: 20}})
+    source = traffic.Interface(pk=1, speed=1000)
+    target = traffic.Interface(pk=2, speed=1000)
+    data = get_traffic_data((source, target), snapshot)
+    assert data.source.in_bps == 10
+    assert data.target.in_bps == 20
+    assert not get_interface_data.called
+
+
+class TestGetTrafficSnapshot(object):
+    @patch('nav.netmap.traffic.build_traffic_snapshot')
+    @patch('nav.netmap.traffic.get_cached_traffic_snapshot')
+    def test_fresh_snapshot_should_be_reused(self, get_cached, build):
+        get_cached.return_value = TrafficSnapshot({})
+        assert traffic.get_traffic_snapshot() is get_cached.return_value
+        assert not build.called
+
+    @patch('nav.netmap.traffic.release_traffic_snapshot_refresh')
+    @patch('nav.netmap.traffic.set_cached_traffic_snapshot')
+    @patch('nav.netmap.traffic.claim_traffic_snapshot_refresh',
+           return_value=True)
+    @patch('nav.netmap.traffic.build_traffic_snapshot')
+    @patch('nav.netmap.traffic.get_cached_traffic_snapshot')
+    def test_stale_snapshot_should_be_rebuilt(self, get_cached, build,
+                                              _claim, set_cached, release):
+        get_cached.return_value = TrafficSnapshot({}, timestamp=0)
+        assert traffic.get_traffic_snapshot() is build.return_value
+        set_cached.assert_called_once_with(build.return_value)
+        assert release.called
+
+    @patch('nav.netmap.traffic.claim_traffic_snapshot_refresh',
+           return_value=False)
+    @patch('nav.netmap.traffic.build_traffic_snapshot')
+    @patch('nav.netmap.traffic.get_cached_traffic_snapshot')
+    def test_stale_snapshot_should_be_served_while_rebuilding(
+            self, get_cached, build, _claim):
+        get_cached.return_value = TrafficSnapshot({}, timestamp=0)
+        assert traffic.get_traffic_snapshot() is get_cached.return_value
+        assert not build.called
+
+
+@patch('nav.web.netmap.api.time')
+@patch('nav.web.netmap.api.get_traffic_snapshot')
+def test_traffic_stream_should_only_send_deltas(get_snapshot, clock):
+    clock.time.side_effect = [0, 0, 10, 20]
+    first = TrafficSnapshot({1: {INOCTETS: 1}, 2: {INOCTETS: 2}}, timestamp=1)
+    second = TrafficSnapshot({1: {INOCTETS: 1}, 2: {INOCTETS: 3}},
+                             timestamp=2)
+    get_snapshot.side_effect = [first, first, second]
+    events = list(api.stream_traffic_deltas(duration=25, interval=10))
+    assert len(events) == 3
+    assert '"1": {"in_bps": 1' in events[0]
+    assert events[1].startswith(':')
+    assert '"1"' not in events[2]
+    assert '"2": {"in_bps": 3' in events[2]
@@ -0,0 +1,91 @@
+from mock import Mock, patch
+import pytest
+
+from nav.snmptrapd import dispatch
+
+
+def make_trap(oid='.1.3.6.1.6.3.1.1.5.3'):
+    return Mock(snmpTrapOID=oid, netbox=None, agent='10.0.0.1', version=2)
+
+
+@pytest.fixture(autouse=True)
+def connection():
+    with patch('nav.snmptrapd.dispatch.nav.db.getConnection') as get:
+        yield get.return_value
+
+
+def test_batch_handler_should_get_all_traps_at_once(connection):
+    traps = [make_trap(), make_trap()]
+    handler = Mock(__name__='batch')
+    handler.handleTraps.return_value = [True, False]
+    dispatch.handle_traps(traps, [handler], config=None)
+    handler.handleTraps.assert_called_once_with(traps, config=None)
+    assert not handler.handleTrap.called
+    connection.rollback.assert_called_once_with()
+
+
+def test_single_trap_handler_should_get_one_trap_at_a_time():
+    traps = [make_trap(), make_trap()]
+    handler = Mock(__name__='single', spec=['handleTrap', '__name__'])
+    dispatch.handle_traps(traps, [handler], config=None)
+    assert handler.handleTrap.call_count == 2
+
+
+def test_failing_handler_should_not_stop_other_handlers():
+    failing = Mock(__name__='failing', spec=['handleTrap', '__name__'])
+    failing.handleTrap.side_effect = ValueError('boom')
+    other = Mock(__name__='other')
+    other.handleTraps.return_value = [True]
+    dispatch.handle_traps([make_trap()], [failing, other], config=None)
+    assert other.handleTraps.called
+
+
+def test_get_batch_should_return_waiting_traps():
+    queue = dispatch.queue.Queue()
+    for oid in '123':
+        queue.put(oid)
+    batch = dispatch.get_batch(queue, size=2)
+    assert batch == ['1', '2']
+
+
+def test_full_queue_should_drop_traps():
+    dispatcher = dispatch.TrapDispatcher([], None, workers=0, queue_size=1)
+    dispatcher._queues = [Mock()]
+    dispatcher._queues[0].put_nowait.side_effect = [None, dispatch.queue.Full]
+    dispatcher.dispatch(make_trap())
+    dispatcher.dispatch(make_trap())
+    assert dispatcher.received == 2
+    assert dispatcher.dropped == 1
+
+
+def test_traps_from_same_agent_should_go_to_same_worker():
+    dispatcher = dispatch.TrapDispatcher([], None, workers=0)
+    dispatcher._queues = [dispatch.queue.Queue() for _ in range(4)]
+    agents = ['10.0.0.%d' % i for i in range(8)] * 3
+    for agent in agents:
+        trap = make_trap()
+        trap.agent = agent
+        dispatcher.dispatch(trap)
+    for trap_queue in dispatcher._queues:
+        queued = dispatch.get_batch(trap_queue, size=100) \
+            if not trap_queue.empty() else []
+        for agent in set(trap.agent for trap in queued):
+            assert agents.count(agent) == sum(
+                1 for trap in queued if trap.agent == agent)
+
+
+@patch('nav.snmptrapd.dispatch.send_metrics')
+def test_metrics_should_be_reported(send_metrics):
+    dispatcher = dispatch.TrapDispatcher([], None, workers=0)
+    dispatcher.received = 3
+    dispatcher.dropped = 1
+    dispatcher._queues = [Mock(**{'qsize.return_value': 2}),
+                          Mock(**{'qsize.return_value': 1})]
+    dispatcher.report_metrics(timestamp=10)
+    [[metrics], _kwargs] = send_metrics.call_args
+    assert dict(metrics) == {
+        'nav.snmptrapd.received': (10, 3),
+        'nav.snmptrapd.dropped': (10, 1),
+        'nav.snmptrapd.handled': (10, 0),
+        'nav.snmptrapd.queue': (10, 3),
+    }
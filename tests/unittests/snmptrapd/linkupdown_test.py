@@ -0,0 +1,49 @@
+from mock import Mock, patch
+
+from nav.snmptrapd.handlers import linkupdown
+from nav.snmptrapd.trap import AgentNetbox, AgentMap
+
+
+class Config(object):
+    def get(self, section, option):
+        return '.1.3.6.1.2.1.2.2.1.1'
+
+
+def make_trap(oid, ifindex, netbox=AgentNetbox(1, 'switch', 'room')):
+    return Mock(snmpTrapOID=oid, netbox=netbox, agent='10.0.0.1',
+                varbinds={'.1.3.6.1.2.1.2.2.1.1.%s' % ifindex: ifindex})
+
+
+@patch('nav.snmptrapd.handlers.linkupdown.EventQ')
+@patch('nav.snmptrapd.handlers.linkupdown.get_interfaces_details')
+def test_link_traps_should_be_posted_as_one_batch(get_details, eventq):
+    get_details.return_value = {
+        (1, 1): (11, 100, 'module', 'ge-0/0/1', 'uplink'),
+        (1, 2): (12, 100, 'module', 'ge-0/0/2', ''),
+    }
+    traps = [
+        make_trap(linkupdown.LINKDOWN, '1'),
+        make_trap('.1.2.3', '1'),
+        make_trap(linkupdown.LINKUP, '2'),
+        make_trap(linkupdown.LINKUP, '3'),
+        make_trap(linkupdown.LINKUP, '1', netbox=None),
+    ]
+    accepted = linkupdown.handleTraps(traps, Config())
+
+    assert accepted == [True, False, True, False, False]
+    assert get_details.call_count == 1
+    [[events], _kwargs] = eventq.post_events.call_args
+    assert [(e.subid, e.state, e['alerttype']) for e in events] == [
+        (11, 's', 'linkDown'), (12, 'e', 'linkUp')]
+
+
+@patch('nav.snmptrapd.trap.getConnection')
+def test_agent_map_should_only_query_when_stale(get_connection):
+    cursor = get_connection.return_value.cursor.return_value
+    cursor.fetchall.return_value = [('10.0.0.1', 1, 'switch', 'room'),
+                                    ('2001:db8::0:1', 2, 'router', 'room')]
+    agents = AgentMap(refresh_interval=60)
+    assert agents.get('10.0.0.1') == AgentNetbox(1, 'switch', 'room')
+    assert agents.get('2001:db8::1').sysname == 'router'
+    assert agents.get('10.0.0.2') is None
+    assert cursor.execute.call_count == 1
@@ -0,0 +1,146 @@
+import psycopg2
+import pytest
+from mock import Mock, patch
+
+from nav.statemon import db
+from nav.statemon.event import Event
+
+
+def make_event(serviceid=1, status=Event.DOWN, eventtype=Event.serviceState,
+               source='serviceping', **kwargs):
+    return Event(serviceid, 10, None, eventtype, source, status, **kwargs)
+
+
+@pytest.fixture
+def database(tmpdir):
+    instance = db._DB()
+    instance.spool_file = str(tmpdir.join('servicemon-eventq.json'))
+    instance.db = Mock()
+    cursor = instance.db.cursor.return_value
+    cursor.fetchall.side_effect = lambda: [
+        (i,) for i in range(1, cursor.execute.call_args[0][1][0] + 1)]
+    return instance
+
+
+@patch('nav.statemon.db.execute_values')
+def test_batch_should_be_inserted_in_one_transaction(execute_values,
+                                                     database):
+    database.commit_events([make_event(1, Event.DOWN, info='gone'),
+                            make_event(2, Event.UP, info='back')])
+
+    eventq, eventqvar = [call[0][2] for call in execute_values.call_args_list]
+    assert eventq == [
+        (1, 1, 10, Event.serviceState, 's', 1, 'serviceping', 'eventEngine'),
+        (2, 2, 10, Event.serviceState, 'e', 100, 'serviceping', 'eventEngine'),
+    ]
+    assert eventqvar == [(1, 'descr', 'gone'), (2, 'descr', 'back')]
+    database.db.commit.assert_called_once_with()
+
+
+@patch('nav.statemon.db.execute_values')
+def test_version_events_should_update_services(execute_values, database):
+    database.commit_events([make_event(5, eventtype='version',
+                                       version='OpenSSH_7.4')])
+    cursor = database.db.cursor.return_value
+    assert cursor.executemany.call_args[0][1] == [('OpenSSH_7.4', 5)]
+    assert not execute_values.called
+
+
+@patch('nav.statemon.db.execute_values')
+def test_events_with_invalid_source_should_be_dropped(execute_values,
+                                                      database):
+    database.commit_events([make_event(source='bogus')])
+    assert not execute_values.called
+
+
+@patch('nav.statemon.db.execute_values')
+def test_integrity_error_should_retry_events_one_by_one(execute_values,
+                                                        database):
+    def _fail_for_service_2(cursor, sql, rows):
+        if any(row[1] == 2 for row in rows):
+            raise psycopg2.IntegrityError()
+
+    execute_values.side_effect = _fail_for_service_2
+    database.commit_events([make_event(1), make_event(2), make_event(3)])
+    assert database.db.commit.call_count == 2
+
+
+@patch('nav.statemon.db.execute_values')
+def test_unadaptable_value_should_only_throw_away_its_event(execute_values,
+                                                            database):
+    def _fail_for_service_2(cursor, sql, rows):
+        if any(row[1] == 2 for row in rows):
+            raise psycopg2.ProgrammingError("can't adapt type")
+
+    execute_values.side_effect = _fail_for_service_2
+    database.commit_events([make_event(1), make_event(2), make_event(3)])
+    assert database.db.commit.call_count == 2
+
+
+@patch('nav.statemon.db.execute_values')
+def test_outage_while_committing_one_by_one_should_keep_unwritten_events(
+        execute_values, database):
+    execute_values.side_effect = [
+        psycopg2.DataError(), None, None, psycopg2.OperationalError()]
+    events = [make_event(1), make_event(2)]
+    with pytest.raises(db.DbError) as error:
+        database.commit_events(events)
+    assert error.value.unwritten == events[1:]
+
+
+@patch('nav.statemon.db.execute_values', side_effect=psycopg2.OperationalError)
+def test_database_failure_should_raise_dberror(_execute_values, database):
+    with pytest.raises(db.DbError):
+        database.commit_events([make_event()])
+    database.db.rollback.assert_called_once_with()
+
+
+def test_spooled_events_should_be_loaded(database):
+    database.save_spool([make_event(1, info='x'), make_event(2)])
+    events = database.load_spool()
+    assert [(e.serviceid, e.info) for e in events] == [(1, 'x'), (2, '')]
+
+
+def test_unserializable_event_values_should_be_spooled_as_text(database):
+    database.save_spool([make_event(1, eventtype='version',
+                                    version=Mock(__str__=lambda _: '1.0'))])
+    assert [e.version for e in database.load_spool()] == ['1.0']
+
+
+def test_empty_spool_should_remove_spool_file(database, tmpdir):
+    database.save_spool([make_event()])
+    database.save_spool([])
+    assert not tmpdir.listdir()
+    assert database.load_spool() == []
+
+
+def test_collect_events_should_batch_queued_events(database):
+    for serviceid in range(3):
+        database.queue.put(make_event(serviceid))
+    with patch('nav.statemon.db.FLUSH_WINDOW', 0.01):
+        events = database.collect_events()
+    assert [e.serviceid for e in events] == [0, 1, 2]
+
+
+def test_collect_events_should_respect_max_batch_size(database):
+    for serviceid in range(3):
+        database.queue.put(make_event(serviceid))
+    with patch('nav.statemon.db.MAX_BATCH_SIZE', 2):
+        assert len(database.collect_events()) == 2
+
+
+def test_collect_events_should_not_block_when_asked_not_to(database):
+    assert database.collect_events(block=False) == []
+
+
+@patch('nav.statemon.db.send_metrics')
+def test_queue_depth_should_include_pending_events(send_metrics, database):
+    database.program = 'pping'
+    database.queue.put(make_event())
+    database.report_queue_depth(pending=4)
+    database.report_queue_depth(pending=4)
+    [[metrics], _kwargs] = send_metrics.call_args
+    [(path, (_timestamp, depth))] = metrics
+    assert path == 'nav.statemon.pping.eventQueue'
+    assert depth == 5
+    assert send_metrics.call_count == 1
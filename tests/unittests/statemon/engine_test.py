@@ -0,0 +1,87 @@
+from mock import Mock, patch
+
+from twisted.internet import defer, task
+
+from nav.statemon.engine import CheckEngine
+from nav.statemon.event import Event
+
+
+class FakeChecker(object):
+    def __init__(self, result=None, blocking_result=None):
+        self.result = result
+        self.blocking_result = blocking_result
+        self.version = ''
+        self.sysname = 'example-sw'
+        self.handled = []
+
+    def get_type(self):
+        return 'fake'
+
+    def execute_test_async(self):
+        return self.result
+
+    def execute_test(self):
+        return self.blocking_result
+
+    def handle_result(self, status, info, orig_version):
+        self.handled.append((status, info))
+
+
+def test_native_checker_should_run_on_reactor():
+    engine = CheckEngine()
+    checker = FakeChecker(result=defer.succeed((Event.UP, 'Alive')))
+    engine.run(checker)
+    assert checker.handled == [(Event.UP, 'Alive')]
+    assert checker.runq is engine
+    assert engine.active == 0
+
+
+@patch('nav.statemon.engine.threads.deferToThreadPool')
+def test_blocking_checker_should_run_in_thread_pool(defer_to_thread):
+    defer_to_thread.side_effect = lambda _r, _pool, func: defer.succeed(func())
+    engine = CheckEngine()
+    checker = FakeChecker(blocking_result=(Event.DOWN, 'Refused'))
+    engine.run(checker)
+    assert checker.handled == [(Event.DOWN, 'Refused')]
+    assert defer_to_thread.called
+
+
+def test_active_checker_should_not_be_run_again():
+    engine = CheckEngine()
+    result = defer.Deferred()
+    checker = FakeChecker(result=result)
+    engine.run(checker)
+    engine.run(checker)
+    result.callback((Event.UP, 'Alive'))
+    assert checker.handled == [(Event.UP, 'Alive')]
+
+
+def test_concurrent_checks_should_be_limited():
+    engine = CheckEngine(max_concurrent=1)
+    first, second = defer.Deferred(), defer.succeed((Event.UP, 'Alive'))
+    checkers = [FakeChecker(result=first), FakeChecker(result=second)]
+    for checker in checkers:
+        engine.run(checker)
+    assert checkers[1].handled == []
+    first.callback((Event.UP, 'Alive'))
+    assert checkers[1].handled == [(Event.UP, 'Alive')]
+
+
+def test_scheduled_checker_should_run_at_timestamp():
+    clock = task.Clock()
+    engine = CheckEngine(clock=clock)
+    checker = FakeChecker(result=defer.succeed((Event.UP, 'Alive')))
+    with patch('time.time', return_value=1000):
+        engine.enq((1005, checker))
+    clock.advance(4)
+    assert checker.handled == []
+    clock.advance(1)
+    assert checker.handled == [(Event.UP, 'Alive')]
+
+
+def test_unexpected_failure_should_not_keep_checker_active():
+    engine = CheckEngine()
+    checker = FakeChecker(result=defer.succeed((Event.UP, 'Alive')))
+    checker.handle_result = Mock(side_effect=ValueError)
+    engine.run(checker)
+    assert engine.active == 0
@@ -0,0 +1,94 @@
+import errno
+import socket
+import struct
+
+from mock import Mock
+
+from nav.statemon.icmppacket import PacketV4
+from nav.statemon.megaping import (
+    MegaPing,
+    TokenBucket,
+    _receive_all,
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_should_allow_bursts():
+    clock = FakeClock()
+    bucket = TokenBucket(100, burst=10, clock=clock, sleeper=clock.sleep)
+    for _ in range(10):
+        bucket.consume()
+    assert clock.now == 1000.0
+
+
+def test_token_bucket_should_keep_average_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(100, burst=10, clock=clock, sleeper=clock.sleep)
+    for _ in range(1010):
+        bucket.consume()
+    assert abs(clock.now - 1010.0) < 0.11
+
+
+def _pinger(hosts, **conf):
+    conf.setdefault('checkinterval', 20)
+    pinger = MegaPing([Mock(), Mock()], conf=conf)
+    pinger.set_hosts(hosts)
+    pinger.reset()
+    return pinger
+
+
+def _reply(pinger, index, token=None):
+    packet = PacketV4()
+    packet.type = PacketV4.ICMP_ECHO_REPLY
+    packet.id = pinger._pid
+    token = pinger._round_token if token is None else token
+    packet.data = (token + struct.pack('!I', index)).ljust(20)
+    # IPv4 raw sockets include the IP header
+    return b'\0' * 20 + packet.assemble()
+
+
+def test_reply_should_be_recorded_by_cookie_index():
+    pinger = _pinger(['10.0.0.1', '10.0.0.2'])
+    pinger._sent[1] = 100.0
+    pinger._process_response(_reply(pinger, 1), ('10.0.0.2', 0), False,
+                             100.5)
+    results = dict(pinger.results())
+    assert results[pinger._round_hosts[1].ip] == 0.5
+    assert results[pinger._round_hosts[0].ip] == -1
+
+
+def test_reply_from_previous_round_should_be_counted_as_late():
+    pinger = _pinger(['10.0.0.1'])
+    previous = pinger._round_token
+    pinger.reset()
+    pinger._sent[0] = 100.0
+    pinger._process_response(_reply(pinger, 0, previous),
+                             ('10.0.0.1', 0), False, 100.5)
+    assert pinger._late_replies == 1
+    assert pinger.results() == [('10.0.0.1', -1)]
+
+
+def test_send_rate_should_be_increased_to_fit_check_interval():
+    pinger = _pinger(['10.0.%d.%d' % (i // 256, i % 256)
+                      for i in range(2000)],
+                     delay=10, timeout=5, checkinterval=25)
+    assert pinger.get_send_rate() == 100.0
+
+
+def test_receive_all_should_drain_socket():
+    sock = Mock()
+    sock.recvfrom.side_effect = [(b'a', 'x'), (b'b', 'y'),
+                                 socket.error(errno.EAGAIN, 'again')]
+    packets = _receive_all(sock)
+    assert [packet for packet, _sender, _arrival in packets] == [b'a', b'b']
+
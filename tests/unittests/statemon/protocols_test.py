@@ -0,0 +1,111 @@
+from mock import Mock, patch
+
+from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransport
+
+from nav.statemon.protocols import LineConnection, CheckTimeout
+from nav.statemon.checker.HttpChecker import HttpChecker
+from nav.statemon.checker.SmtpChecker import SmtpChecker
+from nav.statemon.checker.SshChecker import SshChecker
+from nav.statemon.event import Event
+
+
+def _connection():
+    conn = LineConnection()
+    conn.factory = Mock()
+    conn.makeConnection(StringTransport())
+    return conn
+
+
+def test_lines_should_be_read_in_order():
+    conn = _connection()
+    conn.dataReceived(b'first\r\nsecond\n')
+    lines = []
+    conn.read_line().addCallback(lines.append)
+    conn.read_line().addCallback(lines.append)
+    assert lines == ['first', 'second']
+
+
+def test_pending_read_should_get_next_line():
+    conn = _connection()
+    lines = []
+    conn.read_line().addCallback(lines.append)
+    conn.dataReceived(b'SSH-2.0-OpenSSH\r\n')
+    assert lines == ['SSH-2.0-OpenSSH']
+
+
+def test_expired_connection_should_fail_pending_reads():
+    conn = _connection()
+    failures = []
+    conn.read_line().addErrback(failures.append)
+    conn.expire(5)
+    conn.connectionLost(Mock())
+    assert failures[0].check(CheckTimeout)
+
+
+class FakeConnection(object):
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.sent = []
+        self.closed = False
+
+    def read_line(self):
+        if self.lines:
+            return defer.succeed(self.lines.pop(0))
+        return defer.fail(CheckTimeout(5))
+
+    def send_line(self, line):
+        self.sent.append(line)
+
+    send = send_line
+
+    def close(self):
+        self.closed = True
+
+
+class TestNativeCheckers(object):
+    def _run(self, checker_class, lines, **args):
+        module = checker_class.__module__
+        with patch('nav.statemon.abstractchecker.config'), \
+                patch('nav.statemon.abstractchecker.db'), \
+                patch('nav.statemon.abstractchecker.RunQueue'), \
+                patch(module + '.connect_lines') as connect:
+            checker = checker_class({
+                'id': 1, 'ip': '10.0.0.1', 'netboxid': 1, 'args': args,
+                'version': '', 'sysname': 'example'})
+            conn = FakeConnection(lines)
+            connect.return_value = defer.succeed(conn)
+            result = []
+            checker.execute_test_async().addCallback(result.append)
+        return result[0], checker, conn
+
+    def test_ssh_banner_should_set_version(self):
+        result, checker, conn = self._run(SshChecker, ['SSH-2.0-OpenSSH_7.4'])
+        assert result == (Event.UP, 'SSH-2.0-OpenSSH_7.4')
+        assert checker.version == 'SSH-2.0-OpenSSH_7.4'
+        assert conn.sent == ['SSH-2.0-NAV_Servicemon']
+        assert conn.closed
+
+    def test_http_redirect_should_be_up(self):
+        result, checker, conn = self._run(
+            HttpChecker, ['HTTP/1.1 302 Found', 'Server: nginx', '', 'x'],
+            url='http://www.example.org/foo?bar=1')
+        assert result == (Event.UP, 'OK (302) nginx')
+        assert conn.sent[:2] == ['GET /foo?bar=1 HTTP/1.0',
+                                 'Host: www.example.org']
+
+    def test_http_error_should_be_down(self):
+        result, _checker, _conn = self._run(
+            HttpChecker, ['HTTP/1.1 500 Internal Server Error', ''])
+        assert result == (Event.DOWN, 'ERROR (500) /')
+
+    def test_multiline_smtp_greeting_should_be_parsed(self):
+        result, _checker, conn = self._run(
+            SmtpChecker, ['220-mail.example.org ESMTP Postfix',
+                          '220 Ready'])
+        assert result == (Event.UP, 'mail.example.org ESMTP Postfix\nReady')
+        assert conn.sent == ['QUIT']
+
+    def test_timeout_should_be_down(self):
+        result, _checker, _conn = self._run(SmtpChecker, [])
+        assert result == (Event.DOWN, 'Timed out after 5 seconds')
@@ -0,0 +1,120 @@
+from django.db import transaction
+from mock import patch
+import networkx as nx
+import pytest
+
+from nav.models.manage import Interface, Netbox, SwPortVlan, Vlan
+from nav.topology import vlan
+
+
+def _netbox(netboxid):
+    return Netbox(id=netboxid, sysname='switch%d' % netboxid)
+
+
+def _interface(ifcid, netbox, vlan_tag):
+    return Interface(id=ifcid, netbox=netbox, ifname='if%d' % ifcid,
+                     vlan=vlan_tag, trunk=False)
+
+
+def _link(graph, ifc, peer):
+    ifc.to_netbox, ifc.to_interface = peer.netbox, peer
+    peer.to_netbox, peer.to_interface = ifc.netbox, ifc
+    graph.add_edge(ifc.netbox, peer.netbox, key=ifc)
+    graph.add_edge(peer.netbox, ifc.netbox, key=peer)
+
+
+@pytest.fixture
+def analyzer():
+    """An analyzer for two switches linked on VLAN 10, and two others linked
+    on VLAN 20, with unrouted VLAN candidates seeded on all of them.
+    """
+    a, b, c, d = (_netbox(i) for i in range(1, 5))
+    graph = nx.MultiDiGraph()
+    _link(graph, _interface(11, a, 10), _interface(12, b, 10))
+    _link(graph, _interface(13, c, 20), _interface(14, d, 20))
+
+    instance = vlan.VlanGraphAnalyzer.__new__(vlan.VlanGraphAnalyzer)
+    instance.processes = 1
+    instance.routed_vlans = {}
+    instance.unrouted_vlans = {
+        Vlan(id=100 + netbox.id, vlan=tag, netbox=netbox, net_ident='x')
+        for netbox, tag in ((a, 10), (b, 10), (c, 20), (d, 20))}
+    instance.layer2 = graph
+    instance.stp_blocked = {}
+    instance.non_trunk_ports = {}
+    instance.ifc_vlan_map = {}
+    instance._interfaces = None
+    instance._groups = []
+    return instance
+
+
+def _summarize(ifc_vlan_map):
+    return {(ifc.id, vlan_.id, direction)
+            for ifc, vlans in ifc_vlan_map.items()
+            for vlan_, direction in vlans.items()}
+
+
+def test_unrouted_vlans_should_be_pruned_by_earlier_candidates(analyzer):
+    result = _summarize(analyzer.analyze_all())
+    assert result == {
+        (11, 101, 'undefined'), (12, 101, 'undefined'),
+        (13, 103, 'undefined'), (14, 103, 'undefined'),
+    }
+    assert not analyzer.unrouted_vlans
+
+
+def test_parallel_analysis_should_match_serial_analysis(analyzer):
+    serial = _summarize(analyzer.analyze_all())
+
+    analyzer.processes = 2
+    analyzer.ifc_vlan_map = {}
+    analyzer.unrouted_vlans = {
+        Vlan(id=100 + netbox.id, vlan=netbox.id < 3 and 10 or 20,
+             netbox=netbox, net_ident='x')
+        for netbox in analyzer.layer2.nodes()}
+    parallel_map = analyzer.analyze_all()
+
+    assert _summarize(parallel_map) == serial
+    layer2_interfaces = {ifc for _u, _v, ifc
+                         in analyzer.layer2.edges(keys=True)}
+    assert all(any(ifc is known for known in layer2_interfaces)
+               for ifc in parallel_map)
+
+
+def test_non_trunk_ports_should_activate_vlan_on_trunk_destination():
+    a, b = _netbox(1), _netbox(2)
+    trunk = Interface(id=1, netbox=a, trunk=True, to_interface_id=2)
+    analyzer = vlan.UnroutedVlanTopologyAnalyzer(
+        Vlan(vlan=10), a, nx.MultiDiGraph(),
+        non_trunk_ports={(2, 10): {2, 3}})
+    assert analyzer._is_vlan_active_on_destination(b, trunk)
+    analyzer.non_trunk_ports = {(2, 10): {2}}
+    assert not analyzer._is_vlan_active_on_destination(b, trunk)
+
+
+@patch('nav.topology.vlan.SwPortVlan.objects')
+def test_updater_should_only_write_the_difference(objects):
+    netbox = _netbox(1)
+    up, changed, new = (_interface(i, netbox, 10) for i in (1, 2, 3))
+    vlan10 = Vlan(id=10, vlan=10)
+    objects.values_list.return_value.iterator.return_value = [
+        (1001, 1, 10, SwPortVlan.DIRECTION_UP),
+        (1002, 2, 10, SwPortVlan.DIRECTION_UP),
+        (1004, 4, 10, SwPortVlan.DIRECTION_DOWN),
+    ]
+    updater = vlan.VlanTopologyUpdater({
+        up: {vlan10: 'up'},
+        changed: {vlan10: 'down'},
+        new: {vlan10: 'blocked'},
+    })
+    with patch.object(transaction.Atomic, '__enter__'), \
+            patch.object(transaction.Atomic, '__exit__', return_value=False):
+        updater.update()
+
+    objects.filter.assert_any_call(id__in=[1004])
+    objects.filter.assert_any_call(id__in=[1002])
+    objects.filter.return_value.update.assert_called_once_with(
+        direction=SwPortVlan.DIRECTION_DOWN)
+    [created], _kwargs = objects.bulk_create.call_args
+    assert [(s.interface_id, s.vlan_id, s.direction) for s in created] == [
+        (3, 10, SwPortVlan.DIRECTION_BLOCKED)]
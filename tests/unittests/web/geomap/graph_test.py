@@ -0,0 +1,130 @@
+import random
+from math import sqrt
+
+import pytest
+
+from nav.web.geomap import graph as geograph
+from nav.web.geomap.graph import Graph, Node, PlaceIndex
+from nav.web.geomap.utils import avg
+
+BOUNDS = {'minLon': 0.0, 'maxLon': 10.0, 'minLat': 60.0, 'maxLat': 65.0}
+VIEWPORT = {'width': 1000, 'height': 500}
+LIMIT = 30
+
+
+def make_rooms(count, seed=42):
+    rand = random.Random(seed)
+    return [Node('room%d' % i, rand.uniform(0, 10), rand.uniform(60, 65), {})
+            for i in range(count)]
+
+
+def make_netbox_graph(rooms, netboxes_per_room=2):
+    graph = Graph()
+    for room in rooms:
+        for i in range(netboxes_per_room):
+            graph.add_node(Node('%s-%d' % (room.id, i), room.lon, room.lat,
+                                {'roomid': room.id}))
+    return graph
+
+
+def naive_places(rooms, lon_scale, lat_scale, limit):
+    """The original nested loop clustering of create_places"""
+    def distance(node, place):
+        return sqrt(((node.lon - place['lon']) * lon_scale) ** 2 +
+                    ((node.lat - place['lat']) * lat_scale) ** 2)
+
+    places = []
+    for node in rooms:
+        for place in places:
+            if distance(node, place) < limit:
+                place['rooms'].append(node)
+                place['lon'] = avg([n.lon for n in place['rooms']])
+                place['lat'] = avg([n.lat for n in place['rooms']])
+                break
+        else:
+            places.append({'lon': node.lon, 'lat': node.lat, 'rooms': [node]})
+    return [[n.id for n in place['rooms']] for place in places]
+
+
+@pytest.mark.parametrize('limit', [0, 5, 30, 200])
+def test_place_index_should_cluster_like_nested_loops(limit):
+    rooms = make_rooms(500)
+    lon_scale, lat_scale = geograph.get_scale(BOUNDS, VIEWPORT)
+    index = PlaceIndex(lon_scale, lat_scale, limit)
+    for room in rooms:
+        index.add_room(room.id, room.lon, room.lat)
+    assert ([place.rooms for place in index.places] ==
+            naive_places(rooms, lon_scale, lat_scale, limit))
+
+
+def test_place_position_should_be_average_of_rooms():
+    index = PlaceIndex(100, 100, LIMIT)
+    for roomid, lon in enumerate((1.0, 1.1, 1.2)):
+        index.add_room(roomid, lon, 60.0)
+    [place] = index.places
+    assert place.lon == pytest.approx(1.1)
+    assert place.lat == pytest.approx(60.0)
+
+
+def test_rooms_within_should_match_bounds():
+    rooms = make_rooms(300)
+    index = PlaceIndex(100, 100, LIMIT)
+    for room in rooms:
+        index.add_room(room.id, room.lon, room.lat)
+    bounds = {'minLon': 2.5, 'maxLon': 4.0, 'minLat': 61.0, 'maxLat': 64.2}
+    assert index.rooms_within(bounds) == {
+        room.id for room in rooms
+        if 2.5 <= room.lon <= 4.0 and 61.0 <= room.lat <= 64.2}
+
+
+def test_area_filter_with_index_should_keep_same_nodes():
+    rooms = make_rooms(100)
+    bounds = {'minLon': 2.0, 'maxLon': 5.0, 'minLat': 61.0, 'maxLat': 63.0}
+    plain = make_netbox_graph(rooms)
+    indexed = make_netbox_graph(rooms)
+    index = geograph.get_place_index(indexed, BOUNDS, VIEWPORT, LIMIT)
+    geograph.area_filter(plain, bounds)
+    geograph.area_filter(indexed, bounds, index)
+    assert set(plain.nodes) == set(indexed.nodes)
+
+
+def test_place_index_should_be_cached_per_scale():
+    rooms = make_rooms(50)
+    index = geograph.get_place_index(make_netbox_graph(rooms), BOUNDS,
+                                     VIEWPORT, LIMIT)
+    panned = {'minLon': 1.0, 'maxLon': 11.0, 'minLat': 60.0, 'maxLat': 65.0}
+    assert geograph.get_place_index(make_netbox_graph(rooms), panned,
+                                    VIEWPORT, LIMIT) is index
+    zoomed = {'minLon': 0.0, 'maxLon': 5.0, 'minLat': 60.0, 'maxLat': 62.5}
+    assert geograph.get_place_index(make_netbox_graph(rooms), zoomed,
+                                    VIEWPORT, LIMIT) is not index
+
+
+def test_place_index_should_be_cached_per_zoom_level_when_given():
+    rooms = make_rooms(50)
+    index = geograph.get_place_index(make_netbox_graph(rooms), BOUNDS,
+                                     VIEWPORT, LIMIT, zoom=7)
+    # In a Mercator projection, the latitude span changes when panning north
+    panned = {'minLon': 1.0, 'maxLon': 11.0, 'minLat': 61.0, 'maxLat': 65.6}
+    assert geograph.get_place_index(make_netbox_graph(rooms), panned,
+                                    VIEWPORT, LIMIT, zoom=7) is index
+    assert geograph.get_place_index(make_netbox_graph(rooms), BOUNDS,
+                                    VIEWPORT, LIMIT, zoom=8) is not index
+
+
+def test_place_index_should_not_be_shared_by_different_rooms():
+    index = geograph.get_place_index(make_netbox_graph(make_rooms(50)),
+                                     BOUNDS, VIEWPORT, LIMIT, zoom=7)
+    other = geograph.get_place_index(
+        make_netbox_graph(make_rooms(50, seed=1)), BOUNDS, VIEWPORT, LIMIT,
+        zoom=7)
+    assert other is not index
+
+
+def test_simplify_should_collapse_netboxes_to_places():
+    graph = make_netbox_graph(make_rooms(200))
+    geograph.simplify(graph, BOUNDS, VIEWPORT, LIMIT)
+    places = list(graph.nodes.values())
+    assert sum(place.properties['num_netboxes'] for place in places) == 400
+    assert sum(place.properties['num_rooms'] for place in places) == 200
+    assert 1 < len(places) < 200
@@ -0,0 +1,110 @@
+import random
+
+from IPy import IP, IPSet
+
+from nav.web.ipam.prefix_index import (
+    PrefixIndex,
+    NavPrefixIndex,
+    PrefixEntry,
+    get_empty_ranges,
+)
+
+
+def test_walk_should_return_prefixes_in_ip_order():
+    prefixes = ['10.0.1.0/24', '::/0', '10.0.0.0/8', '10.0.0.0/16',
+                '9.0.0.0/8', '10.0.0.0/24', '2001:db8::/32']
+    index = PrefixIndex((prefix, prefix) for prefix in prefixes)
+    walked = [prefix for prefix, _values, _parent in index.walk()]
+    assert walked == [str(ip) for ip in sorted(IP(p) for p in prefixes)]
+
+
+def test_walk_should_return_nearest_stored_parent():
+    index = PrefixIndex((prefix, prefix) for prefix in
+                        ['10.0.0.0/8', '10.1.2.0/24', '10.2.0.0/16'])
+    parents = {prefix: parent for prefix, _values, parent in index.walk()}
+    assert parents == {
+        '10.0.0.0/8': None,
+        '10.1.2.0/24': '10.0.0.0/8',
+        '10.2.0.0/16': '10.0.0.0/8',
+    }
+
+
+def test_walk_within_prefix_should_only_return_its_subtree():
+    index = PrefixIndex((prefix, prefix) for prefix in
+                        ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+                         '10.2.0.0/16', '192.168.0.0/16'])
+    walked = list(index.walk('10.1.0.0/16'))
+    assert walked == [('10.1.0.0/16', ['10.1.0.0/16'], '10.0.0.0/8'),
+                      ('10.1.2.0/24', ['10.1.2.0/24'], '10.1.0.0/16')]
+
+
+def test_within_strict_should_exclude_prefix_itself():
+    index = PrefixIndex((prefix, prefix) for prefix in
+                        ['10.0.0.0/8', '10.1.0.0/16'])
+    assert index.within('10.0.0.0/8', strict=True) == [
+        ('10.1.0.0/16', ['10.1.0.0/16'])]
+
+
+def test_unstored_prefix_should_have_stored_children():
+    index = PrefixIndex((prefix, prefix) for prefix in
+                        ['10.1.0.0/16', '10.1.2.0/24', '10.2.0.0/16'])
+    assert index.get_children('10.0.0.0/8') == [
+        ('10.1.0.0/16', ['10.1.0.0/16']),
+        ('10.2.0.0/16', ['10.2.0.0/16'])]
+
+
+def test_remove_should_prune_prefix():
+    index = PrefixIndex([('10.1.0.0/16', 1), ('10.2.0.0/16', 2)])
+    assert index.remove('10.1.0.0/16', 1)
+    assert not index.remove('10.1.0.0/16', 1)
+    assert len(index) == 1
+    assert index.get('10.1.0.0/16') == []
+    assert [prefix for prefix, _v, _p in index.walk()] == ['10.2.0.0/16']
+
+
+def test_index_should_match_naive_hierarchy():
+    rng = random.Random(42)
+    prefixes = set()
+    while len(prefixes) < 300:
+        prefixlen = rng.randint(8, 30)
+        address = rng.randint(0, 2 ** 24 - 1) << 8 | 10 << 24
+        prefixes.add(str(IP(address).make_net(prefixlen)))
+    index = PrefixIndex((prefix, prefix) for prefix in prefixes)
+    ips = [IP(prefix) for prefix in prefixes]
+    for prefix, _values, parent in index.walk():
+        ip = IP(prefix)
+        enclosing = [other for other in ips if ip in other and other != ip]
+        expected = max(enclosing, key=lambda p: p.prefixlen()) if enclosing \
+            else None
+        assert parent == (str(expected) if expected else None)
+
+
+def test_empty_ranges_should_match_ipset():
+    children = [IP('10.0.0.0/24'), IP('10.0.2.0/23'), IP('10.0.8.0/21')]
+    expected = IPSet([IP('10.0.0.0/16')])
+    for child in children:
+        expected.discard(child)
+    assert get_empty_ranges(IP('10.0.0.0/16'), children) == expected.prefixes
+
+
+def test_index_empty_ranges_should_skip_nested_prefixes():
+    index = PrefixIndex((prefix, prefix) for prefix in
+                        ['10.0.0.0/25', '10.0.0.0/26', '10.0.0.128/26'])
+    assert index.get_empty_ranges('10.0.0.0/24') == [IP('10.0.0.192/26')]
+
+
+def test_covered_size_should_not_count_nested_prefixes_twice():
+    index = PrefixIndex([('10.0.0.0/24', 'scope'), ('10.0.0.0/25', 'lan'),
+                         ('10.0.0.0/26', 'lan'), ('10.0.0.128/26', 'lan')])
+    assert index.get_covered_size('10.0.0.0/24') == 192
+    assert index.get_covered_size(
+        '10.0.0.0/16', predicate=lambda value: value != 'scope') == 192
+
+
+def test_nav_prefix_index_should_move_updated_prefix():
+    index = NavPrefixIndex([(1, '10.0.0.0/24', 'lan')])
+    index.update_prefix(PrefixEntry(1, '10.0.1.0/24', 'lan'))
+    assert index.get('10.0.0.0/24') == []
+    assert [entry.pk for entry in index.get('10.0.1.0/24')] == [1]
+    index.remove_prefix(1)
+    assert len(index) == 0
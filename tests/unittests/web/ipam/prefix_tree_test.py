@@ -19,3 +19,16 @@ def test_prefix_tree_valid_cidr():
     child = tree.children[0].children[0]
     assert child.prefix == "10.0.1.0/24"
     assert child.prefixlen == 24
+
+
+def test_prefix_tree_should_nest_deeply():
+    cidrs = ["10.0.2.0/24", "10.0.0.0/8", "10.0.0.0/16", "192.168.0.0/16",
+             "10.1.0.0/16"]
+    tree = make_tree_from_ip(cidrs)
+    assert [child.prefix for child in tree.children] == [
+        "10.0.0.0/8", "192.168.0.0/16"]
+    ten = tree.children[0]
+    assert [child.prefix for child in ten.children] == [
+        "10.0.0.0/16", "10.1.0.0/16"]
+    assert ten.children[0].children[0].prefix == "10.0.2.0/24"
+    assert ten.children[0].children[0].parent is ten.children[0]
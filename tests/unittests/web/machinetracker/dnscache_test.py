@@ -0,0 +1,61 @@
+from django.core.cache import caches
+from mock import patch
+import pytest
+
+from nav import asyncdns
+from nav.web.machinetracker import dnscache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    caches['dns'].clear()
+
+
+@pytest.fixture
+def resolver():
+    with patch('nav.asyncdns.ReverseResolver') as resolver_class:
+        resolver = resolver_class.return_value
+        resolver.resolve.side_effect = lambda addresses, _timeout: {
+            addr: RESPONSES[addr] for addr in addresses}
+        resolver.ttls = {'10.0.0.1': 60, '10.0.0.2': 30, '10.0.0.3': 0}
+        yield resolver
+
+
+RESPONSES = {
+    '10.0.0.1': ['host.example.org'],
+    '10.0.0.2': asyncdns.DNSNameError(),
+    '10.0.0.3': asyncdns.DNSServerError(),
+    '10.0.0.4': asyncdns.DNSQueryTimeoutError('10.0.0.4'),
+}
+
+
+def test_should_return_hostnames_and_leave_out_timeouts(resolver):
+    assert dnscache.reverse_lookup(RESPONSES) == {
+        '10.0.0.1': 'host.example.org',
+        '10.0.0.2': '',
+        '10.0.0.3': '',
+    }
+
+
+def test_should_cache_positive_and_negative_responses(resolver):
+    dnscache.reverse_lookup(RESPONSES)
+    assert dnscache.get_cached_hostnames(RESPONSES) == {
+        '10.0.0.1': 'host.example.org',
+        '10.0.0.2': '',
+    }
+    dnscache.reverse_lookup(['10.0.0.1', '10.0.0.2'])
+    assert resolver.resolve.call_count == 1
+
+
+def test_zero_timeout_should_only_use_cache(resolver):
+    assert dnscache.reverse_lookup(['10.0.0.1'], timeout=0) == {}
+    assert not resolver.resolve.called
+
+
+def test_ttl_should_be_capped(resolver):
+    resolver.ttls['10.0.0.1'] = 86400
+    with patch.object(dnscache, '_get_cache') as get_cache:
+        get_cache.return_value.get_many.return_value = {}
+        dnscache.reverse_lookup(['10.0.0.1'])
+    get_cache.return_value.set_many.assert_called_once_with(
+        {'machinetracker:ptr:10.0.0.1': 'host.example.org'}, dnscache.MAX_TTL)
@@ -0,0 +1,106 @@
+from mock import Mock, patch
+
+from nav.models.manage import Interface
+from nav.netmap.traffic import TrafficSnapshot
+from nav.web.netmap import graph
+
+TOPOLOGY = {
+    'vlans': [],
+    'nodes': {'1': {'id': '1', 'sysname': 'a'},
+              '2': {'id': '2', 'sysname': 'b'}},
+    'links': [],
+}
+
+
+@patch('nav.web.netmap.graph.NetmapViewNodePosition')
+def test_view_positions_should_be_applied_to_copy(positions):
+    positions.objects.filter.return_value.values_list.return_value = [
+        (1, 10, 20), (3, 0, 0)]
+    result = graph.attach_view_positions(TOPOLOGY, Mock())
+    assert result['nodes']['1']['position'] == {'x': 10, 'y': 20}
+    assert 'position' not in result['nodes']['2']
+    assert '3' not in result['nodes']
+    assert 'position' not in TOPOLOGY['nodes']['1']
+
+
+@patch('nav.web.netmap.graph.build_topology')
+@patch('nav.web.netmap.graph.get_cached_topology')
+def test_precomputed_topology_should_be_served(get_cached, build):
+    get_cached.return_value = {'version': 'x', 'data': TOPOLOGY}
+    assert graph.get_topology_graph(2) == TOPOLOGY
+    assert not build.called
+
+
+@patch('nav.web.netmap.graph.set_cached_topology')
+@patch('nav.web.netmap.graph.get_topology_version', return_value='v1')
+@patch('nav.web.netmap.graph.build_topology', return_value=TOPOLOGY)
+@patch('nav.web.netmap.graph.get_cached_topology', return_value=None)
+def test_missing_topology_should_be_built_and_cached(_get, build, _version,
+                                                     set_cached):
+    assert graph.get_topology_graph(3) == TOPOLOGY
+    build.assert_called_once_with(3)
+    set_cached.assert_called_once_with(3, 'v1', TOPOLOGY)
+
+
+@patch('nav.web.netmap.graph.refresh_cached_topology')
+@patch('nav.web.netmap.graph.set_cached_topology')
+@patch('nav.web.netmap.graph.build_topology', return_value=TOPOLOGY)
+@patch('nav.web.netmap.graph.get_cached_topology')
+@patch('nav.web.netmap.graph.get_topology_version')
+def test_precompute_should_only_rebuild_changed_layers(version, get_cached,
+                                                       build, _set_cached,
+                                                       refresh):
+    version.side_effect = lambda layer: 'v%s' % layer
+    get_cached.side_effect = lambda layer: {'version': 'v2', 'data': {}}
+    assert graph.precompute_topologies() == [3]
+    build.assert_called_once_with(3)
+    refresh.assert_called_once_with(2)
+
+
+@patch('nav.web.netmap.graph.set_cached_topology')
+@patch('nav.web.netmap.graph.build_topology', return_value=TOPOLOGY)
+@patch('nav.web.netmap.graph.get_cached_topology')
+@patch('nav.web.netmap.graph.get_topology_version', return_value='v')
+def test_forced_precompute_should_rebuild_all_layers(_version, get_cached,
+                                                     build, _set_cached):
+    get_cached.return_value = {'version': 'v', 'data': {}}
+    assert graph.precompute_topologies(force=True) == [2, 3]
+
+
+def _edge(source_ifc, target_ifc):
+    return {'source': {'netbox': '1', 'interface': {'id': source_ifc}},
+            'target': {'netbox': '2', 'interface': {'id': target_ifc}},
+            'traffic': None}
+
+
+LAYER2_TOPOLOGY = dict(TOPOLOGY, links=[
+    {'source': '1', 'target': '2', 'edges': [_edge(11, 21), _edge(12, 22)]},
+])
+
+
+@patch('nav.web.netmap.graph.Interface.objects')
+@patch('nav.web.netmap.graph.get_traffic_snapshot')
+def test_traffic_should_be_attached_to_copy_of_topology(snapshot, objects):
+    objects.only.return_value.in_bulk.return_value = {
+        ifc_id: Interface(id=ifc_id, speed=1000) for ifc_id in (11, 21, 22)}
+    snapshot.return_value = TrafficSnapshot({
+        11: {'ifInOctets': 100, 'ifOutOctets': 200},
+        22: {'ifInOctets': 300, 'ifOutOctets': 400},
+    })
+    result = graph.attach_traffic(LAYER2_TOPOLOGY)
+    first, second = result['links'][0]['edges']
+    assert first['traffic']['source']['in_bps'] == 100
+    # Falls back to the far side of the link when there is no data
+    assert second['traffic']['source']['in_bps'] == 400
+    assert LAYER2_TOPOLOGY['links'][0]['edges'][0]['traffic'] is None
+
+
+@patch('nav.web.netmap.graph.attach_traffic', side_effect=lambda t: t)
+@patch('nav.web.netmap.graph.build_topology')
+@patch('nav.web.netmap.graph.get_cached_topology')
+def test_traffic_should_be_served_from_precomputed_topology(get_cached, build,
+                                                            attach):
+    get_cached.return_value = {'version': 'x', 'data': LAYER2_TOPOLOGY}
+    assert graph.get_topology_graph(2, load_traffic=True) == LAYER2_TOPOLOGY
+    assert not build.called
+    attach.assert_called_once_with(LAYER2_TOPOLOGY)